@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains helper functions and classes to store numpy arrays in binary file formats
+(npz and HDF5) including streaming writers and memory mapped reading.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import abc
+import shutil
+import struct
+import tempfile
+import threading
+import zipfile
+import numpy as np
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def hdf5_available():
+    """
+    Check if the optional HDF5 support (h5py) is available.
+
+    @return bool: True if HDF5 files can be written and read
+    """
+    return h5py is not None
+
+
+def _dataset_name(key):
+    """ HDF5 interprets slashes as group separators. Replace them in dataset names. """
+    return key.replace('/', '_')
+
+
+def _set_attributes(attributes, parameters):
+    """
+    Store a dict of parameters as HDF5 attributes. Values that can not be stored natively are
+    converted into their string representation.
+
+    @param h5py.AttributeManager attributes: attribute manager of a HDF5 object
+    @param dict parameters: parameter names and values
+    """
+    for name, value in parameters.items():
+        name = str(name)
+        try:
+            if value is None:
+                raise TypeError
+            attributes[name] = value
+        except (TypeError, ValueError):
+            attributes[name] = str(value)
+    return
+
+
+def save_npz(file_path, data, compression=True):
+    """
+    Save a dict of arrays as npz file. Uncompressed files can be read memory mapped later on.
+
+    @param str file_path: full path of the file to create (including .npz ending)
+    @param dict data: data arrays with the identifier strings as keys
+    @param bool compression: flag indicating if the arrays should be compressed (zip deflate)
+    """
+    # np.savez would append ".npz" to the file name, so write into a file object instead
+    with open(file_path, 'wb') as file:
+        if compression:
+            np.savez_compressed(file, **data)
+        else:
+            np.savez(file, **data)
+    return
+
+
+def save_hdf5(file_path, data, attributes=None, compression=False):
+    """
+    Save a dict of arrays as HDF5 file. Each array becomes a dataset and the parameters are
+    stored as attributes of the file root group.
+    Compressed datasets are stored in chunks, uncompressed datasets are stored contiguously so
+    they can be read memory mapped later on.
+
+    @param str file_path: full path of the file to create
+    @param dict data: data arrays with the identifier strings as keys
+    @param dict attributes: optional, parameters to store as file attributes
+    @param bool compression: flag indicating if the arrays should be compressed (gzip)
+    """
+    if h5py is None:
+        raise ImportError('Saving data in HDF5 format requires the python package "h5py".')
+    with h5py.File(file_path, 'w') as file:
+        if attributes:
+            _set_attributes(file.attrs, attributes)
+        for key, arr in data.items():
+            arr = np.asarray(arr)
+            if arr.dtype.kind == 'U':
+                arr = arr.astype(h5py.special_dtype(vlen=str))
+            if compression and arr.ndim > 0:
+                dset = file.create_dataset(_dataset_name(key),
+                                           data=arr,
+                                           chunks=True,
+                                           compression='gzip')
+            else:
+                dset = file.create_dataset(_dataset_name(key), data=arr)
+            dset.attrs['name'] = key
+    return
+
+
+def load_data_file(file_path, mmap=True):
+    """
+    Load the data arrays and parameters from a npz or HDF5 file written by the functions and
+    classes in this module.
+    Arrays stored uncompressed and contiguously are returned as read-only numpy.memmap instances
+    if mmap is True. All other arrays are read into memory.
+
+    @param str file_path: full path of the file to read
+    @param bool mmap: flag indicating if arrays should be memory mapped if possible
+
+    @return (dict, dict): data arrays and parameters (only for HDF5 files)
+    """
+    if zipfile.is_zipfile(file_path):
+        return _load_npz(file_path, mmap), dict()
+    if h5py is None:
+        raise ImportError('Loading data in HDF5 format requires the python package "h5py".')
+    return _load_hdf5(file_path, mmap)
+
+
+def _load_npz(file_path, mmap):
+    data = dict()
+    with zipfile.ZipFile(file_path, 'r') as zfile, open(file_path, 'rb') as file:
+        for info in zfile.infolist():
+            if not info.filename.endswith('.npy'):
+                continue
+            key = info.filename[:-4]
+            if mmap and info.compress_type == zipfile.ZIP_STORED:
+                # Locate the start of the stored npy file within the zip archive.
+                # Fixed local file header is 30 bytes followed by file name and extra field.
+                file.seek(info.header_offset)
+                local_header = file.read(30)
+                name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+                file.seek(info.header_offset + 30 + name_length + extra_length)
+                version = np.lib.format.read_magic(file)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+                if not dtype.hasobject:
+                    if int(np.prod(shape)) == 0:
+                        data[key] = np.zeros(shape, dtype=dtype)
+                    else:
+                        data[key] = np.memmap(file_path,
+                                              dtype=dtype,
+                                              mode='r',
+                                              offset=file.tell(),
+                                              shape=shape,
+                                              order='F' if fortran_order else 'C')
+                    continue
+            with zfile.open(info.filename) as npy_file:
+                data[key] = np.lib.format.read_array(npy_file, allow_pickle=False)
+    return data
+
+
+def _load_hdf5(file_path, mmap):
+    data = dict()
+    with h5py.File(file_path, 'r') as file:
+        parameters = dict(file.attrs)
+        for dset in file.values():
+            if not isinstance(dset, h5py.Dataset):
+                continue
+            key = dset.attrs.get('name', dset.name.lstrip('/'))
+            offset = dset.id.get_offset() if mmap and dset.chunks is None else None
+            if offset is not None and dset.dtype.kind not in 'OSU' and dset.size > 0:
+                data[key] = np.memmap(file_path,
+                                      dtype=dset.dtype,
+                                      mode='r',
+                                      offset=offset,
+                                      shape=dset.shape)
+            else:
+                data[key] = dset[()]
+    return data, parameters
+
+
+class DataStream(metaclass=abc.ABCMeta):
+    """
+    Base class for appending data arrays to a file while they are acquired.
+    Arrays are appended along their first axis. The shape of all other axes and the data type is
+    fixed by the first array appended for each key.
+
+    Usage:
+        with DataStreamXY(file_path) as stream:
+            stream.append({'counts': arr1})
+            stream.append({'counts': arr2})
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._shapes = dict()
+        self._dtypes = dict()
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def shapes(self):
+        """ Current shapes of all streamed arrays """
+        return self._shapes.copy()
+
+    def append(self, data):
+        """
+        Append data to the file.
+
+        @param dict data: data arrays with the identifier strings as keys
+        """
+        if self._closed:
+            raise ValueError('Unable to append data to a closed DataStream.')
+        for key, arr in data.items():
+            arr = np.asarray(arr)
+            if arr.ndim == 0:
+                arr = arr.reshape(1)
+            if key not in self._shapes:
+                self._dtypes[key] = arr.dtype
+                self._shapes[key] = (0,) + arr.shape[1:]
+                self._create(key, arr)
+            elif arr.shape[1:] != self._shapes[key][1:]:
+                raise ValueError('Shape {0} of data to append for "{1}" does not match the shape '
+                                 'of the previous data {2}.'.format(arr.shape, key,
+                                                                    self._shapes[key]))
+            arr = arr.astype(self._dtypes[key], copy=False)
+            self._append(key, arr)
+            self._shapes[key] = (self._shapes[key][0] + arr.shape[0],) + arr.shape[1:]
+        return
+
+    def close(self):
+        """
+        Finalize the file. No more data can be appended afterwards.
+        """
+        if not self._closed:
+            self._closed = True
+            self._finalize()
+        return
+
+    @abc.abstractmethod
+    def _create(self, key, arr):
+        """ Create the storage for the data of a new key. arr is the first array appended.
+        """
+        pass
+
+    @abc.abstractmethod
+    def _append(self, key, arr):
+        """ Append an array with the data type and shape of the existing data to the file.
+        """
+        pass
+
+    @abc.abstractmethod
+    def _finalize(self):
+        """ Write everything still pending and close the file.
+        """
+        pass
+
+
+class Hdf5DataStream(DataStream):
+    """
+    Appends data arrays to chunked and resizable datasets of a HDF5 file.
+    The parameters are stored as attributes of the file root group.
+    """
+    def __init__(self, file_path, attributes=None, compression=False):
+        """
+        @param str file_path: full path of the file to create
+        @param dict attributes: optional, parameters to store as file attributes
+        @param bool compression: flag indicating if the arrays should be compressed (gzip)
+        """
+        if h5py is None:
+            raise ImportError('Saving data in HDF5 format requires the python package "h5py".')
+        super().__init__(file_path)
+        self._compression = 'gzip' if compression else None
+        self._file = h5py.File(file_path, 'w')
+        if attributes:
+            _set_attributes(self._file.attrs, attributes)
+
+    def _create(self, key, arr):
+        dset = self._file.create_dataset(_dataset_name(key),
+                                         shape=(0,) + arr.shape[1:],
+                                         maxshape=(None,) + arr.shape[1:],
+                                         dtype=arr.dtype,
+                                         chunks=True,
+                                         compression=self._compression)
+        dset.attrs['name'] = key
+
+    def _append(self, key, arr):
+        dset = self._file[_dataset_name(key)]
+        old_length = dset.shape[0]
+        dset.resize(old_length + arr.shape[0], axis=0)
+        dset[old_length:] = arr
+
+    def flush(self):
+        """ Flush all buffered data to disk """
+        if not self._closed:
+            self._file.flush()
+        return
+
+    def _finalize(self):
+        self._file.close()
+
+
+class NpzDataStream(DataStream):
+    """
+    Collects data arrays in anonymous temporary files while they are acquired and packs them into
+    a npz file upon closing. Uncompressed files can be read memory mapped later on.
+    """
+    def __init__(self, file_path, compression=True):
+        """
+        @param str file_path: full path of the file to create (including .npz ending)
+        @param bool compression: flag indicating if the arrays should be compressed (zip deflate)
+        """
+        super().__init__(file_path)
+        self._compression = zipfile.ZIP_DEFLATED if compression else zipfile.ZIP_STORED
+        self._buffers = dict()
+
+    def _create(self, key, arr):
+        self._buffers[key] = tempfile.TemporaryFile()
+
+    def _append(self, key, arr):
+        self._buffers[key].write(np.ascontiguousarray(arr).tobytes())
+
+    def flush(self):
+        """ Flush all buffered data to disk """
+        if not self._closed:
+            for buffer in self._buffers.values():
+                buffer.flush()
+        return
+
+    def _finalize(self):
+        try:
+            with zipfile.ZipFile(self.file_path, 'w', compression=self._compression,
+                                 allowZip64=True) as zfile:
+                for key, buffer in self._buffers.items():
+                    header = {'descr': np.lib.format.dtype_to_descr(self._dtypes[key]),
+                              'fortran_order': False,
+                              'shape': self._shapes[key]}
+                    with zfile.open(key + '.npy', 'w', force_zip64=True) as npy_file:
+                        np.lib.format.write_array_header_1_0(npy_file, header)
+                        buffer.seek(0)
+                        shutil.copyfileobj(buffer, npy_file, 2**24)
+        finally:
+            for buffer in self._buffers.values():
+                buffer.close()
+            self._buffers = dict()
+
+
+class NpyArrayStream:
+    """
+    Appends rows to a two-dimensional array in a npy file while they are acquired.
+
+    The rows are collected in a preallocated chunk in memory which is written to disk as soon as it
+    is full, so the memory consumption is bounded by the chunk size. After each written chunk the
+    array shape in the file header is updated. The file is therefore always a valid npy file
+    containing all rows written so far, even if the program crashes during the acquisition, and
+    closing the stream takes constant time.
+    The file can be read memory mapped with numpy.load(file_path, mmap_mode='r').
+    Appending, flushing, closing and reading back are serialized by a lock, so read_last can be
+    called from another thread while the rows are appended.
+    """
+    # Total length of the npy header in bytes. Large enough for any shape of a 2D array.
+    _header_length = 128
+
+    def __init__(self, file_path, columns, dtype=np.float64, chunk_rows=65536):
+        """
+        @param str file_path: full path of the file to create (including .npy ending)
+        @param int columns: number of values per row
+        @param dtype: numpy data type of the array
+        @param int chunk_rows: number of rows to collect in memory before writing them to disk
+        """
+        self.file_path = file_path
+        self._dtype = np.dtype(dtype)
+        self._chunk = np.empty((max(int(chunk_rows), 1), int(columns)), dtype=self._dtype)
+        self._chunk_index = 0
+        self._written_rows = 0
+        self._closed = False
+        self._lock = threading.RLock()
+        self._file = open(file_path, 'wb')
+        self._write_header()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def rows(self):
+        """ Total number of rows appended so far """
+        return self._written_rows + self._chunk_index
+
+    @property
+    def columns(self):
+        return self._chunk.shape[1]
+
+    def append(self, data):
+        """
+        Append rows to the array.
+
+        @param numpy.ndarray data: a single row of shape (columns,) or several rows of shape
+                                   (rows, columns)
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data[np.newaxis, :]
+        if data.shape[1] != self.columns:
+            raise ValueError('Number of columns of data to append ({0}) does not match the number '
+                             'of columns of the stream ({1}).'.format(data.shape[1], self.columns))
+        with self._lock:
+            if self._closed:
+                raise ValueError('Unable to append data to a closed NpyArrayStream.')
+            chunk_rows = self._chunk.shape[0]
+            index = 0
+            while index < data.shape[0]:
+                rows = min(data.shape[0] - index, chunk_rows - self._chunk_index)
+                self._chunk[self._chunk_index:self._chunk_index + rows] = data[index:index + rows]
+                self._chunk_index += rows
+                index += rows
+                if self._chunk_index == chunk_rows:
+                    self.flush()
+        return
+
+    def read_last(self, rows=None):
+        """
+        Read the most recently appended rows without interrupting the stream.
+        Rows already written to disk are read memory mapped from the file, so reading a few rows
+        is cheap even for long recordings.
+
+        @param int rows: optional, number of rows to read. All rows if None.
+
+        @return numpy.ndarray: copy of the rows with shape (rows, columns)
+        """
+        with self._lock:
+            total = self.rows
+            rows = total if rows is None else max(min(int(rows), total), 0)
+            from_chunk = min(rows, self._chunk_index)
+            from_file = rows - from_chunk
+            data = np.empty((rows, self.columns), dtype=self._dtype)
+            if from_file > 0:
+                stored = np.load(self.file_path, mmap_mode='r')
+                data[:from_file] = stored[self._written_rows - from_file:self._written_rows]
+                del stored
+            data[from_file:] = self._chunk[self._chunk_index - from_chunk:self._chunk_index]
+        return data
+
+    def flush(self):
+        """ Write all collected rows to disk and update the file header """
+        with self._lock:
+            if self._closed or self._chunk_index == 0:
+                return
+            self._file.write(self._chunk[:self._chunk_index].tobytes())
+            self._written_rows += self._chunk_index
+            self._chunk_index = 0
+            self._write_header()
+        return
+
+    def close(self):
+        """
+        Write the remaining rows and close the file. No more data can be appended afterwards.
+        """
+        with self._lock:
+            if not self._closed:
+                try:
+                    self.flush()
+                finally:
+                    self._closed = True
+                    self._file.close()
+        return
+
+    def _write_header(self):
+        header = {'descr': np.lib.format.dtype_to_descr(self._dtype),
+                  'fortran_order': False,
+                  'shape': (self._written_rows, self.columns)}
+        header_str = repr(header)
+        # magic string (6 bytes), version (2 bytes) and header length (2 bytes) precede the header
+        header_str = header_str.ljust(self._header_length - 11) + '\n'
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(np.lib.format.magic(1, 0))
+        self._file.write(struct.pack('<H', len(header_str)))
+        self._file.write(header_str.encode('latin1'))
+        if position > self._header_length:
+            self._file.seek(position)
+        self._file.flush()
+        return
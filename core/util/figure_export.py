@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains helper functions to export matplotlib figures as PDF/PNG files.
+The functions can be executed in a separate process to keep figure rendering out of the
+measurement threads.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import pickle
+from PIL import Image
+from PIL import PngImagePlugin
+
+# matplotlib.pyplot is imported inside the functions, so the backend can be selected by
+# init_figure_process before pyplot is imported for the first time in a worker process.
+
+
+def init_figure_process(style=None):
+    """
+    Initializer for figure export worker processes. Selects a non-interactive backend and applies
+    the matplotlib style used for saving, since the rcParams of the main process (e.g. savefig.dpi)
+    are not carried over to the worker process.
+
+    @param dict style: optional, matplotlib rcParams to apply in the worker process
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    if style is not None:
+        matplotlib.rcParams.update(style)
+    return
+
+
+def save_pickled_figure(pickled_figure, file_base, metadata, save_pdf=False, save_png=True):
+    """
+    Restore a pickled matplotlib figure and save it to file. Used in figure export processes.
+
+    @param bytes pickled_figure: the pickled matplotlib figure
+    @param str file_base: full path of the files to create without ending
+    @param dict metadata: metadata to add to the files
+    @param bool save_pdf: flag indicating if a PDF file should be created
+    @param bool save_png: flag indicating if a PNG file should be created
+    """
+    import matplotlib.pyplot as plt
+    figure = pickle.loads(pickled_figure)
+    try:
+        save_figure(figure, file_base, metadata, save_pdf=save_pdf, save_png=save_png)
+    finally:
+        plt.close(figure)
+    return
+
+
+def save_figure(figure, file_base, metadata, save_pdf=False, save_png=True):
+    """
+    Save a matplotlib figure as PDF and/or PNG file including metadata.
+
+    @param matplotlib.figure.Figure figure: the figure to save
+    @param str file_base: full path of the files to create without ending
+    @param dict metadata: metadata to add to the files
+    @param bool save_pdf: flag indicating if a PDF file should be created
+    @param bool save_png: flag indicating if a PNG file should be created
+    """
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    metadata = metadata.copy()
+    if save_pdf:
+        # determine the PDF-Filename
+        fig_fname_vector = file_base + '_fig.pdf'
+
+        # Create the PdfPages object to which we will save the pages:
+        # The with statement makes sure that the PdfPages object is closed properly at
+        # the end of the block, even if an Exception occurs.
+        with PdfPages(fig_fname_vector) as pdf:
+            pdf.savefig(figure, bbox_inches='tight', pad_inches=0.05)
+
+            # We can also set the file's metadata via the PdfPages object:
+            pdf_metadata = pdf.infodict()
+            for x in metadata:
+                pdf_metadata[x] = metadata[x]
+
+    if save_png:
+        # determine the PNG-Filename and save the plain PNG
+        fig_fname_image = file_base + '_fig.png'
+        figure.savefig(fig_fname_image, bbox_inches='tight', pad_inches=0.05)
+
+        # Use Pillow (an fork for PIL) to attach metadata to the PNG
+        png_image = Image.open(fig_fname_image)
+        png_metadata = PngImagePlugin.PngInfo()
+
+        # PIL can only handle Strings, so let's convert our times
+        metadata['CreationDate'] = metadata['CreationDate'].strftime('%Y%m%d-%H%M-%S')
+        metadata['ModDate'] = metadata['ModDate'].strftime('%Y%m%d-%H%M-%S')
+
+        for x in metadata:
+            # make sure every value of the metadata is a string
+            if not isinstance(metadata[x], str):
+                metadata[x] = str(metadata[x])
+
+            # add the metadata to the picture
+            png_metadata.add_text(x, metadata[x])
+
+        # save the picture again, this time including the metadata
+        png_image.save(fig_fname_image, "png", pnginfo=png_metadata)
+    return
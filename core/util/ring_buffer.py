@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains Qudi data structures to store continuously running data traces with a constant
+cost per new sample, independent of the length of the trace.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import bisect
+import collections
+import threading
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Preallocated multi-channel ring buffer of fixed length.
+
+    Every sample is stored twice in an array of double length, so the samples in chronological
+    order (oldest first) are always available as a contiguous slice of the internal array.
+    Appending k samples therefore costs O(k) and obtaining the ordered trace does not copy at all.
+
+    Note that the view returned by the data property is only valid until the next call of append
+    or overwrite_latest. Copy it if it needs to be kept.
+    """
+    def __init__(self, length, channels=1, dtype=np.float64):
+        """
+        @param int length: number of samples per channel kept in the buffer
+        @param int channels: number of channels
+        @param dtype: numpy data type of the samples
+        """
+        self._length = int(length)
+        if self._length < 1:
+            raise ValueError('RingBuffer length must be larger than 0.')
+        self._buffer = np.zeros((int(channels), 2 * self._length), dtype=dtype)
+        self._index = 0
+        return
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def channels(self):
+        return self._buffer.shape[0]
+
+    @property
+    def data(self):
+        """
+        Zero-copy view of the buffer content in chronological order.
+
+        @return numpy.ndarray: array of shape (channels, length), oldest sample first
+        """
+        return self._buffer[:, self._index:self._index + self._length]
+
+    def clear(self):
+        """ Reset all samples to zero """
+        self._buffer[:] = 0
+        self._index = 0
+        return
+
+    def append(self, data):
+        """
+        Append new samples to the end of the trace, dropping the same number of the oldest samples.
+
+        @param numpy.ndarray data: one sample per channel with shape (channels,) or several
+                                   samples per channel with shape (channels, samples)
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        data = data[:, -self._length:]
+        self._index = (self._index + data.shape[1]) % self._length
+        self._write(data)
+        return
+
+    def overwrite_latest(self, data):
+        """
+        Overwrite the newest samples of the trace without advancing it.
+
+        @param numpy.ndarray data: one sample per channel with shape (channels,) or several
+                                   samples per channel with shape (channels, samples)
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        self._write(data[:, -self._length:])
+        return
+
+    def _write(self, data):
+        """
+        Write samples into both halves of the buffer, ending right before the current index.
+        """
+        samples = data.shape[1]
+        start = self._index - samples
+        if start >= 0:
+            self._buffer[:, start:self._index] = data
+            self._buffer[:, start + self._length:self._index + self._length] = data
+        else:
+            # The samples wrap around the end of the first half of the buffer
+            self._buffer[:, :self._index] = data[:, -start:]
+            self._buffer[:, start + 2 * self._length:] = data[:, :-start]
+            self._buffer[:, start + self._length:self._index + self._length] = data
+        return
+
+
+class GrowingArray:
+    """
+    Two-dimensional array, which grows by appending rows.
+
+    The rows are stored in a preallocated array whose capacity is doubled whenever it is full, so
+    appending costs amortized O(1) per row and no Python objects are created per row.
+    Appending from one thread while another thread reads the data property is safe. Growing the
+    array and counting the new rows happen under a lock, so a view never contains rows that have
+    not been written yet.
+    """
+    def __init__(self, columns, dtype=np.float64, capacity=1024):
+        """
+        @param int columns: number of values per row
+        @param dtype: numpy data type of the array
+        @param int capacity: number of rows to allocate initially
+        """
+        self._array = np.empty((max(int(capacity), 1), int(columns)), dtype=dtype)
+        self._rows = 0
+        self._lock = threading.Lock()
+        return
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def columns(self):
+        return self._array.shape[1]
+
+    @property
+    def data(self):
+        """
+        Zero-copy view of all rows appended so far with shape (rows, columns).
+        Only valid until the array is cleared.
+        """
+        with self._lock:
+            return self._array[:self._rows]
+
+    def clear(self):
+        """ Discard all rows but keep the allocated memory """
+        with self._lock:
+            self._rows = 0
+        return
+
+    def append(self, data):
+        """
+        Append rows to the array.
+
+        @param numpy.ndarray data: a single row of shape (columns,) or several rows of shape
+                                   (rows, columns)
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data[np.newaxis, :]
+        with self._lock:
+            rows = self._rows + data.shape[0]
+            if rows > self._array.shape[0]:
+                array = np.empty((max(rows, 2 * self._array.shape[0]), self.columns),
+                                 dtype=self._array.dtype)
+                array[:self._rows] = self._array[:self._rows]
+                self._array = array
+            self._array[self._rows:rows] = data
+            self._rows = rows
+        return
+
+
+class RunningMean:
+    """
+    Moving average over the last samples of several channels.
+
+    The history of the previous samples is kept internally, so only the new samples need to be
+    passed to update. The cost per call is O(samples + width).
+    """
+    def __init__(self, width, channels=1):
+        """
+        @param int width: number of samples to average over
+        @param int channels: number of channels
+        """
+        self._width = max(int(width), 1)
+        self._history = np.zeros((int(channels), self._width - 1))
+        return
+
+    @property
+    def width(self):
+        return self._width
+
+    def update(self, data):
+        """
+        Add new samples and calculate the moving average for each of them.
+
+        @param numpy.ndarray data: new samples with shape (channels, samples)
+
+        @return numpy.ndarray: moving average of shape (channels, samples). The value for each new
+                               sample is the mean of this sample and the width-1 samples before.
+        """
+        data = np.asarray(data, dtype=np.float64)
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        samples = data.shape[1]
+        extended = np.concatenate((self._history, data), axis=1)
+        cumsum = np.cumsum(extended, axis=1)
+        mean = cumsum[:, self._width - 1:]
+        mean[:, 1:] = mean[:, 1:] - cumsum[:, :samples - 1]
+        mean /= self._width
+        self._history = extended[:, extended.shape[1] - self._width + 1:]
+        return mean
+
+
+class RunningMedian:
+    """
+    Moving median over the last samples of several channels.
+
+    A sorted copy of the current window is maintained per channel, so each new sample costs
+    O(width) for the (fast) list insertion and removal and O(log(width)) for the search.
+    """
+    def __init__(self, width, channels=1):
+        """
+        @param int width: number of samples to calculate the median of
+        @param int channels: number of channels
+        """
+        self._width = max(int(width), 1)
+        self._windows = [collections.deque([0.0] * self._width) for _ in range(int(channels))]
+        self._sorted = [[0.0] * self._width for _ in range(int(channels))]
+        return
+
+    @property
+    def width(self):
+        return self._width
+
+    def update(self, sample):
+        """
+        Add a new sample per channel and return the current median of the window.
+
+        @param numpy.ndarray sample: one new sample per channel with shape (channels,)
+
+        @return numpy.ndarray: median of the current window per channel
+        """
+        median = np.empty(len(self._windows))
+        center = self._width // 2
+        for i, value in enumerate(sample):
+            value = float(value)
+            window = self._windows[i]
+            sorted_window = self._sorted[i]
+            del sorted_window[bisect.bisect_left(sorted_window, window.popleft())]
+            window.append(value)
+            bisect.insort(sorted_window, value)
+            if self._width % 2:
+                median[i] = sorted_window[center]
+            else:
+                median[i] = (sorted_window[center - 1] + sorted_window[center]) / 2
+        return median
+
+
+class SweepAccumulator:
+    """
+    Accumulates repeated sweeps (e.g. ODMR spectra) and provides their average.
+
+    The most recent sweeps are kept in a circular history of fixed length. Like in RingBuffer each
+    sweep is stored twice, so the history is always available as a contiguous view with the newest
+    sweep first. The sum of all sweeps and the sum over the averaging window are updated with every
+    new sweep, so the cost per sweep does not depend on the number of sweeps acquired so far.
+    """
+    def __init__(self, history_length, channels, points, average_length=0):
+        """
+        @param int history_length: number of sweeps to keep in the history
+        @param int channels: number of channels per sweep
+        @param int points: number of points per sweep and channel
+        @param int average_length: number of most recent sweeps to average (0 means all)
+        """
+        self._average_length = max(int(average_length), 0)
+        self._history_length = max(int(history_length), self._average_length, 1)
+        self._history = np.zeros((2 * self._history_length, int(channels), int(points)))
+        self._index = 0
+        self._total_sum = np.zeros((int(channels), int(points)))
+        self._window_sum = np.zeros((int(channels), int(points)))
+        self._sweeps = 0
+        # Number of history rows holding a recorded sweep. Smaller than history_length after the
+        # history has been extended.
+        self._filled = 0
+        return
+
+    @property
+    def sweeps(self):
+        """ Number of sweeps accumulated since the last clear """
+        return self._sweeps
+
+    @property
+    def history_length(self):
+        return self._history_length
+
+    @property
+    def history(self):
+        """
+        Zero-copy view of the sweep history with shape (history_length, channels, points).
+        The newest sweep comes first. Only valid until the next sweep is added.
+        """
+        return self._history[self._index:self._index + self._history_length]
+
+    @property
+    def average_length(self):
+        return self._average_length
+
+    @average_length.setter
+    def average_length(self, length):
+        self._average_length = max(int(length), 0)
+        if self._average_length > self._history_length:
+            self.history_length = self._average_length
+        self._update_window_sum()
+
+    @property
+    def average(self):
+        """
+        Average over the last average_length sweeps (all sweeps if average_length is 0).
+
+        @return numpy.ndarray: averaged sweep with shape (channels, points)
+        """
+        if self._average_length > 0:
+            return self._window_sum / max(min(self._average_length, self._filled), 1)
+        return self._total_sum / max(self._sweeps, 1)
+
+    @history_length.setter
+    def history_length(self, length):
+        length = max(int(length), self._average_length, 1)
+        if length == self._history_length:
+            return
+        history = np.zeros((2 * length,) + self._history.shape[1:])
+        kept = min(length, self._history_length)
+        history[:kept] = self.history[:kept]
+        history[length:length + kept] = history[:kept]
+        self._history = history
+        self._history_length = length
+        self._index = 0
+        self._filled = min(self._filled, kept)
+        self._update_window_sum()
+        return
+
+    def clear(self):
+        """ Discard all sweeps """
+        self._history[:] = 0
+        self._index = 0
+        self._total_sum[:] = 0
+        self._window_sum[:] = 0
+        self._sweeps = 0
+        self._filled = 0
+        return
+
+    def add_sweep(self, sweep):
+        """
+        Add a new sweep to the history and the averages.
+
+        @param numpy.ndarray sweep: new sweep with shape (channels, points)
+        """
+        if self._average_length > 0:
+            # Drop the sweep which leaves the averaging window.
+            # Before the index is moved it is found at average_length - 1 in the history.
+            if self._filled >= self._average_length:
+                self._window_sum -= self.history[self._average_length - 1]
+            self._window_sum += sweep
+        self._total_sum += sweep
+        self._index = (self._index - 1) % self._history_length
+        self._history[self._index] = sweep
+        self._history[self._index + self._history_length] = sweep
+        self._sweeps += 1
+        self._filled = min(self._filled + 1, self._history_length)
+        # Remove accumulated rounding errors of the window sum once per history cycle
+        if self._index == 0 and self._average_length > 0:
+            self._update_window_sum()
+        return
+
+    def _update_window_sum(self):
+        if self._average_length > 0:
+            window = min(self._average_length, self._filled)
+            np.sum(self.history[:window], axis=0, out=self._window_sum)
+        return
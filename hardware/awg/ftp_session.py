@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains a persistent FTP session used by the AWG hardware modules to transfer files
+to and from the device.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import ftplib
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BufferReader:
+    """
+    Read only file-like object over a list of bytes-like objects (bytes, bytearray, numpy arrays).
+    The buffers are not copied. Every read returns a memoryview into one of the buffers, which is
+    what ftplib needs to stream the data to the socket.
+    """
+    def __init__(self, buffers):
+        if not isinstance(buffers, (list, tuple)):
+            buffers = [buffers]
+        self._buffers = [self._byte_view(buf) for buf in buffers if len(buf) > 0]
+        self._index = 0
+        self._offset = 0
+
+    @staticmethod
+    def _byte_view(buf):
+        """ Flat memoryview of the bytes of buf. Handles numpy record arrays as well. """
+        if isinstance(buf, np.ndarray):
+            return memoryview(np.ascontiguousarray(buf).reshape(-1).view(np.uint8))
+        return memoryview(buf).cast('B')
+
+    def __len__(self):
+        return sum(len(buf) for buf in self._buffers)
+
+    def read(self, size=-1):
+        """
+        Read the next block of data.
+
+        @param int size: maximum number of bytes to read. Reads to the end of the current buffer
+                         if negative.
+
+        @return memoryview: the data, empty if all buffers are consumed
+        """
+        if self._index >= len(self._buffers):
+            return b''
+        buf = self._buffers[self._index]
+        end = len(buf) if size < 0 else min(self._offset + size, len(buf))
+        data = buf[self._offset:end]
+        self._offset = end
+        if self._offset >= len(buf):
+            self._index += 1
+            self._offset = 0
+        return data
+
+
+class FTPSession:
+    """
+    Persistent FTP connection to a device.
+
+    The connection is opened on first use and kept open, so subsequent file operations do not pay
+    for connection setup and login again. If the device has closed the connection in the meantime
+    (e.g. idle timeout), the operation is repeated once with a new connection.
+    All operations are serialized, so the session can be used from several threads. Uploads can
+    be run in a background thread with upload_async, e.g. to prepare the next file while the
+    previous one is transferred.
+    """
+    # Errors after which the connection is considered dead and a reconnect is tried
+    _connection_errors = (OSError, EOFError, ftplib.error_temp, ftplib.error_reply)
+
+    def __init__(self, host, user='anonymous', passwd='anonymous@', working_dir=None, port=21,
+                 timeout=60, block_size=1048576):
+        """
+        @param str host: IP address or hostname of the device
+        @param str user: user name for the login
+        @param str passwd: password for the login
+        @param str working_dir: optional, directory to change into after login
+        @param int port: FTP port of the device
+        @param float timeout: timeout of the socket operations in s
+        @param int block_size: size of the blocks sent to the socket during upload in bytes
+        """
+        self.host = host
+        self.port = port
+        self.user = user
+        self.passwd = passwd
+        self.timeout = timeout
+        self.block_size = block_size
+        self._working_dir = working_dir
+        self._ftp = None
+        self._lock = threading.RLock()
+        self._executor = None
+
+    @property
+    def working_dir(self):
+        return self._working_dir
+
+    @working_dir.setter
+    def working_dir(self, path):
+        """
+        Change the working directory of this session. Applied to new connections as well.
+        Connects to the device if necessary, so an error is raised right away if the directory
+        does not exist.
+        """
+        with self._lock:
+            self._execute(lambda ftp: ftp.cwd(path))
+            self._working_dir = path
+
+    @property
+    def is_connected(self):
+        return self._ftp is not None
+
+    def connect(self):
+        """ Open the connection and log in, if not already connected. """
+        with self._lock:
+            if self._ftp is None:
+                ftp = ftplib.FTP(timeout=self.timeout)
+                try:
+                    ftp.connect(self.host, self.port)
+                    ftp.login(user=self.user, passwd=self.passwd)
+                    if self._working_dir:
+                        ftp.cwd(self._working_dir)
+                except BaseException:
+                    ftp.close()
+                    raise
+                self._ftp = ftp
+        return
+
+    def close(self):
+        """ Wait for pending uploads and close the connection. """
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._lock:
+            if self._ftp is not None:
+                try:
+                    self._ftp.quit()
+                except Exception:
+                    self._ftp.close()
+                self._ftp = None
+        return
+
+    def pwd(self):
+        """ @return str: current directory on the device """
+        return self._execute(lambda ftp: ftp.pwd())
+
+    def mkd(self, path):
+        """ Create a directory on the device. """
+        return self._execute(lambda ftp: ftp.mkd(path))
+
+    def list_lines(self):
+        """
+        List the working directory.
+
+        @return list: the raw lines returned by the LIST command
+        """
+        lines = list()
+
+        def list_dir(ftp):
+            del lines[:]
+            ftp.retrlines('LIST', callback=lines.append)
+        self._execute(list_dir)
+        return lines
+
+    def delete(self, filename, missing_ok=True):
+        """
+        Delete a file in the working directory.
+
+        @param str filename: name of the file to delete
+        @param bool missing_ok: ignore the error, if the file does not exist
+        """
+        try:
+            self._execute(lambda ftp: ftp.delete(filename))
+        except ftplib.error_perm:
+            if not missing_ok:
+                raise
+        return
+
+    def upload(self, filename, data):
+        """
+        Upload data to a file in the working directory. An existing file is replaced.
+
+        @param str filename: name of the file on the device
+        @param data: bytes-like object, list of bytes-like objects, which are concatenated, or an
+                     opened binary file
+
+        @return int: number of bytes sent
+        """
+        def store(ftp):
+            fp = data if hasattr(data, 'read') else BufferReader(data)
+            if hasattr(fp, 'seek'):
+                fp.seek(start)
+            ftp.storbinary('STOR ' + filename, fp, blocksize=self.block_size)
+
+        start = data.tell() if hasattr(data, 'tell') else 0
+        with self._lock:
+            self.delete(filename)
+            self._execute(store)
+        if hasattr(data, 'tell'):
+            return data.tell() - start
+        return len(BufferReader(data))
+
+    def upload_async(self, filename, data):
+        """
+        Upload data in a background thread. Uploads are executed in the order they are submitted.
+        The data must not be changed until the upload has finished.
+
+        @param str filename: name of the file on the device
+        @param data: see upload
+
+        @return concurrent.futures.Future: future of the upload. result() returns the number of
+                                           bytes sent or raises the error of the upload.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            return self._executor.submit(self.upload, filename, data)
+
+    def _execute(self, func):
+        """
+        Run func(ftp) with the connection. Reconnects and retries once if the connection was lost.
+        """
+        with self._lock:
+            for attempt in range(2):
+                self.connect()
+                try:
+                    return func(self._ftp)
+                except self._connection_errors:
+                    self._ftp.close()
+                    self._ftp = None
+                    if attempt > 0:
+                        raise
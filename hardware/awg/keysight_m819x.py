@@ -25,7 +25,6 @@ import visa
 import os
 import time
 import numpy as np
-import scipy.interpolate
 from fnmatch import fnmatch
 from collections import OrderedDict
 from abc import abstractmethod
@@ -54,6 +53,7 @@ class AWGM819X(Base, PulserInterface):
     _wave_mem_mode = None
     _wave_file_extension = '.bin'
     _wave_transfer_datatype = 'h'
+    _quantize_chunk_size = 1048576  # samples converted at once, limits the temporary memory
 
     # explicitly set low/high levels for [[d_ch1_low, d_ch1_high], [d_ch2_low, d_ch2_high], ...]
     _d_ch_level_low_high = ConfigOption(name='d_ch_level_low_high', default=[], missing='nothing')
@@ -1396,39 +1396,80 @@ class AWGM819X(Base, PulserInterface):
         pass
 
     @abstractmethod
-    def float_to_sample(self, val):
+    def float_to_sample(self, val, out=None):
        pass
 
-    def _float_to_int(self, val, n_bits):
-
-        """
-        :param val: np.array(dtype=float64) of sampled values from sequencegenerator.sample_pulse_block_ensemble().
-                    normed (-1...1) where 1 encodes the full Vpp as set in 'PulsedGui/Pulsegenerator Settings'.
-                    If MW ampl in 'PulsedGui/Predefined methods' < as full Vpp, amplitude reduction will be
-                    performed digitally (reducing the effective digital resolution in bits).
-        :param n_bits: number of bits; sets the highest integer allowed. Eg. 8 bits -> int in [-128, 127]
-        :return:    np.array(dtype=int16)
-        """
+    def _quantize_samples(self, val, n_bits, dtype='int16', shiftbits=0, marker_1=None,
+                          marker_2=None, out=None):
+        """
+        Converts the normalized float samples to DAC integers and packs the marker bits in a single
+        pass. The samples are processed chunkwise, so apart from the output only a buffer of
+        _quantize_chunk_size samples is needed.
+
+        The float samples are mapped linearly from [-1, 1] (or the maximum absolute value, if the
+        samples exceed this range) to the integer range of n_bits and truncated towards zero.
+        manual 8.22.4 Waveform Data Format in Direct Mode
+
+        :param val: np.ndarray, normalized analog samples (-1..1)
+        :param n_bits: int, DAC resolution in bits
+        :param dtype: int type of the output samples
+        :param shiftbits: int, number of bits the DAC value is shifted to the left to make room for
+                          the markers
+        :param marker_1: np.ndarray, optional digital samples stored in bit 0
+        :param marker_2: np.ndarray, optional digital samples stored in bit 1
+        :param out: np.ndarray, optional preallocated output array of dtype and size of val
+        :return: np.ndarray, the binary samples
+        """
+        val = np.asarray(val)
+        if out is None:
+            out = np.empty(val.size, dtype=dtype)
+        if val.size == 0:
+            return out
 
         bitsize = int(2 ** n_bits)
         min_intval = -bitsize / 2
         max_intval = bitsize / 2 - 1
 
         max_u_samples = 1  # data should be normalized in (-1..1)
-
-        if max(abs(val)) > 1:
+        val_min, val_max = float(np.min(val)), float(np.max(val))
+        if max(abs(val_min), abs(val_max)) > 1:
             self.log.warning("Samples from sequencegenerator out of range. Normalizing to -1..1. Please change the "
                              "maximum peak to peak Voltage in the Pulse Generator Settings if you want to use a higher "
                              "power.")
-            biggest_val = max([abs(np.min(val)), np.max(val)])
-            max_u_samples = biggest_val
-        # manual 8.22.4 Waveform Data Format in Direct Mode
-        # 2 bits LSB reserved for markers
-        mapper = scipy.interpolate.interp1d([-max_u_samples, max_u_samples], [min_intval, max_intval])
-
-        return mapper(val)
-
-    def bool_to_sample(self, val_dch_1, val_dch_2, int_type_str='int16'):
+            max_u_samples = max(abs(val_min), val_max)
+        slope = (max_intval - min_intval) / (2 * max_u_samples)
+
+        chunk_size = min(self._quantize_chunk_size, val.size)
+        work = np.empty(chunk_size, dtype=np.float64)
+        if marker_1 is not None or marker_2 is not None:
+            marker_work = np.empty(chunk_size, dtype=out.dtype)
+
+        for start in range(0, val.size, chunk_size):
+            stop = min(start + chunk_size, val.size)
+            chunk = out[start:stop]
+            tmp = work[:stop - start]
+            # linear map from [-max_u_samples, max_u_samples] to [min_intval, max_intval]
+            np.copyto(tmp, val[start:stop])
+            np.subtract(tmp, -max_u_samples, out=tmp)
+            np.multiply(tmp, slope, out=tmp)
+            np.add(tmp, min_intval, out=tmp)
+            # casting truncates towards zero
+            np.copyto(chunk, tmp, casting='unsafe')
+            if shiftbits:
+                np.left_shift(chunk, shiftbits, out=chunk)
+            # 2 bits LSB reserved for markers
+            for bit, marker in enumerate((marker_1, marker_2)):
+                if marker is None:
+                    continue
+                mrk = marker_work[:stop - start]
+                np.copyto(mrk, marker[start:stop], casting='unsafe')
+                np.bitwise_and(mrk, 0x1, out=mrk)
+                if bit:
+                    np.left_shift(mrk, bit, out=mrk)
+                np.bitwise_or(chunk, mrk, out=chunk)
+        return out
+
+    def bool_to_sample(self, val_dch_1, val_dch_2, int_type_str='int16', out=None):
         """
         Takes 2 digital sample values from the sequence generator and converts them to int.
         For AWG819x always two digital channels are tied with a single analogue output.
@@ -1436,13 +1477,18 @@ class AWGM819X(Base, PulserInterface):
         :param vals_dch_1: np.ndarray, digital samples from the sequence generator
         :param vals_dch_2: np.ndarray, digital samples from the sequence generator
         :param int_type_str: int type the output is casted to
+        :param out: np.ndarray, optional preallocated output array
         :return:
         """
-
-        bit_dch_1 = 0x1 & np.asarray(val_dch_1).astype(int_type_str)
-        bit_dch_2 = 0x2 & (np.asarray(val_dch_2).astype(int_type_str) << 1)
-
-        return bit_dch_1 + bit_dch_2
+        val_dch_2 = np.asarray(val_dch_2)
+        if out is None:
+            out = np.empty(val_dch_2.size, dtype=int_type_str)
+        np.copyto(out, val_dch_2, casting='unsafe')
+        np.bitwise_and(out, 0x1, out=out)
+        np.left_shift(out, 1, out=out)
+        bit_dch_1 = np.bitwise_and(np.asarray(val_dch_1), 0x1, dtype=out.dtype, casting='unsafe')
+        np.bitwise_or(out, bit_dch_1, out=out)
+        return out
 
     @abstractmethod
     def _compile_bin_samples(self, analog_samples, digital_samples, ch_num):
@@ -2306,18 +2352,15 @@ class AWGM8195A(AWGM819X):
         interleaved = self.interleaved_wavefile
         self.log.debug("Compiling samples for {}, interleaved: {}".format(ch_str, interleaved))
 
-        a_samples = self.float_to_sample(analog_samples[ch_str])
-
         if interleaved and ch_str == 'a_ch1':
-            d_samples = self.bool_to_sample(digital_samples['d_ch1'], digital_samples['d_ch2'],
-                                            int_type_str='int8')
             # the analog and digital samples are stored in the following format: a1, d1, a2, d2, a3, d3, ...
-            comb_samples = np.zeros(2 * a_samples.size, dtype=np.int8)
-            comb_samples[::2] =  a_samples
-            comb_samples[1::2] = d_samples
+            comb_samples = np.empty(2 * len(analog_samples[ch_str]), dtype=np.int8)
+            self.float_to_sample(analog_samples[ch_str], out=comb_samples[::2])
+            self.bool_to_sample(digital_samples['d_ch1'], digital_samples['d_ch2'],
+                                int_type_str='int8', out=comb_samples[1::2])
 
         else:
-            comb_samples = a_samples
+            comb_samples = self.float_to_sample(analog_samples[ch_str])
 
         return comb_samples
 
@@ -2404,11 +2447,9 @@ class AWGM8195A(AWGM819X):
             else:
                 self.write('OUTP{0:d} OFF'.format(dch_num))
 
-    def float_to_sample(self, val):
-
-        val_int = self._float_to_int(val, self._dac_resolution)
+    def float_to_sample(self, val, out=None):
 
-        return val_int.astype('int8')
+        return self._quantize_samples(val, self._dac_resolution, dtype='int8', out=out)
 
     def _define_new_sequence(self, name, num_steps):
         # no storage system for sequences on 8195a
@@ -2668,14 +2709,14 @@ class AWGM8190A(AWGM819X):
 
         marker = self.marker_on
 
-        a_samples = self.float_to_sample(analog_samples[ch_num])
-        marker_sample = digital_samples[self._analogue_ch_corresponding_digital_chs(ch_num)[0]]
-        marker_sync = digital_samples[self._analogue_ch_corresponding_digital_chs(ch_num)[1]]
-        d_samples = self.bool_to_sample(marker_sample, marker_sync, int_type_str='int16')
         if marker:
-            comb_samples = a_samples + d_samples
+            marker_sample = digital_samples[self._analogue_ch_corresponding_digital_chs(ch_num)[0]]
+            marker_sync = digital_samples[self._analogue_ch_corresponding_digital_chs(ch_num)[1]]
+            # quantize and pack the marker bits in one pass
+            comb_samples = self.float_to_sample(analog_samples[ch_num], marker_1=marker_sample,
+                                                marker_2=marker_sync)
         else:
-            comb_samples = a_samples
+            comb_samples = self.float_to_sample(analog_samples[ch_num])
 
         return comb_samples
 
@@ -2752,12 +2793,12 @@ class AWGM8190A(AWGM819X):
             else:
                 self.write('OUTP{0:d}:NORM OFF'.format(ach_num))
 
-    def float_to_sample(self, val):
+    def float_to_sample(self, val, marker_1=None, marker_2=None, out=None):
 
-        val_int = self._float_to_int(val, self._dac_resolution)
         shiftbits = 16 - self._dac_resolution  # 2 for marker, dac: 12 -> 2, dac: 14 -> 4
 
-        return val_int.astype('int16') << shiftbits
+        return self._quantize_samples(val, self._dac_resolution, dtype='int16', shiftbits=shiftbits,
+                                      marker_1=marker_1, marker_2=marker_2, out=out)
 
     def _delete_all_sequences(self):
 
@@ -22,7 +22,6 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 from core.util.modules import get_home_dir
 import time
-from ftplib import FTP
 from socket import socket, AF_INET, SOCK_STREAM
 import os
 from collections import OrderedDict
@@ -32,6 +31,7 @@ import re
 from core.module import Base
 from core.configoption import ConfigOption
 from interface.pulser_interface import PulserInterface, PulserConstraints, SequenceOption
+from hardware.awg.ftp_session import FTPSession
 
 
 class AWG5002C(Base, PulserInterface):
@@ -68,6 +68,7 @@ class AWG5002C(Base, PulserInterface):
         super().__init__(config=config, **kwargs)
 
         self.connected = False
+        self._ftp_session = None  # persistent FTP connection to the AWG
 
         self._marker_byte_dict = {0: b'\x00', 1: b'\x01', 2: b'\x02', 3: b'\x03'}
         self.current_loaded_asset = ''
@@ -91,8 +92,8 @@ class AWG5002C(Base, PulserInterface):
         #   https://docs.python.org/3/library/socket.html#socket.socket.recv
         self.input_buffer = int(4096)   # buffer length for received text
 
-        # the ftp connection will be established during runtime if needed and
-        # closed directly afterwards. This makes the connection stable.
+        # the ftp connection will be established when it is needed for the first time and kept
+        # open until deactivation. Lost connections are reestablished automatically.
 
         if 'default_sample_rate' in config.keys():
             self._sample_rate = self.set_sample_rate(config['default_sample_rate'])
@@ -104,6 +105,10 @@ class AWG5002C(Base, PulserInterface):
 
         # settings for remote access on the AWG PC
         self.asset_directory = '\\waves'
+        self._ftp_session = FTPSession(self.ip_address,
+                                       user=self.user,
+                                       passwd=self.passwd,
+                                       working_dir=self.asset_directory)
 
         if 'tmp_work_dir' in config.keys():
             self._tmp_work_dir = config['tmp_work_dir']
@@ -133,6 +138,10 @@ class AWG5002C(Base, PulserInterface):
         """ Deinitialisation performed during deactivation of the module.
         """
         self.connected = False
+        try:
+            self._ftp_session.close()
+        except:
+            self.log.debug('Closing AWG connection using FTP failed.')
         self.soc.shutdown(0)  # tell the connection that the host will not listen
                               # any more to messages from it.
         self.soc.close()
@@ -306,7 +315,7 @@ class AWG5002C(Base, PulserInterface):
             if (asset_name + '.seq') in filename:
                 upload_names.append(filename)
 
-        # upload files
+        # upload files. All files are transferred over the same connection.
         for name in upload_names:
             self._send_file(name)
         return 0
@@ -325,11 +334,9 @@ class AWG5002C(Base, PulserInterface):
 
         filepath = os.path.join(self.host_waveform_directory, filename)
 
-        with FTP(self.ip_address) as ftp:
-            ftp.login()  # login as default user anonymous, passwd anonymous@
-            ftp.cwd(self.asset_directory)
-            with open(filepath, 'rb') as uploaded_file:
-                ftp.storbinary('STOR '+filename, uploaded_file)
+        with open(filepath, 'rb') as uploaded_file:
+            self._ftp_session.upload(filename, uploaded_file)
+        return 0
 
     def load_asset(self, asset_name, load_dict=None):
         """ Loads a sequence or waveform to the specified channel of the pulsing
@@ -964,11 +971,8 @@ class AWG5002C(Base, PulserInterface):
                     files_to_delete.append(filename)
 
         # delete files
-        with FTP(self.ip_address) as ftp:
-            ftp.login() # login as default user anonymous, passwd anonymous@
-            ftp.cwd(self.asset_directory)
-            for filename in files_to_delete:
-                ftp.delete(filename)
+        for filename in files_to_delete:
+            self._ftp_session.delete(filename)
 
         # clear the AWG if the deleted asset is the currently loaded asset
         # if self.current_loaded_asset == asset_name:
@@ -987,15 +991,13 @@ class AWG5002C(Base, PulserInterface):
         """
 
         # check whether the desired directory exists:
-        with FTP(self.ip_address) as ftp:
-            ftp.login()  # login as default user anonymous, passwd anonymous@
-
-            try:
-                ftp.cwd(dir_path)
-            except:
-                self.log.info('Desired directory {0} not found on AWG device.\n'
-                              'Create new.'.format(dir_path))
-                ftp.mkd(dir_path)
+        try:
+            self._ftp_session.working_dir = dir_path
+        except:
+            self.log.info('Desired directory {0} not found on AWG device.\n'
+                          'Create new.'.format(dir_path))
+            self._ftp_session.mkd(dir_path)
+            self._ftp_session.working_dir = dir_path
 
         self.asset_directory = dir_path
         return 0
@@ -1213,33 +1215,28 @@ class AWG5002C(Base, PulserInterface):
         @return: list, The full filenames of all assets saved on the device.
         """
         filename_list = []
-        with FTP(self.ip_address) as ftp:
-            ftp.login()  # login as default user anonymous, passwd anonymous@
-            ftp.cwd(self.asset_directory)
-            # get only the files from the dir and skip possible directories
-            log =[]
-            file_list = []
-            ftp.retrlines('LIST', callback=log.append)
-            for line in log:
-                if '<DIR>' not in line:
-                    # that is how a potential line is looking like:
-                    #   '05-10-16  05:22PM                  292 SSR aom adjusted.seq'
-                    # One can see that the first part consists of the date
-                    # information. Remove those information and separate then
-                    # the first number, which indicates the size of the file,
-                    # from the following. That is necessary if the filename has
-                    # whitespaces in the name:
-                    size_filename = line[18:].lstrip()
-
-                    # split after the first appearing whitespace and take the
-                    # rest as filename, remove for safety all trailing
-                    # whitespaces:
-                    actual_filename = size_filename.split(' ', 1)[1].lstrip()
-                    file_list.append(actual_filename)
-            for filename in file_list:
-                if filename.endswith('.wfm') or filename.endswith('.seq'):
-                    if filename not in filename_list:
-                        filename_list.append(filename)
+        # get only the files from the dir and skip possible directories
+        file_list = []
+        for line in self._ftp_session.list_lines():
+            if '<DIR>' not in line:
+                # that is how a potential line is looking like:
+                #   '05-10-16  05:22PM                  292 SSR aom adjusted.seq'
+                # One can see that the first part consists of the date
+                # information. Remove those information and separate then
+                # the first number, which indicates the size of the file,
+                # from the following. That is necessary if the filename has
+                # whitespaces in the name:
+                size_filename = line[18:].lstrip()
+
+                # split after the first appearing whitespace and take the
+                # rest as filename, remove for safety all trailing
+                # whitespaces:
+                actual_filename = size_filename.split(' ', 1)[1].lstrip()
+                file_list.append(actual_filename)
+        for filename in file_list:
+            if filename.endswith('.wfm') or filename.endswith('.seq'):
+                if filename not in filename_list:
+                    filename_list.append(filename)
 
         return filename_list
 
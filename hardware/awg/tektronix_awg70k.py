@@ -22,12 +22,12 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 
 import os
+import tempfile
 import time
 import visa
 import numpy as np
 
 from collections import OrderedDict
-from ftplib import FTP
 from lxml import etree as ET
 
 from core.module import Base
@@ -35,6 +35,7 @@ from core.configoption import ConfigOption
 from core.util.modules import get_home_dir
 from core.util.helpers import natural_sort
 from interface.pulser_interface import PulserInterface, PulserConstraints, SequenceOption
+from hardware.awg.ftp_session import FTPSession
 
 
 class AWG70K(Base, PulserInterface):
@@ -79,6 +80,8 @@ class AWG70K(Base, PulserInterface):
         self.awg_model = ''  # String describing the model
 
         self.ftp_working_dir = 'waves'  # subfolder of FTP root dir on AWG disk to work in
+        self._ftp_session = None  # persistent FTP connection to the AWG
+        self._wfmx_chunks = dict()  # spool files and markers of chunkwise written waveforms
 
         self.__max_seq_steps = 0
         self.__max_seq_repetitions = 0
@@ -105,10 +108,12 @@ class AWG70K(Base, PulserInterface):
             # set timeout by default to 30 sec
             self.awg.timeout = self._visa_timeout * 1000
 
-        # try connecting to AWG using FTP protocol
-        with FTP(self._ip_address) as ftp:
-            ftp.login(user=self._username, passwd=self._password)
-            ftp.cwd(self.ftp_working_dir)
+        # connect to AWG using FTP protocol. The session is kept open until deactivation.
+        self._ftp_session = FTPSession(self._ip_address,
+                                       user=self._username,
+                                       passwd=self._password,
+                                       working_dir=self.ftp_working_dir)
+        self._ftp_session.connect()
 
         if self.awg is not None:
             self.awg_model = self.query('*IDN?').split(',')[1]
@@ -132,6 +137,13 @@ class AWG70K(Base, PulserInterface):
             self.awg.close()
         except:
             self.log.debug('Closing AWG connection using pyvisa failed.')
+        try:
+            self._ftp_session.close()
+        except:
+            self.log.debug('Closing AWG connection using FTP failed.')
+        for spool_file, digital_bytes in self._wfmx_chunks.values():
+            spool_file.close()
+        self._wfmx_chunks = dict()
         self.log.info('Closed connection to AWG')
         return
 
@@ -364,7 +376,10 @@ class AWG70K(Base, PulserInterface):
                                      set(analog_samples.keys()).union(set(digital_samples.keys()))))
             return -1, waveforms
 
-        # Write waveforms. One for each analog channel.
+        # Encode and upload waveforms. One for each analog channel.
+        # The upload runs in the background while the next channel is encoded.
+        uploads = list()
+        existing_waveforms = self.get_waveform_names() if is_first_chunk else list()
         for a_ch in active_analog:
             # Get the integer analog channel number
             a_ch_num = int(a_ch.split('ch')[-1])
@@ -389,23 +404,40 @@ class AWG70K(Base, PulserInterface):
             wfm_name = '{0}_ch{1:d}'.format(name, a_ch_num)
 
             # Check if waveform already exists and delete if necessary.
-            if wfm_name in self.get_waveform_names():
+            if wfm_name in existing_waveforms:
                 self.delete_waveform(wfm_name)
 
-            # Write WFMX file for waveform
-            start = time.time()
-            self._write_wfmx(filename=wfm_name,
-                             analog_samples=analog_samples[a_ch],
-                             marker_bytes=mrk_bytes,
-                             is_first_chunk=is_first_chunk,
-                             is_last_chunk=is_last_chunk,
-                             total_number_of_samples=total_number_of_samples)
-            self.log.debug('Write WFMX file: {0}'.format(time.time() - start))
-
-            # transfer waveform to AWG and load into workspace
+            # Assemble WFMX file for waveform (in a temporary file if written in several chunks)
+            wfmx_file = self._write_wfmx(filename=wfm_name,
+                                            analog_samples=analog_samples[a_ch],
+                                            marker_bytes=mrk_bytes,
+                                            is_first_chunk=is_first_chunk,
+                                            is_last_chunk=is_last_chunk,
+                                            total_number_of_samples=total_number_of_samples)
+
+            # transfer waveform to AWG once it is complete. The sample arrays of a single chunk
+            # are uploaded directly from memory, so the upload has to finish before returning.
+            if wfmx_file is not None:
+                uploads.append((wfm_name,
+                                self._ftp_session.upload_async(wfm_name + '.wfmx', wfmx_file),
+                                wfmx_file))
+
+        # Load the uploaded waveforms into workspace as soon as the transfer is finished
+        failed = False
+        for wfm_name, upload, wfmx_file in uploads:
             start = time.time()
-            self._send_file(filename=wfm_name + '.wfmx')
+            try:
+                upload.result()
+            except Exception as err:
+                self.log.error('Upload of waveform "{0}" to AWG failed: {1}'.format(wfm_name, err))
+                failed = True
+                continue
+            finally:
+                if hasattr(wfmx_file, 'close'):
+                    wfmx_file.close()
             self.log.debug('Send WFMX file: {0}'.format(time.time() - start))
+            if failed:
+                continue
 
             start = time.time()
             self.write('MMEM:OPEN "{0}"'.format(os.path.join(
@@ -427,7 +459,9 @@ class AWG70K(Base, PulserInterface):
 
             # Append created waveform name to waveform list
             waveforms.append(wfm_name)
-        return total_number_of_samples, waveforms
+        if failed:
+            return -1, waveforms
+        return len(analog_samples[active_analog[0]]), waveforms
 
     def write_sequence(self, name, sequence_parameter_list):
         """
@@ -1515,81 +1549,72 @@ class AWG70K(Base, PulserInterface):
         @return list: filenames found in <ftproot>\\waves
         """
         filename_list = list()
-        with FTP(self._ip_address) as ftp:
-            ftp.login(user=self._username, passwd=self._password)
-            ftp.cwd(self.ftp_working_dir)
-            # get only the files from the dir and skip possible directories
-            log = list()
-            ftp.retrlines('LIST', callback=log.append)
-            for line in log:
-                if '<DIR>' not in line:
-                    # that is how a potential line is looking like:
-                    #   '05-10-16  05:22PM                  292 SSR aom adjusted.seq'
-                    # The first part consists of the date information. Remove this information and
-                    # separate the first number, which indicates the size of the file. This is
-                    # necessary if the filename contains whitespaces.
-                    size_filename = line[18:].lstrip()
-                    # split after the first appearing whitespace and take the rest as filename.
-                    # Remove for safety all trailing and leading whitespaces:
-                    filename = size_filename.split(' ', 1)[1].strip()
-                    filename_list.append(filename)
+        # get only the files from the dir and skip possible directories
+        for line in self._ftp_session.list_lines():
+            if '<DIR>' not in line:
+                # that is how a potential line is looking like:
+                #   '05-10-16  05:22PM                  292 SSR aom adjusted.seq'
+                # The first part consists of the date information. Remove this information and
+                # separate the first number, which indicates the size of the file. This is
+                # necessary if the filename contains whitespaces.
+                size_filename = line[18:].lstrip()
+                # split after the first appearing whitespace and take the rest as filename.
+                # Remove for safety all trailing and leading whitespaces:
+                filename = size_filename.split(' ', 1)[1].strip()
+                filename_list.append(filename)
         return filename_list
 
     def _delete_file(self, filename):
         """
 
-        @param str filename:
+        @param str filename: The full filename to delete from FTP cwd
         """
-        if filename in self._get_filenames_on_device():
-            with FTP(self._ip_address) as ftp:
-                ftp.login(user=self._username, passwd=self._password)
-                ftp.cwd(self.ftp_working_dir)
-                ftp.delete(filename)
+        self._ftp_session.delete(filename)
         return
 
-    def _send_file(self, filename):
+    def _send_file(self, filename, data=None):
         """
+        Upload a file to the AWG. An existing file by the same filename is replaced.
 
-        @param filename:
-        @return:
+        @param str filename: the filename on the device
+        @param data: optional, bytes-like object or list of them to upload directly from memory.
+                     If None, the file is read from tmp_work_dir.
+        @return int: error code (0: OK, -1: error)
         """
         # check input
         if not filename:
             self.log.error('No filename provided for file upload to awg!\nCommand will be ignored.')
             return -1
 
+        if data is not None:
+            self._ftp_session.upload(filename, data)
+            return 0
+
         filepath = os.path.join(self._tmp_work_dir, filename)
         if not os.path.isfile(filepath):
             self.log.error('No file "{0}" found in "{1}". Unable to upload!'
                            ''.format(filename, self._tmp_work_dir))
             return -1
 
-        # Delete old file on AWG by the same filename
-        self._delete_file(filename)
-
         # Transfer file
-        with FTP(self._ip_address) as ftp:
-            ftp.login(user=self._username, passwd=self._password)
-            ftp.cwd(self.ftp_working_dir)
-            with open(filepath, 'rb') as file:
-                ftp.storbinary('STOR ' + filename, file)
+        with open(filepath, 'rb') as file:
+            self._ftp_session.upload(filename, file)
         return 0
 
     def _write_wfmx(self, filename, analog_samples, marker_bytes, is_first_chunk, is_last_chunk,
                     total_number_of_samples):
         """
-        Appends a sampled chunk of a whole waveform to a wfmx-file. Create the file
+        Appends a sampled chunk of a whole waveform to a temporary wfmx-file. Create the file
         if it is the first chunk.
         If both flags (is_first_chunk, is_last_chunk) are set to TRUE it means
-        that the whole ensemble is written as a whole in one big chunk.
+        that the whole ensemble is written as a whole in one big chunk. In this case no file is
+        created and the sample arrays are uploaded directly from memory.
 
         @param name: string, represents the name of the sampled ensemble
-        @param analog_samples: dict containing float32 numpy ndarrays, contains the
-                                       samples for the analog channels that
-                                       are to be written by this function call.
-        @param marker_bytes: np.ndarray containing bool numpy ndarrays, contains the samples
-                                      for the digital channels that
-                                      are to be written by this function call.
+        @param analog_samples: float32 numpy ndarray, contains the samples for the analog channel
+                               that are to be written by this function call.
+        @param marker_bytes: uint8 numpy ndarray, contains the encoded samples of the digital
+                             channels that are to be written by this function call.
         @param total_number_of_samples: int, The total number of samples in the
                                         entire waveform. Has to be known in advance.
         @param is_first_chunk: bool, indicates if the current chunk is the
@@ -1597,58 +1622,46 @@ class AWG70K(Base, PulserInterface):
         @param is_last_chunk: bool, indicates if the current chunk is the last
                               write to this file.
 
-        @return list: the list contains the string names of the created files for the passed
-                      presampled arrays
+        @return list|file: the buffers making up the complete wfmx file for a single chunk or the
+                           complete wfmx file after the last of several chunks, opened for reading
+                           from the start. None otherwise. The file is deleted when it is closed.
         """
-        # The memory overhead of the tmp file write/read process in bytes. Only used if wfmx file is
-        # written in chunks in order to avoid excessive memory usage.
-        tmp_bytes_overhead = 16777216  # 16 MB
-
         if not filename.endswith('.wfmx'):
             filename += '.wfmx'
-        wfmx_path = os.path.join(self._tmp_work_dir, filename)
-        tmp_path = os.path.join(self._tmp_work_dir, 'digital_tmp.bin')
 
         # if it is the first chunk, create the .WFMX file with header.
         if is_first_chunk:
-            # create header
+            if filename in self._wfmx_chunks:
+                self._wfmx_chunks.pop(filename)[0].close()
             header = self._create_xml_header(total_number_of_samples, marker_bytes is not None)
-            # write header
-            with open(wfmx_path, 'wb') as wfmxfile:
-                wfmxfile.write(header.encode('utf8'))
-            # Check if a tmp digital samples file is present and delete it if necessary.
-            if os.path.isfile(tmp_path):
-                os.remove(tmp_path)
-
-        # append analog samples to the .WFMX file.
-        # Write digital samples in temporary file if not the entire samples are passed at once.
-        with open(wfmx_path, 'ab') as wfmxfile:
-            # append analog samples in binary format. One sample is 4 bytes (np.float32).
-            wfmxfile.write(analog_samples)
-
-        # Write digital samples to tmp file if chunkwise writing is used and it's not the last chunk
-        if not is_last_chunk and marker_bytes is not None:
-            with open(tmp_path, 'ab') as tmp_file:
-                tmp_file.write(marker_bytes)
-
-        # If this is the last chunk, write digital samples from tmp file to wfmx file (if present)
-        # and also append the currently passed digital samples to wfmx file.
-        # Read from tmp file in chunks of tmp_bytes_overhead in order to avoid too much memory
-        # overhead.
-        if is_last_chunk and marker_bytes is not None:
-            with open(wfmx_path, 'ab') as wfmxfile:
-                # Copy over digital samples from tmp file. Delete tmp file afterwards.
-                if os.path.isfile(tmp_path):
-                    with open(tmp_path, 'rb') as tmp_file:
-                        while True:
-                            tmp = tmp_file.read(tmp_bytes_overhead)
-                            if not tmp:
-                                break
-                            wfmxfile.write(tmp)
-                    os.remove(tmp_path)
-                # Append current digital samples array to wfmx file
-                wfmxfile.write(marker_bytes)
-        return
+            if is_last_chunk:
+                # The whole waveform is known, so the file does not need to be assembled
+                buffers = [header.encode('utf8'), analog_samples]
+                if marker_bytes is not None:
+                    buffers.append(marker_bytes)
+                return buffers
+            spool_file = tempfile.TemporaryFile(dir=self._tmp_work_dir)
+            spool_file.write(header.encode('utf8'))
+            self._wfmx_chunks[filename] = (spool_file, bytearray())
+        elif filename not in self._wfmx_chunks:
+            self.log.error('Unable to append samples to "{0}". First chunk is missing.'
+                           ''.format(filename))
+            return None
+        spool_file, digital_bytes = self._wfmx_chunks[filename]
+
+        # The analog samples are followed by all digital samples. The analog samples are written
+        # to the file right away, only the (four times smaller) marker bytes are kept in memory
+        # until the last chunk.
+        spool_file.write(memoryview(analog_samples).cast('B'))
+        if marker_bytes is not None:
+            digital_bytes.extend(memoryview(marker_bytes).cast('B'))
+        if not is_last_chunk:
+            return None
+
+        del self._wfmx_chunks[filename]
+        spool_file.write(digital_bytes)
+        spool_file.seek(0)
+        return spool_file
 
     def _create_xml_header(self, number_of_samples, markers_active):
         """
@@ -22,10 +22,10 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 
 import os
+import tempfile
 import time
 import visa
 import numpy as np
-from ftplib import FTP
 from collections import OrderedDict
 
 from core.util.modules import get_home_dir
@@ -33,6 +33,7 @@ from core.util.helpers import natural_sort
 from core.module import Base
 from core.configoption import ConfigOption
 from interface.pulser_interface import PulserInterface, PulserConstraints, SequenceOption
+from hardware.awg.ftp_session import FTPSession
 
 
 class AWG7k(Base, PulserInterface):
@@ -73,6 +74,8 @@ class AWG7k(Base, PulserInterface):
         self.awg = None  # This variable will hold a reference to the awg visa resource
 
         self.ftp_working_dir = 'waves'  # subfolder of FTP root dir on AWG disk to work in
+        self._ftp_session = None  # persistent FTP connection to the AWG
+        self._wfm_chunks = dict()  # spool files of chunkwise written waveforms
 
         self.installed_options = list()  # will hold the encoded installed options available on awg
         self._internal_ch_state = {
@@ -104,11 +107,12 @@ class AWG7k(Base, PulserInterface):
                 'the connection by using for example "Agilent Connection Expert".'
                 ''.format(self._visa_address))
 
-        # try connecting to AWG using FTP protocol
-        with FTP(self._ip_address) as ftp:
-            ftp.login(user=self._username, passwd=self._password)
-            ftp.cwd(self.ftp_working_dir)
-            self.log.debug('FTP working dir: {0}'.format(ftp.pwd()))
+        # connect to AWG using FTP protocol. The session is kept open until deactivation.
+        self._ftp_session = FTPSession(self._ip_address,
+                                       user=self._username,
+                                       passwd=self._password,
+                                       working_dir=self.ftp_working_dir)
+        self.log.debug('FTP working dir: {0}'.format(self._ftp_session.pwd()))
 
         idn = self.query('*IDN?').split(',')
         self.mfg, self.model, self.ser, self.fw_ver = idn
@@ -137,6 +141,13 @@ class AWG7k(Base, PulserInterface):
             self.awg.close()
         except:
             self.log.debug('Closing AWG connection using pyvisa failed.')
+        try:
+            self._ftp_session.close()
+        except:
+            self.log.debug('Closing AWG connection using FTP failed.')
+        for spool_file in self._wfm_chunks.values():
+            spool_file.close()
+        self._wfm_chunks = dict()
         self.log.info('Closed connection to AWG')
         return
 
@@ -966,7 +977,9 @@ class AWG7k(Base, PulserInterface):
                                      set(analog_samples.keys()).union(set(digital_samples.keys()))))
             return -1, waveforms
 
-        # Write waveforms. One for each analog channel.
+        # Encode and upload waveforms. One for each analog channel.
+        # The upload runs in the background while the next channel is encoded.
+        uploads = list()
         for a_ch in active_analog:
             # Get the integer analog channel number
             a_ch_num = int(a_ch.rsplit('ch', 1)[1])
@@ -990,21 +1003,38 @@ class AWG7k(Base, PulserInterface):
             # Create waveform name string
             wfm_name = '{0}_ch{1:d}'.format(name, a_ch_num)
 
-            # Write WFM file for waveform
+            # Encode WFM file for waveform (in a temporary file if written in several chunks)
             start = time.time()
-            self._write_wfm(filename=wfm_name,
-                            analog_samples=analog_samples[a_ch],
-                            marker_bytes=mrk_bytes,
-                            is_first_chunk=is_first_chunk,
-                            is_last_chunk=is_last_chunk,
-                            total_number_of_samples=total_number_of_samples)
-
+            wfm_file = self._write_wfm(filename=wfm_name,
+                                          analog_samples=analog_samples[a_ch],
+                                          marker_bytes=mrk_bytes,
+                                          is_first_chunk=is_first_chunk,
+                                          is_last_chunk=is_last_chunk,
+                                          total_number_of_samples=total_number_of_samples)
             self.log.debug('Write WFM file: {0}'.format(time.time() - start))
 
-            # transfer waveform to AWG and load into workspace
+            # transfer waveform to AWG once it is complete
+            if wfm_file is not None:
+                uploads.append((wfm_name,
+                                self._ftp_session.upload_async(wfm_name + '.wfm', wfm_file),
+                                wfm_file))
+
+        # Import the uploaded waveforms into workspace as soon as the transfer is finished
+        failed = False
+        for wfm_name, upload, wfm_file in uploads:
             start = time.time()
-            self._send_file(filename=wfm_name + '.wfm')
+            try:
+                upload.result()
+            except Exception as err:
+                self.log.error('Upload of waveform "{0}" to AWG failed: {1}'.format(wfm_name, err))
+                failed = True
+                continue
+            finally:
+                if hasattr(wfm_file, 'close'):
+                    wfm_file.close()
             self.log.debug('Send WFM file: {0}'.format(time.time() - start))
+            if failed:
+                continue
 
             start = time.time()
             self.write('MMEM:IMP "{0}","{1}",WFM'.format(wfm_name, wfm_name + '.wfm'))
@@ -1018,7 +1048,9 @@ class AWG7k(Base, PulserInterface):
 
             # Append created waveform name to waveform list
             waveforms.append(wfm_name)
-        return total_number_of_samples, waveforms
+        if failed:
+            return -1, waveforms
+        return len(analog_samples[active_analog[0]]), waveforms
 
     def write_sequence(self, name, sequence_parameter_list):
         """
@@ -1268,39 +1300,36 @@ class AWG7k(Base, PulserInterface):
 
         @param str filename: The full filename to delete from FTP cwd
         """
-        if filename in self._get_filenames_on_device():
-            with FTP(self._ip_address) as ftp:
-                ftp.login(user=self._username, passwd=self._password)
-                ftp.cwd(self.ftp_working_dir)
-                ftp.delete(filename)
+        self._ftp_session.delete(filename)
         return
 
-    def _send_file(self, filename):
+    def _send_file(self, filename, data=None):
         """
+        Upload a file to the AWG. An existing file by the same filename is replaced.
 
-        @param filename:
-        @return:
+        @param str filename: the filename on the device
+        @param data: optional, bytes-like object or list of them to upload directly from memory.
+                     If None, the file is read from tmp_work_dir.
+        @return int: error code (0: OK, -1: error)
         """
         # check input
         if not filename:
             self.log.error('No filename provided for file upload to awg!\nCommand will be ignored.')
             return -1
 
+        if data is not None:
+            self._ftp_session.upload(filename, data)
+            return 0
+
         filepath = os.path.join(self._tmp_work_dir, filename)
         if not os.path.isfile(filepath):
             self.log.error('No file "{0}" found in "{1}". Unable to upload!'
                            ''.format(filename, self._tmp_work_dir))
             return -1
 
-        # Delete old file on AWG by the same filename
-        self._delete_file(filename)
-
         # Transfer file
-        with FTP(self._ip_address) as ftp:
-            ftp.login(user=self._username, passwd=self._password)
-            ftp.cwd(self.ftp_working_dir)
-            with open(filepath, 'rb') as file:
-                ftp.storbinary('STOR ' + filename, file)
+        with open(filepath, 'rb') as file:
+            self._ftp_session.upload(filename, file)
         return 0
 
     def _get_filenames_on_device(self):
@@ -1309,24 +1338,19 @@ class AWG7k(Base, PulserInterface):
         @return list: filenames found in <ftproot>\\waves
         """
         filename_list = list()
-        with FTP(self._ip_address) as ftp:
-            ftp.login(user=self._username, passwd=self._password)
-            ftp.cwd(self.ftp_working_dir)
-            # get only the files from the dir and skip possible directories
-            log = list()
-            ftp.retrlines('LIST', callback=log.append)
-            for line in log:
-                if '<DIR>' not in line:
-                    # that is how a potential line is looking like:
-                    #   '05-10-16  05:22PM                  292 SSR aom adjusted.seq'
-                    # The first part consists of the date information. Remove this information and
-                    # separate the first number, which indicates the size of the file. This is
-                    # necessary if the filename contains whitespaces.
-                    size_filename = line[18:].lstrip()
-                    # split after the first appearing whitespace and take the rest as filename.
-                    # Remove for safety all trailing and leading whitespaces:
-                    filename = size_filename.split(' ', 1)[1].strip()
-                    filename_list.append(filename)
+        # get only the files from the dir and skip possible directories
+        for line in self._ftp_session.list_lines():
+            if '<DIR>' not in line:
+                # that is how a potential line is looking like:
+                #   '05-10-16  05:22PM                  292 SSR aom adjusted.seq'
+                # The first part consists of the date information. Remove this information and
+                # separate the first number, which indicates the size of the file. This is
+                # necessary if the filename contains whitespaces.
+                size_filename = line[18:].lstrip()
+                # split after the first appearing whitespace and take the rest as filename.
+                # Remove for safety all trailing and leading whitespaces:
+                filename = size_filename.split(' ', 1)[1].strip()
+                filename_list.append(filename)
         return filename_list
 
     def _get_all_channels(self):
@@ -1387,75 +1411,72 @@ class AWG7k(Base, PulserInterface):
     def _write_wfm(self, filename, analog_samples, marker_bytes, is_first_chunk, is_last_chunk,
                    total_number_of_samples):
         """
-        Appends a sampled chunk of a whole waveform to a wfm-file. Create the file
+        Appends a sampled chunk of a whole waveform to a temporary wfm-file. Create the file
         if it is the first chunk.
         If both flags (is_first_chunk, is_last_chunk) are set to TRUE it means
-        that the whole ensemble is written as a whole in one big chunk.
+        that the whole ensemble is written as a whole in one big chunk. In this case no file is
+        created and the encoded samples are uploaded directly from memory.
 
         @param filename: string, represents the name of the sampled waveform
-        @param analog_samples: dict containing float32 numpy ndarrays, contains the
-                                       samples for the analog channels that
-                                       are to be written by this function call.
-        @param marker_bytes: np.ndarray containing bool numpy ndarrays, contains the samples
-                                      for the digital channels that
-                                      are to be written by this function call.
+        @param analog_samples: float32 numpy ndarray, contains the samples for the analog channel
+                               that are to be written by this function call.
+        @param marker_bytes: uint8 numpy ndarray, contains the encoded samples of the digital
+                             channels that are to be written by this function call.
         @param total_number_of_samples: int, The total number of samples in the
                                         entire waveform. Has to be known in advance.
         @param is_first_chunk: bool, indicates if the current chunk is the
                                first write to this file.
         @param is_last_chunk: bool, indicates if the current chunk is the last
                               write to this file.
-        """
-        # The memory overhead of the tmp file write/read process in bytes.
-        tmp_bytes_overhead = 104857600  # 100 MB
-        tmp_samples = tmp_bytes_overhead // 5
-        if tmp_samples > len(analog_samples):
-            tmp_samples = len(analog_samples)
 
+        @return list|file: the buffers making up the complete wfm file for a single chunk or the
+                           complete wfm file after the last of several chunks, opened for reading
+                           from the start. None otherwise. The file is deleted when it is closed.
+        """
         if not filename.endswith('.wfm'):
             filename += '.wfm'
-        wfm_path = os.path.join(self._tmp_work_dir, filename)
 
         # if it is the first chunk, create the WFM file with header.
         if is_first_chunk:
-            with open(wfm_path, 'wb') as wfm_file:
-                # write the first line, which is the header file, if first chunk is passed:
-                num_bytes = str(int(total_number_of_samples * 5))
-                num_digits = str(len(num_bytes))
-                header = 'MAGIC 1000\r\n#{0}{1}'.format(num_digits, num_bytes)
-                wfm_file.write(header.encode())
+            # write the first line, which is the header file, if first chunk is passed:
+            num_bytes = str(int(total_number_of_samples * 5))
+            num_digits = str(len(num_bytes))
+            header = 'MAGIC 1000\r\n#{0}{1}'.format(num_digits, num_bytes)
+            if filename in self._wfm_chunks:
+                self._wfm_chunks.pop(filename).close()
+            if not is_last_chunk:
+                self._wfm_chunks[filename] = tempfile.TemporaryFile(dir=self._tmp_work_dir)
+                self._wfm_chunks[filename].write(header.encode())
+        elif filename not in self._wfm_chunks:
+            self.log.error('Unable to append samples to "{0}". First chunk is missing.'
+                           ''.format(filename))
+            return None
 
         # For the WFM file format unfortunately we need to write the digital sampels together
-        # with the analog samples. Therefore we need a temporary copy of all samples for each
-        # analog channel.
-        write_array = np.zeros(tmp_samples, dtype='float32, uint8')
-
-        # Consecutively prepare and write chunks of maximal size tmp_bytes_overhead to file
-        samples_written = 0
-        with open(wfm_path, 'ab') as wfm_file:
-            while samples_written < len(analog_samples):
-                write_end = samples_written + write_array.size
-                # Prepare tmp write array
-                write_array['f0'] = analog_samples[samples_written:write_end]
-                if marker_bytes is not None:
-                    write_array['f1'] = marker_bytes[samples_written:write_end]
-                # Write to file
-                wfm_file.write(write_array)
-                # Increment write counter
-                samples_written = write_end
-                # Reduce write array size if
-                if 0 < total_number_of_samples - samples_written < write_array.size:
-                    write_array.resize(total_number_of_samples - samples_written)
-
-        del write_array
+        # with the analog samples. Therefore each chunk is encoded into a new record array,
+        # which is written to the file right away.
+        write_array = np.zeros(len(analog_samples), dtype='float32, uint8')
+        write_array['f0'] = analog_samples
+        if marker_bytes is not None:
+            write_array['f1'] = marker_bytes
 
         # append footer if it's the last chunk to write
+        # the footer encodes the sample rate, which was used for that file:
         if is_last_chunk:
-            # the footer encodes the sample rate, which was used for that file:
             footer = 'CLOCK {0:16.10E}\r\n'.format(self.get_sample_rate())
-            with open(wfm_path, 'ab') as wfm_file:
-                wfm_file.write(footer.encode())
-        return
+            if is_first_chunk:
+                # The whole waveform is known, so the file does not need to be assembled
+                return [header.encode(), write_array, footer.encode()]
+
+        spool_file = self._wfm_chunks[filename]
+        spool_file.write(memoryview(write_array.view(np.uint8)))
+        if not is_last_chunk:
+            return None
+
+        del self._wfm_chunks[filename]
+        spool_file.write(footer.encode())
+        spool_file.seek(0)
+        return spool_file
 
     def sequence_set_waveform(self, waveform_name, step, track):
         """
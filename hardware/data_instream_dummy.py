@@ -507,15 +507,27 @@ class InStreamDummy(Base, DataInStreamInterface):
                                ''.format(self.number_of_channels, buffer.shape[0]))
                 return -1
             number_of_samples = buffer.shape[1] if number_of_samples is None else number_of_samples
-            buffer = buffer.flatten()
+            if number_of_samples > buffer.shape[1]:
+                self.log.error('Number of samples to read exceeds the size of the buffer.')
+                return -1
         elif buffer.ndim == 1:
             number_of_samples = (buffer.size // self.number_of_channels) if number_of_samples is None else number_of_samples
+            if number_of_samples * self.number_of_channels > buffer.size:
+                self.log.error('Number of samples to read exceeds the size of the buffer.')
+                return -1
         else:
             self.log.error('Buffer must be a 1D or 2D numpy.ndarray.')
             return -1
 
         if number_of_samples < 1:
             return 0
+
+        # Get a writable (channels, samples) view of the buffer without copying the data
+        if buffer.ndim == 1:
+            buffer = buffer[:number_of_samples * self.number_of_channels].reshape(
+                (self.number_of_channels, number_of_samples))
+        else:
+            buffer = buffer[:, :number_of_samples]
         while self.available_samples < number_of_samples:
             time.sleep(0.001)
 
@@ -524,7 +536,6 @@ class InStreamDummy(Base, DataInStreamInterface):
         if avail_samples > self.buffer_size:
             self._has_overflown = True
 
-        offset = 0
         analog_x = np.arange(number_of_samples, dtype=self.__data_type) / self.__sample_rate
         analog_x *= 2 * np.pi
         analog_x += 2 * np.pi * (self._last_read - self._start_time)
@@ -533,17 +544,15 @@ class InStreamDummy(Base, DataInStreamInterface):
             if chnl in self._digital_channels:
                 ch_index = self._digital_channels.index(chnl)
                 events_per_bin = self._digital_event_rates[ch_index] / self.__sample_rate
-                buffer[offset:(offset+number_of_samples)] = np.random.poisson(events_per_bin,
-                                                                              number_of_samples)
+                buffer[i] = np.random.poisson(events_per_bin, number_of_samples)
             else:
                 ch_index = self._analog_channels.index(chnl)
                 amplitude = self._analog_amplitudes[ch_index]
-                np.sin(analog_x, out=buffer[offset:(offset+number_of_samples)])
-                buffer[offset:(offset + number_of_samples)] *= amplitude
+                np.sin(analog_x, out=buffer[i])
+                buffer[i] *= amplitude
                 noise_level = 0.1 * amplitude
                 noise = noise_level - 2 * noise_level * np.random.rand(number_of_samples)
-                buffer[offset:(offset + number_of_samples)] += noise
-            offset += number_of_samples
+                buffer[i] += noise
         return number_of_samples
 
     def read_available_data_into_buffer(self, buffer):
@@ -1405,6 +1405,43 @@ class NationalInstrumentsXSeries(Base, SlowCounterInterface, ConfocalScannerInte
         # return values is a rate of counts/s
         return all_data.transpose()
 
+    def scan_lines(self, line_paths, return_paths=None, pixel_clock=False):
+        """ Scans several lines in a row and returns the counts on these lines.
+
+        @param float[l][c][m] line_paths: array of l lines with c-tuples defining the voltage
+                                          points (m = samples per line)
+        @param float[l][c][r] return_paths: optional, array of l return lines scanned directly
+                                            after each line. The counts are thrown away.
+        @param bool pixel_clock: whether we need to output a pixel clock for the scan lines
+
+        @return float[l][m][n]: l lines of m (samples per line) n-channel photon counts per second
+
+        All lines and return lines are concatenated into a single trajectory which is output and
+        counted in one hardware timed run, so there is no dead time between the lines.
+        If a pixel clock is requested and configured, the lines are scanned one by one, since the
+        pixel clock must not be output during the return lines.
+        """
+        if pixel_clock and self._pixel_clock_channel is not None:
+            return super().scan_lines(line_paths, return_paths, pixel_clock=pixel_clock)
+
+        line_paths = np.asarray(line_paths)
+        number_of_lines, number_of_axes, line_length = line_paths.shape
+        if return_paths is None:
+            trajectory = line_paths
+            segment_length = line_length
+        else:
+            return_paths = np.asarray(return_paths)
+            trajectory = np.concatenate((line_paths, return_paths), axis=2)
+            segment_length = line_length + return_paths.shape[2]
+        # Reorder into a single continuous path of shape (axes, samples)
+        trajectory = trajectory.transpose(1, 0, 2).reshape(number_of_axes, -1)
+
+        counts = self.scan_line(trajectory, pixel_clock=False)
+        if np.any(counts == -1):
+            return np.array([[[-1.]]])
+        counts = counts.reshape(number_of_lines, segment_length, -1)
+        return counts[:, :line_length, :]
+
     def close_scanner(self):
         """ Closes the scanner and cleans up afterwards.
 
@@ -642,10 +642,19 @@ class NIXSeriesInStreamer(Base, DataInStreamInterface):
                                ''.format(self.number_of_channels, buffer.shape[0]))
                 return -1
             number_of_samples = buffer.shape[1] if number_of_samples is None else number_of_samples
-            buffer = buffer.flatten()
+            if number_of_samples > buffer.shape[1]:
+                self.log.error('Number of samples to read exceeds the size of the buffer.')
+                return -1
+            buffer = buffer[:, :number_of_samples]
         elif buffer.ndim == 1:
             if number_of_samples is None:
                 number_of_samples = buffer.size // self.number_of_channels
+            if number_of_samples * self.number_of_channels > buffer.size:
+                self.log.error('Number of samples to read exceeds the size of the buffer.')
+                return -1
+            # Samples are stored channel after channel
+            buffer = buffer[:number_of_samples * self.number_of_channels].reshape(
+                (self.number_of_channels, number_of_samples))
         else:
             self.log.error('Buffer must be a 1D or 2D numpy.ndarray.')
             return -1
@@ -658,23 +667,34 @@ class NIXSeriesInStreamer(Base, DataInStreamInterface):
             self._has_overflown = True
 
         try:
-            write_offset = 0
-            # Read digital channels
+            read_samples = number_of_samples
+            # Read digital channels directly into the (contiguous) rows of the buffer
             for i, reader in enumerate(self._di_readers):
                 # read the counter value. This function is blocking.
                 read_samples = reader.read_many_sample_double(
-                    buffer[write_offset:],
+                    buffer[i],
                     number_of_samples_per_channel=number_of_samples,
                     timeout=self._rw_timeout)
                 if read_samples != number_of_samples:
                     return -1
-                write_offset += number_of_samples
             # Read analog channels
             if self._ai_reader is not None:
-                read_samples = self._ai_reader.read_many_sample(
-                    buffer[write_offset:],
-                    number_of_samples_per_channel=number_of_samples,
-                    timeout=self._rw_timeout)
+                ai_buffer = buffer[len(self._di_readers):]
+                if ai_buffer.flags.c_contiguous:
+                    read_samples = self._ai_reader.read_many_sample(
+                        ai_buffer,
+                        number_of_samples_per_channel=number_of_samples,
+                        timeout=self._rw_timeout)
+                else:
+                    # Only part of each row of a 2D buffer is used, but the driver needs
+                    # contiguous memory. Pass a 1D buffer (or a contiguous view) to avoid the
+                    # temporary copy.
+                    tmp_buffer = np.empty(ai_buffer.shape, dtype=self.__data_type)
+                    read_samples = self._ai_reader.read_many_sample(
+                        tmp_buffer,
+                        number_of_samples_per_channel=number_of_samples,
+                        timeout=self._rw_timeout)
+                    ai_buffer[:] = tmp_buffer
             if read_samples != number_of_samples:
                 return -1
         except ni.DaqError:
@@ -21,6 +21,7 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import ctypes
 import numpy as np
+import os
 import time
 from qtpy import QtCore
 
@@ -32,6 +33,7 @@ from interface.slow_counter_interface import SlowCounterInterface
 from interface.slow_counter_interface import SlowCounterConstraints
 from interface.slow_counter_interface import CountingMode
 from interface.fast_counter_interface import FastCounterInterface
+from hardware.picoquant.tttr import TTTRDecoder, TTTRHistogram, FifoReader
 
 # =============================================================================
 # Wrapper around the PHLib.DLL. The current file is based on the header files
@@ -99,14 +101,18 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
         module.Class: 'picoquant.picoharp300.PicoHarp300'
         deviceID: 0 # a device index from 0 to 7.
         mode: 0 # 0: histogram mode, 2: T2 mode, 3: T3 mode
-        
+        gated: False # optional, gated fast counter (one gate per sync)
+
+    As fast counter the device is used in T2 mode (sync on input channel 0, photons on channel 1)
+    or in T3 mode, so mode has to be set to 2 or 3. In histogram mode (0) the device can only be
+    used as slow counter. The records are read from the FIFO in a separate thread, decoded
+    and histogrammed while the measurement is running.
     """
 
     _deviceID = ConfigOption('deviceID', 0, missing='warn') # a device index from 0 to 7.
     _mode = ConfigOption('mode', 0, missing='warn')
+    _gated = ConfigOption('gated', False, missing='nothing')
 
-    sigReadoutPicoharp = QtCore.Signal()
-    sigAnalyzeData = QtCore.Signal(object, object)
     sigStart = QtCore.Signal()
 
     def __init__(self, config, **kwargs):
@@ -126,8 +132,8 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
         self._dll = ctypes.cdll.LoadLibrary('phlib64')
 
         # Just some default values:
-        self._bin_width_ns = 3000
-        self._record_length_ns = 100 *1e9
+        self._bin_width_s = 1e-9
+        self._record_length_s = 1e-6
 
         self._photon_source2 = None #for compatibility reasons with second APD
         self._count_channel = 1
@@ -135,6 +141,16 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
         #locking for thread safety
         self.threadlock = Mutex()
 
+        # TTTR processing chain of the fast counter
+        self._number_of_gates = 0
+        self._fast_counter_status = 0
+        self._fifo_buffer = None
+        self._fifo_reader = None
+        self._decoder = None
+        self._histogram = None
+        self._start_time = 0
+        self._elapsed_time = 0
+
 
     def on_activate(self):
         """ Activate and establish the connection to Picohard and initialize.
@@ -151,18 +167,18 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
         # anything to pass through:
 
         self.sigStart.connect(self.start_measure)
-        self.sigReadoutPicoharp.connect(self.get_fresh_data_loop, QtCore.Qt.QueuedConnection) # ,QtCore.Qt.QueuedConnection
-        self.sigAnalyzeData.connect(self.analyze_received_data, QtCore.Qt.QueuedConnection)
-        self.result = []
+        self._fifo_buffer = np.zeros(self.TTREADMAX, dtype=np.uint32)
+        self._fast_counter_status = 0
 
 
     def on_deactivate(self):
         """ Deactivates and disconnects the device.
         """
 
+        if self._fifo_reader is not None and self._fifo_reader.is_running:
+            self.stop_measure()
         self.close_connection()
-        self.sigReadoutPicoharp.disconnect()
-        self.sigAnalyzeData.disconnect()
+        self.sigStart.disconnect()
 
     def _create_errorcode(self):
         """ Create a dictionary with the errorcode for the device.
@@ -690,59 +706,35 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
     # To check whether you can use the TTTR mode (must be purchased in
     # addition) you can call PH_GetFeatures to check.
 
-    def tttr_read_fifo(self):#, num_counts):
+    def tttr_read_fifo(self, buffer=None):
         """ Read out the buffer of the FIFO.
 
-        @param int num_counts: number of TTTR records to be fetched. Maximal
-                               TTREADMAX
+        @param numpy.ndarray buffer: optional, uint32 array to store the TTTR records in. Maximal
+                                     TTREADMAX records are read. If None, a buffer allocated
+                                     once on activation is reused.
 
         @return tuple (buffer, actual_num_counts):
                     buffer = data array where the TTTR data are stored.
                     actual_num_counts = how many numbers of TTTR could be
-                                        actually be read out. THIS NUMBER IS
-                                        NOT CHECKED FOR PERFORMANCE REASONS, SO
-                                        BE  CAREFUL! Maximum is TTREADMAX.
+                                        actually be read out.
 
         THIS FUNCTION SHOULD BE CALLED IN A SEPARATE THREAD!
 
-        Must not be called with count larger than buffer size permits. CPU time
-        during wait for completion will be yielded to other processes/threads.
+        CPU time during wait for completion will be yielded to other processes/threads.
         Function will return after a timeout period of 80 ms even if not all
         data could be fetched. Return value indicates how many records were
         fetched. Buffer must not be accessed until the function returns!
+        The record formats are described in hardware/picoquant/tttr.py.
         """
-
-        # if type(num_counts) is not int:
-        #     num_counts = self.TTREADMAX
-        # elif (num_counts<0) or (num_counts>self.TTREADMAX):
-        #     self.log.error('PicoHarp: num_counts were expected to within the '
-        #                 'interval [0,{0}], but a value of {1} was '
-        #                 'passed'.format(self.TTREADMAX, num_counts))
-        #     num_counts = self.TTREADMAX
-
-        # PicoHarp T3 Format (for analysis and interpretation):
-        # The bit allocation in the record for the 32bit event is, starting
-        # from the MSB:
-        #       channel:     4 bit
-        #       dtime:      12 bit
-        #       nsync:      16 bit
-        # The channel code 15 (all bits ones) marks a special record.
-        # Special records can be overflows or external markers. To
-        # differentiate this, dtime must be checked:
-        #
-        #     If it is zero, the record marks an overflow.
-        #     If it is >=1 the individual bits are external markers.
-
-        num_counts = self.TTREADMAX
-
-        buffer = np.zeros((num_counts,), dtype=np.uint32)
+        if buffer is None:
+            buffer = self._fifo_buffer
+        num_counts = min(len(buffer), self.TTREADMAX)
 
         actual_num_counts = ctypes.c_int32()
 
         self.check(self._dll.PH_ReadFiFo(self._deviceID, buffer.ctypes.data,
                                          num_counts, ctypes.byref(actual_num_counts)))
 
-
         return buffer, actual_num_counts.value
 
     def tttr_set_marker_edges(self, me0, me1, me2, me3):
@@ -1010,17 +1002,20 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
         return ['Ctr0']
 
     def get_constraints(self):
-        """ Get hardware limits of NI device.
+        """ Get hardware limits of the device.
 
-        @return SlowCounterConstraints: constraints class for slow counter
+        @return SlowCounterConstraints|dict: constraints class for slow counter in histogram mode
+                                             or the fast counter constraints dict in T2/T3 mode
 
         FIXME: ask hardware for limits when module is loaded
         """
+        if self._mode in (self.MODE_T2, self.MODE_T3):
+            return self._get_fast_counter_constraints()
         constraints = SlowCounterConstraints()
         constraints.max_detectors = 1
         constraints.min_count_frequency = 1e-3
         constraints.max_count_frequency = 10e9
-        conetraints.counting_mode = [CountingMode.CONTINUOUS]
+        constraints.counting_mode = [CountingMode.CONTINUOUS]
         return constraints
 
     def get_counter(self, samples=None):
@@ -1055,31 +1050,62 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
     #  Functions for the FastCounter Interface
     # =========================================================================
 
-    #FIXME: The interface connection to the fast counter must be established!
+    def _get_fast_counter_constraints(self):
+        """ Retrieve the hardware constrains of the fast counter.
 
-    def configure(self, bin_width_ns, record_length_ns, number_of_gates = 0):
+        @return dict: dict with the key 'hardware_binwidth_list'. The bins are calculated from
+                      the time tags, so any multiple of the resolution (4 ps) is possible.
         """
-        Configuration of the fast counter.
-        bin_width_ns: Length of a single time bin in the time trace histogram
-                      in nanoseconds.
-        record_length_ns: Total length of the timetrace/each single gate in
-                          nanoseconds.
-        number_of_gates: Number of gates in the pulse sequence. Ignore for
-                         ungated counter.
+        constraints = dict()
+        # the unit of those entries are seconds per bin.
+        constraints['hardware_binwidth_list'] = [4e-12 * 2 ** n for n in range(20)]
+        return constraints
+
+    def configure(self, bin_width_s, record_length_s, number_of_gates=0):
+        """ Configuration of the fast counter.
+
+        @param float bin_width_s: Length of a single time bin in the time trace histogram in
+                                  seconds.
+        @param float record_length_s: Total length of the timetrace/each single gate in seconds.
+        @param int number_of_gates: optional, number of gates in the pulse sequence. Ignore for
+                                    not gated counter.
+
+        @return tuple(binwidth_s, record_length_s, number_of_gates):
+                    binwidth_s: float the actual set binwidth in seconds
+                    gate_length_s: the actual record length in seconds
+                    number_of_gates: the number of gated, which are accepted, None if not-gated
         """
-        #        self.initialize(mode=3)
-        self._bin_width_ns = bin_width_ns
-        self._record_length_ns = record_length_ns
-        self._number_of_gates = number_of_gates
-
-        #FIXME: actualle only an unsigned array will be needed. Change that later.
-        #        self.data_trace = np.zeros(number_of_gates, dtype=np.int64 )
-        self.data_trace = [0]*number_of_gates
-        self.count = 0
-
-        self.result = []
-        self.initialize(2)
-        return
+        mode = self._mode
+        if mode not in (self.MODE_T2, self.MODE_T3):
+            self.log.error('PicoHarp: The fast counter needs the device in T2 ({0}) or T3 ({1}) '
+                           'mode, but mode {2} is configured.'.format(self.MODE_T2, self.MODE_T3,
+                                                                     mode))
+            return (self._bin_width_s, self._record_length_s,
+                    self._number_of_gates if self._gated else None)
+        self.initialize(mode)
+
+        if mode == self.MODE_T3:
+            # Choose the finest resolution for which the dtime (12 bit) covers the record length
+            binning = int(np.ceil(np.log2(max(record_length_s / (4096 * 4e-12), 1))))
+            self.set_binning(min(binning, self.BINSTEPSMAX - 1))
+            resolution = self.get_resolution() * 1e-12
+        else:
+            resolution = 4e-12
+
+        # The bin width is a multiple of the resolution
+        self._bin_width_s = max(round(bin_width_s / resolution), 1) * resolution
+        number_of_bins = max(int(round(record_length_s / self._bin_width_s)), 1)
+        self._record_length_s = number_of_bins * self._bin_width_s
+        self._number_of_gates = int(number_of_gates) if self._gated else 0
+
+        self._decoder = TTTRDecoder('picoharp', mode)
+        self._histogram = TTTRHistogram(mode, resolution, self._bin_width_s, number_of_bins,
+                                        self._number_of_gates)
+        self._fifo_reader = FifoReader(self._read_records, self._process_records,
+                                       buffer_size=self.TTREADMAX)
+        self._fast_counter_status = 1
+        return (self._bin_width_s, self._record_length_s,
+                self._number_of_gates if self._gated else None)
 
     def get_status(self):
         """
@@ -1093,42 +1119,103 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
         """
         if not self.connected_to_device:
             return -1
-        else:
-            returnvalue = self._get_status()
-            if returnvalue == 0:
-                return 2
-            else:
-                return 1
+        if self._fifo_reader is not None and self._fifo_reader.error is not None:
+            return -1
+        return self._fast_counter_status
 
+    def start_measure(self):
+        """
+        Starts the fast counter.
+        """
+        if self._fast_counter_status == 0:
+            self.log.error('PicoHarp: Configure the fast counter before starting a measurement.')
+            return -1
+        if self._fast_counter_status in (2, 3):
+            self.stop_measure()
+        self.module_state.lock()
+        with self.threadlock:
+            self._decoder.reset()
+            self._histogram.reset()
+            self._elapsed_time = 0
+        return self._start_device()
+
+    def stop_measure(self):
+        """ Stop the fast counter. """
+        if self._fast_counter_status == 2:
+            self._stop_device()
+        if self._fast_counter_status in (2, 3):
+            self.module_state.unlock()
+            self._fast_counter_status = 1
+        return 0
 
     def pause_measure(self):
         """
         Pauses the current measurement if the fast counter is in running state.
         """
-
-        self.stop_measure()
-        self.meas_run = False
+        if self._fast_counter_status == 2:
+            self._stop_device()
+            self._fast_counter_status = 3
+        return 0
 
     def continue_measure(self):
         """
         Continues the current measurement if the fast counter is in pause state.
         """
-        self.meas_run = True
-        self.start(self._record_length_ns/1e6)
+        if self._fast_counter_status == 3:
+            # The time tags and the syncs start again at zero, only the histogram is continued
+            with self.threadlock:
+                self._decoder.reset()
+                self._histogram.restart()
+            return self._start_device()
+        return 0
+
+    def _start_device(self):
+        """ Start the TTTR acquisition and the FIFO readout """
+        self._start_time = time.time()
+        self._fifo_reader.start()
+        self.start(self.ACQTMAX)
+        self._fast_counter_status = 2
+        return 0
+
+    def _stop_device(self):
+        """ Stop the TTTR acquisition and process the records left in the FIFO """
+        self.stop_device()
+        self._fifo_reader.stop(drain=True)
+        self._elapsed_time += time.time() - self._start_time
+        if self._fifo_reader.error is not None:
+            self.log.error('PicoHarp: Processing of the TTTR records failed: '
+                           '{0}'.format(self._fifo_reader.error))
+        return
+
+    def _read_records(self, buffer):
+        """ Read function of the FIFO reader """
+        return self.tttr_read_fifo(buffer)[1]
+
+    def _process_records(self, records):
+        """ Decode the records read from the FIFO and add them to the histogram.
+
+        @param numpy.ndarray records: uint32 TTTR records
+        """
+        if len(records) == self.TTREADMAX:
+            self.log.debug('PicoHarp: FIFO read with maximum number of records. The processing '
+                           'might not keep up with the count rate.')
+        with self.threadlock:
+            events, markers = self._decoder.decode(records)
+            self._histogram.add_events(events)
+        return
 
     def is_gated(self):
         """
         Boolean return value indicates if the fast counter is a gated counter
         (TRUE) or not (FALSE).
         """
-        return False
+        return bool(self._gated)
 
     def get_binwidth(self):
         """
         returns the width of a single timebin in the timetrace in seconds
         """
-        #FIXME: Must be implemented
-        return 2e-9
+        return self._bin_width_s
 
     def get_data_trace(self):
         """
@@ -1141,166 +1228,15 @@ class PicoHarp300(Base, SlowCounterInterface, FastCounterInterface):
           - If the counter is gated it will return a 2D-numpy-array with
             returnarray[gate_index, timebin_index]
         """
-
-        info_dict = {'elapsed_sweeps': None,
-                     'elapsed_time': None}  # TODO : implement that according to hardware capabilities
-        return self.data_trace, info_dict
-
-    # =========================================================================
-    #  Test routine for continuous readout
-    # =========================================================================
-
-
-    def start_measure(self):
-        """
-        Starts the fast counter.
-        """
-        self.lock()
-
-        self.meas_run = True
-
-        # start the device:
-        self.start(int(self._record_length_ns/1e6))
-
-        self.sigReadoutPicoharp.emit()
-
-    def stop_measure(self):
-        """ By setting the Flag, the measurement should stop.  """
-        self.meas_run = False
-
-
-    def get_fresh_data_loop(self):
-        """ This method will be run infinitely until the measurement stops. """
-
-        # for testing one can also take another array:
-        buffer, actual_counts = self.tttr_read_fifo()
-        #        buffer, actual_counts = [1,2,3,4,5,6,7,8,9], 9
-
-        # This analysis signel should be analyzed in a queued thread:
-        self.sigAnalyzeData.emit(buffer[0:actual_counts-1], actual_counts)
-
-        if not self.meas_run:
-            with self.threadlock:
-                self.unlock()
-                self.stop_device()
-                return
-
-        print('get new data.')
-        # get the next data:
-        self.sigReadoutPicoharp.emit()
-
-
-
-    def analyze_received_data(self, arr_data, actual_counts):
-        """ Analyze the actual data obtained from the TTTR mode of the device.
-
-        @param arr_data: numpy uint32 array with length 'actual_counts'.
-        @param actual_counts: int, number of read out events from the buffer.
-
-        Write the obtained arr_data to the predefined array data_trace,
-        initialized in the configure method.
-
-        The received array contains 32bit words. The bit assignment starts from
-        the MSB (most significant bit), which is here displayed as the most
-        left bit.
-
-        For T2 (initialized device with mode=2):
-        ----------------------------------------
-
-        [ 4 bit for channel-number |28 bit for time-tag] = [32 bit word]
-
-        channel-number: 4 marker, which serve for the different channels.
-                            0001 = marker 1
-                            0010 = marker 2
-                            0011 = marker 3
-                            0100 = marker 4
-
-                        The channel code 15 (all bits ones, 1111) marks a
-                        special record. Special records can be overflows or
-                        external markers. To differentiate this, the lower 4
-                        bits of timetag must be checked:
-                            - If they are all zero, the record marks an
-                              overflow.
-                            - If they are >=1 the individual bits are external
-                              markers.
-
-                        Overflow period: 210698240
-
-                        the first bit is the overflow bit. It will be set if
-                        the time-tag reached 2^28:
-
-                            0000 = overflow
-
-                        Afterwards both overflow marker and time-tag
-                        will be reseted. This overflow should be detected and
-                        the time axis should be adjusted accordingly.
-
-        time-tag: The resolution is fixed to 4ps. Within the time of
-                  4ps*2^28 = 1.073741824 ms
-                  another photon event should occur so that the time axis can
-                  be computed properly.
-
-        For T3 (initialized device with mode=3):
-        ----------------------------------------
-
-        [ 4 bit for channel-number | 12 bit for start-stop-time | 16 bit for sync counter] = [32 bit word]
-
-        channel-number: 4 marker, which serve for the different channels.
-                            0001 = marker 1
-                            0010 = marker 2
-                            0011 = marker 3
-                            0100 = marker 4
-
-                        the first bit is the overflow bit. It will be set if
-                        the sync-counter reached 65536 events:
-
-                            1000 = overflow
-
-                        Afterwards both, overflow marker and sync-counter
-                        will be reseted. This overflow should be detected and
-                        the time axis should be adjusted accordingly.
-
-        start-stop-time: time between to consecutive sync pulses. Maximal time
-                         between two sync pulses is therefore limited to
-                             2^12 * Res
-                         where Res is the Resolution
-                             Res = {4,8,16,32,54,128,256,512} (in ps)
-                         For largest Resolution of 512ps you have 2097.152 ns.
-        sync-counter: can hold up to 2^16 = 65536 events. It that number is
-                      reached overflow will be set. That means all 4 bits in
-                      the channel-number are set to high (i.e. 1).
-        """
-
-        # at first just a simple test
-        time.sleep(0.2)
-
-        self.data_trace[self.count] = actual_counts
-        self.count += 1
-
-        if self.count > self._number_of_gates-1:
-            self.count = 0
-
-        if actual_counts == self.TTREADMAX:
-            self.log.warning('Overflow!')
-
-        print('Data analyzed.')
-
-#        self.result = []
-#        for entry in arr_data[0:actual_counts-1]:
-#
-#            # apply three bitmasks to extract the relavent numbers:
-#            overflow = entry & (2**(32-1) )
-#            marker_ch = entry & (2**(32-2)  + 2**(32-3) + 2**(32-4))
-#            time_tag = entry & (2**32 -1 - 2**(32-1) + 2**(32-2) + 2**(32-3) + 2**(32-4))
-
-
-
-
-
-
-
-
-
-
-
-
+        if self._histogram is None:
+            self.log.error('PicoHarp: Configure the fast counter before reading data.')
+            return np.zeros(0, dtype=np.int64), {'elapsed_sweeps': None, 'elapsed_time': None}
+        with self.threadlock:
+            data = self._histogram.histogram
+            sweeps = self._histogram.sweeps
+        elapsed_time = self._elapsed_time
+        if self._fast_counter_status == 2:
+            elapsed_time += time.time() - self._start_time
+        info_dict = {'elapsed_sweeps': sweeps,
+                     'elapsed_time': elapsed_time}
+        return data, info_dict
@@ -0,0 +1,565 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains helpers to process the time-tagged time-resolved (TTTR) records of PicoQuant
+time counting devices (PicoHarp 300 and HydraHarp 400) in real time:
+a vectorized decoder for T2 and T3 records, an incremental histogram of the decoded events, a
+double-buffered FIFO reader running in its own threads and a generator of synthetic records.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import queue
+import threading
+import numpy as np
+
+# Record formats (32 bit words, starting from the MSB):
+#
+# PicoHarp 300 T2:  [ channel: 4 bit | time tag: 28 bit ]
+# PicoHarp 300 T3:  [ channel: 4 bit | dtime: 12 bit | nsync: 16 bit ]
+#     Channel 15 marks a special record. If the marker bits (lowest 4 bits of the time tag in T2,
+#     lowest 4 bits of dtime in T3) are zero the record is an overflow, otherwise an external
+#     marker. In T2 mode channel 0 is the sync input.
+#
+# HydraHarp 400 T2 (format version 2):  [ special: 1 bit | channel: 6 bit | time tag: 25 bit ]
+# HydraHarp 400 T3 (format version 2):  [ special: 1 bit | channel: 6 bit | dtime: 15 bit |
+#                                         nsync: 10 bit ]
+#     Special records with channel 63 are overflows, the number of overflows is stored in the
+#     time tag (T2) or nsync (T3). Special records with channel 1 to 15 are external markers and
+#     in T2 mode a special record with channel 0 is a sync event.
+#
+# Overflow periods of the time tag (T2) or sync counter (T3):
+WRAPAROUND = {('picoharp', 2): 210698240,
+              ('picoharp', 3): 65536,
+              ('hydraharp', 2): 33554432,
+              ('hydraharp', 3): 1024}
+
+# Decoded events. The channel 0 is the sync input (only T2), the detector inputs start at 1.
+# The time is the time tag including overflows (T2) or the number of the sync period (T3).
+# The dtime is the time since the last sync in T3 mode and 0 in T2 mode.
+EVENT_DTYPE = np.dtype([('channel', np.uint8), ('time', np.uint64), ('dtime', np.uint16)])
+# Decoded external markers. The marker field contains the marker bits.
+MARKER_DTYPE = np.dtype([('marker', np.uint8), ('time', np.uint64)])
+
+
+def _check_format(device, mode):
+    if (device, mode) not in WRAPAROUND:
+        raise ValueError('Unknown TTTR record format "{0}" in T{1} mode. Device must be '
+                         '"picoharp" or "hydraharp" and mode 2 or 3.'.format(device, mode))
+    return
+
+
+class TTTRDecoder:
+    """
+    Vectorized decoder for TTTR records of a PicoHarp 300 or HydraHarp 400.
+
+    The records are decoded chunk by chunk as they are read from the FIFO. The overflow correction
+    is kept between the chunks, so the decoded times are continuous over the whole measurement.
+    """
+    def __init__(self, device='picoharp', mode=2):
+        """
+        @param str device: record format of the device, 'picoharp' or 'hydraharp'
+        @param int mode: TTTR mode, 2 (T2) or 3 (T3)
+        """
+        _check_format(device, mode)
+        self._device = device
+        self._mode = int(mode)
+        self._wraparound = WRAPAROUND[(device, self._mode)]
+        self._overflow_correction = 0
+        return
+
+    @property
+    def device(self):
+        return self._device
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def overflow_correction(self):
+        """ Time (T2) or sync count (T3) added to the records due to the overflows so far """
+        return self._overflow_correction
+
+    def reset(self):
+        """ Reset the overflow correction for a new measurement """
+        self._overflow_correction = 0
+        return
+
+    def decode(self, records):
+        """
+        Decode a chunk of records.
+
+        @param numpy.ndarray records: uint32 records in the order read from the device
+
+        @return (numpy.ndarray, numpy.ndarray): events (EVENT_DTYPE) and markers (MARKER_DTYPE)
+        """
+        records = np.asarray(records, dtype=np.uint32)
+        if self._device == 'picoharp':
+            channel, time, dtime, overflows, is_marker, is_event = self._split_picoharp(records)
+        else:
+            channel, time, dtime, overflows, is_marker, is_event = self._split_hydraharp(records)
+
+        # Overflow correction valid for each record. Overflow records come before the events they
+        # apply to, so the cumulative sum including the record itself is correct.
+        correction = np.cumsum(overflows * np.uint64(self._wraparound), dtype=np.uint64)
+        correction += np.uint64(self._overflow_correction)
+        if len(correction) > 0:
+            self._overflow_correction = int(correction[-1])
+
+        events = np.empty(np.count_nonzero(is_event), dtype=EVENT_DTYPE)
+        events['channel'] = channel[is_event]
+        events['time'] = time[is_event] + correction[is_event]
+        events['dtime'] = dtime[is_event]
+
+        markers = np.empty(np.count_nonzero(is_marker), dtype=MARKER_DTYPE)
+        markers['marker'] = channel[is_marker]
+        markers['time'] = time[is_marker] + correction[is_marker]
+        return events, markers
+
+    def _split_picoharp(self, records):
+        channel = (records >> 28).astype(np.uint8)
+        special = channel == 15
+        if self._mode == 2:
+            time = (records & 0x0FFFFFFF).astype(np.uint64)
+            dtime = np.zeros(len(records), dtype=np.uint16)
+            marker_bits = (records & 0xF).astype(np.uint8)
+            # The lowest bits of the time tag of a marker record are the marker bits
+            time[special] &= np.uint64(0x0FFFFFF0)
+        else:
+            time = (records & 0xFFFF).astype(np.uint64)
+            dtime = ((records >> 16) & 0xFFF).astype(np.uint16)
+            marker_bits = ((records >> 16) & 0xF).astype(np.uint8)
+        is_overflow = special & (marker_bits == 0)
+        is_marker = special & (marker_bits != 0)
+        channel[is_marker] = marker_bits[is_marker]
+        return channel, time, dtime, is_overflow.astype(np.uint64), is_marker, ~special
+
+    def _split_hydraharp(self, records):
+        special = (records >> 31) == 1
+        channel = ((records >> 25) & 0x3F).astype(np.uint8)
+        if self._mode == 2:
+            time = (records & 0x1FFFFFF).astype(np.uint64)
+            dtime = np.zeros(len(records), dtype=np.uint16)
+        else:
+            time = (records & 0x3FF).astype(np.uint64)
+            dtime = ((records >> 10) & 0x7FFF).astype(np.uint16)
+        is_overflow = special & (channel == 63)
+        is_marker = special & (channel >= 1) & (channel <= 15)
+        if self._mode == 2:
+            is_sync = special & (channel == 0)
+        else:
+            is_sync = np.zeros(len(records), dtype=bool)
+        # The number of overflows is stored in the time tag or nsync field (at least one)
+        overflows = np.where(is_overflow, np.maximum(time, 1), 0).astype(np.uint64)
+        # Detector channels start at 1, the sync is channel 0
+        channel = np.where(special, channel, channel + 1).astype(np.uint8)
+        channel[is_sync] = 0
+        return channel, time, dtime, overflows, is_marker, ~special | is_sync
+
+
+class TTTRHistogram:
+    """
+    Histogram of decoded TTTR events relative to the preceding sync (trigger), updated
+    incrementally with each chunk of events.
+
+    In T2 mode the sync is an event on channel 0. In T3 mode the time since the last sync is given
+    by the dtime of each event directly.
+    If the histogram is gated, consecutive syncs are assigned to consecutive gates, i.e. the first
+    sync of the measurement starts gate 0 and every number_of_gates syncs a new sweep starts.
+    After the acquisition has been restarted (see restart) the first sync starts gate 0 again.
+    """
+    def __init__(self, mode, resolution, bin_width, number_of_bins, number_of_gates=0,
+                 channels=None):
+        """
+        @param int mode: TTTR mode, 2 (T2) or 3 (T3)
+        @param float resolution: time of one time tag (T2) or dtime (T3) unit in s
+        @param float bin_width: width of a histogram bin in s
+        @param int number_of_bins: number of bins per gate (or of the ungated histogram)
+        @param int number_of_gates: number of gates. 0 for an ungated histogram.
+        @param list channels: optional, detector channels to count. All if None.
+        """
+        if mode not in (2, 3):
+            raise ValueError('TTTR mode must be 2 or 3.')
+        self._mode = int(mode)
+        self._ticks_per_bin = float(bin_width) / float(resolution)
+        # Use exact integer arithmetic if the bin width is a multiple of the resolution
+        if abs(self._ticks_per_bin - round(self._ticks_per_bin)) < 1e-6:
+            self._ticks_per_bin = max(int(round(self._ticks_per_bin)), 1)
+        self._bins = max(int(number_of_bins), 1)
+        self._gates = max(int(number_of_gates), 0)
+        self._channels = None if channels is None else np.asarray(channels, dtype=np.uint8)
+        self._histogram = np.zeros(max(self._gates, 1) * self._bins, dtype=np.int64)
+        self.reset()
+        return
+
+    @property
+    def is_gated(self):
+        return self._gates > 0
+
+    @property
+    def histogram(self):
+        """
+        Copy of the current histogram.
+
+        @return numpy.ndarray: int64 array of shape (number_of_bins,) or, if gated,
+                               (number_of_gates, number_of_bins)
+        """
+        if self.is_gated:
+            return self._histogram.reshape(self._gates, self._bins).copy()
+        return self._histogram.copy()
+
+    @property
+    def syncs(self):
+        """ Number of syncs (triggers) observed so far """
+        return self._syncs
+
+    @property
+    def sweeps(self):
+        """ Number of completed sweeps (syncs divided by the number of gates if gated) """
+        if self.is_gated:
+            return self._restart_sweeps + (self._syncs - self._first_gate_sync) // self._gates
+        return self._syncs
+
+    def reset(self):
+        """ Clear the histogram for a new measurement """
+        self._histogram[:] = 0
+        self._syncs = 0
+        # Time of the last sync in T2 mode
+        self._last_sync = None
+        # Number of the sync, which starts gate 0, and sweeps completed before the last restart
+        self._first_gate_sync = 0
+        self._restart_sweeps = 0
+        return
+
+    def restart(self):
+        """
+        Continue the histogram after the acquisition was stopped and started again.
+
+        The time tags and the sync count of the new acquisition start at zero, so the time of the
+        last sync is discarded and the next sync starts gate 0 of a new sweep. An incomplete sweep
+        of the previous acquisition is not counted.
+        """
+        if self.is_gated:
+            self._restart_sweeps = self.sweeps
+        self._first_gate_sync = self._syncs
+        self._last_sync = None
+        return
+
+    def add_events(self, events):
+        """
+        Add a chunk of decoded events (in the order of the records) to the histogram.
+
+        @param numpy.ndarray events: decoded events (EVENT_DTYPE)
+        """
+        if len(events) == 0:
+            return
+        if self._mode == 2:
+            sync_index, ticks = self._t2_sync_delays(events)
+        else:
+            sync_index, ticks = self._t3_sync_delays(events)
+        if isinstance(self._ticks_per_bin, int):
+            bins = ticks // self._ticks_per_bin
+        else:
+            bins = (ticks / self._ticks_per_bin).astype(np.int64)
+        valid = bins < self._bins
+        if self.is_gated:
+            gate = (sync_index[valid] - self._first_gate_sync) % self._gates
+            index = gate * self._bins + bins[valid]
+        else:
+            index = bins[valid]
+        self._histogram += np.bincount(index, minlength=len(self._histogram))
+        return
+
+    def _select_channels(self, events):
+        if self._channels is None:
+            return events['channel'] != 0
+        return np.isin(events['channel'], self._channels)
+
+    def _t2_sync_delays(self, events):
+        """ Sync number and time since the sync of the photon events in T2 mode """
+        is_sync = events['channel'] == 0
+        sync_times = events['time'][is_sync]
+        photons = events['time'][self._select_channels(events)]
+        first_sync = self._syncs
+        if self._last_sync is not None:
+            sync_times = np.concatenate(([self._last_sync], sync_times)).astype(np.uint64)
+            first_sync -= 1
+        self._syncs += np.count_nonzero(is_sync)
+        if len(sync_times) > 0:
+            self._last_sync = sync_times[-1]
+            index = np.searchsorted(sync_times, photons, side='right') - 1
+        else:
+            index = np.full(len(photons), -1, dtype=np.int64)
+        # Photons before the first sync can not be assigned
+        valid = index >= 0
+        index = index[valid]
+        ticks = (photons[valid] - sync_times[index]).astype(np.int64)
+        return index + first_sync, ticks
+
+    def _t3_sync_delays(self, events):
+        """ Sync number and time since the sync of the photon events in T3 mode """
+        photons = events[self._select_channels(events)]
+        # The sync count is only known from the events, so count up to the latest one. It starts
+        # at zero again after a restart.
+        self._syncs = max(self._syncs, self._first_gate_sync + int(events['time'][-1]) + 1)
+        sync_index = photons['time'].astype(np.int64) + self._first_gate_sync
+        return sync_index, photons['dtime'].astype(np.int64)
+
+
+class FifoReader:
+    """
+    Reads TTTR records from the FIFO of a device and processes them in two threads.
+
+    Two (or more) preallocated buffers are used alternately: while the records of one buffer are
+    processed (decoded and histogrammed) the next read already fills another buffer, so reading
+    the FIFO is never delayed by the processing. No memory is allocated per read.
+    """
+    def __init__(self, read_function, process_function, buffer_size=131072, buffers=2):
+        """
+        @param callable read_function: fills the given uint32 buffer with records and returns the
+                                       number of records read
+        @param callable process_function: called with the records read (view of the buffer,
+                                          only valid during the call)
+        @param int buffer_size: number of records per buffer
+        @param int buffers: number of buffers
+        """
+        self._read_function = read_function
+        self._process_function = process_function
+        self._buffers = [np.zeros(int(buffer_size), dtype=np.uint32)
+                         for _ in range(max(int(buffers), 2))]
+        self._free = queue.Queue()
+        self._filled = queue.Queue()
+        self._stop_request = threading.Event()
+        self._drain = True
+        self._read_thread = None
+        self._process_thread = None
+        self.records_read = 0
+        self.max_records_per_read = 0
+        self.error = None
+        return
+
+    @property
+    def buffer_size(self):
+        return len(self._buffers[0])
+
+    @property
+    def is_running(self):
+        return self._read_thread is not None and self._read_thread.is_alive()
+
+    def start(self):
+        """ Start reading and processing in background threads """
+        if self._read_thread is not None:
+            raise RuntimeError('FifoReader is already running.')
+        self._stop_request.clear()
+        self._free = queue.Queue()
+        self._filled = queue.Queue()
+        for buffer in self._buffers:
+            self._free.put(buffer)
+        self.records_read = 0
+        self.max_records_per_read = 0
+        self.error = None
+        self._read_thread = threading.Thread(target=self._read_loop, name='TTTR-FIFO-read')
+        self._process_thread = threading.Thread(target=self._process_loop,
+                                                name='TTTR-FIFO-process')
+        self._read_thread.daemon = True
+        self._process_thread.daemon = True
+        self._process_thread.start()
+        self._read_thread.start()
+        return
+
+    def stop(self, drain=True, timeout=None):
+        """
+        Stop reading and wait until all records read are processed.
+
+        @param bool drain: keep reading until the FIFO is empty (stop the device before)
+        @param float timeout: optional, maximum time to wait for each thread in s
+        """
+        if self._read_thread is None:
+            return
+        self._drain = drain
+        self._stop_request.set()
+        self._read_thread.join(timeout)
+        self._process_thread.join(timeout)
+        self._read_thread = None
+        self._process_thread = None
+        return
+
+    def _read_loop(self):
+        try:
+            while True:
+                buffer = self._free.get()
+                count = int(self._read_function(buffer))
+                if count > 0:
+                    self.records_read += count
+                    self.max_records_per_read = max(self.max_records_per_read, count)
+                    self._filled.put((buffer, count))
+                else:
+                    self._free.put(buffer)
+                if self._stop_request.is_set() and (not self._drain or count == 0):
+                    break
+        except Exception as err:
+            self.error = err
+        finally:
+            self._filled.put(None)
+        return
+
+    def _process_loop(self):
+        while True:
+            item = self._filled.get()
+            if item is None:
+                break
+            buffer, count = item
+            try:
+                if self.error is None:
+                    self._process_function(buffer[:count])
+            except Exception as err:
+                self.error = err
+                self._stop_request.set()
+                self._drain = False
+            finally:
+                self._free.put(buffer)
+        return
+
+
+def encode_records(events, markers=None, device='picoharp', mode=2):
+    """
+    Encode events and markers into TTTR records as the device would write them, including the
+    overflow records. This is the inverse of TTTRDecoder.decode.
+
+    @param numpy.ndarray events: events (EVENT_DTYPE) sorted by time
+    @param numpy.ndarray markers: optional, markers (MARKER_DTYPE) sorted by time
+    @param str device: record format, 'picoharp' or 'hydraharp'
+    @param int mode: TTTR mode, 2 (T2) or 3 (T3)
+
+    @return numpy.ndarray: uint32 records
+    """
+    _check_format(device, mode)
+    wraparound = WRAPAROUND[(device, mode)]
+    events = np.asarray(events, dtype=EVENT_DTYPE)
+    if markers is None:
+        markers = np.empty(0, dtype=MARKER_DTYPE)
+    markers = np.asarray(markers, dtype=MARKER_DTYPE)
+
+    # Merge events and markers by time (events first for equal times)
+    time = np.concatenate((events['time'], markers['time'])).astype(np.uint64)
+    order = np.argsort(time, kind='mergesort')
+    time = time[order]
+    is_marker = (np.arange(len(time)) >= len(events))[order]
+    channel = np.concatenate((events['channel'], markers['marker'])).astype(np.uint32)[order]
+    dtime = np.concatenate((events['dtime'], np.zeros(len(markers), np.uint16))).astype(
+        np.uint32)[order]
+    residue = (time % np.uint64(wraparound)).astype(np.uint32)
+    # Number of overflows between each record and the one before
+    wraps = (time // np.uint64(wraparound)).astype(np.int64)
+    overflows = np.diff(np.concatenate(([0], wraps)))
+
+    if device == 'picoharp':
+        if mode == 2:
+            records = np.where(is_marker,
+                               (15 << 28) | (residue & 0x0FFFFFF0) | channel,
+                               (channel << 28) | residue)
+            overflow_record = np.uint32(15 << 28)
+        else:
+            records = np.where(is_marker,
+                               (15 << 28) | (channel << 16) | residue,
+                               (channel << 28) | (dtime << 16) | residue)
+            overflow_record = np.uint32(15 << 28)
+        # One overflow record for each overflow
+        counts = overflows + 1
+        result = np.full(int(np.sum(counts)), overflow_record, dtype=np.uint32)
+        result[np.cumsum(counts) - 1] = records
+        return result
+
+    special = np.uint32(1 << 31)
+    is_sync = ~is_marker & (channel == 0)
+    detector = np.where(is_marker | is_sync, channel, channel - 1)
+    if mode == 2:
+        records = (detector << 25) | residue
+    else:
+        records = (detector << 25) | (dtime << 10) | residue
+    records = np.where(is_marker | is_sync, records | special, records).astype(np.uint32)
+    # A single overflow record holds the number of overflows
+    has_overflow = overflows > 0
+    counts = has_overflow.astype(np.int64) + 1
+    positions = np.cumsum(counts) - 1
+    result = np.empty(int(np.sum(counts)), dtype=np.uint32)
+    result[positions] = records
+    result[positions[has_overflow] - 1] = (special | np.uint32(63 << 25)
+                                           | overflows[has_overflow].astype(np.uint32))
+    return result
+
+
+def generate_records(number_of_syncs, sync_period, resolution, count_rate,
+                     decay_time=None, device='picoharp', mode=2, marker_period=0, seed=None):
+    """
+    Generate synthetic records of a pulsed measurement, e.g. for testing the processing chain
+    without hardware. Photons arrive with an exponential delay after each sync.
+
+    @param int number_of_syncs: number of sync pulses
+    @param float sync_period: time between two syncs in s
+    @param float resolution: time of one time tag (T2) or dtime (T3) unit in s
+    @param float count_rate: mean number of photons per sync
+    @param float decay_time: optional, mean photon delay after the sync in s. Default is a
+                             fifth of the sync period.
+    @param str device: record format, 'picoharp' or 'hydraharp'
+    @param int mode: TTTR mode, 2 (T2) or 3 (T3)
+    @param int marker_period: optional, a marker 1 is written every marker_period syncs
+    @param int seed: optional, seed of the random number generator
+
+    @return (numpy.ndarray, numpy.ndarray, numpy.ndarray): uint32 records, encoded events and
+                                                           encoded markers
+    """
+    rng = np.random.RandomState(seed)
+    if decay_time is None:
+        decay_time = sync_period / 5
+    period_ticks = int(round(sync_period / resolution))
+    photons_per_sync = rng.poisson(count_rate, number_of_syncs)
+    photon_sync = np.repeat(np.arange(number_of_syncs, dtype=np.uint64), photons_per_sync)
+    delay = np.floor(rng.exponential(decay_time / resolution, len(photon_sync))).astype(np.uint64)
+    keep = delay < period_ticks
+    if mode == 3:
+        # The dtime field is limited
+        keep &= delay < (0xFFF if device == 'picoharp' else 0x7FFF)
+    photon_sync = photon_sync[keep]
+    delay = delay[keep]
+
+    if mode == 2:
+        sync = np.zeros(number_of_syncs, dtype=EVENT_DTYPE)
+        sync['time'] = np.arange(number_of_syncs, dtype=np.uint64) * np.uint64(period_ticks)
+        photons = np.zeros(len(photon_sync), dtype=EVENT_DTYPE)
+        photons['channel'] = 1
+        photons['time'] = photon_sync * np.uint64(period_ticks) + delay
+        events = np.concatenate((sync, photons))
+        events = events[np.argsort(events['time'], kind='mergesort')]
+        marker_time = np.uint64(period_ticks)
+    else:
+        events = np.zeros(len(photon_sync), dtype=EVENT_DTYPE)
+        events['channel'] = 1
+        events['time'] = photon_sync
+        events['dtime'] = delay
+        marker_time = np.uint64(1)
+
+    markers = np.empty(0, dtype=MARKER_DTYPE)
+    if marker_period > 0:
+        markers = np.zeros(len(range(0, number_of_syncs, marker_period)), dtype=MARKER_DTYPE)
+        markers['marker'] = 1
+        markers['time'] = np.arange(0, number_of_syncs, marker_period,
+                                    dtype=np.uint64) * marker_time
+        if device == 'picoharp' and mode == 2:
+            # The lowest time bits of PicoHarp T2 markers are lost
+            markers['time'] &= ~np.uint64(0xF)
+    return encode_records(events, markers, device, mode), events, markers
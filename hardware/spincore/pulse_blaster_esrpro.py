@@ -1850,62 +1850,48 @@ class PulseBlasterESRPRO(Base, SwitchInterface, PulserInterface):
 
         ch_list = list(digital_samples)
         ch_list.sort()
-        num_ch = len(ch_list)
+        channels = [int(ch_name.replace('d_ch', '')) - 1 for ch_name in ch_list]
 
         # take on of the channel and obtain the channel length
         num_entries = len(digital_samples[ch_list[0]])
-
-        last_sequence_dict = None
-        pb_sequence_list = list()
-
-        for index in range(num_entries):
-
-            # create at first a temporary array, with the minimal granularity
-            # length. The sampling freq is fixed anyway and cannot be changed.
-            temp_sequence_dict = {'active_channels': [],
-                                  'length': self.GRAN_MIN}
-
-            for ch_name in ch_list:
-
-                if digital_samples[ch_name][index]:
-                    temp_sequence_dict['active_channels'].append(int(ch_name.replace('d_ch', ''))-1)
-
-            # compare it with the last array if present
-
-            # if not present start to count
-            if last_sequence_dict is None:
-                last_sequence_dict = temp_sequence_dict
-
-            else:
-
-                 # if present and the same channels, accumulate length
-                if temp_sequence_dict['active_channels'] == last_sequence_dict['active_channels']:
-                    last_sequence_dict['length'] += temp_sequence_dict['length']
-
-                # if present and not the same channels, append last array to
-                # sequence array
-                else:
-                    # increase length by 1%, to remove the ambiguity for the
-                    # comparison
-                    if last_sequence_dict['length']*1.01 < self.LEN_MIN:
-                        self.log.warning('Current waveform contains a pulse of '
-                                         'length {0:.2f}ns, which is smaller '
-                                         'than the minimal allowed length of '
-                                         '{1:.2f}ns! Pulse sequence might '
-                                         'most probably look unexpected. '
-                                         'Increase the length of the smallest '
-                                         'pulse!'
-                                         ''.format(last_sequence_dict['length']*1e9,
-                                                   self.LEN_MIN*1e9))
-
-                    pb_sequence_list.append(last_sequence_dict)
-
-                    # and temporary array becomes last array for the next round
-                    last_sequence_dict = temp_sequence_dict
-
-        # do not forget to add the last sequence
-        pb_sequence_list.append(last_sequence_dict)
-
+        if num_entries == 0:
+            return list()
+
+        # Pack the channel states of each sample into a bitmask, where bit n corresponds to the
+        # n-th channel in ch_list.
+        bitmask = np.zeros(num_entries, dtype=np.uint32)
+        for bit, ch_name in enumerate(ch_list):
+            bitmask |= np.asarray(digital_samples[ch_name], dtype=np.uint32) << bit
+
+        # Run-length encode the bitmask. A new pulse starts wherever the state changes.
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(bitmask)) + 1))
+        run_samples = np.diff(np.append(starts, num_entries))
+        run_masks = bitmask[starts]
+
+        # The sampling freq is fixed anyway and cannot be changed, i.e. each sample has the
+        # minimal granularity length.
+        lengths = run_samples * self.GRAN_MIN
+
+        # increase length by 1%, to remove the ambiguity for the comparison. The last pulse
+        # might be continued in the next chunk.
+        too_short = lengths[:-1] * 1.01 < self.LEN_MIN
+        if np.any(too_short):
+            self.log.warning('Current waveform contains {0:d} pulses shorter than the minimal '
+                             'allowed length of {1:.2f}ns (shortest: {2:.2f}ns)! Pulse sequence '
+                             'might most probably look unexpected. Increase the length of the '
+                             'smallest pulse!'
+                             ''.format(int(np.count_nonzero(too_short)),
+                                       self.LEN_MIN*1e9,
+                                       lengths[:-1][too_short].min()*1e9))
+
+        # Translate each distinct state only once into the list of active channels
+        active_channels = dict()
+        for mask in np.unique(run_masks).tolist():
+            active_channels[mask] = [ch for bit, ch in enumerate(channels) if (mask >> bit) & 1]
+
+        pb_sequence_list = [{'active_channels': list(active_channels[mask]),
+                             'length': length}
+                            for mask, length in zip(run_masks.tolist(), lengths.tolist())]
         return pb_sequence_list
 
     def write_sequence(self, name, sequence_parameters):
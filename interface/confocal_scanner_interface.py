@@ -20,6 +20,8 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
 
+import numpy as np
+
 from core.interface import abstract_interface_method
 from core.meta import InterfaceMetaclass
 
@@ -180,6 +182,35 @@ class ConfocalScannerInterface(metaclass=InterfaceMetaclass):
         """
         pass
 
+    def scan_lines(self, line_paths, return_paths=None, pixel_clock=False):
+        """ Scans several lines in a row and returns the counts on these lines.
+
+        @param float[l][k][n] line_paths: array of l lines with k axes and n pixel positions each
+        @param float[l][k][r] return_paths: optional, array of l lines with k axes and r positions.
+                                            Each return line is scanned directly after the
+                                            corresponding line. The counts are thrown away.
+        @param bool pixel_clock: whether we need to output a pixel clock for the scan lines
+
+        @return float[l][n][m]: the photon counts per second for l lines with n pixels and m
+                                channels
+
+        This method does not need to be implemented by the hardware. The default implementation
+        scans each line and return line with a separate call of scan_line.
+        Hardware that is able to output a continuous trajectory should override it to scan all
+        lines in a single hardware timed run, which avoids the dead time between lines.
+        """
+        line_counts = list()
+        for line_no, line_path in enumerate(line_paths):
+            counts = self.scan_line(line_path, pixel_clock=pixel_clock)
+            if np.any(counts == -1):
+                return np.array([[[-1.]]])
+            line_counts.append(counts)
+            if return_paths is not None:
+                return_counts = self.scan_line(return_paths[line_no])
+                if np.any(return_counts == -1):
+                    return np.array([[[-1.]]])
+        return np.array(line_counts)
+
     @abstract_interface_method
     def close_scanner(self):
         """ Closes the scanner and cleans up afterwards.
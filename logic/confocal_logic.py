@@ -31,6 +31,7 @@ import matplotlib.pyplot as plt
 from logic.generic_logic import GenericLogic
 from core.util.mutex import Mutex
 from core.connector import Connector
+from core.configoption import ConfigOption
 from core.statusvariable import StatusVar
 
 
@@ -257,6 +258,10 @@ class ConfocalLogic(GenericLogic):
     confocalscanner1 = Connector(interface='ConfocalScannerInterface')
     savelogic = Connector(interface='SaveLogic')
 
+    # config options
+    # Number of image lines (incl. return lines) handed to the scanner in a single call
+    _scan_lines_per_call = ConfigOption('scan_lines_per_call', 1, missing='nothing')
+
     # status vars
     _clock_frequency = StatusVar('clock_frequency', 500)
     return_slowness = StatusVar(default=50)
@@ -299,6 +304,8 @@ class ConfocalLogic(GenericLogic):
         self.depth_scan_dir_is_xz = True
         self.depth_img_is_xz = True
         self.permanent_scan = False
+        # Precomputed scanner trajectory of the current image (scan lines, return lines)
+        self._scan_trajectory = None
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -576,6 +583,7 @@ class ConfocalLogic(GenericLogic):
             self._scanning_device.module_state.unlock()
             self.module_state.unlock()
             return -1
+        self._scan_trajectory = self._build_scan_trajectory()
 
         clock_status = self._scanning_device.set_up_scanner_clock(
             clock_frequency=self._clock_frequency)
@@ -605,6 +613,7 @@ class ConfocalLogic(GenericLogic):
         """
         self.module_state.lock()
         self._scanning_device.module_state.lock()
+        self._scan_trajectory = self._build_scan_trajectory()
 
         clock_status = self._scanning_device.set_up_scanner_clock(
             clock_frequency=self._clock_frequency)
@@ -712,6 +721,33 @@ class ConfocalLogic(GenericLogic):
         """
         return self._scanning_device.get_scanner_count_channels()
 
+    def _build_scan_trajectory(self):
+        """ Precompute the scanner positions of all scan lines and return lines of the current
+        image.
+
+        @return (numpy.ndarray, numpy.ndarray): scan lines with shape (lines, axes, pixels) and
+                                                return lines with shape (lines, axes, return_slowness)
+        """
+        image = self.depth_image if self._zscan else self.xy_image
+        n_ch = min(len(self.get_scanner_axes()), 4)
+        n_lines, n_pixels = image.shape[:2]
+
+        lines = np.empty((n_lines, 4, n_pixels))
+        lines[:, :3, :] = image[:, :, :3].transpose(0, 2, 1)
+        lines[:, 3, :] = self._current_a
+
+        # make lines to go back to the starting position of the next scan line
+        return_lines = np.empty((n_lines, 4, self.return_slowness))
+        if self.depth_img_is_xz or not self._zscan:
+            return_lines[:, 0, :] = self._return_XL
+            return_lines[:, 1, :] = image[:, 0, 1:2]
+        else:
+            return_lines[:, 0, :] = image[:, 0, 0:1]
+            return_lines[:, 1, :] = self._return_YL
+        return_lines[:, 2, :] = image[:, 0, 2:3]
+        return_lines[:, 3, :] = self._current_a
+        return np.ascontiguousarray(lines[:, :n_ch]), np.ascontiguousarray(return_lines[:, :n_ch])
+
     def _scan_line(self):
         """scanning an image in either depth or xy
 
@@ -762,78 +798,54 @@ class ConfocalLogic(GenericLogic):
                     self.signal_scan_lines_next.emit()
                     return
 
-            # adjust z of line in image to current z before building the line
-            if not self._zscan:
-                z_shape = image[self._scan_counter, :, 2].shape
-                image[self._scan_counter, :, 2] = self._current_z * np.ones(z_shape)
-
-            # make a line in the scan, _scan_counter says which one it is
-            lsx = image[self._scan_counter, :, 0]
-            lsy = image[self._scan_counter, :, 1]
-            lsz = image[self._scan_counter, :, 2]
-            if n_ch <= 3:
-                line = np.vstack([lsx, lsy, lsz][0:n_ch])
-            else:
-                line = np.vstack(
-                    [lsx, lsy, lsz, np.ones(lsx.shape) * self._current_a])
+            # Scan several lines at once if configured
+            first_line = self._scan_counter
+            last_line = min(first_line + max(int(self._scan_lines_per_call), 1),
+                            np.size(self._image_vert_axis))
+            lines, return_lines = self._scan_trajectory
 
-            # scan the line in the scan
-            line_counts = self._scanning_device.scan_line(line, pixel_clock=True)
-            if np.any(line_counts == -1):
-                self.stopRequested = True
-                self.signal_scan_lines_next.emit()
-                return
+            # adjust z of lines in image and trajectory to current z
+            if not self._zscan:
+                image[first_line:last_line, :, 2] = self._current_z
+                if lines.shape[1] > 2:
+                    lines[first_line:last_line, 2, :] = self._current_z
+                    return_lines[first_line:last_line, 2, :] = self._current_z
+
+            if last_line - first_line == 1:
+                # scan the line in the scan
+                line_counts = self._scanning_device.scan_line(lines[first_line], pixel_clock=True)
+                if np.any(line_counts == -1):
+                    self.stopRequested = True
+                    self.signal_scan_lines_next.emit()
+                    return
 
-            # make a line to go to the starting position of the next scan line
-            if self.depth_img_is_xz or not self._zscan:
-                if n_ch <= 3:
-                    return_line = np.vstack([
-                        self._return_XL,
-                        image[self._scan_counter, 0, 1] * np.ones(self._return_XL.shape),
-                        image[self._scan_counter, 0, 2] * np.ones(self._return_XL.shape)
-                    ][0:n_ch])
-                else:
-                    return_line = np.vstack([
-                            self._return_XL,
-                            image[self._scan_counter, 0, 1] * np.ones(self._return_XL.shape),
-                            image[self._scan_counter, 0, 2] * np.ones(self._return_XL.shape),
-                            np.ones(self._return_XL.shape) * self._current_a
-                        ])
+                # return the scanner to the start of next line, counts are thrown away
+                return_line_counts = self._scanning_device.scan_line(return_lines[first_line])
+                if np.any(return_line_counts == -1):
+                    self.stopRequested = True
+                    self.signal_scan_lines_next.emit()
+                    return
             else:
-                if n_ch <= 3:
-                    return_line = np.vstack([
-                            image[self._scan_counter, 0, 1] * np.ones(self._return_YL.shape),
-                            self._return_YL,
-                            image[self._scan_counter, 0, 2] * np.ones(self._return_YL.shape)
-                        ][0:n_ch])
-                else:
-                    return_line = np.vstack([
-                            image[self._scan_counter, 0, 1] * np.ones(self._return_YL.shape),
-                            self._return_YL,
-                            image[self._scan_counter, 0, 2] * np.ones(self._return_YL.shape),
-                            np.ones(self._return_YL.shape) * self._current_a
-                        ])
-
-            # return the scanner to the start of next line, counts are thrown away
-            return_line_counts = self._scanning_device.scan_line(return_line)
-            if np.any(return_line_counts == -1):
-                self.stopRequested = True
-                self.signal_scan_lines_next.emit()
-                return
+                # scan all lines including return lines with a single call
+                line_counts = self._scanning_device.scan_lines(
+                    lines[first_line:last_line],
+                    return_lines[first_line:last_line],
+                    pixel_clock=True)
+                if np.any(line_counts == -1):
+                    self.stopRequested = True
+                    self.signal_scan_lines_next.emit()
+                    return
 
-            # update image with counts from the line we just scanned
+            # update image with counts from the lines we just scanned
             if self._zscan:
-                if self.depth_img_is_xz:
-                    self.depth_image[self._scan_counter, :, 3:3 + s_ch] = line_counts
-                else:
-                    self.depth_image[self._scan_counter, :, 3:3 + s_ch] = line_counts
+                self.depth_image[first_line:last_line, :, 3:3 + s_ch] = line_counts
                 self.signal_depth_image_updated.emit()
             else:
-                self.xy_image[self._scan_counter, :, 3:3 + s_ch] = line_counts
+                self.xy_image[first_line:last_line, :, 3:3 + s_ch] = line_counts
                 self.signal_xy_image_updated.emit()
 
             # next line in scan
-            self._scan_counter += 1
+            self._scan_counter = last_line
 
             # stop scanning when last line scan was performed and makes scan not continuable
             if self._scan_counter >= np.size(self._image_vert_axis):
@@ -870,6 +882,8 @@ class ConfocalLogic(GenericLogic):
 
         if block:
             self._save_xy_data(colorscale_range, percentile_range)
+            # Data is written by the save logic in the background. Wait for it to finish.
+            self._save_logic.wait_for_saves()
         else:
             self._signal_save_xy.emit(colorscale_range, percentile_range)
 
@@ -924,14 +938,14 @@ class ConfocalLogic(GenericLogic):
                 'of entries where the Signal is in counts/s:'] = self.xy_image[:, :, 3 + n]
 
             filelabel = 'confocal_xy_image_{0}'.format(ch.replace('/', ''))
-            self._save_logic.save_data(image_data,
-                                       filepath=filepath,
-                                       timestamp=timestamp,
-                                       parameters=parameters,
-                                       filelabel=filelabel,
-                                       fmt='%.6e',
-                                       delimiter='\t',
-                                       plotfig=figs[ch])
+            self._save_logic.save_data_async(image_data,
+                                             filepath=filepath,
+                                             timestamp=timestamp,
+                                             parameters=parameters,
+                                             filelabel=filelabel,
+                                             fmt='%.6e',
+                                             delimiter='\t',
+                                             plotfig=figs[ch])
 
         # prepare the full raw data in an OrderedDict:
         data = OrderedDict()
@@ -944,13 +958,13 @@ class ConfocalLogic(GenericLogic):
 
         # Save the raw data to file
         filelabel = 'confocal_xy_data'
-        self._save_logic.save_data(data,
-                                   filepath=filepath,
-                                   timestamp=timestamp,
-                                   parameters=parameters,
-                                   filelabel=filelabel,
-                                   fmt='%.6e',
-                                   delimiter='\t')
+        self._save_logic.save_data_async(data,
+                                         filepath=filepath,
+                                         timestamp=timestamp,
+                                         parameters=parameters,
+                                         filelabel=filelabel,
+                                         fmt='%.6e',
+                                         delimiter='\t')
 
         self.log.debug('Confocal Image saved.')
         self.signal_xy_data_saved.emit()
@@ -973,6 +987,8 @@ class ConfocalLogic(GenericLogic):
         @param: bool block (optional) If False, return immediately; if True, block until save completes."""
         if block:
             self._save_depth_data(colorscale_range, percentile_range)
+            # Data is written by the save logic in the background. Wait for it to finish.
+            self._save_logic.wait_for_saves()
         else:
             self._signal_save_depth.emit(colorscale_range, percentile_range)
 
@@ -1033,14 +1049,14 @@ class ConfocalLogic(GenericLogic):
                 'of entries where the Signal is in counts/s:'] = self.depth_image[:, :, 3 + n]
 
             filelabel = 'confocal_depth_image_{0}'.format(ch.replace('/', ''))
-            self._save_logic.save_data(image_data,
-                                       filepath=filepath,
-                                       timestamp=timestamp,
-                                       parameters=parameters,
-                                       filelabel=filelabel,
-                                       fmt='%.6e',
-                                       delimiter='\t',
-                                       plotfig=figs[ch])
+            self._save_logic.save_data_async(image_data,
+                                             filepath=filepath,
+                                             timestamp=timestamp,
+                                             parameters=parameters,
+                                             filelabel=filelabel,
+                                             fmt='%.6e',
+                                             delimiter='\t',
+                                             plotfig=figs[ch])
 
         # prepare the full raw data in an OrderedDict:
         data = OrderedDict()
@@ -1053,13 +1069,13 @@ class ConfocalLogic(GenericLogic):
 
         # Save the raw data to file
         filelabel = 'confocal_depth_data'
-        self._save_logic.save_data(data,
-                                   filepath=filepath,
-                                   timestamp=timestamp,
-                                   parameters=parameters,
-                                   filelabel=filelabel,
-                                   fmt='%.6e',
-                                   delimiter='\t')
+        self._save_logic.save_data_async(data,
+                                         filepath=filepath,
+                                         timestamp=timestamp,
+                                         parameters=parameters,
+                                         filelabel=filelabel,
+                                         fmt='%.6e',
+                                         delimiter='\t')
 
         self.log.debug('Confocal Image saved.')
         self.signal_depth_data_saved.emit()
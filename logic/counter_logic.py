@@ -21,12 +21,16 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 from qtpy import QtCore
 from collections import OrderedDict
+import datetime
 import numpy as np
+import os
 import time
 import matplotlib.pyplot as plt
 
+from core.configoption import ConfigOption
 from core.connector import Connector
 from core.statusvariable import StatusVar
+from core.util.ring_buffer import RingBuffer, RunningMedian
 from logic.generic_logic import GenericLogic
 from interface.slow_counter_interface import CountingMode
 from core.util.mutex import Mutex
@@ -59,6 +63,13 @@ class CounterLogic(GenericLogic):
     counter1 = Connector(interface='SlowCounterInterface')
     savelogic = Connector(interface='SaveLogic')
 
+    # config options
+    # Number of samples kept in memory before they are written to the file while saving
+    _saving_chunk_size = ConfigOption('saving_chunk_size', 4096, missing='nothing')
+
+    # Maximum number of points per channel drawn in the figure of saved data
+    _max_figure_points = 100000
+
     # status vars
     _count_length = StatusVar('count_length', 300)
     _smooth_window_length = StatusVar('smooth_window_length', 10)
@@ -95,6 +106,10 @@ class CounterLogic(GenericLogic):
         self._counting_mode = CountingMode['CONTINUOUS']
 
         self._saving = False
+
+        # read-only copies of the count traces handed to other threads, see countdata
+        self._countdata_snapshot = None
+        self._countdata_smoothed_snapshot = None
         return
 
     def on_activate(self):
@@ -112,11 +127,10 @@ class CounterLogic(GenericLogic):
         number_of_detectors = constraints.max_detectors
 
         # initialize data arrays
-        self.countdata = np.zeros([len(self.get_channels()), self._count_length])
-        self.countdata_smoothed = np.zeros([len(self.get_channels()), self._count_length])
+        self._init_data_buffers()
         self.rawdata = np.zeros([len(self.get_channels()), self._counting_samples])
         self._already_counted_samples = 0  # For gated counting
-        self._data_to_save = []
+        self._saving_stream = None
 
         # Flag to stop the loop
         self.stopRequested = False
@@ -138,6 +152,12 @@ class CounterLogic(GenericLogic):
             self._stopCount_wait()
 
         self.sigCountDataNext.disconnect()
+
+        # Keep the data recorded so far
+        with self.threadlock:
+            if self._saving_stream is not None:
+                self._save_logic.close_array_stream(self._saving_stream)
+                self._saving_stream = None
         return
 
     def get_hardware_constraints(self):
@@ -255,6 +275,18 @@ class CounterLogic(GenericLogic):
         """
         return self._saving
 
+    def get_saved_data(self, rows=None):
+        """ Returns the count trace data saved since saving was started.
+
+        @param int rows: optional, number of most recent rows to return. All rows if None.
+
+        @return numpy.ndarray: saved data with the time in the first column
+        """
+        stream = self._saving_stream
+        if stream is None:
+            return np.empty((0, len(self.get_channels()) + 1))
+        return stream.read_last(rows)
+
     def start_saving(self, resume=False):
         """
         Sets up start-time and initializes data array, if not resuming, and changes saving state.
@@ -262,11 +294,14 @@ class CounterLogic(GenericLogic):
 
         @return bool: saving state
         """
-        if not resume:
-            self._data_to_save = []
-            self._saving_start_time = time.time()
+        with self.threadlock:
+            if not resume or self._saving_stream is None:
+                if self._saving_stream is not None:
+                    self._discard_saving_stream()
+                self._saving_start_time = time.time()
+                self._open_saving_stream()
 
-        self._saving = True
+            self._saving = True
 
         # If the counter is not running, then it should start running so there is data to save
         if self.module_state() != 'locked':
@@ -276,51 +311,123 @@ class CounterLogic(GenericLogic):
         return self._saving
 
     def save_data(self, to_file=True, postfix='', save_figure=True):
-        """ Save the counter trace data and writes it to a file.
+        """ Stop saving the counter trace data and finish the file.
 
-        @param bool to_file: indicate, whether data have to be saved to file
+        The data is streamed into a npy file in chunks while counting, so finishing the file only
+        requires saving the parameters and the figure. The count trace is saved as a 2D array with
+        the time in the first column (load with numpy.load). Former versions saved a tab separated
+        ".dat" text file. The parameters are saved in a text file ending with "_params.dat".
+        The files are named after the stop time like before.
+
+        @param bool to_file: indicate, whether data have to be kept in a file. If False the file
+                             is deleted after reading back the data.
         @param str postfix: an additional tag, which will be added to the filename upon save
         @param bool save_figure: select whether png and pdf should be saved
 
-        @return dict parameters: Dictionary which contains the saving parameters
+        @return numpy.ndarray, dict: saved data with the time in the first column (memory mapped if
+                                     kept in a file) and dictionary containing the parameters
         """
-        # stop saving thus saving state has to be set to False
-        self._saving = False
-        self._saving_stop_time = time.time()
+        # stop saving thus saving state has to be set to False. The count loop must not append
+        # to the stream while it is taken away and closed.
+        with self.threadlock:
+            self._saving = False
+            self._saving_stop_time = time.time()
+            stream = self._saving_stream
+            self._saving_stream = None
+            if stream is not None:
+                stream.close()
 
         # write the parameters:
+        parameters = self._get_saving_parameters()
+        parameters['Stop counting time'] = time.strftime('%d.%m.%Y %Hh:%Mmin:%Ss', time.localtime(self._saving_stop_time))
+
+        if stream is None:
+            self.sigSavingStatusChanged.emit(self._saving)
+            return np.empty((0, len(self.get_channels()) + 1)), parameters
+
+        if to_file:
+            # The data has been written to file during counting already, so only the parameters
+            # and the figure are left to save.
+            fig = None
+            if save_figure:
+                data = np.load(stream.file_path, mmap_mode='r')
+                if len(data) > 0:
+                    # Only draw a limited number of points for long recordings
+                    step = max(len(data) // self._max_figure_points, 1)
+                    fig = self.draw_figure(data=np.array(data[::step]))
+                # The memory map has to be released before the files are renamed
+                del data
+
+            # If there is a postfix then add separating underscore
+            filelabel = 'count_trace_' + postfix if postfix else 'count_trace'
+            self._save_logic.close_array_stream(
+                stream,
+                parameters=parameters,
+                plotfig=fig,
+                filelabel=filelabel,
+                timestamp=datetime.datetime.fromtimestamp(self._saving_stop_time))
+            data = np.load(stream.file_path, mmap_mode='r')
+            self.log.info('Counter Trace saved to:\n{0}'.format(stream.file_path))
+        else:
+            self._save_logic.close_array_stream(stream)
+            data = np.load(stream.file_path)
+            self._discard_saving_stream(stream)
+
+        self.sigSavingStatusChanged.emit(self._saving)
+        return data, parameters
+
+    def _get_saving_parameters(self):
+        """ Collect the parameters of the current count trace recording.
+
+        @return dict: parameters
+        """
         parameters = OrderedDict()
         parameters['Start counting time'] = time.strftime('%d.%m.%Y %Hh:%Mmin:%Ss', time.localtime(self._saving_start_time))
-        parameters['Stop counting time'] = time.strftime('%d.%m.%Y %Hh:%Mmin:%Ss', time.localtime(self._saving_stop_time))
         parameters['Count frequency (Hz)'] = self._count_frequency
         parameters['Oversampling (Samples)'] = self._counting_samples
         parameters['Smooth Window Length (# of events)'] = self._smooth_window_length
+        return parameters
+
+    def _open_saving_stream(self):
+        """ Open the file the count trace is streamed into while saving.
+        """
+        header = 'Time (s)'
+        for i, detector in enumerate(self.get_channels()):
+            header = header + ',Signal{0} (counts/s)'.format(i)
+        self._saving_stream = self._save_logic.open_array_stream(
+            columns=len(self.get_channels()) + 1,
+            filepath=self._save_logic.get_path_for_module(module_name='Counter'),
+            parameters=self._get_saving_parameters(),
+            filelabel='count_trace',
+            header=header,
+            chunk_rows=self._saving_chunk_size)
+        return
 
-        if to_file:
-            # If there is a postfix then add separating underscore
-            if postfix == '':
-                filelabel = 'count_trace'
-            else:
-                filelabel = 'count_trace_' + postfix
-
-            # prepare the data in a dict or in an OrderedDict:
-            header = 'Time (s)'
-            for i, detector in enumerate(self.get_channels()):
-                header = header + ',Signal{0} (counts/s)'.format(i)
+    def _discard_saving_stream(self, stream=None):
+        """ Close a saving stream and delete its files.
+        """
+        if stream is None:
+            stream, self._saving_stream = self._saving_stream, None
+        stream.close()
+        for path in (stream.file_path, stream.file_path[:-4] + '_params.dat'):
+            if os.path.exists(path):
+                os.remove(path)
+        return
 
-            data = {header: self._data_to_save}
-            filepath = self._save_logic.get_path_for_module(module_name='Counter')
+    def _save_counts(self, counts):
+        """ Append count values together with the time since the start of saving to the file.
 
-            if save_figure:
-                fig = self.draw_figure(data=np.array(self._data_to_save))
-            else:
-                fig = None
-            self._save_logic.save_data(data, filepath=filepath, parameters=parameters,
-                                       filelabel=filelabel, plotfig=fig, delimiter='\t')
-            self.log.info('Counter Trace saved to:\n{0}'.format(filepath))
+        Must be called with the threadlock held. Does nothing if saving has been stopped.
 
-        self.sigSavingStatusChanged.emit(self._saving)
-        return self._data_to_save, parameters
+        @param numpy.ndarray counts: count values with shape (channels, samples)
+        """
+        if not self._saving or self._saving_stream is None:
+            return
+        rows = np.empty((counts.shape[1], counts.shape[0] + 1))
+        rows[:, 0] = time.time() - self._saving_start_time
+        rows[:, 1:] = counts.transpose()
+        self._saving_stream.append(rows)
+        return
 
     def draw_figure(self, data):
         """ Draw figure to save with data file.
@@ -426,9 +533,7 @@ class CounterLogic(GenericLogic):
 
             # initialising the data arrays
             self.rawdata = np.zeros([len(self.get_channels()), self._counting_samples])
-            self.countdata = np.zeros([len(self.get_channels()), self._count_length])
-            self.countdata_smoothed = np.zeros([len(self.get_channels()), self._count_length])
-            self._sampling_data = np.empty([len(self.get_channels()), self._counting_samples])
+            self._init_data_buffers()
 
             # the sample index for gated counting
             self._already_counted_samples = 0
@@ -481,6 +586,7 @@ class CounterLogic(GenericLogic):
                         self._process_data_finite_gated()
                     else:
                         self.log.error('No valid counting mode set! Can not process counter data.')
+                    self._invalidate_countdata_snapshots()
 
             # call this again from event loop
             self.sigCounterUpdated.emit()
@@ -509,8 +615,9 @@ class CounterLogic(GenericLogic):
         else:
             filelabel = 'snapshot_count_trace_' + name_tag
 
+        countdata = self.countdata
         stop_time = self._count_length / self._count_frequency
-        time_step_size = stop_time / len(self.countdata)
+        time_step_size = stop_time / len(countdata)
         x_axis = np.arange(0, stop_time, time_step_size)
 
         # prepare the data in a dict or in an OrderedDict:
@@ -521,7 +628,7 @@ class CounterLogic(GenericLogic):
         datastr = 'Time (s)'
 
         for i, ch in enumerate(chans):
-            savearr[i+1] = self.countdata[i]
+            savearr[i+1] = countdata[i]
             datastr += ',Signal {0} (counts/s)'.format(i)
 
         data[datastr] = savearr.transpose()
@@ -541,6 +648,77 @@ class CounterLogic(GenericLogic):
         self.log.debug('Current Counter Trace saved to: {0}'.format(filepath))
         return data, filepath, parameters, filelabel
 
+    @property
+    def countdata(self):
+        """ Count trace of all channels with shape (channels, count_length), oldest value first.
+
+        The trace is read by other threads (e.g. the GUI after sigCounterUpdated), so a read-only
+        snapshot of the ring buffer is returned, which is not overwritten by the next data. The
+        snapshot is copied at most once per new data and shared by all readers until then.
+        """
+        snapshot = self._countdata_snapshot
+        if snapshot is None:
+            with self.threadlock:
+                if self._countdata_snapshot is None:
+                    self._countdata_snapshot = self._snapshot(self._countdata_buffer)
+                snapshot = self._countdata_snapshot
+        return snapshot
+
+    @property
+    def countdata_smoothed(self):
+        """ Median filtered count trace with the same shape as countdata.
+
+        A read-only snapshot of the ring buffer is returned, see countdata.
+        """
+        snapshot = self._countdata_smoothed_snapshot
+        if snapshot is None:
+            with self.threadlock:
+                if self._countdata_smoothed_snapshot is None:
+                    self._countdata_smoothed_snapshot = self._snapshot(
+                        self._countdata_smoothed_buffer)
+                snapshot = self._countdata_smoothed_snapshot
+        return snapshot
+
+    @staticmethod
+    def _snapshot(ring_buffer):
+        data = ring_buffer.data.copy()
+        data.flags.writeable = False
+        return data
+
+    def _invalidate_countdata_snapshots(self):
+        """ Discard the snapshots of the count traces after the ring buffers have changed.
+        Must be called with the threadlock held.
+        """
+        self._countdata_snapshot = None
+        self._countdata_smoothed_snapshot = None
+        return
+
+    def _init_data_buffers(self):
+        """ Allocate the ring buffers for the count traces and reset the running median.
+        """
+        channels = len(self.get_channels())
+        self._countdata_buffer = RingBuffer(self._count_length, channels)
+        self._countdata_smoothed_buffer = RingBuffer(self._count_length, channels)
+        self._running_median = RunningMedian(
+            min(self._smooth_window_length, self._count_length), channels)
+        self._invalidate_countdata_snapshots()
+        return
+
+    def _append_smoothed_sample(self, sample):
+        """ Update the running median with a new sample and add it to the smoothed trace.
+
+        The median is centered in its window, so the newest half window is padded with the
+        latest median value.
+
+        @param numpy.ndarray sample: one new count value per channel
+        """
+        median = self._running_median.update(sample)
+        self._countdata_smoothed_buffer.append(median)
+        padding = min(int(self._smooth_window_length / 2) + 1, self._count_length)
+        self._countdata_smoothed_buffer.overwrite_latest(
+            np.repeat(median[:, np.newaxis], padding, axis=1))
+        return
+
     def get_channels(self):
         """ Shortcut for hardware get_counter_channels.
 
@@ -553,39 +731,19 @@ class CounterLogic(GenericLogic):
         Processes the raw data from the counting device
         @return:
         """
-        for i, ch in enumerate(self.get_channels()):
-            # remember the new count data in circular array
-            self.countdata[i, 0] = np.average(self.rawdata[i])
-        # move the array to the left to make space for the new data
-        self.countdata = np.roll(self.countdata, -1, axis=1)
-        # also move the smoothing array
-        self.countdata_smoothed = np.roll(self.countdata_smoothed, -1, axis=1)
-        # calculate the median and save it
-        window = -int(self._smooth_window_length / 2) - 1
-        for i, ch in enumerate(self.get_channels()):
-            self.countdata_smoothed[i, window:] = np.median(self.countdata[i,
-                                                            -self._smooth_window_length:])
+        # remember the new count data in the ring buffer
+        new_counts = np.average(self.rawdata, axis=1)
+        self._countdata_buffer.append(new_counts)
+        # calculate the running median and save it
+        self._append_smoothed_sample(new_counts)
 
         # save the data if necessary
         if self._saving:
-             # if oversampling is necessary
+            # if oversampling is necessary save all samples, otherwise the average counts
             if self._counting_samples > 1:
-                chans = self.get_channels()
-                self._sampling_data = np.empty([len(chans) + 1, self._counting_samples])
-                self._sampling_data[0, :] = time.time() - self._saving_start_time
-                for i, ch in enumerate(chans):
-                    self._sampling_data[i+1, 0] = self.rawdata[i]
-
-                self._data_to_save.extend(list(self._sampling_data))
-            # if we don't want to use oversampling
+                self._save_counts(self.rawdata)
             else:
-                # append tuple to data stream (timestamp, average counts)
-                chans = self.get_channels()
-                newdata = np.empty((len(chans) + 1, ))
-                newdata[0] = time.time() - self._saving_start_time
-                for i, ch in enumerate(chans):
-                    newdata[i+1] = self.countdata[i, -1]
-                self._data_to_save.append(newdata)
+                self._save_counts(new_counts[:, np.newaxis])
         return
 
     def _process_data_gated(self):
@@ -593,29 +751,19 @@ class CounterLogic(GenericLogic):
         Processes the raw data from the counting device
         @return:
         """
-        # remember the new count data in circular array
-        self.countdata[0] = np.average(self.rawdata[0])
-        # move the array to the left to make space for the new data
-        self.countdata = np.roll(self.countdata, -1)
-        # also move the smoothing array
-        self.countdata_smoothed = np.roll(self.countdata_smoothed, -1)
-        # calculate the median and save it
-        self.countdata_smoothed[-int(self._smooth_window_length / 2) - 1:] = np.median(
-            self.countdata[-self._smooth_window_length:])
+        # remember the new count data in the ring buffer
+        new_counts = np.average(self.rawdata, axis=1)
+        self._countdata_buffer.append(new_counts)
+        # calculate the running median and save it
+        self._append_smoothed_sample(new_counts)
 
         # save the data if necessary
         if self._saving:
-            # if oversampling is necessary
+            # if oversampling is necessary save all samples, otherwise the average counts
             if self._counting_samples > 1:
-                self._sampling_data = np.empty((self._counting_samples, 2))
-                self._sampling_data[:, 0] = time.time() - self._saving_start_time
-                self._sampling_data[:, 1] = self.rawdata[0]
-                self._data_to_save.extend(list(self._sampling_data))
-            # if we don't want to use oversampling
+                self._save_counts(self.rawdata)
             else:
-                # append tuple to data stream (timestamp, average counts)
-                self._data_to_save.append(np.array((time.time() - self._saving_start_time,
-                                                    self.countdata[-1])))
+                self._save_counts(new_counts[:, np.newaxis])
         return
 
     def _process_data_finite_gated(self):
@@ -623,17 +771,14 @@ class CounterLogic(GenericLogic):
         Processes the raw data from the counting device
         @return:
         """
-        if self._already_counted_samples+len(self.rawdata[0]) >= len(self.countdata):
-            needed_counts = len(self.countdata) - self._already_counted_samples
-            self.countdata[0:needed_counts] = self.rawdata[0][0:needed_counts]
-            self.countdata = np.roll(self.countdata, -needed_counts)
+        if self._already_counted_samples+len(self.rawdata[0]) >= self._count_length:
+            needed_counts = self._count_length - self._already_counted_samples
+            self._countdata_buffer.append(self.rawdata[:, 0:needed_counts])
             self._already_counted_samples = 0
             self.stopRequested = True
         else:
-            # replace the first part of the array with the new data:
-            self.countdata[0:len(self.rawdata[0])] = self.rawdata[0]
-            # roll the array by the amount of data it had been inserted:
-            self.countdata = np.roll(self.countdata, -len(self.rawdata[0]))
+            # append the new data to the ring buffer:
+            self._countdata_buffer.append(self.rawdata)
             # increment the index counter:
             self._already_counted_samples += len(self.rawdata[0])
         return
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains helper functions to fit many traces with the same fit method of the Qudi
+FitLogic. The functions can be executed in worker processes of a multiprocessing pool.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import importlib
+import inspect
+import logging
+import sys
+import lmfit
+import numpy as np
+
+
+class FitMethods:
+    """
+    Lightweight container for the fit methods in worker processes.
+    The functions of the fitmethods files are attached to this class by init_fit_process in the
+    same way as they are attached to FitLogic.
+    """
+    log = logging.getLogger(__name__)
+
+
+def attach_fit_methods(cls, module_name, method_modules):
+    """
+    Import a fit methods file and attach its functions to a class.
+
+    Methods which are indexed for another file are not attached, so the file which is imported
+    first does not decide about methods with the same name in several files.
+
+    @param type cls: class the functions are attached to (FitLogic or FitMethods)
+    @param str module_name: name of the file without ending
+    @param dict method_modules: name of the file without ending for each function name
+
+    @return list: names of the functions which could not be attached
+    """
+    mod = importlib.import_module(module_name)
+    failed = list()
+    for method in dir(mod):
+        ref = getattr(mod, method)
+        if callable(ref) and (inspect.ismethod(ref) or inspect.isfunction(ref)):
+            if method_modules.get(method, module_name) != module_name:
+                continue
+            try:
+                setattr(cls, method, ref)
+            except Exception:
+                failed.append(method)
+    return failed
+
+
+def init_fit_process(path_list, method_modules):
+    """
+    Initializer for batch fit worker processes. Imports all fit methods from the given paths.
+
+    @param list path_list: directories containing the fit method files
+    @param dict method_modules: name of the file without ending for each function name, as
+                                indexed by FitLogic
+    """
+    for path in path_list:
+        if path not in sys.path:
+            sys.path.append(path)
+    for module_name in sorted(set(method_modules.values())):
+        # An exception in the initializer would make the pool restart the worker forever
+        try:
+            attach_fit_methods(FitMethods, module_name, method_modules)
+        except Exception:
+            FitMethods.log.exception('Unable to import fit methods from "{0}".'
+                                     ''.format(module_name))
+    return
+
+
+def get_result_dtype(param_names):
+    """
+    Data type of the structured array returned by the batch fit.
+
+    @param list param_names: names of all parameters of the fit model
+
+    @return numpy.dtype: one value and one standard error field per parameter as well as the
+                         fields "chisqr", "redchi", "nfev" and "success"
+    """
+    fields = list()
+    for name in param_names:
+        fields.append((name, np.float64))
+        fields.append((name + '_stderr', np.float64))
+    fields.extend([('chisqr', np.float64),
+                   ('redchi', np.float64),
+                   ('nfev', np.int64),
+                   ('success', np.bool_)])
+    return np.dtype(fields)
+
+
+def fit_trace_chunk(fit_name, estimator_name, x_axis, data, add_params=None, units=None,
+                    warm_start=True):
+    """
+    Fit a chunk of traces in a worker process. See fit_traces for the parameters.
+    Lmfit Parameters are passed as the string returned by Parameters.dumps.
+    """
+    if isinstance(add_params, str):
+        add_params = lmfit.Parameters().loads(add_params)
+    return fit_traces(FitMethods(), fit_name, estimator_name, x_axis, data,
+                      add_params=add_params, units=units, warm_start=warm_start)
+
+
+def fit_traces(fit_methods, fit_name, estimator_name, x_axis, data, add_params=None, units=None,
+               warm_start=True):
+    """
+    Fit all traces in data with the same fit method.
+
+    With warm_start the estimator is only used for the first trace. Each following fit starts
+    from the parameters of the previous successful fit, which is usually much closer to the
+    result and converges in fewer iterations. If such a fit fails, it is repeated with the
+    estimator.
+
+    @param object fit_methods: object providing the fit methods (FitLogic or FitMethods)
+    @param str fit_name: name of the fit, e.g. 'lorentzian' for make_lorentzian_fit
+    @param str estimator_name: name of the estimator, 'generic' or the custom part of the name
+    @param numpy.ndarray x_axis: 1D x axis shared by all traces
+    @param numpy.ndarray data: 2D array with one trace per row
+    @param Parameters or dict add_params: optional, parameters overriding the estimated ones
+    @param list units: optional, units passed to the fit method
+    @param bool warm_start: start each fit from the result of the previous trace
+
+    @return numpy.ndarray: structured array with one entry per trace (see get_result_dtype)
+    """
+    if estimator_name == 'generic':
+        estimator = getattr(fit_methods, 'estimate_{0}'.format(fit_name))
+    else:
+        estimator = getattr(fit_methods, 'estimate_{0}_{1}'.format(fit_name, estimator_name))
+    make_fit = getattr(fit_methods, 'make_{0}_fit'.format(fit_name))
+    model, params = getattr(fit_methods, 'make_{0}_model'.format(fit_name))()
+    param_names = list(params)
+
+    results = np.zeros(len(data), dtype=get_result_dtype(param_names))
+    for name in param_names:
+        results[name] = np.nan
+        results[name + '_stderr'] = np.nan
+    results['chisqr'] = np.nan
+    results['redchi'] = np.nan
+
+    start_params = None
+    for index, trace in enumerate(data):
+        result = None
+        if warm_start and start_params is not None:
+            result = _fit_single_trace(make_fit, _WarmStartEstimator(start_params), x_axis,
+                                       trace, add_params, units)
+        if result is None or not result.success:
+            result = _fit_single_trace(make_fit, estimator, x_axis, trace, add_params, units)
+        if result is None:
+            start_params = None
+            continue
+
+        for name in param_names:
+            if name in result.params:
+                results[name][index] = result.params[name].value
+                stderr = result.params[name].stderr
+                if stderr is not None:
+                    results[name + '_stderr'][index] = stderr
+        results['chisqr'][index] = result.chisqr
+        results['redchi'][index] = result.redchi
+        results['nfev'][index] = result.nfev
+        results['success'][index] = result.success
+        start_params = result.params if result.success else None
+    return results
+
+
+def _fit_single_trace(make_fit, estimator, x_axis, trace, add_params, units):
+    """
+    Perform a single fit. Returns None if the fit raises an exception.
+    """
+    try:
+        return make_fit(x_axis=x_axis, data=trace, estimator=estimator, units=units,
+                        add_params=add_params)
+    except Exception:
+        return None
+
+
+class _WarmStartEstimator:
+    """
+    Estimator replacement, which sets the initial values to the result of a previous fit.
+    Accepts and ignores the additional arguments some estimators take.
+    """
+    def __init__(self, start_params):
+        self._start_params = start_params
+
+    def __call__(self, x_axis=None, data=None, params=None, *args, **kwargs):
+        for name, param in params.items():
+            if name not in self._start_params or param.expr is not None:
+                continue
+            value = self._start_params[name].value
+            if param.min is not None and np.isfinite(param.min):
+                value = max(value, param.min)
+            if param.max is not None and np.isfinite(param.max):
+                value = min(value, param.max)
+            param.value = value
+        return 0, params
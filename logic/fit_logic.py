@@ -20,9 +20,10 @@ Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
 top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
 """
 
-import importlib
-import inspect
+import ast
+import json
 import lmfit
+import multiprocessing
 from qtpy import QtCore
 import numpy as np
 import os
@@ -35,6 +36,7 @@ from core.util.modules import get_main_dir
 from core.util.mutex import Mutex
 from core.config import load, save
 from core.configoption import ConfigOption
+from logic import fit_batch
 
 
 class FitLogic(GenericLogic):
@@ -54,13 +56,16 @@ class FitLogic(GenericLogic):
     _additional_methods_import_path = ConfigOption(name='additional_fit_methods_path',
                                                    default=None,
                                                    missing='nothing')
+    # Number of worker processes for batch fits. 0 uses one process per CPU core.
+    _batch_fit_processes = ConfigOption(name='batch_fit_processes', default=0, missing='nothing')
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # locking for thread safety
         self.lock = Mutex()
+        self._batch_pool = None
+        self._batch_pool_processes = 0
 
-        filenames = []
         # for path in directories:
         path_list = [os.path.join(get_main_dir(), 'logic', 'fitmethods')]
         # adding additional path, to be defined in the config
@@ -81,13 +86,12 @@ class FitLogic(GenericLogic):
             else:
                 self.log.error('ConfigOption additional_predefined_methods_path needs to either be a string or '
                                'a list of strings.')
+        # Remember the paths to import the fit methods in batch fit worker processes
+        self._fit_method_paths = path_list
 
         for path in path_list:
-            for f in os.listdir(path):
-                if os.path.isfile(os.path.join(path, f)) and f.endswith('.py'):
-                    filenames.append(f[:-3])
-                    if path not in sys.path:
-                        sys.path.append(path)
+            if path not in sys.path:
+                sys.path.append(path)
 
         # A dictionary containing all fit methods and their estimators.
         self.fit_list = OrderedDict()
@@ -95,31 +99,22 @@ class FitLogic(GenericLogic):
         self.fit_list['2d'] = OrderedDict()
         self.fit_list['3d'] = OrderedDict()
 
-        # Go through the fitmethods files and import all methods.
+        # Determine the names of all methods in the fitmethods files without importing them.
+        # A file is only imported when one of its methods is used for the first time.
         # Also determine which methods need to be added to the fit_list dictionary
+        self._fit_method_modules = self._index_fit_methods(path_list)
         estimators_for_dict = list()
         models_for_dict = list()
         fits_for_dict = list()
 
-        for files in filenames:
-            mod = importlib.import_module('{0}'.format(files))
-            for method in dir(mod):
-                ref = getattr(mod, method)
-                if callable(ref) and (inspect.ismethod(ref) or inspect.isfunction(ref)):
-                    method_str = str(method)
-                    try:
-                        # import methods in Fitlogic
-                        setattr(FitLogic, method, ref)
-                        # append method to a list of methods to include in the fit_list dictionary
-                        if method_str.startswith('make_') and method_str.endswith('_fit'):
-                            fits_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
-                        elif method_str.startswith('make_') and method_str.endswith('_model'):
-                            models_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
-                        elif method_str.startswith('estimate_'):
-                            estimators_for_dict.append(method_str.split('_', 1)[1])
-                    except:
-                        self.log.error('Method "{0}" could not be imported to FitLogic.'
-                                       ''.format(str(method)))
+        for method_str in self._fit_method_modules:
+            # append method to a list of methods to include in the fit_list dictionary
+            if method_str.startswith('make_') and method_str.endswith('_fit'):
+                fits_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
+            elif method_str.startswith('make_') and method_str.endswith('_model'):
+                models_for_dict.append(method_str.split('_', 1)[1].rsplit('_', 1)[0])
+            elif method_str.startswith('estimate_'):
+                estimators_for_dict.append(method_str.split('_', 1)[1])
 
         fits_for_dict.sort()
         models_for_dict.sort()
@@ -140,11 +135,12 @@ class FitLogic(GenericLogic):
             # Attach make_*_fit method to fit_list
             if fit_name not in self.fit_list[dimension]:
                 self.fit_list[dimension][fit_name] = OrderedDict()
-            self.fit_list[dimension][fit_name]['make_fit'] = getattr(self, fit_method)
+            self.fit_list[dimension][fit_name]['make_fit'] = _LazyFitMethod(self, fit_method)
 
             # Attach make_*_model method to fit_list
             if fit_name in models_for_dict:
-                self.fit_list[dimension][fit_name]['make_model'] = getattr(self, model_method)
+                self.fit_list[dimension][fit_name]['make_model'] = _LazyFitMethod(self,
+                                                                                  model_method)
             else:
                 self.log.error('No make_*_model method for fit "{0}" found in FitLogic.'
                                ''.format(fit_name))
@@ -154,11 +150,13 @@ class FitLogic(GenericLogic):
             for estimator_name in estimators_for_dict:
                 estimator_method = 'estimate_' + estimator_name
                 if fit_name == estimator_name:
-                    self.fit_list[dimension][fit_name]['generic'] = getattr(self, estimator_method)
+                    self.fit_list[dimension][fit_name]['generic'] = _LazyFitMethod(
+                        self, estimator_method)
                     found_estimator = True
                 elif estimator_name.startswith(fit_name + '_'):
                     custom_name = estimator_name.split('_', 1)[1]
-                    self.fit_list[dimension][fit_name][custom_name] = getattr(self, estimator_method)
+                    self.fit_list[dimension][fit_name][custom_name] = _LazyFitMethod(
+                        self, estimator_method)
                     found_estimator = True
             if not found_estimator:
                 self.log.error('No estimator method for fit "{0}" found in FitLogic.'
@@ -167,6 +165,86 @@ class FitLogic(GenericLogic):
         self.log.info('Methods were included to FitLogic, but only if naming is right: check the'
                       ' doxygen documentation if you added a new method and it does not show.')
 
+    def __getattr__(self, name):
+        """ Import the fitmethods file containing the requested method on first access.
+        Only called if the attribute is not found in the usual way.
+        """
+        modules = self.__dict__.get('_fit_method_modules', dict())
+        if name not in modules:
+            raise AttributeError("'{0}' object has no attribute '{1}'".format(
+                type(self).__name__, name))
+        self._import_fit_module(modules[name])
+        if name not in FitLogic.__dict__:
+            raise AttributeError('Method "{0}" could not be imported from fit methods file '
+                                 '"{1}".'.format(name, modules[name]))
+        return getattr(self, name)
+
+    def _import_fit_module(self, module_name):
+        """ Import a fitmethods file and attach its methods to FitLogic.
+            @param module_name str: name of the file without ending
+
+        Methods which are indexed for another file are not attached, so the file which is imported
+        first does not decide about methods with the same name in several files.
+        """
+        # import methods in Fitlogic
+        for method in fit_batch.attach_fit_methods(FitLogic, module_name,
+                                                   self._fit_method_modules):
+            self.log.error('Method "{0}" could not be imported to FitLogic.'.format(method))
+        return
+
+    def _index_fit_methods(self, path_list):
+        """ Find the names of all functions in the fitmethods files without importing them.
+            @param path_list list(str): directories containing the fitmethods files
+
+            @return OrderedDict: name of the file without ending for each function name
+
+        The files are parsed with the ast module. The result is cached per file in the
+        application status directory and only renewed if the modification time or size of a
+        file has changed.
+        """
+        index_file = None
+        try:
+            index_file = os.path.join(self._manager.getStatusDir(), 'fit_methods_index.json')
+            with open(index_file, 'r') as file:
+                cached_index = json.load(file)
+        except Exception:
+            cached_index = dict()
+
+        new_index = dict()
+        method_modules = OrderedDict()
+        for path in path_list:
+            for f in sorted(os.listdir(path)):
+                file_path = os.path.join(path, f)
+                if not (os.path.isfile(file_path) and f.endswith('.py')):
+                    continue
+                stat = os.stat(file_path)
+                entry = cached_index.get(file_path)
+                if entry is None or entry['mtime'] != stat.st_mtime \
+                        or entry['size'] != stat.st_size:
+                    try:
+                        with open(file_path, 'rb') as file:
+                            tree = ast.parse(file.read(), filename=file_path)
+                    except (SyntaxError, ValueError, OSError):
+                        self.log.exception('Unable to read fit methods file "{0}".'
+                                           ''.format(file_path))
+                        continue
+                    functions = [node.name for node in tree.body
+                                 if isinstance(node, ast.FunctionDef)]
+                    entry = {'mtime': stat.st_mtime, 'size': stat.st_size,
+                             'functions': functions}
+                new_index[file_path] = entry
+                for method in entry['functions']:
+                    method_modules[method] = f[:-3]
+
+        if index_file is not None and new_index != cached_index:
+            try:
+                with open(index_file, 'w') as file:
+                    json.dump(new_index, file)
+            except OSError:
+                self.log.warning('Unable to save index of fit methods to "{0}".'
+                                 ''.format(index_file))
+        return method_modules
+
     def on_activate(self):
         """ Initialisation performed during activation of the module.
         """
@@ -177,7 +255,7 @@ class FitLogic(GenericLogic):
 
     def on_deactivate(self):
         """ """
-        pass
+        self._close_batch_pool()
 
     def validate_load_fits(self, fits):
         """ Take fit names and estimators from a dict and check if they are valid.
@@ -283,6 +361,123 @@ class FitLogic(GenericLogic):
       
         return FitContainer(self, container_name, dimension)
 
+    def do_batch_fit(self, fit_name, x_axis, data, estimator=None, add_params=None,
+                     units=None, warm_start=True, processes=None):
+        """ Fit many traces with the same 1D fit method, e.g. all rows of an ODMR matrix.
+            @param fit_name str: name of the fit function, e.g. 'lorentzian' or 'sineexponentialdecay'
+            @param x_axis np.array: 1D x axis shared by all traces
+            @param data np.array: 2D array with one trace per row (a 1D array is a single trace)
+            @param estimator str: optional, name of the estimator, 'generic' or the name of a
+                                  custom estimator. Defaults to the first estimator registered
+                                  for the fit.
+            @param add_params Parameters or dict: optional, parameters used instead of the
+                                                  estimated values for every trace
+            @param units list(str): optional, units passed to the fit method
+            @param warm_start bool: start each fit from the result of the previous trace instead
+                                    of running the estimator. Neighbouring traces are expected to
+                                    be similar. Falls back to the estimator if a fit fails.
+            @param processes int: optional, number of worker processes. Defaults to the
+                                  ConfigOption batch_fit_processes. 1 fits in the calling thread.
+
+            @return np.array: structured array with one entry per trace. For each model parameter
+                              there is a field with its value and one with its standard error
+                              (name + '_stderr'). The fields 'chisqr', 'redchi', 'nfev' and
+                              'success' describe the fit quality. Values of failed fits are NaN.
+
+        The traces are split into contiguous chunks, which are fitted in a pool of worker
+        processes. The estimator is only run for the first trace of each chunk if warm_start is
+        used.
+        """
+        if fit_name not in self.fit_list['1d']:
+            self.log.error('Batch fit "{0}" is not an available 1D fit.'.format(fit_name))
+            return None
+        if estimator is None:
+            estimators = [name for name in self.fit_list['1d'][fit_name]
+                          if name not in ('make_fit', 'make_model')]
+            if not estimators:
+                self.log.error('No estimator available for fit "{0}".'.format(fit_name))
+                return None
+            estimator = estimators[0]
+        if estimator not in self.fit_list['1d'][fit_name] or estimator in ('make_fit',
+                                                                          'make_model'):
+            self.log.error('Estimator "{0}" is not available for fit "{1}".'
+                           ''.format(estimator, fit_name))
+            return None
+        x_axis = np.asarray(x_axis, dtype=float)
+        data = np.asarray(data, dtype=float)
+        if data.ndim == 1:
+            data = data[np.newaxis, :]
+        if data.ndim != 2 or data.shape[1] != x_axis.size:
+            self.log.error('Batch fit data must be a 2D array with one trace of the same length '
+                           'as the x axis per row.')
+            return None
+
+        if processes is None:
+            processes = self._batch_fit_processes
+        if processes is None or processes < 1:
+            processes = os.cpu_count() or 1
+        processes = min(int(processes), len(data))
+
+        if processes > 1:
+            # Several chunks per process to balance the load. Each chunk starts with an estimate.
+            chunks = np.array_split(np.arange(len(data)), min(4 * processes, len(data)))
+            if isinstance(add_params, lmfit.Parameters):
+                add_params = add_params.dumps()
+            try:
+                pool = self._get_batch_pool(processes)
+                async_results = [pool.apply_async(fit_batch.fit_trace_chunk,
+                                                  (fit_name, estimator, x_axis, data[chunk],
+                                                   add_params, units, warm_start))
+                                 for chunk in chunks]
+                return np.concatenate([res.get() for res in async_results])
+            except Exception:
+                self.log.exception('Batch fit in worker processes failed. Fitting in the '
+                                   'current thread.')
+                self._close_batch_pool()
+                if isinstance(add_params, str):
+                    add_params = lmfit.Parameters().loads(add_params)
+        return fit_batch.fit_traces(self, fit_name, estimator, x_axis, data,
+                                    add_params=add_params, units=units, warm_start=warm_start)
+
+    def _get_batch_pool(self, processes):
+        """ Get the pool of batch fit worker processes. The pool is kept alive between batch fits
+            and only started again if the number of processes changes.
+        """
+        with self.lock:
+            if self._batch_pool is not None and self._batch_pool_processes != processes:
+                self._batch_pool.terminate()
+                self._batch_pool = None
+            if self._batch_pool is None:
+                context = multiprocessing.get_context('spawn')
+                self._batch_pool = context.Pool(processes=processes,
+                                                initializer=fit_batch.init_fit_process,
+                                                initargs=(self._fit_method_paths,
+                                                          self._fit_method_modules))
+                self._batch_pool_processes = processes
+            return self._batch_pool
+
+    def _close_batch_pool(self):
+        with self.lock:
+            if self._batch_pool is not None:
+                self._batch_pool.terminate()
+                self._batch_pool = None
+        return
+
+
+class _LazyFitMethod:
+    """ Reference to a FitLogic method used in the fit_list dictionary.
+    The fitmethods file containing the method is only imported when it is called the first time.
+    """
+    def __init__(self, fit_logic, name):
+        self._fit_logic = fit_logic
+        self._method = None
+        self.__name__ = name
+
+    def __call__(self, *args, **kwargs):
+        if self._method is None:
+            self._method = getattr(self._fit_logic, self.__name__)
+        return self._method(*args, **kwargs)
+
 
 class FitContainer(QtCore.QObject):
     """ A class for managing a single flexible fit setting in a logic module.
@@ -462,3 +657,25 @@ class FitContainer(QtCore.QObject):
         self.sigFitUpdated.emit()
 
         return fit_x, fit_y, result
+
+    def do_batch_fit(self, x_data, y_data, warm_start=True, processes=None):
+        """Performs the chosen fit on many traces, e.g. on all rows of a matrix.
+        @param array x_data: 1D np.array with the x values shared by all traces
+        @param array y_data: 2D np.array with one trace per row
+        @param bool warm_start: start each fit from the result of the previous trace
+        @param int processes: optional, number of worker processes
+
+        @return np.array: structured array with the fit results of all traces as returned by
+                          FitLogic.do_batch_fit or None if no fit is selected.
+        """
+        if self.current_fit not in self.fit_list:
+            return None
+        fit = self.fit_list[self.current_fit]
+        return self.fit_logic.do_batch_fit(fit['fit_name'],
+                                           x_data,
+                                           y_data,
+                                           estimator=fit['est_name'],
+                                           add_params=self.use_settings,
+                                           units=self.units,
+                                           warm_start=warm_start,
+                                           processes=processes)
@@ -119,7 +119,12 @@ def make_decayexponential_model(self, prefix=None):
 
     @return tuple: (object model, object params), for more description see in
                    the method make_barestretchedexponentialdecay_model.
+
+    The model is only created once per prefix and provides its analytic jacobian.
     """
+    cached_model = self._get_cached_model(('decayexponential', prefix))
+    if cached_model is not None:
+        return cached_model
 
     bare_exp_model, params = self.make_bareexponentialdecay_model(prefix=prefix)
 
@@ -128,9 +133,29 @@ def make_decayexponential_model(self, prefix=None):
     constant_model, params = self.make_constant_model(prefix=prefix)
 
     exponentialdecay_model = amplitude_model * bare_exp_model + constant_model
+
+    name_prefix = '' if prefix is None else prefix
+
+    def decayexponential_jacobian(x, values):
+        """ Partial derivatives of the exponential decay with offset. beta is usually fixed. """
+        amplitude = values['{0}amplitude'.format(name_prefix)]
+        lifetime = values['{0}lifetime'.format(name_prefix)]
+        beta = values['{0}beta'.format(name_prefix)]
+        scaled_x = x / lifetime
+        power = np.power(scaled_x, beta)
+        decay = np.exp(-power)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_x = np.where(scaled_x > 0, np.log(np.abs(scaled_x)), 0.0)
+        return {'{0}amplitude'.format(name_prefix): decay,
+                '{0}lifetime'.format(name_prefix): amplitude * decay * beta * power / lifetime,
+                '{0}beta'.format(name_prefix): -amplitude * decay * power * log_x,
+                '{0}offset'.format(name_prefix): 1.0}
+
+    exponentialdecay_model.analytic_jacobian = decayexponential_jacobian
+
     params = exponentialdecay_model.make_params()
 
-    return exponentialdecay_model, params
+    return self._cache_model(('decayexponential', prefix), exponentialdecay_model, params)
 
 
 #################################
@@ -220,9 +245,9 @@ def make_decayexponential_fit(self, x_axis, data, estimator, units=None, add_par
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = exponentialdecay.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(exponentialdecay, data, x_axis, params, **kwargs)
     except:
-        result = exponentialdecay.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(exponentialdecay, data, x_axis, params, **kwargs)
         self.log.warning('The exponentialdecay with offset fit did not work. '
                          'Message: {}'.format(str(result.message)))
 
@@ -110,22 +110,43 @@ def make_gaussian_model(self, prefix=None):
 
     @return tuple: (object model, object params), for more description see in
                    the method make_gaussianwithoutoffset_model.
+
+    The model is only created once per prefix and provides its analytic jacobian.
     """
+    cached_model = self._get_cached_model(('gaussian', prefix))
+    if cached_model is not None:
+        return cached_model
 
     gaussian_model, params = self.make_gaussianwithoutoffset_model(prefix=prefix)
     constant_model, params = self.make_constant_model(prefix=prefix)
 
     gaussian_offset_model = gaussian_model + constant_model
 
+    key = ('gaussian', prefix)
     if prefix is None:
         prefix = ''
 
     gaussian_offset_model.set_param_hint('{0}contrast'.format(prefix),
                                          expr='({0}amplitude/offset)*100'.format(prefix))
 
+    def gaussian_jacobian(x, values):
+        """ Partial derivatives of the Gaussian with offset. """
+        amplitude = values['{0}amplitude'.format(prefix)]
+        center = values['{0}center'.format(prefix)]
+        sigma = values['{0}sigma'.format(prefix)]
+        dx = x - center
+        gauss = np.exp(-np.square(dx) / (2 * sigma ** 2))
+        scale = amplitude * gauss * dx / sigma ** 2
+        return {'{0}amplitude'.format(prefix): gauss,
+                '{0}center'.format(prefix): scale,
+                '{0}sigma'.format(prefix): scale * dx / sigma,
+                '{0}offset'.format(prefix): 1.0}
+
+    gaussian_offset_model.analytic_jacobian = gaussian_jacobian
+
     params = gaussian_offset_model.make_params()
 
-    return gaussian_offset_model, params
+    return self._cache_model(key, gaussian_offset_model, params)
 
 ######################################################
 # 1D Gaussian model with linear (inclined) offset    #
@@ -325,7 +346,7 @@ def make_gaussian_fit(self, x_axis, data, estimator, units=None, add_params=None
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = mod_final.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(mod_final, data, x_axis, params, **kwargs)
     except:
         self.log.warning('The 1D gaussian peak fit did not work. Error '
                        'message: {0}\n'.format(result.message))
@@ -21,6 +21,7 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 """
 
 
+import threading
 import numpy as np
 import lmfit
 from scipy.signal import gaussian
@@ -28,6 +29,10 @@ from scipy.ndimage import filters
 from lmfit import Parameters
 from collections import OrderedDict
 
+# Models created by make_*_model methods, which use _get_cached_model and _cache_model.
+# The keys are tuples of the model name and the arguments of the make_*_model method.
+_model_cache = dict()
+_model_cache_lock = threading.Lock()
 ############################################################################
 #                                                                          #
 #                             General methods                              #
@@ -130,6 +135,100 @@ def _substitute_params(self, initial_params, update_params=None):
 
     return initial_params
 
+def _get_cached_model(self, key):
+    """ Get a model created before by the make_*_model method identified by key.
+
+    @param tuple key: name of the model and the arguments used to create it
+
+    @return tuple: (object model, object params) with a new copy of the parameters, or None if
+                   the model has not been created yet.
+
+    Creating the composite lmfit models is expensive compared to a fit of a few hundred data
+    points, so the frequently used models are only created once. The model objects are shared and
+    must not be changed by the caller (e.g. with set_param_hint). Combining them with other models
+    creates new objects and is fine.
+    """
+    with _model_cache_lock:
+        if key not in _model_cache:
+            return None
+        model, params = _model_cache[key]
+    return model, params.copy()
+
+
+def _cache_model(self, key, model, params):
+    """ Store a model to be returned by _get_cached_model.
+
+    @param tuple key: name of the model and the arguments used to create it
+    @param object model: lmfit.model.CompositeModel to store
+    @param object params: lmfit.parameter.Parameters of the model
+
+    @return tuple: (object model, object params) with a new copy of the parameters
+    """
+    with _model_cache_lock:
+        _model_cache[key] = (model, params)
+    return model, params.copy()
+
+
+def _fit_model(self, model, data, x_axis, params, **kwargs):
+    """ Fit a model to the data and use the analytic jacobian of the model if available.
+
+    @param object model: lmfit.model.Model to fit
+    @param numpy.array data: 1D data to fit
+    @param numpy.array x_axis: 1D axis values
+    @param object params: lmfit.parameter.Parameters with the initial values
+    @param kwargs: additional keyword arguments passed to model.fit
+
+    @return object result: lmfit.model.ModelResult
+
+    A model can provide the partial derivatives of the model function in the attribute
+    analytic_jacobian. It must be a function jacobian(x, values), which returns a dictionary with
+    the derivatives (numpy.array or float) for all parameters of the model function. values is the
+    dictionary of all parameter values. The jacobian replaces the numerical derivatives of the
+    Levenberg-Marquardt algorithm, which saves one model evaluation per varied parameter in each
+    iteration. It is only used if all varied parameters are parameters of the model function and
+    none of them is constrained by an expression.
+    """
+    jacobian = getattr(model, 'analytic_jacobian', None)
+    if jacobian is not None and kwargs.get('method', 'leastsq') == 'leastsq' \
+            and kwargs.get('nan_policy', 'raise') == 'raise':
+        fit_kws = dict() if kwargs.get('fit_kws') is None else dict(kwargs['fit_kws'])
+        if 'Dfun' not in fit_kws and _AnalyticJacobian.is_applicable(model, params):
+            fit_kws['Dfun'] = _AnalyticJacobian(jacobian)
+            fit_kws['col_deriv'] = False
+            kwargs['fit_kws'] = fit_kws
+    return model.fit(data, x=x_axis, params=params, **kwargs)
+
+
+class _AnalyticJacobian:
+    """ Wrapper to pass the analytic jacobian of a model to the leastsq minimizer.
+    lmfit calls it with the same arguments as the residual of the model and scales the result for
+    bounded parameters.
+    """
+    def __init__(self, jacobian):
+        self._jacobian = jacobian
+
+    @staticmethod
+    def is_applicable(model, params):
+        for name in model.param_names:
+            if name in params and params[name].expr is not None:
+                return False
+        for name, param in params.items():
+            if param.vary and param.expr is None and name not in model.param_names:
+                return False
+        return True
+
+    def __call__(self, params, data, weights, x=None, **kwargs):
+        x = np.asarray(x, dtype=float)
+        derivatives = self._jacobian(x, params.valuesdict())
+        var_names = [name for name, param in params.items() if param.vary and param.expr is None]
+        jac = np.empty((x.size, len(var_names)))
+        for index, name in enumerate(var_names):
+            jac[:, index] = derivatives[name]
+        if weights is not None:
+            jac *= np.asarray(weights, dtype=float).reshape(-1, 1)
+        return jac
+
+
 def create_fit_string(self, result, model, units=None, decimal_digits_value_given=None,
                       decimal_digits_err_given=None):
     """ This method can produces a well readable string from the results of a fitted model.
@@ -174,6 +174,27 @@ def make_lorentzianwithoutoffset_model(self, prefix=None):
     return full_lorentz_model, params
 
 
+def _lorentzian_derivatives(x, values, prefix=''):
+    """ Partial derivatives of amplitude * physical_lorentzian(x, center, sigma).
+
+    @param numpy.array x: independent variable
+    @param dict values: parameter values
+    @param str prefix: prefix of the parameter names
+
+    @return dict: derivatives with respect to the amplitude, center and sigma parameters
+    """
+    amplitude = values['{0}amplitude'.format(prefix)]
+    center = values['{0}center'.format(prefix)]
+    sigma = values['{0}sigma'.format(prefix)]
+    dx2 = np.square(x - center)
+    denominator = dx2 + sigma ** 2
+    lorentzian = sigma ** 2 / denominator
+    scale = 2 * amplitude * lorentzian / denominator
+    return {'{0}amplitude'.format(prefix): lorentzian,
+            '{0}center'.format(prefix): scale * (x - center),
+            '{0}sigma'.format(prefix): scale * dx2 / sigma}
+
+
 ####################################
 # Lorentzian model with offset     #
 ####################################
@@ -188,22 +209,36 @@ def make_lorentzian_model(self, prefix=None):
 
     @return tuple: (object model, object params), for more description see in
                    the method make_lorentzian_model.
+
+    The model is only created once per prefix and provides its analytic jacobian.
     """
+    cached_model = self._get_cached_model(('lorentzian', prefix))
+    if cached_model is not None:
+        return cached_model
 
     lorentz_model, params = self.make_lorentzianwithoutoffset_model(prefix=prefix)
     constant_model, params = self.make_constant_model(prefix=prefix)
 
     lorentz_offset_model = lorentz_model + constant_model
 
+    key = ('lorentzian', prefix)
     if prefix is None:
         prefix = ''
 
     lorentz_offset_model.set_param_hint('{0}contrast'.format(prefix),
                                         expr='({0}amplitude/offset)*100'.format(prefix))
 
+    def lorentzian_jacobian(x, values):
+        """ Partial derivatives of the Lorentzian with offset. """
+        jacobian = _lorentzian_derivatives(x, values, prefix)
+        jacobian['{0}offset'.format(prefix)] = 1.0
+        return jacobian
+
+    lorentz_offset_model.analytic_jacobian = lorentzian_jacobian
+
     params = lorentz_offset_model.make_params()
 
-    return lorentz_offset_model, params
+    return self._cache_model(key, lorentz_offset_model, params)
 
 
 #################################################
@@ -218,7 +253,12 @@ def make_multiplelorentzian_model(self, no_of_functions=1):
 
     @return tuple: (object model, object params), for more description see in
                    the method make_lorentzian_model.
+
+    The model is only created once per number of functions and provides its analytic jacobian.
     """
+    cached_model = self._get_cached_model(('multiplelorentzian', no_of_functions))
+    if cached_model is not None:
+        return cached_model
 
     if no_of_functions == 1:
         multi_lorentz_model, params = self.make_lorentzian_model()
@@ -241,9 +281,18 @@ def make_multiplelorentzian_model(self, no_of_functions=1):
                 '{0}contrast'.format(prefix),
                 expr='({0}amplitude/offset)*100'.format(prefix))
 
+        def multiple_lorentzian_jacobian(x, values):
+            """ Partial derivatives of the sum of Lorentzians with offset. """
+            jacobian = {'offset': 1.0}
+            for ii in range(no_of_functions):
+                jacobian.update(_lorentzian_derivatives(x, values, 'l{0:d}_'.format(ii)))
+            return jacobian
+
+        multi_lorentz_model.analytic_jacobian = multiple_lorentzian_jacobian
+
     params = multi_lorentz_model.make_params()
 
-    return multi_lorentz_model, params
+    return self._cache_model(('multiplelorentzian', no_of_functions), multi_lorentz_model, params)
 
 #################################################
 #    Double Lorentzian model with offset        #
@@ -306,9 +355,9 @@ def make_lorentzian_fit(self, x_axis, data, estimator, units=None,
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x_axis, params, **kwargs)
     except:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x_axis, params, **kwargs)
         self.log.warning('The 1D lorentzian fit did not work. Error '
                          'message: {0}\n'.format(result.message))
 
@@ -460,9 +509,9 @@ def make_lorentziandouble_fit(self, x_axis, data, estimator, units=None, add_par
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x_axis, params, **kwargs)
     except:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x_axis, params, **kwargs)
         self.log.error('The double lorentzian fit did not '
                      'work: {0}'.format(result.message))
 
@@ -781,9 +830,9 @@ def make_lorentziantriple_fit(self, x_axis, data, estimator, units=None,
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x_axis, params, **kwargs)
     except:
-        result = model.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(model, data, x_axis, params, **kwargs)
         self.log.error('The triple lorentzian fit did not '
                        'work: {0}'.format(result.message))
 
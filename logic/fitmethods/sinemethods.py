@@ -123,15 +123,36 @@ def make_sine_model(self, prefix=None):
 
     @return tuple: (object model, object params), for more description see in
                    the method make_baresine_model.
+
+    The model is only created once per prefix and provides its analytic jacobian.
     """
+    cached_model = self._get_cached_model(('sine', prefix))
+    if cached_model is not None:
+        return cached_model
 
     sine_model, params = self.make_sinewithoutoffset_model(prefix=prefix)
     constant_model, params = self.make_constant_model(prefix=prefix)
 
     sine_offset_model = sine_model + constant_model
+
+    name_prefix = '' if prefix is None else prefix
+
+    def sine_jacobian(x, values):
+        """ Partial derivatives of the sine with offset. """
+        amplitude = values['{0}amplitude'.format(name_prefix)]
+        argument = 2 * np.pi * values['{0}frequency'.format(name_prefix)] * x \
+                   + values['{0}phase'.format(name_prefix)]
+        cosine = amplitude * np.cos(argument)
+        return {'{0}amplitude'.format(name_prefix): np.sin(argument),
+                '{0}frequency'.format(name_prefix): 2 * np.pi * x * cosine,
+                '{0}phase'.format(name_prefix): cosine,
+                '{0}offset'.format(name_prefix): 1.0}
+
+    sine_offset_model.analytic_jacobian = sine_jacobian
+
     params = sine_offset_model.make_params()
 
-    return sine_offset_model, params
+    return self._cache_model(('sine', prefix), sine_offset_model, params)
 
 ###############################################
 # Sinus with exponential decay but not offset #
@@ -594,9 +615,9 @@ def make_sine_fit(self, x_axis, data, estimator, units=None, add_params=None, **
     params = self._substitute_params(initial_params=params,
                                      update_params=add_params)
     try:
-        result = sine.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(sine, data, x_axis, params, **kwargs)
     except:
-        result = sine.fit(data, x=x_axis, params=params, **kwargs)
+        result = self._fit_model(sine, data, x_axis, params, **kwargs)
         self.log.error('The sine fit did not work.\n'
                        'Error message: {0}\n'.format(result.message))
 
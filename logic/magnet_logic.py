@@ -1536,10 +1536,13 @@ class MagnetLogic(GenericLogic):
 
         self._set_cw_mw(switch_on=False)
 
+        # Use one snapshot of the finished count trace for the whole analysis
+        countdata = self._gc_logic.countdata
+
         # try with single poissonian:
 
 
-        num_bins = (self._gc_logic.countdata.max() - self._gc_logic.countdata.min())
+        num_bins = (countdata.max() - countdata.min())
         self._ta_logic.set_num_bins_histogram(num_bins)
 
         hist_fit_x, hist_fit_y, param_single_poisson = self._ta_logic.do_fit('Poisson')
@@ -1549,36 +1552,36 @@ class MagnetLogic(GenericLogic):
         # try with normal double poissonian:
 
         # better performance by starting with half of number of bins:
-        num_bins = int((self._gc_logic.countdata.max() - self._gc_logic.countdata.min()) / 2)
+        num_bins = int((countdata.max() - countdata.min()) / 2)
         self._ta_logic.set_num_bins_histogram(num_bins)
 
-        flip_prob, param2 = self._ta_logic.analyze_flip_prob(self._gc_logic.countdata, num_bins)
+        flip_prob, param2 = self._ta_logic.analyze_flip_prob(countdata, num_bins)
 
         # self._pulser_off()
         #
         # self._load_pulsed_odmr()
         # self._pulser_on()
 
-        out_of_range = (param2['\u03BB0']['value'] < self._gc_logic.countdata.min() or param2['\u03BB0'][
-            'value'] > self._gc_logic.countdata.max()) or \
-                       (param2['\u03BB1']['value'] < self._gc_logic.countdata.min() or param2['\u03BB1'][
-                           'value'] > self._gc_logic.countdata.max())
+        out_of_range = (param2['\u03BB0']['value'] < countdata.min() or param2['\u03BB0'][
+            'value'] > countdata.max()) or \
+                       (param2['\u03BB1']['value'] < countdata.min() or param2['\u03BB1'][
+                           'value'] > countdata.max())
 
         while np.isnan(param2['fidelity'] or out_of_range) and num_bins > 4:
             # Reduce the number of bins if the calculation yields an invalid
             # number
             num_bins = int(num_bins / 2)
             self._ta_logic.set_num_bins_histogram(num_bins)
-            flip_prob, param2 = self._ta_logic.analyze_flip_prob(self._gc_logic.countdata, num_bins)
+            flip_prob, param2 = self._ta_logic.analyze_flip_prob(countdata, num_bins)
 
             # reduce the number of bins by one, so that the fitting algorithm
             # work. Eventually, that has to go in the fit constaints of the
             # algorithm.
 
-            out_of_range = (param2['\u03BB0']['value'] < self._gc_logic.countdata.min() or param2['\u03BB0'][
-                'value'] > self._gc_logic.countdata.max()) or \
-                           (param2['\u03BB1']['value'] < self._gc_logic.countdata.min() or param2['\u03BB1'][
-                               'value'] > self._gc_logic.countdata.max())
+            out_of_range = (param2['\u03BB0']['value'] < countdata.min() or param2['\u03BB0'][
+                'value'] > countdata.max()) or \
+                           (param2['\u03BB1']['value'] < countdata.min() or param2['\u03BB1'][
+                               'value'] > countdata.max())
 
             if out_of_range:
                 num_bins = num_bins - 1
@@ -1587,10 +1590,10 @@ class MagnetLogic(GenericLogic):
                                  'Change the histogram a '
                                  'bit.'.format(param2['\u03BB0']['value'],
                                                param2['\u03BB1']['value'],
-                                               self._gc_logic.countdata.min(),
-                                               self._gc_logic.countdata.max()))
+                                               countdata.min(),
+                                               countdata.max()))
 
-                flip_prob, param2 = self._ta_logic.analyze_flip_prob(self._gc_logic.countdata, num_bins)
+                flip_prob, param2 = self._ta_logic.analyze_flip_prob(countdata, num_bins)
 
         # run the lifetime calculatiion:
         #        In order to calculate the T1 time one needs the length of one SingleShot readout
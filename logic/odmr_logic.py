@@ -34,6 +34,7 @@ from core.util.mutex import Mutex
 from core.connector import Connector
 from core.configoption import ConfigOption
 from core.statusvariable import StatusVar
+from core.util.ring_buffer import SweepAccumulator
 
 
 class ODMRLogic(GenericLogic):
@@ -52,6 +53,8 @@ class ODMRLogic(GenericLogic):
         'LIST',
         missing='warn',
         converter=lambda x: MicrowaveMode[x.upper()])
+    # Number of most recent sweeps kept in memory (and saved as raw data)
+    _max_raw_data_lines = ConfigOption('max_raw_data_lines', 1000, missing='nothing')
 
     clock_frequency = StatusVar('clock_frequency', 200)
     cw_mw_frequency = StatusVar('cw_mw_frequency', 2870e6)
@@ -128,12 +131,9 @@ class ODMRLogic(GenericLogic):
 
         # Initalize the ODMR data arrays (mean signal and sweep matrix)
         self._initialize_odmr_plots()
-        # Raw data array
-        self.odmr_raw_data = np.zeros(
-            [self.number_of_lines,
-             len(self._odmr_counter.get_odmr_channels()),
-             self.odmr_plot_x.size]
-        )
+        # Accumulator holding the raw data history and the averaged signal
+        self.lines_to_average = self._limit_average_length(self.lines_to_average)
+        self._initialize_sweep_accumulator()
 
         # Switch off microwave and set CW frequency and power
         self.mw_off()
@@ -262,24 +262,19 @@ class ODMRLogic(GenericLogic):
         """
         Sets the number of lines to average for the sum of the data
 
-        @param int lines_to_average: desired number of lines to average (0 means all)
+        @param int lines_to_average: desired number of lines to average (0 means all). At most
+                                     max_raw_data_lines lines are kept, so larger values are
+                                     limited to max_raw_data_lines.
 
         @return int: actually set lines to average
         """
-        self.lines_to_average = int(lines_to_average)
-
-        if self.lines_to_average <= 0:
-            self.odmr_plot_y = np.mean(
-                self.odmr_raw_data[:max(1, self.elapsed_sweeps), :, :],
-                axis=0,
-                dtype=np.float64
-            )
-        else:
-            self.odmr_plot_y = np.mean(
-                self.odmr_raw_data[:max(1, min(self.lines_to_average, self.elapsed_sweeps)), :, :],
-                axis=0,
-                dtype=np.float64
-            )
+        self.lines_to_average = self._limit_average_length(int(lines_to_average))
+
+        with self.threadlock:
+            self._sweep_accumulator.average_length = max(self.lines_to_average, 0)
+            self._sweep_accumulator.history_length = self._get_sweep_history_length()
+            self.odmr_plot_y = self._sweep_accumulator.average
+            self.odmr_plot_xy = self._sweep_accumulator.history[:self.number_of_lines].copy()
 
         self.sigOdmrPlotsUpdated.emit(self.odmr_plot_x, self.odmr_plot_y, self.odmr_plot_xy)
         self.sigParameterUpdated.emit({'average_length': self.lines_to_average})
@@ -365,6 +360,8 @@ class ODMRLogic(GenericLogic):
         """
         if isinstance(number_of_lines, int):
             self.number_of_lines = number_of_lines
+            with self.threadlock:
+                self._sweep_accumulator.history_length = self._get_sweep_history_length()
         else:
             self.log.warning('set_matrix_line_number failed. '
                              'Input parameter number_of_lines is no integer.')
@@ -663,18 +660,8 @@ class ODMRLogic(GenericLogic):
                 return -1
 
             self._initialize_odmr_plots()
-            # initialize raw_data array
-            estimated_number_of_lines = self.run_time * self.clock_frequency / self.odmr_plot_x.size
-            estimated_number_of_lines = int(1.5 * estimated_number_of_lines)  # Safety
-            if estimated_number_of_lines < self.number_of_lines:
-                estimated_number_of_lines = self.number_of_lines
-            self.log.debug('Estimated number of raw data lines: {0:d}'
-                           ''.format(estimated_number_of_lines))
-            self.odmr_raw_data = np.zeros(
-                [estimated_number_of_lines,
-                 len(self._odmr_counter.get_odmr_channels()),
-                 self.odmr_plot_x.size]
-            )
+            # initialize raw data history and averages
+            self._initialize_sweep_accumulator()
             self.sigNextLine.emit()
             return 0
 
@@ -767,45 +754,16 @@ class ODMRLogic(GenericLogic):
                 self.sigNextLine.emit()
                 return
 
-            # Add new count data to raw_data array and append if array is too small
+            # Add new count data to the sweep history and the running averages
             if self._clearOdmrData:
-                self.odmr_raw_data[:, :, :] = 0
+                self._sweep_accumulator.clear()
                 self._clearOdmrData = False
-            if self.elapsed_sweeps == (self.odmr_raw_data.shape[0] - 1):
-                expanded_array = np.zeros(self.odmr_raw_data.shape)
-                self.odmr_raw_data = np.concatenate((self.odmr_raw_data, expanded_array), axis=0)
-                self.log.warning('raw data array in ODMRLogic was not big enough for the entire '
-                                 'measurement. Array will be expanded.\nOld array shape was '
-                                 '({0:d}, {1:d}), new shape is ({2:d}, {3:d}).'
-                                 ''.format(self.odmr_raw_data.shape[0] - self.number_of_lines,
-                                           self.odmr_raw_data.shape[1],
-                                           self.odmr_raw_data.shape[0],
-                                           self.odmr_raw_data.shape[1]))
-
-            # shift data in the array "up" and add new data at the "bottom"
-            self.odmr_raw_data = np.roll(self.odmr_raw_data, 1, axis=0)
-
-            self.odmr_raw_data[0] = new_counts
-
-            # Add new count data to mean signal
-            if self._clearOdmrData:
-                self.odmr_plot_y[:, :] = 0
-
-            if self.lines_to_average <= 0:
-                self.odmr_plot_y = np.mean(
-                    self.odmr_raw_data[:max(1, self.elapsed_sweeps), :, :],
-                    axis=0,
-                    dtype=np.float64
-                )
-            else:
-                self.odmr_plot_y = np.mean(
-                    self.odmr_raw_data[:max(1, min(self.lines_to_average, self.elapsed_sweeps)), :, :],
-                    axis=0,
-                    dtype=np.float64
-                )
+            self._sweep_accumulator.add_sweep(new_counts)
 
-            # Set plot slice of matrix
-            self.odmr_plot_xy = self.odmr_raw_data[:self.number_of_lines, :, :]
+            # Mean signal and plot slice of matrix (newest sweep first). The history is
+            # overwritten by the next sweep, so the GUI gets a copy.
+            self.odmr_plot_y = self._sweep_accumulator.average
+            self.odmr_plot_xy = self._sweep_accumulator.history[:self.number_of_lines].copy()
 
             # Update elapsed time/sweeps
             self.elapsed_sweeps += 1
@@ -818,6 +776,40 @@ class ODMRLogic(GenericLogic):
             self.sigNextLine.emit()
             return
 
+    @property
+    def odmr_raw_data(self):
+        """ History of the most recent sweeps with shape (sweeps, channels, frequencies).
+        The newest sweep comes first. This is a view which is only valid until the next sweep.
+        """
+        return self._sweep_accumulator.history
+
+    def _limit_average_length(self, lines_to_average):
+        """ Limit the number of sweeps to average to the number of sweeps kept in the history.
+
+        @param int lines_to_average: desired number of lines to average (0 means all)
+
+        @return int: number of lines to average which can be kept in memory
+        """
+        if lines_to_average > self._max_raw_data_lines:
+            self.log.warning('Only the last {0:d} sweeps are kept (max_raw_data_lines), so the '
+                             'average length is limited to {0:d} instead of {1:d} sweeps.'
+                             ''.format(self._max_raw_data_lines, lines_to_average))
+            return self._max_raw_data_lines
+        return lines_to_average
+
+    def _get_sweep_history_length(self):
+        """ Number of sweeps to keep in the raw data history """
+        return max(self.number_of_lines, self.lines_to_average, self._max_raw_data_lines)
+
+    def _initialize_sweep_accumulator(self):
+        """ Create a new (empty) sweep accumulator matching the current frequency list """
+        self._sweep_accumulator = SweepAccumulator(
+            history_length=self._get_sweep_history_length(),
+            channels=len(self._odmr_counter.get_odmr_channels()),
+            points=self.odmr_plot_x.size,
+            average_length=max(self.lines_to_average, 0))
+        return
+
     def get_odmr_channels(self):
         return self._odmr_counter.get_odmr_channels()
 
@@ -897,18 +889,21 @@ class ODMRLogic(GenericLogic):
             parameters['Microwave Sweep Power (dBm)'] = self.sweep_mw_power
             parameters['Run Time (s)'] = self.run_time
             parameters['Number of frequency sweeps (#)'] = self.elapsed_sweeps
+            if self.elapsed_sweeps > self.odmr_raw_data.shape[0]:
+                # Only the most recent sweeps are kept in memory
+                parameters['Number of saved sweeps (#)'] = self.odmr_raw_data.shape[0]
             parameters['Start Frequencies (Hz)'] = self.mw_starts
             parameters['Stop Frequencies (Hz)'] = self.mw_stops
             parameters['Step sizes (Hz)'] = self.mw_steps
             parameters['Clock Frequencies (Hz)'] = self.clock_frequency
             parameters['Channel'] = '{0}: {1}'.format(nch, channel)
-            self._save_logic.save_data(data_raw,
-                                       filepath=filepath,
-                                       parameters=parameters,
-                                       filelabel=filelabel_raw,
-                                       fmt='%.6e',
-                                       delimiter='\t',
-                                       timestamp=timestamp)
+            self._save_logic.save_data_async(data_raw,
+                                             filepath=filepath,
+                                             parameters=parameters,
+                                             filelabel=filelabel_raw,
+                                             fmt='%.6e',
+                                             delimiter='\t',
+                                             timestamp=timestamp)
 
             # now create a plot for each scan range
             data_start_ind = 0
@@ -950,14 +945,14 @@ class ODMRLogic(GenericLogic):
                                        cbar_range=colorscale_range,
                                        percentile_range=percentile_range)
 
-                self._save_logic.save_data(data,
-                                           filepath=filepath,
-                                           parameters=parameters,
-                                           filelabel=filelabel,
-                                           fmt='%.6e',
-                                           delimiter='\t',
-                                           timestamp=timestamp,
-                                           plotfig=fig)
+                self._save_logic.save_data_async(data,
+                                                 filepath=filepath,
+                                                 parameters=parameters,
+                                                 filelabel=filelabel,
+                                                 fmt='%.6e',
+                                                 delimiter='\t',
+                                                 timestamp=timestamp,
+                                                 plotfig=fig)
 
         self.log.info('ODMR data saved to:\n{0}'.format(filepath))
         return
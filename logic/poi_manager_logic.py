@@ -24,8 +24,10 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 import os
 import numpy as np
 import time
+from scipy import ndimage
 
 from collections import OrderedDict
+from core.configoption import ConfigOption
 from core.connector import Connector
 from core.statusvariable import StatusVar
 from datetime import datetime
@@ -360,6 +362,15 @@ class PoiManagerLogic(GenericLogic):
     scannerlogic = Connector(interface='ConfocalLogic')
     savelogic = Connector(interface='SaveLogic')
 
+    # config options
+    # Refine the positions of automatically found POIs to sub-pixel precision
+    _subpixel_poi_positions = ConfigOption('subpixel_poi_positions', False, missing='nothing')
+    # Number of most recent ROI history entries used to estimate the sample drift
+    _drift_history_length = ConfigOption('drift_history_length', 10, missing='nothing')
+    # Time in s to wait for the result of a POI refocus of the scheduled refocus after the
+    # optimizer has become idle. The POI is skipped afterwards.
+    _refocus_result_timeout = ConfigOption('refocus_result_timeout', 5, missing='nothing')
+
     # status vars
     _roi = StatusVar(default=dict())  # Notice constructor and representer further below
     _refocus_period = StatusVar(default=120)
@@ -367,6 +378,7 @@ class PoiManagerLogic(GenericLogic):
     _move_scanner_after_optimization = StatusVar(default=True)
     _poi_threshold = StatusVar(default=5)
     _poi_diameter = StatusVar(default=1.5)
+    _refocus_uncertainty = StatusVar(default=100e-9)
 
     # Signals for connecting modules
     sigRefocusStateUpdated = QtCore.Signal(bool)  # is_active
@@ -389,6 +401,15 @@ class PoiManagerLogic(GenericLogic):
         self._last_refocus = 0
         self._periodic_refocus_poi = None
 
+        # state of the scheduled refocus of all POIs
+        self._scheduled_refocus = False
+        self._poi_refocus_times = dict()
+        self._refocus_queue = list()
+        self._refocus_results = dict()
+        self._refocus_pending = None
+        self._refocus_idle_since = None
+        self._last_refocused_poi = None
+
         # threading
         self._threadlock = Mutex()
         return
@@ -400,6 +421,13 @@ class PoiManagerLogic(GenericLogic):
         self.__timer.setSingleShot(False)
         self._last_refocus = 0
         self._periodic_refocus_poi = None
+        self._scheduled_refocus = False
+        self._poi_refocus_times = dict()
+        self._refocus_queue = list()
+        self._refocus_results = dict()
+        self._refocus_pending = None
+        self._refocus_idle_since = None
+        self._last_refocused_poi = None
 
         # Connect callback for a finished refocus
         self.optimiserlogic().sigRefocusFinished.connect(
@@ -513,6 +541,15 @@ class PoiManagerLogic(GenericLogic):
         self.set_refocus_period(period)
         return
 
+    @property
+    def refocus_uncertainty(self):
+        return float(self._refocus_uncertainty)
+
+    @refocus_uncertainty.setter
+    def refocus_uncertainty(self, uncertainty):
+        self.set_refocus_uncertainty(uncertainty)
+        return
+
     @property
     def poi_threshold(self):
         return float(self._poi_threshold)
@@ -864,6 +901,21 @@ class PoiManagerLogic(GenericLogic):
                 self.sigRefocusTimerUpdated.emit(False, self.refocus_period, self.refocus_period)
         return
 
+    @QtCore.Slot(float)
+    def set_refocus_uncertainty(self, uncertainty):
+        """ Set the predicted position uncertainty above which a POI is refocused by the
+        scheduled refocus.
+
+        @param float uncertainty: The position uncertainty threshold in m.
+        """
+        if not uncertainty > 0:
+            self.log.error('Refocus uncertainty must be a value > 0. Unable to set uncertainty of '
+                           '"{0}".'.format(uncertainty))
+            return
+        with self._threadlock:
+            self._refocus_uncertainty = float(uncertainty)
+        return
+
     @QtCore.Slot(float)
     def set_poi_threshold(self, threshold):
         if not threshold > 1:
@@ -912,12 +964,15 @@ class PoiManagerLogic(GenericLogic):
         return
 
     def stop_periodic_refocus(self):
-        """ Stops the periodic refocusing of the POI. """
+        """ Stops the periodic refocusing of the POI or the scheduled refocus of all POIs. """
         with self._threadlock:
             if self.__timer.isActive():
                 self.__timer.stop()
                 self.__timer.timeout.disconnect()
                 self._periodic_refocus_poi = None
+                self._scheduled_refocus = False
+                self._refocus_queue = list()
+                self._refocus_results = dict()
                 self.module_state.unlock()
             self.sigRefocusTimerUpdated.emit(False, self.refocus_period, self.refocus_period)
         return
@@ -950,6 +1005,253 @@ class PoiManagerLogic(GenericLogic):
                     self._last_refocus = time.time()
         return
 
+    def start_scheduled_refocus(self):
+        """
+        Starts the scheduled refocus of all POIs in the ROI.
+
+        The sample drift is estimated from the ROI position history (see estimate_drift). In
+        regular intervals the position uncertainty of each POI is predicted from the time since
+        its last refocus. All POIs exceeding the refocus uncertainty are refocused as one batch,
+        starting at the predicted positions and in an order which keeps the scanner travel short.
+        The median shift of the batch updates the ROI position and the remaining deviations of the
+        individual POIs update their anchors.
+        The first batch contains all POIs since none of them has been refocused before.
+        """
+        if len(self.poi_names) == 0:
+            self.log.error('Unable to start scheduled refocus. No POIs defined in ROI.')
+            return
+
+        with self._threadlock:
+            if self.__timer.isActive():
+                self.log.error('Periodic refocus already running. Unable to start a new one.')
+                return
+            self.module_state.lock()
+            self._scheduled_refocus = True
+            self._poi_refocus_times = dict()
+            self._refocus_queue = list()
+            self._refocus_results = dict()
+            self._refocus_pending = None
+            self._refocus_idle_since = None
+            self._last_refocused_poi = None
+            self.__timer.timeout.connect(self._scheduled_refocus_loop)
+            self.__timer.start(500)
+
+            self.sigRefocusTimerUpdated.emit(True, self.refocus_period, 0)
+        return
+
+    @QtCore.Slot()
+    def _scheduled_refocus_loop(self):
+        """ This is the looped function of the scheduled refocus.
+
+        Starts a new batch of refocus procedures if no batch is running and at least one POI
+        exceeds the refocus uncertainty.
+        """
+        with self._threadlock:
+            if not self.__timer.isActive() or not self._scheduled_refocus:
+                return
+            if self._refocus_pending is not None:
+                self._check_pending_refocus()
+                return
+            if self._refocus_queue:
+                return
+            if self.optimiserlogic().module_state() != 'idle':
+                return
+            names = self.get_pois_to_refocus()
+            if not names:
+                return
+            positions = self.get_predicted_poi_positions()
+            self._refocus_queue = self.order_by_travel(
+                self.scanner_position, names, np.array([positions[name] for name in names]))
+            self._refocus_results = dict()
+            self._last_refocused_poi = None
+            self._start_next_scheduled_refocus()
+        return
+
+    def _check_pending_refocus(self):
+        """
+        Skip the pending POI of the scheduled refocus if the optimizer has returned to idle without
+        reporting a result for it (e.g. because the optimization was aborted).
+        The result is sent through a queued connection after the optimizer is idle again, so it
+        is waited for refocus_result_timeout before giving up.
+        """
+        if self.optimiserlogic().module_state() != 'idle':
+            self._refocus_idle_since = None
+        elif self._refocus_idle_since is None:
+            self._refocus_idle_since = time.time()
+        elif time.time() - self._refocus_idle_since > self._refocus_result_timeout:
+            self.log.warning('No refocus result received for POI "{0}". Continuing the scheduled '
+                             'refocus without it.'.format(self._refocus_pending))
+            self._start_next_scheduled_refocus()
+        return
+
+    def _start_next_scheduled_refocus(self):
+        """
+        Start the refocus of the next POI in the queue or finish the batch if it is empty.
+        """
+        self._refocus_pending = None
+        self._refocus_idle_since = None
+        while self._refocus_queue:
+            name = self._refocus_queue.pop(0)
+            if name not in self.poi_names:
+                continue
+            if self.optimiserlogic().module_state() != 'idle':
+                self.log.warning('Unable to continue scheduled refocus. '
+                                 'OptimizerLogic module is still locked.')
+                self._refocus_queue = list()
+                break
+            self._refocus_pending = name
+            self.optimiserlogic().start_refocus(
+                initial_pos=self.get_predicted_poi_positions()[name],
+                caller_tag='poimanagerbatch_{0}'.format(name))
+            self.sigRefocusStateUpdated.emit(True)
+            return
+        self._finish_scheduled_refocus()
+        return
+
+    def _finish_scheduled_refocus(self):
+        """
+        Update the ROI position and the POI anchors from the optimised positions of a batch.
+        """
+        results = {name: pos for name, pos in self._refocus_results.items()
+                   if name in self.poi_names}
+        self._refocus_results = dict()
+        if results:
+            origin = self.roi_origin
+            shifts = np.array([pos - self.get_poi_position(name) for name, pos in results.items()])
+            new_origin = origin + np.median(shifts, axis=0)
+            for name, pos in results.items():
+                self._roi.set_poi_anchor(name, pos - new_origin)
+            self.add_roi_position(new_origin)
+            now = self._roi_time()
+            for name in results:
+                self._poi_refocus_times[name] = now
+            # Stay at the POI refocused last, which is the end of the travel path
+            if self._move_scanner_after_optimization and self._last_refocused_poi in results:
+                self.move_scanner(position=results[self._last_refocused_poi])
+        self._last_refocused_poi = None
+        self.sigRefocusStateUpdated.emit(False)
+        return
+
+    def _roi_time(self):
+        """ Current time in s relative to the ROI creation time (like the ROI history). """
+        return (datetime.now() - self.roi_creation_time).total_seconds()
+
+    @staticmethod
+    def estimate_drift(pos_history, history_length=10):
+        """
+        Estimate the sample drift from the last entries of the ROI position history.
+
+        The drift is modelled as a constant velocity (least squares fit) plus a random walk,
+        whose diffusion constant is estimated from the deviations of the history steps from the
+        constant velocity.
+
+        @param numpy.ndarray pos_history: ROI history with rows (time_in_s, x, y, z)
+        @param int history_length: number of most recent history entries to use
+
+        @return tuple: reference time (float), reference position (float[3]),
+                       velocity in m/s (float[3]) and diffusion constant in m^2/s (float).
+                       The diffusion constant is None if the history is too short.
+        """
+        history = np.asarray(pos_history, dtype=float)[-max(int(history_length), 2):]
+        ref_time = history[-1, 0]
+        ref_pos = history[-1, 1:]
+        if len(history) < 3:
+            return ref_time, ref_pos, np.zeros(3), None
+        times = history[:, 0] - history[:, 0].mean()
+        norm = np.dot(times, times)
+        steps = np.diff(history[:, 0])
+        valid = steps > 0
+        if norm <= 0 or not np.any(valid):
+            return ref_time, ref_pos, np.zeros(3), None
+        velocity = np.dot(times, history[:, 1:] - history[:, 1:].mean(axis=0)) / norm
+        deviations = np.diff(history[:, 1:], axis=0)[valid] - np.outer(steps[valid], velocity)
+        diffusion = np.mean(np.sum(deviations ** 2, axis=1) / steps[valid])
+        return ref_time, ref_pos, velocity, diffusion
+
+    def get_predicted_poi_positions(self, at_time=None):
+        """
+        Predict the current positions of all POIs from the drift of the ROI.
+
+        @param float at_time: optional, time in s relative to the ROI creation time.
+                              Current time if None (default).
+
+        @return dict: predicted positions (float[3]) with the POI names as keys
+        """
+        if at_time is None:
+            at_time = self._roi_time()
+        ref_time, ref_pos, velocity, _ = self.estimate_drift(self.roi_pos_history,
+                                                             self._drift_history_length)
+        origin = ref_pos + velocity * (at_time - ref_time)
+        return {name: anchor + origin for name, anchor in self.poi_anchors.items()}
+
+    def get_poi_uncertainties(self, at_time=None):
+        """
+        Predict the position uncertainty of all POIs, i.e. the expected deviation of the actual
+        from the predicted position due to the random part of the drift since the last refocus
+        of each POI.
+        If the drift can not be estimated yet, POIs are considered uncertain (inf) after the
+        refocus period and certain (0) before.
+        POIs not refocused by the scheduled refocus so far are always uncertain.
+
+        @param float at_time: optional, time in s relative to the ROI creation time.
+                              Current time if None (default).
+
+        @return dict: predicted uncertainties in m with the POI names as keys
+        """
+        if at_time is None:
+            at_time = self._roi_time()
+        diffusion = self.estimate_drift(self.roi_pos_history, self._drift_history_length)[3]
+        uncertainties = dict()
+        for name in self.poi_names:
+            if name not in self._poi_refocus_times:
+                uncertainties[name] = np.inf
+                continue
+            elapsed = max(at_time - self._poi_refocus_times[name], 0)
+            if diffusion is None:
+                uncertainties[name] = np.inf if elapsed >= self.refocus_period else 0.
+            else:
+                uncertainties[name] = np.sqrt(diffusion * elapsed)
+        return uncertainties
+
+    def get_pois_to_refocus(self, at_time=None):
+        """
+        Names of all POIs with a predicted uncertainty above the refocus uncertainty.
+
+        @param float at_time: optional, time in s relative to the ROI creation time.
+                              Current time if None (default).
+
+        @return list: names of the POIs to refocus
+        """
+        uncertainties = self.get_poi_uncertainties(at_time)
+        return [name for name, uncertainty in uncertainties.items()
+                if uncertainty > self.refocus_uncertainty]
+
+    @staticmethod
+    def order_by_travel(start, names, positions):
+        """
+        Order the given POIs to keep the scanner travel short.
+        Starting at the given position, the nearest POI not visited yet is always chosen next.
+
+        @param float[3] start: start position of the scanner
+        @param list names: names of the POIs
+        @param numpy.ndarray positions: positions of the POIs with shape (len(names), 3)
+
+        @return list: names of the POIs in the order to visit
+        """
+        positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        if len(names) < 2:
+            return list(names)
+        distances = np.sqrt(np.sum((positions[:, np.newaxis] - positions) ** 2, axis=2))
+        visited = np.zeros(len(names), dtype=bool)
+        current_distances = np.sqrt(np.sum((positions - np.asarray(start)[:3]) ** 2, axis=1))
+        order = list()
+        for _ in range(len(names)):
+            index = int(np.argmin(np.where(visited, np.inf, current_distances)))
+            visited[index] = True
+            order.append(names[index])
+            current_distances = distances[index]
+        return order
+
     @QtCore.Slot()
     def optimise_poi_position(self, name=None, update_roi_position=True):
         """
@@ -992,6 +1294,17 @@ class PoiManagerLogic(GenericLogic):
         @param caller_tag:
         @param optimal_pos:
         """
+        # Refocus of the scheduled refocus. Collect the result and continue with the batch.
+        if caller_tag.startswith('poimanagerbatch_'):
+            with self._threadlock:
+                poi_name = caller_tag.split('_', 1)[1]
+                if self._scheduled_refocus and poi_name == self._refocus_pending:
+                    self._refocus_results[poi_name] = np.array(optimal_pos[:3], dtype=float)
+                    self._last_refocused_poi = poi_name
+                    self._start_next_scheduled_refocus()
+                else:
+                    self.sigRefocusStateUpdated.emit(False)
+            return
         # If the refocus was initiated by poimanager, update POI and ROI position
         if caller_tag.startswith('poimanager_') or caller_tag.startswith('poimanagermoveroi_'):
             shift_roi = caller_tag.startswith('poimanagermoveroi_')
@@ -1188,71 +1501,119 @@ class PoiManagerLogic(GenericLogic):
         arr_size = int(spot_size / pixel_size)
         return arr_size
 
-    def _is_spot_shape(self, local_arr):
-        unspot_e = 0
-        ensem_e = 0
-        len_arr = len(local_arr)
-        mid_f = int(0.5 * len_arr)
-        hm_local_arr = local_arr[mid_f].mean()
-        vm_local_arr = local_arr[:, mid_f].mean()
-        for i in range(0, len_arr):
-            if local_arr[i].mean() > hm_local_arr:
-                ensem_e += 1
-            if local_arr[:, i].mean() > vm_local_arr:
-                ensem_e += 1
-            if hm_local_arr > vm_local_arr * 1.2:
-                unspot_e += 1
-            if vm_local_arr > hm_local_arr * 1.2:
-                unspot_e += 1
-        if ensem_e > 4:
-            return False
-        elif unspot_e > 1:
-            return False
-        else:
-            return True
+    @staticmethod
+    def _window_sums(scan, size, axis):
+        """ Sums over all segments of length size along the given axis.
+        Element [i, j] of the result (for axis=1) is the sum of scan[i, j:j + size].
+        """
+        cumsum = np.cumsum(scan, axis=axis)
+        zeros_shape = list(scan.shape)
+        zeros_shape[axis] = 1
+        cumsum = np.concatenate((np.zeros(zeros_shape), cumsum), axis=axis)
+        if axis == 0:
+            return cumsum[size:] - cumsum[:-size]
+        return cumsum[:, size:] - cumsum[:, :-size]
 
     def _local_max(self, scan):
-        scan = np.asarray(scan, order="C")  # scan has to be a 2-D array
+        """ Find all bright spots in a scan image.
+
+        A square window with the size of the POI diameter is placed at every position of the
+        image. A spot is found if the pixel in the center of the window is the maximum of the
+        window, the mean of the window is above half the POI threshold and the window content
+        looks like a spot, i.e. no more than 4 rows and columns have a larger mean than the center
+        row and column and the center row and column means differ by less than 20%.
+        All windows are evaluated at once using maximum filters and running sums.
+
+        @param numpy.ndarray scan: 2D scan image
+
+        @return (numpy.ndarray, numpy.ndarray): row and column indices of the spot centers
+        """
+        scan = np.asarray(scan, dtype=float)  # scan has to be a 2-D array
         filter_size = self._spot_filter(scan)
-        scan_m = scan.mean()
+        rows = scan.shape[0] - filter_size
+        cols = scan.shape[1] - filter_size
+        if filter_size < 1 or rows < 1 or cols < 1:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
         mid_f = int(filter_size / 2)
-        xc = []
-        yc = []
-        for i in range(0, len(scan) - filter_size):
-            for j in range(0, len(scan[i]) - filter_size):
-                local_arr = scan[i:i + filter_size, j:j + filter_size]
-                local_arr = np.asarray(local_arr)
-                arr_threshold = scan_m * self._poi_threshold * 0.5
-                if scan[i + mid_f][j + mid_f] == local_arr.max() and self._is_spot_shape(local_arr) and local_arr.mean() > arr_threshold:
-                    xc.append(i + mid_f)
-                    yc.append(j + mid_f)
-        return xc, yc
+
+        # The window with its upper left corner at [i, j] is centered at [i + mid_f, j + mid_f]
+        center = scan[mid_f:mid_f + rows, mid_f:mid_f + cols]
+        window_max = ndimage.maximum_filter(scan, size=filter_size)
+        is_max = center == window_max[mid_f:mid_f + rows, mid_f:mid_f + cols]
+
+        # Mean of every row and column inside the windows
+        row_sums = self._window_sums(scan, filter_size, axis=1)[:, :cols]
+        row_means = row_sums / filter_size
+        col_means = self._window_sums(scan, filter_size, axis=0)[:rows] / filter_size
+        center_row_mean = row_means[mid_f:mid_f + rows]
+        center_col_mean = col_means[:, mid_f:mid_f + cols]
+
+        window_mean = self._window_sums(row_sums, filter_size, axis=0)[:rows] / filter_size ** 2
+        is_bright = window_mean > scan.mean() * self._poi_threshold * 0.5
+
+        # Number of rows and columns with a larger mean than the center row and column
+        brighter_lines = np.zeros((rows, cols), dtype=int)
+        for offset in range(filter_size):
+            brighter_lines += row_means[offset:offset + rows] > center_row_mean
+            brighter_lines += col_means[:, offset:offset + cols] > center_col_mean
+        is_spot = brighter_lines <= 4
+        if filter_size > 1:
+            is_spot &= center_row_mean <= center_col_mean * 1.2
+            is_spot &= center_col_mean <= center_row_mean * 1.2
+
+        xc, yc = np.nonzero(is_max & is_spot & is_bright)
+        return xc + mid_f, yc + mid_f
+
+    def _refine_spot_positions(self, scan, xc, yc):
+        """ Sub-pixel positions of spots from the intensity weighted centroid of the spot window.
+        The minimum of each window is subtracted as background.
+
+        @param numpy.ndarray scan: 2D scan image
+        @param numpy.ndarray xc: row indices of the spot centers
+        @param numpy.ndarray yc: column indices of the spot centers
+
+        @return (numpy.ndarray, numpy.ndarray): fractional row and column indices
+        """
+        filter_size = max(self._spot_filter(scan), 1)
+        offsets = np.arange(filter_size) - int(filter_size / 2)
+        rows = np.clip(xc[:, np.newaxis] + offsets, 0, scan.shape[0] - 1)
+        cols = np.clip(yc[:, np.newaxis] + offsets, 0, scan.shape[1] - 1)
+        windows = scan[rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
+        weights = windows - windows.min(axis=(1, 2), keepdims=True)
+        total = weights.sum(axis=(1, 2))
+        # Keep the pixel position if the window is flat
+        flat = total == 0
+        total[flat] = 1
+        x_refined = (weights.sum(axis=2) * rows).sum(axis=1) / total
+        y_refined = (weights.sum(axis=1) * cols).sum(axis=1) / total
+        x_refined[flat] = xc[flat]
+        y_refined[flat] = yc[flat]
+        return x_refined, y_refined
 
     def auto_catch_poi(self):
-        scan_image = self.roi_scan_image.T
+        """ Add a POI for every bright spot found in the ROI scan image.
+        """
         x_range = self.roi_scan_image_extent[0]
         y_range = self.roi_scan_image_extent[1]
-        x_axis = np.arange(x_range[0], x_range[1], (x_range[1] - x_range[0]) / len(scan_image))
-        y_axis = np.arange(y_range[0], y_range[1], (y_range[1] - y_range[0]) / len(scan_image[0]))
-
-        for i in range(0, len(scan_image)):
-            for j in range(0, len(scan_image[i])):
-                scan_image[i][j] = int(scan_image[i][j])  # data here somehow needs to be reset, otherwise shit happens.
+        # The scan image is truncated to integer counts for the spot detection.
+        scan_image = np.trunc(np.asarray(self.roi_scan_image, dtype=float).T)
+        x_step = (x_range[1] - x_range[0]) / scan_image.shape[0]
+        y_step = (y_range[1] - y_range[0]) / scan_image.shape[1]
 
         threshold = scan_image.mean() * self._poi_threshold
 
-        xc1, yc1 = self._local_max(scan_image)
-        xc2 = []
-        yc2 = []
-        for i in range(0, len(xc1)):
-            if scan_image[xc1[i], yc1[i]] > threshold:
-                xc2.append(xc1[i])
-                yc2.append(yc1[i])
-
-        pois = np.zeros((len(xc2), 3))
-        z = self.scanner_position[2]
+        xc, yc = self._local_max(scan_image)
+        above_threshold = scan_image[xc, yc] > threshold
+        xc = xc[above_threshold]
+        yc = yc[above_threshold]
+        if self._subpixel_poi_positions:
+            xc, yc = self._refine_spot_positions(scan_image, xc, yc)
+
+        pois = np.zeros((len(xc), 3))
+        pois[:, 0] = x_range[0] + xc * x_step
+        pois[:, 1] = y_range[0] + yc * y_step
+        pois[:, 2] = self.scanner_position[2]
         for i in range(0, len(pois)):
-            pois[i] = [x_axis[xc2[i]], y_axis[yc2[i]], z]
             self.add_poi(pois[i])
             if self.poi_nametag is None:
                 time.sleep(0.1)
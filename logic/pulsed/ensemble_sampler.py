@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi helper class to sample the waveform of a PulseBlockEnsemble chunkwise.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import numpy as np
+
+
+class EnsembleSampler:
+    """
+    Helper class to create the sample arrays of a PulseBlockEnsemble chunk by chunk.
+
+    Compared to sampling each element of each block repetition one after another, the sampler
+    avoids redundant work while producing identical samples:
+    1) Samples of identical elements are only calculated once if they do not depend on the
+       absolute time (i.e. all sampling functions are time independent or the rotating frame is
+       not preserved) and reused afterwards.
+    2) If all repetitions of a block result in identical samples (same element lengths and only
+       time independent sampling functions), only one repetition is sampled and tiled into the
+       sample arrays.
+    3) Otherwise all repetitions of a block are sampled at once with a single call to each
+       sampling function per element, if the sampling functions are pointwise (see SamplingBase)
+       and the block fits into a single chunk.
+    4) Two sets of chunk arrays are used alternately, so the next chunk can be sampled (e.g. in a
+       worker thread) while the previous chunk is still being written to the device.
+
+    Usage:
+        sampler = EnsembleSampler(...)
+        while not sampler.is_finished:
+            analog_samples, digital_samples = sampler.next_chunk()
+            ...
+        final_offset_bin = sampler.offset_bin
+    """
+    # Maximum number of samples per channel kept in the element sample cache
+    _max_cached_samples = 2 ** 24
+
+    def __init__(self, ensemble, ensemble_info, blocks, sample_rate, analog_amplitudes,
+                 chunk_length, offset_bin=0):
+        """
+        @param PulseBlockEnsemble ensemble: The ensemble to sample
+        @param dict ensemble_info: The ensemble information as returned by
+                                   SequenceGeneratorLogic.analyze_block_ensemble
+        @param dict blocks: Dictionary containing all PulseBlock instances used in the ensemble
+                            with the block names as keys.
+        @param float sample_rate: The sample rate in samples/s
+        @param dict analog_amplitudes: Peak-to-peak amplitude for each analog channel
+        @param int chunk_length: Maximum number of samples in a single chunk
+        @param int offset_bin: Time offset bin of the first sample (rotating frame)
+        """
+        self._ensemble_info = ensemble_info
+        self._sample_rate = sample_rate
+        self._analog_channels = sorted(ensemble_info['analog_channels'])
+        self._digital_channels = sorted(ensemble_info['digital_channels'])
+        self._analog_norm = {chnl: analog_amplitudes[chnl] / 2 for chnl in self._analog_channels}
+        self._rotating_frame = ensemble.rotating_frame
+        self._total_samples = int(ensemble_info['number_of_samples'])
+        self._chunk_length = min(int(chunk_length), self._total_samples)
+
+        # Current time offset bin (rotating frame) and number of samples already processed
+        self.offset_bin = offset_bin
+        self.processed_samples = 0
+
+        # Cache for sampled elements
+        self._element_cache = dict()
+        self._cached_samples = 0
+
+        # Two sets of chunk arrays used alternately
+        self._chunk_buffers = [self._allocate_chunk(self._chunk_length) for i in range(2)]
+        self._buffer_index = 0
+
+        # Create the sampling plan and an iterator over all segments of the ensemble
+        self._segments = self._iterate_segments(self._create_plan(ensemble, blocks))
+        self._current_segment = None
+        return
+
+    @property
+    def is_finished(self):
+        return self.processed_samples >= self._total_samples
+
+    @property
+    def total_samples(self):
+        return self._total_samples
+
+    def next_chunk(self):
+        """
+        Sample the next chunk of the ensemble.
+        The returned arrays are only valid until next_chunk is called twice more.
+
+        @return (dict, dict): analog samples (float32) and digital samples (bool) arrays with
+                              channel descriptors as keys.
+        """
+        chunk_length = min(self._chunk_length, self._total_samples - self.processed_samples)
+        if chunk_length < self._chunk_length:
+            # Last chunk, which is shorter than the previous ones
+            analog_samples, digital_samples = self._allocate_chunk(chunk_length)
+        else:
+            analog_samples, digital_samples = self._chunk_buffers[self._buffer_index]
+            self._buffer_index = (self._buffer_index + 1) % 2
+
+        write_index = 0
+        while write_index < chunk_length:
+            if self._current_segment is None or self._current_segment[-1] == 0:
+                self._current_segment = next(self._segments)
+            write_func, segment_length, segment_written, remaining = self._current_segment
+            samples_to_add = min(chunk_length - write_index, remaining)
+            write_func(analog_samples,
+                       digital_samples,
+                       slice(write_index, write_index + samples_to_add),
+                       segment_written)
+            self._current_segment = (write_func,
+                                     segment_length,
+                                     segment_written + samples_to_add,
+                                     remaining - samples_to_add)
+            write_index += samples_to_add
+        self.processed_samples += chunk_length
+        return analog_samples, digital_samples
+
+    def _allocate_chunk(self, length):
+        analog_samples = {chnl: np.empty(length, dtype='float32')
+                          for chnl in self._analog_channels}
+        digital_samples = {chnl: np.empty(length, dtype=bool) for chnl in self._digital_channels}
+        return analog_samples, digital_samples
+
+    def _create_plan(self, ensemble, blocks):
+        """
+        Create a list of (block, element lengths per repetition, mode) tuples.
+        The sampling mode of each block is either 'tile' (all repetitions result in identical
+        samples), 'batch' (sample all repetitions at once) or 'element' (sample element by element).
+        """
+        plan = list()
+        element_count = 0
+        elements_length_bins = self._ensemble_info['elements_length_bins']
+        for block_name, reps in ensemble.block_list:
+            block = blocks[block_name]
+            num_elements = len(block.element_list)
+            lengths = np.asarray(
+                elements_length_bins[element_count:element_count + (reps + 1) * num_elements],
+                dtype='int64').reshape((reps + 1, num_elements))
+            element_count += (reps + 1) * num_elements
+            if reps > 0 and num_elements > 0 and (lengths == lengths[0]).all() and all(
+                    self._is_time_independent(element) for element in block.element_list):
+                mode = 'tile'
+            elif reps > 0 and lengths.sum() <= self._chunk_length and all(
+                    self._is_pointwise(element) for element in block.element_list) and (
+                    self._rotating_frame or self._chunk_length == self._total_samples):
+                # Without rotating frame the time axis restarts for element parts split between
+                # chunks. Batch sampling is only equivalent if no element is split.
+                mode = 'batch'
+            else:
+                mode = 'element'
+            plan.append((block, lengths, mode))
+        return plan
+
+    def _iterate_segments(self, plan):
+        """
+        Generator yielding a (write_func, length, written, remaining) tuple for each contiguous
+        segment of the waveform. write_func(analog_samples, digital_samples, dest_slice, start)
+        writes the samples of the segment starting at sample <start> into the given slice of the
+        chunk arrays.
+        The rotating frame offset bin is advanced when the segment is created.
+        """
+        for block, lengths, mode in plan:
+            if mode == 'batch':
+                block_length = int(lengths.sum())
+                if block_length == 0:
+                    continue
+                block_samples = self._sample_block_batch(block, lengths, self.offset_bin)
+                write_func = self._get_array_writer(block_samples)
+                if self._rotating_frame:
+                    self.offset_bin += block_length
+                yield write_func, block_length, 0, block_length
+                continue
+
+            if mode == 'tile':
+                # Sample a single repetition and tile it
+                rep_length = int(lengths[0].sum())
+                if rep_length == 0:
+                    continue
+                repetition = self._allocate_chunk(rep_length)
+                write_index = 0
+                for element, length in zip(block.element_list, lengths[0]):
+                    self._write_element(element, int(length), self.offset_bin, repetition,
+                                        slice(write_index, write_index + length), 0)
+                    write_index += length
+                total_length = rep_length * lengths.shape[0]
+                write_func = self._get_tile_writer(repetition, rep_length)
+                if self._rotating_frame:
+                    self.offset_bin += total_length
+                yield write_func, total_length, 0, total_length
+                continue
+
+            for rep_lengths in lengths:
+                for element, length in zip(block.element_list, rep_lengths):
+                    length = int(length)
+                    if length == 0:
+                        continue
+                    write_func = self._get_element_writer(element, length, self.offset_bin)
+                    if self._rotating_frame:
+                        self.offset_bin += length
+                    yield write_func, length, 0, length
+        return
+
+    def _sample_block_batch(self, block, lengths, offset_bin):
+        """
+        Sample all repetitions of a block at once. Each sampling function is called once per
+        element with the concatenated time arrays of all repetitions.
+        """
+        num_reps, num_elements = lengths.shape
+        flat_lengths = lengths.ravel()
+        starts = (np.cumsum(flat_lengths) - flat_lengths).reshape(lengths.shape)
+        analog_samples, digital_samples = self._allocate_chunk(int(flat_lengths.sum()))
+        for element_index, element in enumerate(block.element_list):
+            element_lengths = lengths[:, element_index]
+            element_samples = element_lengths.sum()
+            if element_samples == 0:
+                continue
+            # sample index within each element repetition and in the block sample arrays
+            element_bins = np.arange(element_samples) - np.repeat(
+                np.cumsum(element_lengths) - element_lengths, element_lengths)
+            block_bins = np.repeat(starts[:, element_index], element_lengths) + element_bins
+
+            for chnl, state in element.digital_high.items():
+                digital_samples[chnl][block_bins] = state
+            if not element.pulse_function:
+                continue
+            time_bins = block_bins if self._rotating_frame else element_bins
+            time_arr = (offset_bin + time_bins) / self._sample_rate
+            for chnl, func in element.pulse_function.items():
+                analog_samples[chnl][block_bins] = func.get_samples(time_arr) / self._analog_norm[
+                    chnl]
+        return analog_samples, digital_samples
+
+    def _get_array_writer(self, samples):
+        sampled_analog, sampled_digital = samples
+
+        def write_array(analog_samples, digital_samples, dest_slice, start):
+            stop = start + dest_slice.stop - dest_slice.start
+            for chnl, arr in sampled_analog.items():
+                analog_samples[chnl][dest_slice] = arr[start:stop]
+            for chnl, arr in sampled_digital.items():
+                digital_samples[chnl][dest_slice] = arr[start:stop]
+            return
+        return write_array
+
+    def _get_tile_writer(self, repetition, rep_length):
+        rep_analog, rep_digital = repetition
+
+        def write_tiled(analog_samples, digital_samples, dest_slice, start):
+            for chnl, samples in rep_analog.items():
+                self._write_tiled(samples, analog_samples[chnl], dest_slice, start, rep_length)
+            for chnl, samples in rep_digital.items():
+                self._write_tiled(samples, digital_samples[chnl], dest_slice, start, rep_length)
+            return
+        return write_tiled
+
+    @staticmethod
+    def _write_tiled(repetition, dest, dest_slice, start, rep_length):
+        """
+        Write periodically repeated samples into dest[dest_slice] starting at sample <start> of the
+        periodic signal.
+        """
+        dest = dest[dest_slice]
+        phase = start % rep_length
+        head = min(rep_length - phase, dest.size)
+        dest[:head] = repetition[phase:phase + head]
+        full_reps = (dest.size - head) // rep_length
+        if full_reps > 0:
+            dest[head:head + full_reps * rep_length].reshape((full_reps, rep_length))[:] = repetition
+        tail_start = head + full_reps * rep_length
+        dest[tail_start:] = repetition[:dest.size - tail_start]
+        return
+
+    def _get_element_writer(self, element, length, offset_bin):
+        def write_element(analog_samples, digital_samples, dest_slice, start):
+            self._write_element(element, length, offset_bin, (analog_samples, digital_samples),
+                                dest_slice, start)
+            return
+        return write_element
+
+    def _write_element(self, element, length, offset_bin, dest, dest_slice, start):
+        """
+        Write the samples [start:start + slice length] of an element with total length <length>
+        and starting at time bin <offset_bin> into the dest arrays.
+        If the rotating frame is not preserved, the time axis of each written part starts again at
+        offset_bin.
+        """
+        analog_samples, digital_samples = dest
+        for chnl, state in element.digital_high.items():
+            digital_samples[chnl][dest_slice] = state
+
+        if not element.pulse_function:
+            return
+
+        samples_to_add = dest_slice.stop - dest_slice.start
+        time_start = start if self._rotating_frame else 0
+        cached = self._get_cached_element(element, length, offset_bin)
+        if cached is not None:
+            for chnl in element.pulse_function:
+                analog_samples[chnl][dest_slice] = cached[chnl][
+                                                   time_start:time_start + samples_to_add]
+            return
+
+        # create floating point time array for the current element part inside rotating frame
+        time_arr = (offset_bin + time_start + np.arange(samples_to_add, dtype='float64')) / \
+                   self._sample_rate
+        for chnl, func in element.pulse_function.items():
+            analog_samples[chnl][dest_slice] = func.get_samples(time_arr) / self._analog_norm[chnl]
+        return
+
+    def _get_cached_element(self, element, length, offset_bin):
+        """
+        Return the analog samples of the whole element from the cache. The samples are calculated
+        and cached if needed. Elements with time dependent samples that can not be reused are not
+        cached and None is returned.
+        """
+        time_independent = self._is_time_independent(element)
+        if not self._is_pointwise(element) or (self._rotating_frame and not time_independent):
+            return None
+
+        key = (self._element_key(element), length, None if time_independent else offset_bin)
+        cached = self._element_cache.get(key)
+        if cached is None:
+            if self._cached_samples + length > self._max_cached_samples:
+                return None
+            time_arr = (offset_bin + np.arange(length, dtype='float64')) / self._sample_rate
+            cached = dict()
+            for chnl, func in element.pulse_function.items():
+                cached[chnl] = np.empty(length, dtype='float32')
+                cached[chnl][:] = func.get_samples(time_arr) / self._analog_norm[chnl]
+            self._element_cache[key] = cached
+            self._cached_samples += length
+        return cached
+
+    @staticmethod
+    def _element_key(element):
+        return (tuple(sorted((chnl, repr(func)) for chnl, func in element.pulse_function.items())),
+                tuple(sorted(element.digital_high.items())))
+
+    @staticmethod
+    def _is_time_independent(element):
+        return all(getattr(func, 'time_independent', False)
+                   for func in element.pulse_function.values())
+
+    @staticmethod
+    def _is_pointwise(element):
+        return all(getattr(func, 'pointwise', False) or getattr(func, 'time_independent', False)
+                   for func in element.pulse_function.values())
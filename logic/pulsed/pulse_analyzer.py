@@ -23,6 +23,7 @@ import os
 import sys
 import inspect
 import importlib
+import numpy as np
 
 from core.util.modules import get_main_dir
 from core.util.helpers import natural_sort
@@ -59,6 +60,68 @@ class PulseAnalyzerBase:
     def log(self):
         return self.__pulsedmeasurementlogic.log
 
+    def time_to_bin_windows(self, windows):
+        """
+        Convert time windows in seconds into bin index windows of the fast counter.
+
+        @param iterable windows: iterable of (start, end) tuples in seconds
+        @return list: list of (start_bin, end_bin) tuples or None if the bin width is not available
+        """
+        bin_width = self.fast_counter_settings.get('bin_width')
+        if not isinstance(bin_width, float):
+            return None
+        return [(int(round(start / bin_width)), int(round(end / bin_width)))
+                for start, end in windows]
+
+    @staticmethod
+    def compute_window_sums(laser_data, bin_windows, dtype=None):
+        """
+        Compute the sums over several bin windows for all laser pulses at once.
+        If the windows overlap (i.e. their total width exceeds the range they span), a prefix sum
+        along the time axis is calculated once and each window costs a single subtraction per
+        laser pulse regardless of its width. Otherwise each window is summed up directly.
+        The bin windows follow python slicing rules, i.e. laser_data[:, start_bin:end_bin].
+
+        @param numpy.ndarray laser_data: 2D array containing the timetraces of all laser pulses
+                                         (dim 0: laser number, dim 1: time bin)
+        @param iterable bin_windows: iterable of (start_bin, end_bin) tuples
+        @param dtype: optional, data type to accumulate in. Defaults to int64 for integer laser_data
+                      (exact) and float64 otherwise. Use float32 to save memory and time if
+                      precision is not an issue.
+
+        @return (numpy.ndarray, numpy.ndarray): 2D array of window sums (dim 0: laser number,
+                                                dim 1: window) and 1D array containing the number
+                                                of bins in each window.
+        """
+        laser_data = np.asarray(laser_data)
+        if dtype is None:
+            dtype = 'int64' if np.issubdtype(laser_data.dtype, np.integer) else 'float64'
+        num_of_lasers, laser_length = laser_data.shape
+
+        window_slices = [slice(start, end).indices(laser_length)[:2] for start, end in bin_windows]
+        starts = np.array([start for start, end in window_slices], dtype='int64')
+        ends = np.array([max(start, end) for start, end in window_slices], dtype='int64')
+        window_lengths = ends - starts
+
+        window_sums = np.zeros((num_of_lasers, len(window_slices)), dtype=dtype)
+        if window_lengths.sum() == 0:
+            return window_sums, window_lengths
+
+        # Only accumulate the range covered by the windows
+        span_start, span_end = starts[window_lengths > 0].min(), ends.max()
+        if window_lengths.sum() > span_end - span_start:
+            cumulative = np.zeros((num_of_lasers, span_end - span_start + 1), dtype=dtype)
+            np.cumsum(laser_data[:, span_start:span_end], axis=1, dtype=dtype,
+                      out=cumulative[:, 1:])
+            starts = np.clip(starts - span_start, 0, span_end - span_start)
+            ends = np.clip(ends - span_start, 0, span_end - span_start)
+            window_sums[:] = cumulative[:, ends] - cumulative[:, starts]
+        else:
+            for index, (start, end) in enumerate(zip(starts, ends)):
+                if end > start:
+                    window_sums[:, index] = laser_data[:, start:end].sum(axis=1, dtype=dtype)
+        return window_sums, window_lengths
+
 
 class PulseAnalyzer(PulseAnalyzerBase):
     """
@@ -208,6 +271,34 @@ class PulseAnalyzer(PulseAnalyzerBase):
         kwargs = self._get_analysis_method_kwargs(analysis_method)
         return analysis_method(laser_data=laser_data, **kwargs)
 
+    def analyse_windows(self, laser_data, windows, use_float32=False):
+        """
+        Batched analysis of several time windows for all laser pulses in a single pass.
+        Independent of the currently selected analysis method.
+
+        @param numpy.ndarray laser_data: 2D numpy array (dtype='int64') containing the timetraces
+                                         for all extracted laser pulses.
+        @param iterable windows: iterable of (start, end) tuples in seconds, e.g. the signal and
+                                 the reference window.
+        @param bool use_float32: accumulate in single precision instead of exact integer arithmetic
+
+        @return (numpy.ndarray, numpy.ndarray): tuple of two 2D numpy arrays containing the counts
+                                                summed up in each window (dim 0: laser number,
+                                                dim 1: window) and the corresponding poissonian
+                                                error.
+        """
+        windows = list(windows)
+        bin_windows = self.time_to_bin_windows(windows)
+        if bin_windows is None:
+            shape = (laser_data.shape[0], len(windows))
+            return np.zeros(shape), np.zeros(shape)
+
+        dtype = 'float32' if use_float32 else None
+        window_sums, _ = self.compute_window_sums(laser_data, bin_windows, dtype=dtype)
+        window_sums = window_sums.astype('float32' if use_float32 else float, copy=False)
+        window_sums[window_sums < 0] = 0
+        return window_sums, np.sqrt(window_sums)
+
     def _get_analysis_method_kwargs(self, method):
         """
         Get the proper values for keyword arguments other than "laser_data" for <method>.
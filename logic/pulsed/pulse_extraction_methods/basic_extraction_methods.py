@@ -166,57 +166,67 @@ class BasicPulseExtractor(PulseExtractorBase):
         rising_ind = np.empty(number_of_lasers, dtype='int64')
         falling_ind = np.empty(number_of_lasers, dtype='int64')
 
+        # Searching the global extremum of the whole derivative for each flank is the bottleneck
+        # for long timetraces with many laser pulses. Keep track of the extrema of contiguous
+        # blocks instead so each search and update only touches a few blocks.
+        block_size = max(1, int(np.sqrt(conv_deriv.size)))
+        num_blocks = -(-conv_deriv.size // block_size)
+        padded = np.empty(num_blocks * block_size, dtype=float)
+        padded[:conv_deriv.size] = conv_deriv
+        padded[conv_deriv.size:] = -np.inf
+        block_max = padded.reshape((num_blocks, block_size)).max(axis=1)
+        padded[conv_deriv.size:] = np.inf
+        block_min = padded.reshape((num_blocks, block_size)).min(axis=1)
+
+        def clear_flank(start, stop):
+            # set the derivative to zero in the given range and update affected block extrema
+            conv_deriv[start:stop] = 0
+            if stop <= start:
+                return
+            for block in range(start // block_size, (stop - 1) // block_size + 1):
+                block_data = conv_deriv[block * block_size:(block + 1) * block_size]
+                block_max[block] = block_data.max()
+                block_min[block] = block_data.min()
+            return
+
         # Find as many rising and falling flanks as there are laser pulses in
         # the trace:
         for i in range(number_of_lasers):
             # save the index of the absolute maximum of the derived time trace
             # as rising edge position
-            rising_ind[i] = np.argmax(conv_deriv)
+            block = np.argmax(block_max)
+            rising_ind[i] = block * block_size + np.argmax(
+                conv_deriv[block * block_size:(block + 1) * block_size])
 
             # refine the rising edge detection, by using a small and fixed
             # conv_std_dev parameter to find the inflection point more precise
-            start_ind = int(rising_ind[i] - conv_std_dev)
-            if start_ind < 0:
-                start_ind = 0
-
-            stop_ind = int(rising_ind[i] + conv_std_dev)
-            if stop_ind > len(conv_deriv):
-                stop_ind = len(conv_deriv)
-
+            start_ind = max(int(rising_ind[i] - conv_std_dev), 0)
+            stop_ind = min(int(rising_ind[i] + conv_std_dev), conv_deriv.size)
             if start_ind == stop_ind:
                 stop_ind = start_ind + 1
-
             rising_ind[i] = start_ind + np.argmax(conv_deriv_ref[start_ind:stop_ind])
 
             # set this position and the surrounding of the saved edge to 0 to
             # avoid a second detection
-            if rising_ind[i] < 2 * conv_std_dev:
-                del_ind_start = 0
-            else:
-                del_ind_start = rising_ind[i] - int(2 * conv_std_dev)
-            if (conv_deriv.size - rising_ind[i]) < 2 * conv_std_dev:
-                del_ind_stop = conv_deriv.size - 1
-            else:
-                del_ind_stop = rising_ind[i] + int(2 * conv_std_dev)
-                conv_deriv[del_ind_start:del_ind_stop] = 0
+            if (conv_deriv.size - rising_ind[i]) >= 2 * conv_std_dev:
+                if rising_ind[i] < 2 * conv_std_dev:
+                    del_ind_start = 0
+                else:
+                    del_ind_start = rising_ind[i] - int(2 * conv_std_dev)
+                clear_flank(del_ind_start, rising_ind[i] + int(2 * conv_std_dev))
 
             # save the index of the absolute minimum of the derived time trace
             # as falling edge position
-            falling_ind[i] = np.argmin(conv_deriv)
+            block = np.argmin(block_min)
+            falling_ind[i] = block * block_size + np.argmin(
+                conv_deriv[block * block_size:(block + 1) * block_size])
 
             # refine the falling edge detection, by using a small and fixed
             # conv_std_dev parameter to find the inflection point more precise
-            start_ind = int(falling_ind[i] - conv_std_dev)
-            if start_ind < 0:
-                start_ind = 0
-
-            stop_ind = int(falling_ind[i] + conv_std_dev)
-            if stop_ind > len(conv_deriv):
-                stop_ind = len(conv_deriv)
-
+            start_ind = max(int(falling_ind[i] - conv_std_dev), 0)
+            stop_ind = min(int(falling_ind[i] + conv_std_dev), conv_deriv.size)
             if start_ind == stop_ind:
                 stop_ind = start_ind + 1
-
             falling_ind[i] = start_ind + np.argmin(conv_deriv_ref[start_ind:stop_ind])
 
             # set this position and the sourrounding of the saved flank to 0 to
@@ -229,7 +239,7 @@ class BasicPulseExtractor(PulseExtractorBase):
                 del_ind_stop = conv_deriv.size - 1
             else:
                 del_ind_stop = falling_ind[i] + int(2 * conv_std_dev)
-            conv_deriv[del_ind_start:del_ind_stop] = 0
+            clear_flank(del_ind_start, del_ind_stop)
 
         # sort all indices of rising and falling flanks
         rising_ind.sort()
@@ -238,16 +248,8 @@ class BasicPulseExtractor(PulseExtractorBase):
         # find the maximum laser length to use as size for the laser array
         laser_length = np.max(falling_ind - rising_ind)
 
-        # initialize the empty output array
-        laser_arr = np.zeros((number_of_lasers, laser_length), dtype='int64')
-        # slice the detected laser pulses of the timetrace and save them in the
-        # output array according to the found rising edge
-        for i in range(number_of_lasers):
-            if rising_ind[i] + laser_length > count_data.size:
-                lenarr = count_data[rising_ind[i]:].size
-                laser_arr[i, 0:lenarr] = count_data[rising_ind[i]:]
-            else:
-                laser_arr[i] = count_data[rising_ind[i]:rising_ind[i] + laser_length]
+        # slice the detected laser pulses of the timetrace according to the found rising edge
+        laser_arr = self._slice_laser_pulses(count_data, rising_ind, laser_length)
 
         return_dict['laser_counts_arr'] = laser_arr.astype('int64')
         return_dict['laser_indices_rising'] = rising_ind
@@ -299,37 +301,34 @@ class BasicPulseExtractor(PulseExtractorBase):
 
         # get all bin indices with counts > threshold value
         bigger_indices = np.where(count_data >= count_threshold)[0]
+        if bigger_indices.size == 0:
+            return return_dict
 
-        # get all indices with consecutive numbering (bin chains not interrupted by
-        # values < threshold
-        index_list = np.split(bigger_indices,
-                              np.where(np.diff(bigger_indices) >= threshold_tolerance)[0] + 1)
-        for i, index_group in enumerate(index_list):
-            if index_group.size > 0:
-                start, end = index_list[i][0], index_list[i][-1]
-                index_list[i] = np.arange(start, end + 1)
-        consecutive_indices_unfiltered = index_list
+        # get first and last index of all bin chains not interrupted by more than
+        # threshold_tolerance values < threshold
+        split_indices = np.where(np.diff(bigger_indices) >= threshold_tolerance)[0]
+        start_indices = bigger_indices[np.concatenate(([0], split_indices + 1))]
+        end_indices = bigger_indices[np.concatenate((split_indices, [-1]))]
+        laser_lengths = end_indices - start_indices + 1
 
-        # sort out all groups shorter than minimum laser length
-        consecutive_indices = [item for item in consecutive_indices_unfiltered if
-                               len(item) > min_laser_length]
+        # sort out all chains shorter than minimum laser length
+        valid = laser_lengths > min_laser_length
+        start_indices = start_indices[valid].astype('int64')
+        end_indices = end_indices[valid].astype('int64')
+        laser_lengths = laser_lengths[valid]
 
         # Check if the number of lasers matches the number of remaining index groups
-        if number_of_lasers != len(consecutive_indices):
+        if number_of_lasers != start_indices.size:
             return return_dict
 
-        # determine max length of laser pulse and initialize laser array
-        max_laser_length = max([index_array.size for index_array in consecutive_indices])
-        return_dict['laser_counts_arr'] = np.zeros((number_of_lasers, max_laser_length),
-                                                   dtype='int64')
-
-        # fill laser array with slices of raw data array. Also populate the rising/falling index
-        # arrays
-        for i, index_group in enumerate(consecutive_indices):
-            return_dict['laser_indices_rising'][i] = index_group[0]
-            return_dict['laser_indices_falling'][i] = index_group[-1]
-            return_dict['laser_counts_arr'][i, :index_group.size] = count_data[index_group]
-
+        # fill laser array with slices of raw data array. Bins after the end of each laser pulse
+        # are set to zero. Also populate the rising/falling index arrays
+        max_laser_length = laser_lengths.max()
+        laser_arr = self._slice_laser_pulses(count_data, start_indices, max_laser_length)
+        laser_arr[np.arange(max_laser_length) >= laser_lengths[:, np.newaxis]] = 0
+        return_dict['laser_indices_rising'] = start_indices
+        return_dict['laser_indices_falling'] = end_indices
+        return_dict['laser_counts_arr'] = laser_arr
         return return_dict
 
     def ungated_gated_conv_deriv(self, count_data, conv_std_dev=20.0, delay=5e-7, safety=2e-7):
@@ -426,4 +425,28 @@ class BasicPulseExtractor(PulseExtractorBase):
                        'laser_indices_rising': np.arange(len(count_data)),
                        'laser_indices_falling': np.arange(len(count_data))}
 
-        return return_dict
\ No newline at end of file
+        return return_dict
+
+    @staticmethod
+    def _slice_laser_pulses(count_data, rising_ind, laser_length):
+        """
+        Slice laser pulses of equal length from an ungated timetrace in a single gather operation.
+        Bins beyond the end of the timetrace are zero-padded.
+
+        @param numpy.ndarray count_data: The raw timetrace data (1D) from an ungated fast counter
+        @param numpy.ndarray rising_ind: 1D array containing the start bin of each laser pulse
+        @param int laser_length: Number of bins to slice for each laser pulse
+
+        @return 2D numpy.ndarray: the sliced laser pulses (dim 0: laser number, 1: time bin)
+        """
+        laser_arr = np.zeros((len(rising_ind), laser_length), dtype='int64')
+        if laser_arr.size == 0:
+            return laser_arr
+        padded = np.zeros(count_data.size + laser_length, dtype='int64')
+        padded[:count_data.size] = count_data
+        windows = np.lib.stride_tricks.as_strided(padded,
+                                                  shape=(count_data.size, laser_length),
+                                                  strides=(padded.strides[0], padded.strides[0]),
+                                                  writeable=False)
+        laser_arr[:] = windows[rising_ind]
+        return laser_arr
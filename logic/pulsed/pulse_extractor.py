@@ -23,6 +23,7 @@ import os
 import sys
 import inspect
 import importlib
+import numpy as np
 
 from core.util.modules import get_main_dir
 from core.util.helpers import natural_sort
@@ -92,6 +93,11 @@ class PulseExtractor(PulseExtractorBase):
         self._parameters = dict()
         # Currently selected extraction method
         self._current_extraction_method = None
+        # Laser flank indices cached from the last successful extraction (see cache_laser_flanks)
+        self._cached_rising_ind = None
+        self._cached_laser_length = None
+        # Flag indicating that the current extraction method does not allow caching of the flanks
+        self._flank_caching_unsupported = False
 
         # import path for extraction modules from default directory (logic.pulse_extraction_methods)
         path_list = [os.path.join(get_main_dir(), 'logic', 'pulsed', 'pulse_extraction_methods')]
@@ -225,6 +231,104 @@ class PulseExtractor(PulseExtractorBase):
         kwargs = self._get_extraction_method_kwargs(extraction_method)
         return extraction_method(count_data=count_data, **kwargs)
 
+    @property
+    def has_cached_flanks(self):
+        """
+        Flag indicating if laser flank indices from a previous extraction are available for reuse.
+
+        @return bool: True if cached laser flank indices are present, False otherwise
+        """
+        return self._cached_rising_ind is not None
+
+    def clear_laser_flank_cache(self):
+        """
+        Discard the cached laser flank indices. Must be called whenever the pulse sequence, the fast
+        counter settings or the extraction settings change.
+        """
+        self._cached_rising_ind = None
+        self._cached_laser_length = None
+        self._flank_caching_unsupported = False
+        return
+
+    def cache_laser_flanks(self, count_data, return_dict):
+        """
+        Store the rising flank indices and the laser length found by the last extraction in order to
+        reuse them via extract_cached_laser_pulses.
+
+        Flanks are only cached if slicing count_data with them reproduces the extracted laser array
+        exactly, i.e. each laser pulse must be the slice [rising_ind:rising_ind + laser_length] of
+        the count data (zero-padded at the end of an ungated timetrace). Extraction methods that
+        do not comply to this rule are simply not cached. This is remembered until the cache is
+        cleared, so the check is not repeated for every extraction.
+
+        @param numpy.ndarray count_data: 1D (ungated) or 2D (gated) numpy array the laser pulses
+                                         in return_dict have been extracted from.
+        @param dict return_dict: result dictionary of the extraction method
+
+        @return bool: True if the flank indices have been cached, False otherwise
+        """
+        self._cached_rising_ind = None
+        self._cached_laser_length = None
+        if self._flank_caching_unsupported:
+            return False
+
+        laser_arr = return_dict.get('laser_counts_arr')
+        rising_ind = return_dict.get('laser_indices_rising')
+        # Without counts the flanks can not be verified yet. Try again with the next extraction.
+        if not isinstance(laser_arr, np.ndarray) or laser_arr.ndim != 2 or not laser_arr.any():
+            return False
+
+        if self.is_gated:
+            if not isinstance(rising_ind, (int, np.integer)):
+                self._flank_caching_unsupported = True
+                return False
+            rising_ind = int(rising_ind)
+        else:
+            rising_ind = np.asarray(rising_ind)
+            if rising_ind.ndim != 1 or rising_ind.size != laser_arr.shape[0]:
+                self._flank_caching_unsupported = True
+                return False
+            rising_ind = rising_ind.astype('int64')
+
+        self._cached_rising_ind = rising_ind
+        self._cached_laser_length = laser_arr.shape[1]
+
+        # Verify that the cached flanks reproduce the extracted laser pulses
+        if not np.array_equal(self.extract_cached_laser_pulses(count_data), laser_arr):
+            self.log.debug('Extraction method "{0}" does not support reuse of laser flank indices.'
+                           ''.format(self._current_extraction_method))
+            self._cached_rising_ind = None
+            self._cached_laser_length = None
+            self._flank_caching_unsupported = True
+            return False
+        return True
+
+    def extract_cached_laser_pulses(self, count_data):
+        """
+        Extract laser pulses from count_data by slicing it at the cached laser flank indices.
+        No flank detection is performed, so the cost of this method only depends on the size of the
+        resulting laser array.
+
+        @param numpy.ndarray count_data: 1D (ungated) or 2D (gated) numpy array (dtype='int64')
+                                         containing the timetrace to extract laser pulses from.
+        @return numpy.ndarray: 2D laser pulse array (dim 0: laser number, dim 1: time bin) or None
+                               if no flank indices are cached.
+        """
+        if self._cached_rising_ind is None:
+            return None
+
+        if self.is_gated:
+            start = self._cached_rising_ind
+            return count_data[:, start:start + self._cached_laser_length].astype('int64')
+
+        # Gather all laser pulses at once and zero-pad bins beyond the end of the timetrace
+        bin_indices = self._cached_rising_ind[:, np.newaxis] + np.arange(self._cached_laser_length)
+        out_of_range = bin_indices >= count_data.size
+        laser_arr = count_data[np.where(out_of_range, 0, bin_indices)].astype('int64')
+        if out_of_range.any():
+            laser_arr[out_of_range] = 0
+        return laser_arr
+
     def _get_extraction_method_kwargs(self, method):
         """
         Get the proper values for keyword arguments other than "count_data" for <method>.
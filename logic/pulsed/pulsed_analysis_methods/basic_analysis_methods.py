@@ -44,46 +44,32 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         """
         # Get number of lasers
         num_of_lasers = laser_data.shape[0]
-        # Get counter bin width
-        bin_width = self.fast_counter_settings.get('bin_width')
 
-        if not isinstance(bin_width, float):
+        # Convert the times in seconds to bins (i.e. array indices)
+        bin_windows = self.time_to_bin_windows([(signal_start, signal_end), (norm_start, norm_end)])
+        if bin_windows is None:
             return np.zeros(num_of_lasers), np.zeros(num_of_lasers)
 
-        # Convert the times in seconds to bins (i.e. array indices)
-        signal_start_bin = round(signal_start / bin_width)
-        signal_end_bin = round(signal_end / bin_width)
-        norm_start_bin = round(norm_start / bin_width)
-        norm_end_bin = round(norm_end / bin_width)
-
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
-
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the sum and mean of the data in the normalization window
-            tmp_data = laser_arr[norm_start_bin:norm_end_bin]
-            reference_sum = np.sum(tmp_data)
-            reference_mean = (reference_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
-
-            # calculate the sum and mean of the data in the signal window
-            tmp_data = laser_arr[signal_start_bin:signal_end_bin]
-            signal_sum = np.sum(tmp_data)
-            signal_mean = (signal_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
+        # calculate the sum and mean of the data in the signal and normalization window for all
+        # laser pulses at once
+        window_sums, window_lengths = self.compute_window_sums(laser_data, bin_windows)
+        signal_sum, reference_sum = window_sums[:, 0], window_sums[:, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            signal_mean = signal_sum / window_lengths[0] if window_lengths[0] != 0 else \
+                np.zeros(num_of_lasers)
+            reference_mean = reference_sum / window_lengths[1] if window_lengths[1] != 0 else \
+                np.zeros(num_of_lasers)
 
             # Calculate normalized signal while avoiding division by zero
-            if reference_mean > 0 and signal_mean >= 0:
-                signal_data[ii] = signal_mean / reference_mean
-            else:
-                signal_data[ii] = 0.0
+            signal_data = np.where((reference_mean > 0) & (signal_mean >= 0),
+                                   signal_mean / reference_mean,
+                                   0.0)
 
             # Calculate measurement error while avoiding division by zero
-            if reference_sum > 0 and signal_sum > 0:
-                # calculate with respect to gaussian error 'evolution'
-                error_data[ii] = signal_data[ii] * np.sqrt(1 / signal_sum + 1 / reference_sum)
-            else:
-                error_data[ii] = 0.0
+            # calculate with respect to gaussian error 'evolution'
+            error_data = np.where((reference_sum > 0) & (signal_sum > 0),
+                                  signal_data * np.sqrt(1 / signal_sum + 1 / reference_sum),
+                                  0.0)
 
         return signal_data, error_data
 
@@ -96,35 +82,21 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         """
         # Get number of lasers
         num_of_lasers = laser_data.shape[0]
-        # Get counter bin width
-        bin_width = self.fast_counter_settings.get('bin_width')
 
-        if not isinstance(bin_width, float):
+        # Convert the times in seconds to bins (i.e. array indices)
+        bin_windows = self.time_to_bin_windows([(signal_start, signal_end)])
+        if bin_windows is None:
             return np.zeros(num_of_lasers), np.zeros(num_of_lasers)
 
-        # Convert the times in seconds to bins (i.e. array indices)
-        signal_start_bin = round(signal_start / bin_width)
-        signal_end_bin = round(signal_end / bin_width)
-
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
-
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the sum of the data in the signal window
-            signal = laser_arr[signal_start_bin:signal_end_bin].sum()
-            signal_error = np.sqrt(signal)
-
-            # Avoid numpy C type variables overflow and NaN values
-            if signal < 0 or signal != signal:
-                signal_data[ii] = 0.0
-                error_data[ii] = 0.0
-            else:
-                signal_data[ii] = signal
-                error_data[ii] = signal_error
+        # calculate the sum of the data in the signal window for all laser pulses
+        signal = self.compute_window_sums(laser_data, bin_windows)[0][:, 0].astype(float)
 
-        return signal_data, error_data
+        # Avoid numpy C type variables overflow and NaN values
+        invalid = (signal < 0) | np.isnan(signal)
+        signal[invalid] = 0.0
+        signal_error = np.sqrt(signal)
+
+        return signal, signal_error
 
     def analyse_mean(self, laser_data, signal_start=0.0, signal_end=200e-9):
         """
@@ -136,34 +108,27 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         """
         # Get number of lasers
         num_of_lasers = laser_data.shape[0]
-        # Get counter bin width
-        bin_width = self.fast_counter_settings.get('bin_width')
-
-        if not isinstance(bin_width, float):
-            return np.zeros(num_of_lasers), np.zeros(num_of_lasers)
 
         # Convert the times in seconds to bins (i.e. array indices)
-        signal_start_bin = round(signal_start / bin_width)
-        signal_end_bin = round(signal_end / bin_width)
-
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
-
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the mean of the data in the signal window
-            signal = laser_arr[signal_start_bin:signal_end_bin].mean()
-            signal_sum = laser_arr[signal_start_bin:signal_end_bin].sum()
+        bin_windows = self.time_to_bin_windows([(signal_start, signal_end)])
+        if bin_windows is None:
+            return np.zeros(num_of_lasers), np.zeros(num_of_lasers)
+        signal_start_bin, signal_end_bin = bin_windows[0]
+
+        # calculate the mean of the data in the signal window for all laser pulses
+        window_sums, window_lengths = self.compute_window_sums(laser_data, bin_windows)
+        signal_sum = window_sums[:, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if window_lengths[0] != 0:
+                signal = signal_sum / window_lengths[0]
+            else:
+                signal = np.full(num_of_lasers, np.nan)
             signal_error = np.sqrt(signal_sum) / (signal_end_bin - signal_start_bin)
 
-            # Avoid numpy C type variables overflow and NaN values
-            if signal < 0 or signal != signal:
-                signal_data[ii] = 0.0
-                error_data[ii] = 0.0
-            else:
-                signal_data[ii] = signal
-                error_data[ii] = signal_error
+        # Avoid numpy C type variables overflow and NaN values
+        invalid = (signal < 0) | np.isnan(signal)
+        signal_data = np.where(invalid, 0.0, signal)
+        error_data = np.where(invalid, 0.0, signal_error)
 
         return signal_data, error_data
 
@@ -202,37 +167,25 @@ class BasicPulseAnalyzer(PulseAnalyzerBase):
         """
         # Get number of lasers
         num_of_lasers = laser_data.shape[0]
-        # Get counter bin width
-        bin_width = self.fast_counter_settings.get('bin_width')
-
-        if not isinstance(bin_width, float):
-            return np.zeros(num_of_lasers), np.zeros(num_of_lasers)
 
         # Convert the times in seconds to bins (i.e. array indices)
-        signal_start_bin = round(signal_start / bin_width)
-        signal_end_bin = round(signal_end / bin_width)
-        norm_start_bin = round(norm_start / bin_width)
-        norm_end_bin = round(norm_end / bin_width)
-
-        # initialize data arrays for signal and measurement error
-        signal_data = np.empty(num_of_lasers, dtype=float)
-        error_data = np.empty(num_of_lasers, dtype=float)
-
-        # loop over all laser pulses and analyze them
-        for ii, laser_arr in enumerate(laser_data):
-            # calculate the sum and mean of the data in the normalization window
-            tmp_data = laser_arr[norm_start_bin:norm_end_bin]
-            reference_sum = np.sum(tmp_data)
-            reference_mean = (reference_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
+        bin_windows = self.time_to_bin_windows([(signal_start, signal_end), (norm_start, norm_end)])
+        if bin_windows is None:
+            return np.zeros(num_of_lasers), np.zeros(num_of_lasers)
 
-            # calculate the sum and mean of the data in the signal window
-            tmp_data = laser_arr[signal_start_bin:signal_end_bin]
-            signal_sum = np.sum(tmp_data)
-            signal_mean = (signal_sum / len(tmp_data)) if len(tmp_data) != 0 else 0.0
+        # calculate the sum and mean of the data in the signal and background window for all
+        # laser pulses at once
+        window_sums, window_lengths = self.compute_window_sums(laser_data, bin_windows)
+        signal_sum, reference_sum = window_sums[:, 0], window_sums[:, 1]
+        signal_mean = signal_sum / window_lengths[0] if window_lengths[0] != 0 else \
+            np.zeros(num_of_lasers)
+        reference_mean = reference_sum / window_lengths[1] if window_lengths[1] != 0 else \
+            np.zeros(num_of_lasers)
 
-            signal_data[ii] = signal_mean - reference_mean
+        signal_data = signal_mean - reference_mean
 
-            # calculate with respect to gaussian error 'evolution'
-            error_data[ii] = signal_data[ii] * np.sqrt(1 / abs(signal_sum) + 1 / abs(reference_sum))
+        # calculate with respect to gaussian error 'evolution'
+        with np.errstate(divide='ignore', invalid='ignore'):
+            error_data = signal_data * np.sqrt(1 / np.abs(signal_sum) + 1 / np.abs(reference_sum))
 
         return signal_data, error_data
@@ -57,6 +57,8 @@ class PulsedMeasurementLogic(GenericLogic):
     analysis_import_path = ConfigOption(name='additional_analysis_path', default=None)
     # Optional file type descriptor for saving raw data to file
     _raw_data_save_type = ConfigOption(name='raw_data_save_type', default='text')
+    # Optional incremental extraction/analysis reusing laser flanks found in a previous extraction
+    _incremental_extraction = ConfigOption(name='incremental_extraction', default=False)
 
     # status variables
     # ext. microwave settings
@@ -140,6 +142,9 @@ class PulsedMeasurementLogic(GenericLogic):
         self._saved_raw_data = OrderedDict()  # temporary saved raw data
         self._recalled_raw_data_tag = None  # the currently recalled raw data dict key
 
+        # Signal and error of the last analysis for incremental analysis (only changed lasers)
+        self._analysis_cache = None
+
         # Paused measurement flag
         self.__is_paused = False
         self._time_of_pause = None
@@ -649,6 +654,7 @@ class PulsedMeasurementLogic(GenericLogic):
         # Use threadlock to update settings during a running measurement
         with self._threadlock:
             self._pulseanalyzer.analysis_settings = settings_dict
+            self._analysis_cache = None
             self.sigAnalysisSettingsUpdated.emit(self.analysis_settings)
         return
 
@@ -674,6 +680,8 @@ class PulsedMeasurementLogic(GenericLogic):
         # Use threadlock to update settings during a running measurement
         with self._threadlock:
             self._pulseextractor.extraction_settings = settings_dict
+            self._pulseextractor.clear_laser_flank_cache()
+            self._analysis_cache = None
             self.sigExtractionSettingsUpdated.emit(self.extraction_settings)
         return
 
@@ -1105,9 +1113,9 @@ class PulsedMeasurementLogic(GenericLogic):
             if self.module_state() == 'locked':
                 # Update elapsed time
 
-                self._extract_laser_pulses()
+                changed_lasers = self._extract_laser_pulses()
 
-                tmp_signal, tmp_error = self._analyze_laser_pulses()
+                tmp_signal, tmp_error = self._analyze_laser_pulses(changed_lasers)
 
                 # exclude laser pulses to ignore
                 if len(self._laser_ignore_list) > 0:
@@ -1148,26 +1156,84 @@ class PulsedMeasurementLogic(GenericLogic):
             return
 
     def _extract_laser_pulses(self):
+        """
+        Get new raw data from the fast counter and extract the laser pulses from it.
+
+        If incremental extraction is enabled and the laser flanks of the last extraction are
+        cached, only the counts added since the last call are sliced at the cached flanks and added
+        to the laser pulse array. A full extraction is performed if no flanks are cached or the
+        raw data can not have been created by adding counts to the previous raw data. After a full
+        extraction the laser pulses are compared to the previous ones, so only the laser pulses
+        that actually changed need to be analyzed again.
+
+        @return numpy.ndarray: indices of the laser pulses that changed since the last call or None
+                               if all laser pulses have to be analyzed again.
+        """
         # Get counter raw data (including recalled raw data from previous measurement)
         fc_data, info_dict = self._get_raw_data()
-        self.raw_data = fc_data
         self.__elapsed_sweeps = info_dict['elapsed_sweeps']
         self.__elapsed_time = info_dict['elapsed_time']
 
+        if self._incremental_extraction and self._pulseextractor.has_cached_flanks:
+            if fc_data.shape == self.raw_data.shape:
+                delta_data = fc_data - self.raw_data
+                if not (delta_data < 0).any():
+                    self.raw_data = fc_data
+                    laser_delta = self._pulseextractor.extract_cached_laser_pulses(delta_data)
+                    self.laser_data += laser_delta
+                    return np.flatnonzero(laser_delta.any(axis=1))
+
         # extract laser pulses from raw data
+        previous_laser_data = self.laser_data
+        self.raw_data = fc_data
         return_dict = self._pulseextractor.extract_laser_pulses(self.raw_data)
         self.laser_data = return_dict['laser_counts_arr']
-        return
+        if not self._incremental_extraction:
+            return None
+        if self._pulseextractor.cache_laser_flanks(self.raw_data, return_dict):
+            # laser_data is accumulated in-place from now on. Make sure it is not a view.
+            self.laser_data = self.laser_data.astype('int64', copy=True)
+        # Only the laser pulses which differ from the last extraction need to be analyzed again
+        if previous_laser_data is None or previous_laser_data.shape != self.laser_data.shape:
+            return None
+        return np.flatnonzero((self.laser_data != previous_laser_data).any(axis=1))
+
+    def _analyze_laser_pulses(self, changed_lasers=None):
+        """
+        Analyze the extracted laser pulses.
+
+        @param numpy.ndarray changed_lasers: optional, indices of laser pulses that changed since
+                                             the last analysis. If given and the result of the
+                                             last analysis is available, only these laser pulses
+                                             are analyzed again.
+
+        @return (numpy.ndarray, numpy.ndarray): signal and error for each laser pulse
+        """
+        if (changed_lasers is not None and self._analysis_cache is not None
+                and len(self._analysis_cache[0]) == self.laser_data.shape[0]):
+            tmp_signal, tmp_error = self._analysis_cache
+            if changed_lasers.size > 0:
+                signal, error = self._pulseanalyzer.analyse_laser_pulses(
+                    self.laser_data[changed_lasers])
+                tmp_signal[changed_lasers] = signal
+                tmp_error[changed_lasers] = error
+            return tmp_signal.copy(), tmp_error.copy()
 
-    def _analyze_laser_pulses(self):
         # analyze pulses and get data points for signal array. Also check if extraction
         # worked (non-zero array returned).
         if self.laser_data.any():
             tmp_signal, tmp_error = self._pulseanalyzer.analyse_laser_pulses(
                 self.laser_data)
+            if self._incremental_extraction:
+                self._analysis_cache = (np.array(tmp_signal, dtype=float),
+                                        np.array(np.broadcast_to(tmp_error, np.shape(tmp_signal)),
+                                                 dtype=float))
+            else:
+                self._analysis_cache = None
         else:
             tmp_signal = np.zeros(self.laser_data.shape[0])
             tmp_error = np.zeros(self.laser_data.shape[0])
+            self._analysis_cache = None
         return tmp_signal, tmp_error
 
     def _get_raw_data(self):
@@ -1242,6 +1308,10 @@ class PulsedMeasurementLogic(GenericLogic):
         else:
             self.raw_data = np.zeros(number_of_bins, dtype='int64')
 
+        # Sequence or counter settings may have changed. Discard data for incremental extraction.
+        self._pulseextractor.clear_laser_flank_cache()
+        self._analysis_cache = None
+
         self.sigMeasurementDataUpdated.emit()
         return
 
@@ -1286,14 +1356,14 @@ class PulsedMeasurementLogic(GenericLogic):
             parameters['gated counting'] = self.fast_counter_settings['is_gated']
             parameters['extraction parameters'] = self.extraction_settings
 
-            self.savelogic().save_data(data,
-                                       timestamp=timestamp,
-                                       parameters=parameters,
-                                       filepath=filepath,
-                                       filelabel=filelabel,
-                                       filetype='text',
-                                       fmt='%d',
-                                       delimiter='\t')
+            self.savelogic().save_data_async(data,
+                                             timestamp=timestamp,
+                                             parameters=parameters,
+                                             filepath=filepath,
+                                             filelabel=filelabel,
+                                             filetype='text',
+                                             fmt='%d',
+                                             delimiter='\t')
 
         #####################################################################
         ####                Save measurement data                        ####
@@ -1559,10 +1629,10 @@ class PulsedMeasurementLogic(GenericLogic):
             else:
                 fig = None
 
-            self.savelogic().save_data(data, timestamp=timestamp,
-                                       parameters=parameters, fmt='%.15e',
-                                       filepath=filepath, filelabel=filelabel, filetype='text',
-                                       delimiter='\t', plotfig=fig)
+            self.savelogic().save_data_async(data, timestamp=timestamp,
+                                             parameters=parameters, fmt='%.15e',
+                                             filepath=filepath, filelabel=filelabel, filetype='text',
+                                             delimiter='\t', plotfig=fig)
 
         #####################################################################
         ####                Save raw data timetrace                      ####
@@ -1584,11 +1654,11 @@ class PulsedMeasurementLogic(GenericLogic):
         parameters['Approx. measurement time (s)'] = self.__elapsed_time
         parameters['Measurement sweeps'] = self.__elapsed_sweeps
 
-        self.savelogic().save_data(data, timestamp=timestamp,
-                                   parameters=parameters, fmt='%d',
-                                   filepath=filepath, filelabel=filelabel,
-                                   filetype=self._raw_data_save_type,
-                                   delimiter='\t')
+        self.savelogic().save_data_async(data, timestamp=timestamp,
+                                         parameters=parameters, fmt='%d',
+                                         filepath=filepath, filelabel=filelabel,
+                                         filetype=self._raw_data_save_type,
+                                         delimiter='\t')
         return filepath
 
     def _compute_alt_data(self):
@@ -29,6 +29,8 @@ class Idle(SamplingBase):
     """
     Object representing an idle element (zero voltage)
     """
+    time_independent = True
+
     def __init__(self):
         pass
 
@@ -42,6 +44,7 @@ class DC(SamplingBase):
     """
     Object representing an DC element (constant voltage)
     """
+    time_independent = True
     params = OrderedDict()
     params['voltage'] = {'unit': 'V', 'init': 0.0, 'min': -np.inf, 'max': +np.inf, 'type': float}
 
@@ -66,6 +69,7 @@ class Sin(SamplingBase):
     """
     Object representing a sine wave element
     """
+    pointwise = True
     params = OrderedDict()
     params['amplitude'] = {'unit': 'V', 'init': 0.0, 'min': 0.0, 'max': np.inf, 'type': float}
     params['frequency'] = {'unit': 'Hz', 'init': 2.87e9, 'min': 0.0, 'max': np.inf, 'type': float}
@@ -101,6 +105,7 @@ class DoubleSinSum(SamplingBase):
     """
     Object representing a double sine wave element (Superposition of two sine waves; NOT normalized)
     """
+    pointwise = True
     params = OrderedDict()
     params['amplitude_1'] = {'unit': 'V', 'init': 0.0, 'min': 0.0, 'max': np.inf, 'type': float}
     params['frequency_1'] = {'unit': 'Hz', 'init': 2.87e9, 'min': 0.0, 'max': np.inf, 'type': float}
@@ -159,6 +164,7 @@ class DoubleSinProduct(SamplingBase):
     """
     Object representing a double sine wave element (Product of two sine waves; NOT normalized)
     """
+    pointwise = True
     params = OrderedDict()
     params['amplitude_1'] = {'unit': 'V', 'init': 0.0, 'min': 0.0, 'max': np.inf, 'type': float}
     params['frequency_1'] = {'unit': 'Hz', 'init': 2.87e9, 'min': 0.0, 'max': np.inf, 'type': float}
@@ -218,6 +224,7 @@ class TripleSinSum(SamplingBase):
     Object representing a linear combination of three sines
     (Superposition of three sine waves; NOT normalized)
     """
+    pointwise = True
     params = OrderedDict()
     params['amplitude_1'] = {'unit': 'V', 'init': 0.0, 'min': 0.0, 'max': np.inf, 'type': float}
     params['frequency_1'] = {'unit': 'Hz', 'init': 2.87e9, 'min': 0.0, 'max': np.inf, 'type': float}
@@ -298,6 +305,7 @@ class TripleSinProduct(SamplingBase):
     Object representing a wave element composed of the product of three sines
     (Product of three sine waves; NOT normalized)
     """
+    pointwise = True
     params = OrderedDict()
     params['amplitude_1'] = {'unit': 'V', 'init': 0.0, 'min': 0.0, 'max': np.inf, 'type': float}
     params['frequency_1'] = {'unit': 'Hz', 'init': 2.87e9, 'min': 0.0, 'max': np.inf, 'type': float}
@@ -104,6 +104,13 @@ class SamplingBase:
     """
     params = OrderedDict()
     log = logging.getLogger(__name__)
+    # Set to True in subclasses whose samples only depend on the length of the time array but not
+    # on the actual time values. Samples of such functions can be reused at any position.
+    time_independent = False
+    # Set to True in subclasses where each sample only depends on the corresponding time value and
+    # not on the whole time array (e.g. its first or last value). Such functions can be sampled
+    # for several elements at once.
+    pointwise = False
 
     def __repr__(self):
         kwargs = []
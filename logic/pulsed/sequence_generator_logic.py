@@ -22,12 +22,14 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 import numpy as np
 import os
+import hashlib
 import pickle
 import time
 import copy
 import traceback
 import datetime
 
+from concurrent.futures import ThreadPoolExecutor
 from qtpy import QtCore
 from collections import OrderedDict
 from core.statusvariable import StatusVar
@@ -41,6 +43,8 @@ from logic.generic_logic import GenericLogic
 from logic.pulsed.pulse_objects import PulseBlock, PulseBlockEnsemble, PulseSequence
 from logic.pulsed.pulse_objects import PulseObjectGenerator, PulseBlockElement
 from logic.pulsed.sampling_functions import SamplingFunctions
+from logic.pulsed.ensemble_sampler import EnsembleSampler
+from logic.pulsed.waveform_cache import WaveformCache
 from interface.pulser_interface import SequenceOption
 
 
@@ -76,6 +80,9 @@ class SequenceGeneratorLogic(GenericLogic):
                                                    missing='nothing')
     _info_on_estimated_upload_time = ConfigOption(name='info_on_estimated_upload_time', default=60, missing='nothing')
     _disable_bench_prompt = ConfigOption(name='disable_benchmark_prompt', default=False, missing='nothing')
+    # Optional directory to keep sampled waveforms on disk for reuse and the maximum size in bytes
+    _waveform_cache_dir = ConfigOption(name='waveform_cache_path', default=None, missing='nothing')
+    _waveform_cache_size = ConfigOption(name='waveform_cache_size', default=2**30, missing='nothing')
 
     # status vars
     # Global parameters describing the channel usage and common parameters used during pulsed object
@@ -142,6 +149,16 @@ class SequenceGeneratorLogic(GenericLogic):
         # A flag indicating if sampling of a sequence is in progress
         self.__sequence_generation_in_progress = False
 
+        # Hash, final offset bin and waveform names of the last sampled ensemble for each name tag.
+        # Used to skip sampling if the identical waveforms are still present on the device.
+        self._waveform_records = dict()
+        # Optional on-disk store of sampled waveforms (WaveformCache instance)
+        self._waveform_cache = None
+
+        # Memoized analysis results of PulseBlocks used by analyze_block_ensemble.
+        # Keys are tuples describing the timing and channel states of all elements in a block.
+        self._block_analysis_cache = dict()
+
         # Get instance of PulseObjectGenerator which takes care of collecting all predefined methods
         self._pog = None
 
@@ -212,6 +229,16 @@ class SequenceGeneratorLogic(GenericLogic):
 
         self.__sequence_generation_in_progress = False
 
+        self._waveform_records = dict()
+        self._waveform_cache = None
+        if self._waveform_cache_dir:
+            try:
+                self._waveform_cache = WaveformCache(path=self._waveform_cache_dir,
+                                                     max_bytes=self._waveform_cache_size)
+            except OSError:
+                self.log.exception('Unable to use directory "{0}" as waveform cache. Disk cache '
+                                   'disabled.'.format(self._waveform_cache_dir))
+
         return
 
     def on_deactivate(self):
@@ -462,6 +489,7 @@ class SequenceGeneratorLogic(GenericLogic):
             self.log.error('Can´t clear the pulser as it is running. Switch off the pulser and try again.')
             return -1
         self.pulsegenerator().clear_all()
+        self._waveform_records = dict()
         # Delete all sampling information from all PulseBlockEnsembles and PulseSequences
         for seq_name in self.saved_pulse_sequences:
             seq = self.saved_pulse_sequences[seq_name]
@@ -1239,6 +1267,49 @@ class SequenceGeneratorLogic(GenericLogic):
             number_of_lasers = -1
         return length_s, length_bins, number_of_lasers
 
+    def _get_block_analysis(self, block, channel_order):
+        """
+        Helper method to get the element timing and channel states of a PulseBlock as arrays.
+        The results are memoized with the block content as key, so each distinct block is only
+        converted once.
+
+        @param PulseBlock block: The PulseBlock to analyze
+        @param list channel_order: Ordered digital channel descriptors for the state array columns
+
+        @return dict: init_length_s (1D numpy.ndarray[float]): initial length of each element
+                      increment_s (1D numpy.ndarray[float]): length increment of each element
+                      states (2D numpy.ndarray[bool]): digital channel states (in the order given by
+                                                       channel_order) and laser_on flag (last
+                                                       column) of each element
+                      rising (2D numpy.ndarray[bool]): low-to-high transitions between consecutive
+                                                       elements of the block for each state column
+                      falling (2D numpy.ndarray[bool]): high-to-low transitions between consecutive
+                                                        elements of the block for each state column
+        """
+        block_key = (tuple(channel_order),
+                     tuple((element.init_length_s,
+                            element.increment_s,
+                            element.laser_on,
+                            tuple(element.digital_high[chnl] for chnl in channel_order))
+                           for element in block.element_list))
+        block_info = self._block_analysis_cache.get(block_key)
+        if block_info is None:
+            states = np.zeros((len(block), len(channel_order) + 1), dtype=bool)
+            for ii, element_key in enumerate(block_key[1]):
+                states[ii, :-1] = element_key[3]
+                states[ii, -1] = element_key[2]
+            block_info = {
+                'init_length_s': np.array([key[0] for key in block_key[1]], dtype='float64'),
+                'increment_s': np.array([key[1] for key in block_key[1]], dtype='float64'),
+                'states': states,
+                'rising': ~states[:-1] & states[1:],
+                'falling': states[:-1] & ~states[1:]}
+            # Keep the memory footprint bounded
+            if len(self._block_analysis_cache) >= 1000:
+                self._block_analysis_cache.clear()
+            self._block_analysis_cache[block_key] = block_info
+        return block_info
+
     def analyze_block_ensemble(self, ensemble):
         """
         This helper method runs through each element of a PulseBlockEnsemble object and extracts
@@ -1284,94 +1355,94 @@ class SequenceGeneratorLogic(GenericLogic):
         laser_channel = self.generation_parameters['gate_channel'] if self.generation_parameters[
             'gate_channel'] else self.generation_parameters['laser_channel']
 
-        # memorize the digital channel state of the previous element
-        tmp_digital_high = dict()
-        # memorize the laser_on flag of the previous element (in case of non-digital laser channel)
-        tmp_laser_on = False
         # Set of used analog and digital channels
         digital_channels = set()
         analog_channels = set()
-        # check for active channels and initialize tmp_digital_high/tmp_laser_on with the state of
-        # the very last element in the ensemble
         if len(ensemble) > 0:
             block = self.get_block(ensemble[0][0])
             digital_channels = block.digital_channels
             analog_channels = block.analog_channels
+        # Fixed channel order for the columns of the element state arrays. The last column holds
+        # the laser_on flag of the elements.
+        channel_order = sorted(digital_channels)
+
+        # Initialize the previous element state with the state of the very last element in the
+        # ensemble
+        prev_state = np.zeros(len(channel_order) + 1, dtype=bool)
+        if len(ensemble) > 0:
             block = self.get_block(ensemble[-1][0])
             if len(block) > 0:
-                tmp_digital_high = block[-1].digital_high.copy()
-                tmp_laser_on = block[-1].laser_on
-            else:
-                tmp_digital_high = {chnl: False for chnl in digital_channels}
-                tmp_laser_on = False
+                prev_state = self._get_block_analysis(block, channel_order)['states'][-1]
 
-        # dicts containing the bins where the digital channels are rising/falling
-        digital_rising_bins = {chnl: list() for chnl in digital_channels}
-        digital_falling_bins = {chnl: list() for chnl in digital_channels}
-        laser_rising_bins = list()
-        laser_falling_bins = list()
+        # Lists of the lengths of all elements including repetitions and the element indices of the
+        # rising/falling transitions for each state column.
+        element_lengths_s = list()
+        rising_elements = [list() for col in range(len(channel_order) + 1)]
+        falling_elements = [list() for col in range(len(channel_order) + 1)]
 
-        # Array to store the length in bins for all elements including repetitions in the order
-        # they are occuring in the waveform later on.
-        elements_length_bins = list()
-
-        # variables to keep track of the current timeframe
-        current_end_time = 0.0
-        current_start_bin = 0
-
-        # Loop through all blocks in the ensemble
+        element_offset = 0
         for block_name, reps in ensemble:
-            # Get the stored PulseBlock instance
-            block = self.get_block(block_name)
-
-            # Iterate over all repetitions of the current block
-            for rep_no in range(reps + 1):
-                # Iterate over the Block_Elements inside the current block
-                for element in block:
-                    # save bin position if a transition from low to high or vice versa has occurred
-                    # in a digital channel
-                    if tmp_digital_high != element.digital_high:
-                        for chnl, state in element.digital_high.items():
-                            if not tmp_digital_high[chnl] and state:
-                                digital_rising_bins[chnl].append(current_start_bin)
-                            elif tmp_digital_high[chnl] and not state:
-                                digital_falling_bins[chnl].append(current_start_bin)
-                        tmp_digital_high = element.digital_high.copy()
-
-                    if not laser_channel.startswith('d') and tmp_laser_on != element.laser_on:
-                        if not tmp_laser_on and element.laser_on:
-                            laser_rising_bins.append(current_start_bin)
-                        else:
-                            laser_falling_bins.append(current_start_bin)
-                        tmp_laser_on = element.laser_on
-
-                    # Calculate length of the current element with current repetition count in sec
-                    # and add this to the ideal end time for the sequence up until this point.
-                    current_end_time += element.init_length_s + rep_no * element.increment_s
-
-                    # Nearest possible match including the discretization in bins
-                    current_end_bin = int(np.rint(current_end_time * self.__sample_rate))
-
-                    # append current element length in discrete bins to temporary array
-                    elements_length_bins.append(current_end_bin - current_start_bin)
-
-                    # advance bin offset for next element
-                    current_start_bin = current_end_bin
-
-        elements_length_bins = np.array(elements_length_bins, dtype='int64')
-
-        # convert rising/falling indices to numpy.ndarrays. Remove duplicates.
-        for chnl in digital_channels:
-            digital_rising_bins[chnl] = sorted(set(digital_rising_bins[chnl]))
-            digital_falling_bins[chnl] = sorted(set(digital_falling_bins[chnl]))
-            digital_rising_bins[chnl] = np.array(digital_rising_bins[chnl], dtype='int64')
-            digital_falling_bins[chnl] = np.array(digital_falling_bins[chnl], dtype='int64')
+            block_info = self._get_block_analysis(self.get_block(block_name), channel_order)
+            states = block_info['states']
+            block_elements = len(states)
+            if block_elements == 0:
+                continue
+            # Element lengths for each repetition of the block
+            rep_no = np.arange(reps + 1, dtype='float64')
+            element_lengths_s.append(
+                (block_info['init_length_s'] + np.outer(rep_no, block_info['increment_s'])).ravel())
+
+            # Global index of the first element for each repetition of the block
+            rep_offsets = element_offset + block_elements * np.arange(reps + 1, dtype='int64')
+            # Transitions within the block are identical for each repetition.
+            # Transitions at the block start depend on the preceding element which is the last
+            # element of the previous block for the first repetition and the last element of the
+            # same block for all further repetitions.
+            for col in range(len(channel_order) + 1):
+                for transitions, bin_list, start_state, end_state in (
+                        (block_info['rising'], rising_elements, False, True),
+                        (block_info['falling'], falling_elements, True, False)):
+                    internal = np.flatnonzero(transitions[:, col]) + 1
+                    if internal.size > 0:
+                        bin_list[col].append((rep_offsets[:, None] + internal).ravel())
+                    if prev_state[col] == start_state and states[0, col] == end_state:
+                        bin_list[col].append(rep_offsets[:1])
+                    if reps > 0 and states[-1, col] == start_state and states[0, col] == end_state:
+                        bin_list[col].append(rep_offsets[1:])
+            prev_state = states[-1]
+            element_offset += block_elements * (reps + 1)
+
+        # Calculate the ideal end time of each element and the nearest possible match including
+        # the discretization in bins.
+        if element_lengths_s:
+            element_end_times = np.cumsum(np.concatenate(element_lengths_s))
+        else:
+            element_end_times = np.zeros(0, dtype='float64')
+        element_end_bins = np.rint(element_end_times * self.__sample_rate).astype('int64')
+        element_start_bins = np.zeros(len(element_end_bins), dtype='int64')
+        element_start_bins[1:] = element_end_bins[:-1]
+        elements_length_bins = element_end_bins - element_start_bins
+        ideal_length = float(element_end_times[-1]) if len(element_end_times) > 0 else 0.0
+
+        # convert rising/falling element indices to sorted bin arrays. Remove duplicates.
+        # Element start bins are monotonic, so sorting the element indices sorts the bins as well.
+        def _to_bins(element_indices):
+            if not element_indices:
+                return np.empty(0, dtype='int64')
+            bins = element_start_bins[np.sort(np.concatenate(element_indices))]
+            return bins[np.append(True, bins[1:] != bins[:-1])]
+
+        digital_rising_bins = dict()
+        digital_falling_bins = dict()
+        for col, chnl in enumerate(channel_order):
+            digital_rising_bins[chnl] = _to_bins(rising_elements[col])
+            digital_falling_bins[chnl] = _to_bins(falling_elements[col])
         if laser_channel.startswith('d'):
             laser_rising_bins = digital_rising_bins[laser_channel]
             laser_falling_bins = digital_falling_bins[laser_channel]
         else:
-            laser_rising_bins = np.array(sorted(set(laser_rising_bins)), dtype='int64')
-            laser_falling_bins = np.array(sorted(set(laser_falling_bins)), dtype='int64')
+            laser_rising_bins = _to_bins(rising_elements[-1])
+            laser_falling_bins = _to_bins(falling_elements[-1])
 
         return_dict = dict()
         return_dict['number_of_samples'] = np.sum(elements_length_bins)
@@ -1383,7 +1454,7 @@ class SequenceGeneratorLogic(GenericLogic):
         return_dict['digital_channels'] = digital_channels
         return_dict['channel_set'] = analog_channels.union(digital_channels)
         return_dict['generation_parameters'] = self.generation_parameters.copy()
-        return_dict['ideal_length'] = current_end_time
+        return_dict['ideal_length'] = ideal_length
         return_dict['laser_rising_bins'] = laser_rising_bins
         return_dict['laser_falling_bins'] = laser_falling_bins
         return return_dict
@@ -1470,12 +1541,17 @@ class SequenceGeneratorLogic(GenericLogic):
         step_last_digital_state = last_digital_channel_state
         step_last_laser_on_state = last_laser_on_state
 
+        # Ensembles are usually used in several sequence steps. Analyze each only once.
+        ensemble_infos = dict()
+
         for step_no, seq_step in enumerate(sequence):
             is_finite = seq_step.repetitions >= 0
             # Get the PulseBlockEnsemble instance associated with this sequence step
             ensemble = self.get_ensemble(seq_step.ensemble)
             # Get information about the current PulseBlockEnsemble instance
-            info_dict = self.analyze_block_ensemble(ensemble=ensemble)
+            if ensemble.name not in ensemble_infos:
+                ensemble_infos[ensemble.name] = self.analyze_block_ensemble(ensemble=ensemble)
+            info_dict = ensemble_infos[ensemble.name]
             # Set tmp helper variables
             ensemble_name_set.add(ensemble.name)
             reps = seq_step.repetitions + 1
@@ -1496,55 +1572,37 @@ class SequenceGeneratorLogic(GenericLogic):
             step_elements_length_bins.append(
                 [seq_step.repetitions, info_dict['elements_length_bins']])
 
-            # Get the digital channel rising/falling bin positions and concatenate them according
+            # Get the digital channel rising/falling bin positions and tile them according
             # to sequence step repetition count considering bin offsets.
             # This will result in a sequence of rising and falling bins representing the real-time
             # signal with all repetitions taken into account.
             # Do that for every digital channel and only if the sequence is finite
-            if sequence.is_finite:
+            if sequence.is_finite and reps > 0:
+                bin_offsets = starting_bin + ens_bins * np.arange(reps, dtype='int64')
                 for chnl in digital_channels:
-                    # Append rising/falling bin arrays for each step to a list in order to merge
-                    # them all later on into a single array. This is more efficient than having
-                    # an intermediate array.
-                    # Pay special attention to transitions from one sequence step to another.
-                    for iteration in range(reps):
-                        bin_offset = iteration * ens_bins + starting_bin
-                        rising_bins = info_dict['digital_rising_bins'][chnl] + bin_offset
-                        falling_bins = info_dict['digital_falling_bins'][chnl] + bin_offset
-                        if iteration == 0 and prev_step_digital_state[chnl] != step_last_digital_state[chnl]:
-                            if prev_step_digital_state[chnl] and not step_first_digital_state[chnl]:
-                                falling_bins = np.append(bin_offset, falling_bins)
-                            elif not prev_step_digital_state[chnl] and step_first_digital_state[chnl]:
-                                rising_bins = np.append(bin_offset, rising_bins)
-                            elif prev_step_digital_state[chnl] == step_first_digital_state[chnl]:
-                                if step_last_digital_state[chnl]:
-                                    falling_bins = falling_bins[1:]
-                                else:
-                                    rising_bins = rising_bins[1:]
-
-                        digital_rising_bins[chnl].append(rising_bins)
-                        digital_falling_bins[chnl].append(falling_bins)
-
-                # Append laser_bins arrays with bin offsets for each repetition analogous to the
-                # digital channels above.
+                    rising_bins, falling_bins = self._tile_step_transitions(
+                        rising_bins=info_dict['digital_rising_bins'][chnl],
+                        falling_bins=info_dict['digital_falling_bins'][chnl],
+                        bin_offsets=bin_offsets,
+                        prev_state=prev_step_digital_state[chnl],
+                        first_state=step_first_digital_state[chnl],
+                        last_state=step_last_digital_state[chnl])
+                    digital_rising_bins[chnl].append(rising_bins)
+                    digital_falling_bins[chnl].append(falling_bins)
+
+                # Tile laser_bins arrays analogous to the digital channels above.
                 if not laser_channel.startswith('d'):
-                    for iteration in range(reps):
-                        bin_offset = iteration * ens_bins + starting_bin
-                        rising_bins = info_dict['laser_rising_bins'] + bin_offset
-                        falling_bins = info_dict['laser_falling_bins'] + bin_offset
-                        if iteration == 0 and prev_step_laser_on_state != step_last_laser_on_state:
-                            if prev_step_laser_on_state and not step_first_laser_on_state:
-                                falling_bins = np.append(bin_offset, falling_bins)
-                            elif not prev_step_laser_on_state and step_first_laser_on_state:
-                                rising_bins = np.append(bin_offset, rising_bins)
-                            elif prev_step_laser_on_state == step_first_laser_on_state:
-                                if step_last_laser_on_state:
-                                    falling_bins = falling_bins[1:]
-                                else:
-                                    rising_bins = rising_bins[1:]
-                        laser_rising_bins.append(rising_bins)
-                        laser_falling_bins.append(falling_bins)
+                    rising_bins, falling_bins = self._tile_step_transitions(
+                        rising_bins=info_dict['laser_rising_bins'],
+                        falling_bins=info_dict['laser_falling_bins'],
+                        bin_offsets=bin_offsets,
+                        prev_state=prev_step_laser_on_state,
+                        first_state=step_first_laser_on_state,
+                        last_state=step_last_laser_on_state)
+                    laser_rising_bins.append(rising_bins)
+                    laser_falling_bins.append(falling_bins)
 
+            if sequence.is_finite:
                 # Increment the current starting bin offset for the next sequence step
                 starting_bin += ens_bins * reps
 
@@ -1605,6 +1663,39 @@ class SequenceGeneratorLogic(GenericLogic):
 
         return return_dict
 
+    @staticmethod
+    def _tile_step_transitions(rising_bins, falling_bins, bin_offsets, prev_state, first_state,
+                               last_state):
+        """
+        Helper method to repeat the rising/falling transition bins of a PulseBlockEnsemble for all
+        repetitions of a sequence step. Pays special attention to the transition from the previous
+        sequence step into the first repetition.
+
+        @param numpy.ndarray rising_bins: low-to-high transition bins of the ensemble
+        @param numpy.ndarray falling_bins: high-to-low transition bins of the ensemble
+        @param numpy.ndarray bin_offsets: start bin of each repetition of the sequence step
+        @param bool prev_state: channel state at the end of the previous sequence step
+        @param bool first_state: channel state of the first element of the ensemble
+        @param bool last_state: channel state of the last element of the ensemble
+
+        @return (numpy.ndarray, numpy.ndarray): rising and falling bins of the sequence step
+        """
+        rising_bins = (bin_offsets[:, None] + rising_bins).ravel()
+        falling_bins = (bin_offsets[:, None] + falling_bins).ravel()
+        # The ensemble transition bins assume the last ensemble element preceding the first one.
+        # Correct the first repetition for the actual state of the previous sequence step.
+        if prev_state != last_state:
+            if prev_state and not first_state:
+                falling_bins = np.append(bin_offsets[0], falling_bins)
+            elif not prev_state and first_state:
+                rising_bins = np.append(bin_offsets[0], rising_bins)
+            elif prev_state == first_state:
+                if last_state:
+                    falling_bins = falling_bins[1:]
+                else:
+                    rising_bins = rising_bins[1:]
+        return rising_bins, falling_bins
+
     def _sampling_ensemble_sanity_check(self, ensemble):
         blocks_missing = set()
         channel_activation_mismatch = False
@@ -1649,6 +1740,42 @@ class SequenceGeneratorLogic(GenericLogic):
         # Return error code
         return -1 if ensembles_missing else 0
 
+    def _get_waveform_hash(self, ensemble, number_of_samples, offset_bin, array_length):
+        """ Calculates a hash that uniquely identifies the samples created from a
+        PulseBlockEnsemble with the current pulse generator settings.
+
+        @param PulseBlockEnsemble ensemble: The PulseBlockEnsemble to sample
+        @param int number_of_samples: The total number of samples of the ensemble
+        @param int offset_bin: The time offset bin the sampling starts with
+        @param int array_length: The number of samples written per chunk
+
+        @return str: hex digest of the waveform definition
+        """
+        # Without rotating frame the time axis of elements split across chunks depends on the
+        # chunk length. Only take it into account if the waveform is actually written in chunks.
+        if ensemble.rotating_frame or array_length >= number_of_samples:
+            array_length = None
+        definition = [repr(ensemble.rotating_frame),
+                      repr(offset_bin),
+                      repr(array_length),
+                      repr(self.__sample_rate),
+                      repr(sorted(self.__activation_config[1])),
+                      repr(sorted(self.__analog_levels[0].items()))]
+        for block_name, reps in ensemble.block_list:
+            definition.append('{0!r}:{1:d}'.format(self.get_block(block_name).element_list, reps))
+        return hashlib.sha1('\n'.join(definition).encode('utf-8')).hexdigest()
+
+    def _set_ensemble_sampling_information(self, ensemble, ensemble_info, waveforms):
+        """ Save sampling related parameters to the sampling_information container within the
+        PulseBlockEnsemble.
+        """
+        ensemble.sampling_information = dict()
+        ensemble.sampling_information.update(ensemble_info)
+        ensemble.sampling_information['pulse_generator_settings'] = self.pulse_generator_settings
+        ensemble.sampling_information['waveforms'] = waveforms
+        self.save_ensemble(ensemble)
+        return
+
     @QtCore.Slot(str)
     def sample_pulse_block_ensemble(self, ensemble, offset_bin=0, name_tag=None):
         """ General sampling of a PulseBlockEnsemble object, which serves as the construction plan.
@@ -1687,6 +1814,9 @@ class SequenceGeneratorLogic(GenericLogic):
         The chunkwise write mode is used to save memory usage at the expense of time.
         In other words: The whole sample arrays are never created at any time. This results in more
         function calls and general overhead causing much longer time to complete.
+        To reduce this overhead the next chunk is sampled in a worker thread while the previous
+        chunk is written to the device. Also samples of identical elements and repetitions of
+        blocks are reused whenever possible (see EnsembleSampler).
 
         In addition the pulse_block_ensemble gets analyzed and important parameters used during
         sampling get stored in the ensemble object "sampling_information" attribute.
@@ -1716,9 +1846,6 @@ class SequenceGeneratorLogic(GenericLogic):
         # Set the waveform name (excluding the device specific channel naming suffix, i.e. '_ch1')
         waveform_name = name_tag if name_tag else ensemble.name
 
-        # check for old waveforms associated with the ensemble and delete them from pulse generator.
-        self._delete_waveform_by_nametag(waveform_name)
-
         # Take current time
         start_time = time.time()
 
@@ -1789,14 +1916,53 @@ class SequenceGeneratorLogic(GenericLogic):
             self.sigSampleEnsembleComplete.emit(None)
             return -1, list(), dict()
 
-        # Allocate the sample arrays that are used for a single write command
-        analog_samples = dict()
-        digital_samples = dict()
+        # Skip sampling altogether if the identical waveforms are still present on the device
+        waveform_hash = self._get_waveform_hash(ensemble,
+                                                ensemble_info['number_of_samples'],
+                                                offset_bin,
+                                                array_length)
+        record = self._waveform_records.get(waveform_name)
+        if record is not None and record[0] == waveform_hash and set(record[2]).issubset(
+                self.sampled_waveforms):
+            self.log.info('Waveforms for PulseBlockEnsemble "{0}" are already present on the '
+                          'device. Sampling skipped.'.format(ensemble.name))
+            if waveform_name == ensemble.name:
+                self._set_ensemble_sampling_information(ensemble, ensemble_info, record[2])
+            if not self.__sequence_generation_in_progress:
+                self.module_state.unlock()
+            self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
+            self.sigSampleEnsembleComplete.emit(ensemble)
+            return record[1], list(record[2]), ensemble_info
+
+        # check for old waveforms associated with the ensemble and delete them from pulse generator.
+        self._delete_waveform_by_nametag(waveform_name)
+
+        # Read the samples from the on-disk waveform cache if available. Otherwise create the
+        # sampler which allocates the sample arrays used for a single write command.
+        sampler = None
+        cache_writer = None
+        if self._waveform_cache is not None:
+            sampler = self._waveform_cache.get_reader(waveform_hash, array_length)
+            if sampler is not None:
+                self.log.debug('Reading samples for PulseBlockEnsemble "{0}" from waveform cache.'
+                               ''.format(ensemble.name))
         try:
-            for chnl in ensemble_info['analog_channels']:
-                analog_samples[chnl] = np.empty(array_length, dtype='float32')
-            for chnl in ensemble_info['digital_channels']:
-                digital_samples[chnl] = np.empty(array_length, dtype=bool)
+            if sampler is None:
+                sampler = EnsembleSampler(
+                    ensemble=ensemble,
+                    ensemble_info=ensemble_info,
+                    blocks={block_name: self.get_block(block_name)
+                            for block_name, reps in ensemble.block_list},
+                    sample_rate=self.__sample_rate,
+                    analog_amplitudes=self.__analog_levels[0],
+                    chunk_length=array_length,
+                    offset_bin=offset_bin)
+                if self._waveform_cache is not None:
+                    cache_writer = self._waveform_cache.get_writer(
+                        waveform_hash,
+                        analog_channels=ensemble_info['analog_channels'],
+                        digital_channels=ensemble_info['digital_channels'],
+                        number_of_samples=ensemble_info['number_of_samples'])
         except MemoryError:
             self.log.error('Sampling of PulseBlockEnsemble "{0}" failed due to a MemoryError.\n'
                            'The sample array needed is too large to allocate in memory.\n'
@@ -1814,116 +1980,69 @@ class SequenceGeneratorLogic(GenericLogic):
                           " {0:%Y-%m-%d %H:%M:%S} ({1:d} s)".format(
                 (now + datetime.timedelta(0, t_est_upload)), int(t_est_upload)))
 
-        # integer to keep track of the sampls already processed
+        # integer to keep track of the samples already written
         processed_samples = 0
-        # Index to keep track of the samples written into the preallocated samples array
-        array_write_index = 0
-        # Keep track of the number of elements already written
-        element_count = 0
         # set of written waveform names on the device
         written_waveforms = set()
-        # Iterate over all blocks within the PulseBlockEnsemble object
-        for block_name, reps in ensemble.block_list:
-            block = self.get_block(block_name)
-            # Iterate over all repetitions of the current block
-            for rep_no in range(reps + 1):
-                # Iterate over the PulseBlockElement instances inside the current block
-                for element in block.element_list:
-                    digital_high = element.digital_high
-                    pulse_function = element.pulse_function
-                    element_length_bins = ensemble_info['elements_length_bins'][element_count]
-
-                    # Indicator on how many samples of this element have been written already
-                    element_samples_written = 0
-
-                    while element_samples_written != element_length_bins:
-                        samples_to_add = min(array_length - array_write_index,
-                                             element_length_bins - element_samples_written)
-                        # create floating point time array for the current element inside rotating
-                        # frame if analog samples are to be calculated.
-                        if pulse_function:
-                            time_arr = (offset_bin + np.arange(
-                                samples_to_add, dtype='float64')) / self.__sample_rate
-
-                        # Calculate respective part of the sample arrays
-                        for chnl in digital_high:
-                            digital_samples[chnl][array_write_index:array_write_index + samples_to_add] = digital_high[
-                                chnl]
-                        for chnl in pulse_function:
-                            analog_samples[chnl][array_write_index:array_write_index + samples_to_add] = pulse_function[
-                                                                                                             chnl].get_samples(
-                                time_arr) / (self.__analog_levels[0][chnl] / 2)
-
-                        # Free memory
-                        if pulse_function:
-                            del time_arr
-
-                        element_samples_written += samples_to_add
-                        array_write_index += samples_to_add
-                        processed_samples += samples_to_add
-                        # if the rotating frame should be preserved (default) increment the offset
-                        # counter for the time array.
-                        if ensemble.rotating_frame:
-                            offset_bin += samples_to_add
-
-                        # Check if the temporary sample array is full and write to the device if so.
-                        if array_write_index == array_length:
-                            # Set first/last chunk flags
-                            is_first_chunk = array_write_index == processed_samples
-                            is_last_chunk = processed_samples == ensemble_info['number_of_samples']
-                            written_samples, wfm_list = self.pulsegenerator().write_waveform(
-                                name=waveform_name,
-                                analog_samples=analog_samples,
-                                digital_samples=digital_samples,
-                                is_first_chunk=is_first_chunk,
-                                is_last_chunk=is_last_chunk,
-                                total_number_of_samples=ensemble_info['number_of_samples'])
-
-                            # Update written waveforms set
-                            written_waveforms.update(wfm_list)
-
-                            # check if write process was successful
-                            if written_samples != array_length:
-                                self.log.error('Sampling of block "{0}" in ensemble "{1}" failed. '
-                                               'Write to device was unsuccessful.\nThe number of '
-                                               'actually written samples ({2:d}) does not match '
-                                               'the number of samples staged to write ({3:d}).'
-                                               ''.format(block_name, ensemble.name, written_samples,
-                                                         array_length))
-                                if not self.__sequence_generation_in_progress:
-                                    self.module_state.unlock()
-                                self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
-                                self.sigSampleEnsembleComplete.emit(None)
-                                return -1, list(), dict()
-
-                            # Reset array write start pointer
-                            array_write_index = 0
-
-                            # check if the temporary write array needs to be truncated for the next
-                            # part. (because it is the last part of the ensemble to write which can
-                            # be shorter than the previous chunks)
-                            if array_length > ensemble_info['number_of_samples'] - processed_samples:
-                                array_length = ensemble_info['number_of_samples'] - processed_samples
-                                analog_samples = dict()
-                                digital_samples = dict()
-                                for chnl in ensemble_info['analog_channels']:
-                                    analog_samples[chnl] = np.empty(array_length, dtype='float32')
-                                for chnl in ensemble_info['digital_channels']:
-                                    digital_samples[chnl] = np.empty(array_length, dtype=bool)
-
-                    # Increment element index
-                    element_count += 1
+        # Sample the next chunk in a worker thread while the previous chunk is written to the device
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_chunk = None if sampler.is_finished else executor.submit(sampler.next_chunk)
+            while next_chunk is not None:
+                analog_samples, digital_samples = next_chunk.result()
+                chunk_length = sampler.processed_samples - processed_samples
+                processed_samples = sampler.processed_samples
+                next_chunk = None if sampler.is_finished else executor.submit(sampler.next_chunk)
+
+                # Set first/last chunk flags
+                is_first_chunk = chunk_length == processed_samples
+                is_last_chunk = processed_samples == ensemble_info['number_of_samples']
+                written_samples, wfm_list = self.pulsegenerator().write_waveform(
+                    name=waveform_name,
+                    analog_samples=analog_samples,
+                    digital_samples=digital_samples,
+                    is_first_chunk=is_first_chunk,
+                    is_last_chunk=is_last_chunk,
+                    total_number_of_samples=ensemble_info['number_of_samples'])
+
+                # Update written waveforms set
+                written_waveforms.update(wfm_list)
+
+                if cache_writer is not None:
+                    cache_writer.write_chunk(analog_samples, digital_samples)
+
+                # check if write process was successful
+                if written_samples != chunk_length:
+                    self.log.error('Sampling of ensemble "{0}" failed. Write to device was '
+                                   'unsuccessful.\nThe number of actually written samples ({1:d}) '
+                                   'does not match the number of samples staged to write ({2:d}).'
+                                   ''.format(ensemble.name, written_samples, chunk_length))
+                    if next_chunk is not None:
+                        next_chunk.cancel()
+                    if cache_writer is not None:
+                        cache_writer.abort()
+                    if not self.__sequence_generation_in_progress:
+                        self.module_state.unlock()
+                    self.sigAvailableWaveformsUpdated.emit(self.sampled_waveforms)
+                    self.sigSampleEnsembleComplete.emit(None)
+                    return -1, list(), dict()
+
+        # Final time offset bin to preserve the rotating frame in subsequent ensembles
+        offset_bin = sampler.offset_bin
+
+        if cache_writer is not None:
+            cache_writer.finish(offset_bin)
+        self._waveform_records[waveform_name] = (waveform_hash,
+                                                 offset_bin,
+                                                 natural_sort(written_waveforms))
 
         # Save sampling related parameters to the sampling_information container within the
         # PulseBlockEnsemble.
         # This step is only performed if the resulting waveforms are named by the PulseBlockEnsemble
         # and not by a sequence nametag
         if waveform_name == ensemble.name:
-            ensemble.sampling_information = dict()
-            ensemble.sampling_information.update(ensemble_info)
-            ensemble.sampling_information['pulse_generator_settings'] = self.pulse_generator_settings
-            ensemble.sampling_information['waveforms'] = natural_sort(written_waveforms)
-            self.save_ensemble(ensemble)
+            self._set_ensemble_sampling_information(ensemble,
+                                                    ensemble_info,
+                                                    natural_sort(written_waveforms))
 
         self.log.info('Time needed for sampling and writing PulseBlockEnsemble {0} to device: {1} sec'
                       ''.format(ensemble.name, int(np.rint(time.time() - start_time))))
@@ -2102,6 +2221,7 @@ class SequenceGeneratorLogic(GenericLogic):
     def _delete_waveform_by_nametag(self, nametag):
         if not isinstance(nametag, str):
             return
+        self._waveform_records.pop(nametag, None)
         wfm_to_delete = [wfm for wfm in self.sampled_waveforms if
                          wfm.rsplit('_', 1)[0] == nametag]
         self._delete_waveform(wfm_to_delete)
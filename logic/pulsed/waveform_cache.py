@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+This file contains the Qudi helper classes to store sampled waveforms on disk for later reuse.
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import shutil
+import pickle
+import logging
+import numpy as np
+
+
+class WaveformCache:
+    """
+    Content addressed on-disk store for sampled waveforms.
+
+    Each waveform is stored in a sub-directory named by the hash of the waveform definition and
+    contains one npy file per channel as well as a small pickle file with additional information.
+    If the total size of the cache exceeds max_bytes, the least recently used waveforms are
+    removed. The modification time of each waveform directory is used to keep track of its last
+    usage, so the order persists between sessions.
+    """
+    _info_file = 'info.pickle'
+    _incomplete_suffix = '.incomplete'
+
+    def __init__(self, path, max_bytes):
+        """
+        @param str path: Directory to store the waveforms in
+        @param int max_bytes: Maximum total size of the stored waveforms in bytes
+        """
+        self.log = logging.getLogger(__name__)
+        self._path = path
+        self._max_bytes = int(max_bytes)
+        if not os.path.exists(self._path):
+            os.makedirs(self._path)
+        # Remove leftovers of interrupted writes
+        for name in os.listdir(self._path):
+            if name.endswith(self._incomplete_suffix):
+                shutil.rmtree(os.path.join(self._path, name), ignore_errors=True)
+        return
+
+    def __contains__(self, key):
+        return os.path.isfile(os.path.join(self._path, key, self._info_file))
+
+    def get_reader(self, key, chunk_length):
+        """
+        Open a stored waveform for reading and mark it as recently used.
+
+        @param str key: hash of the waveform to read
+        @param int chunk_length: number of samples per read chunk
+
+        @return CachedWaveformReader: reader instance or None if the waveform is not in the cache
+        """
+        if key not in self:
+            return None
+        directory = os.path.join(self._path, key)
+        try:
+            with open(os.path.join(directory, self._info_file), 'rb') as file:
+                info = pickle.load(file)
+            analog_samples = {chnl: np.load(os.path.join(directory, '{0}.npy'.format(chnl)),
+                                            mmap_mode='r') for chnl in info['analog_channels']}
+            digital_samples = {chnl: np.load(os.path.join(directory, '{0}.npy'.format(chnl)),
+                                             mmap_mode='r') for chnl in info['digital_channels']}
+        except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+            self.log.warning('Unable to read cached waveform "{0}". Removing it from cache.'
+                             ''.format(key))
+            shutil.rmtree(directory, ignore_errors=True)
+            return None
+        os.utime(directory)
+        return CachedWaveformReader(analog_samples, digital_samples, info['offset_bin'],
+                                    chunk_length)
+
+    def get_writer(self, key, analog_channels, digital_channels, number_of_samples):
+        """
+        Create a writer to store a new waveform chunk by chunk.
+        Returns None if the waveform is too large to be cached at all.
+
+        @param str key: hash of the waveform to store
+        @param iterable analog_channels: analog channel descriptors
+        @param iterable digital_channels: digital channel descriptors
+        @param int number_of_samples: total number of samples per channel
+
+        @return CachedWaveformWriter: writer instance or None
+        """
+        nbytes = number_of_samples * (4 * len(analog_channels) + len(digital_channels))
+        if nbytes > self._max_bytes or number_of_samples == 0:
+            return None
+        self._evict(self._max_bytes - nbytes)
+        directory = os.path.join(self._path, key)
+        return CachedWaveformWriter(directory,
+                                    directory + self._incomplete_suffix,
+                                    self._info_file,
+                                    analog_channels,
+                                    digital_channels,
+                                    number_of_samples)
+
+    def _evict(self, max_bytes):
+        """
+        Remove the least recently used waveforms until the cache size is below max_bytes.
+        """
+        entries = list()
+        for name in os.listdir(self._path):
+            directory = os.path.join(self._path, name)
+            if not os.path.isdir(directory) or name.endswith(self._incomplete_suffix):
+                continue
+            size = sum(os.path.getsize(os.path.join(directory, file))
+                       for file in os.listdir(directory))
+            entries.append((os.path.getmtime(directory), size, directory))
+        entries.sort()
+        total_size = sum(size for mtime, size, directory in entries)
+        while entries and total_size > max_bytes:
+            mtime, size, directory = entries.pop(0)
+            shutil.rmtree(directory, ignore_errors=True)
+            total_size -= size
+        return
+
+
+class CachedWaveformWriter:
+    """
+    Writes a waveform chunk by chunk into memory mapped npy files. The waveform only becomes
+    available in the cache after all samples have been written and finish has been called.
+    """
+    def __init__(self, directory, tmp_directory, info_file, analog_channels, digital_channels,
+                 number_of_samples):
+        self._directory = directory
+        self._tmp_directory = tmp_directory
+        self._info_file = info_file
+        self._analog_channels = sorted(analog_channels)
+        self._digital_channels = sorted(digital_channels)
+        self._number_of_samples = number_of_samples
+        self._write_index = 0
+
+        shutil.rmtree(self._tmp_directory, ignore_errors=True)
+        os.makedirs(self._tmp_directory)
+        self._arrays = dict()
+        for chnl in self._analog_channels:
+            self._arrays[chnl] = np.lib.format.open_memmap(
+                os.path.join(self._tmp_directory, '{0}.npy'.format(chnl)),
+                mode='w+', dtype='float32', shape=(number_of_samples,))
+        for chnl in self._digital_channels:
+            self._arrays[chnl] = np.lib.format.open_memmap(
+                os.path.join(self._tmp_directory, '{0}.npy'.format(chnl)),
+                mode='w+', dtype=bool, shape=(number_of_samples,))
+        return
+
+    def write_chunk(self, analog_samples, digital_samples):
+        """
+        Append a chunk of samples.
+
+        @param dict analog_samples: analog sample arrays with channel descriptors as keys
+        @param dict digital_samples: digital sample arrays with channel descriptors as keys
+        """
+        chunk_length = 0
+        for samples_dict in (analog_samples, digital_samples):
+            for chnl, samples in samples_dict.items():
+                chunk_length = len(samples)
+                self._arrays[chnl][self._write_index:self._write_index + chunk_length] = samples
+        self._write_index += chunk_length
+        return
+
+    def finish(self, offset_bin):
+        """
+        Flush all samples to disk and make the waveform available in the cache.
+
+        @param int offset_bin: the time offset bin after the last sample of the waveform
+        """
+        for arr in self._arrays.values():
+            arr.flush()
+        self._arrays = dict()
+        if self._write_index != self._number_of_samples:
+            self.abort()
+            return
+        info = {'analog_channels': self._analog_channels,
+                'digital_channels': self._digital_channels,
+                'number_of_samples': self._number_of_samples,
+                'offset_bin': offset_bin}
+        with open(os.path.join(self._tmp_directory, self._info_file), 'wb') as file:
+            pickle.dump(info, file)
+        shutil.rmtree(self._directory, ignore_errors=True)
+        os.rename(self._tmp_directory, self._directory)
+        return
+
+    def abort(self):
+        """
+        Discard all written samples.
+        """
+        self._arrays = dict()
+        shutil.rmtree(self._tmp_directory, ignore_errors=True)
+        return
+
+
+class CachedWaveformReader:
+    """
+    Provides the chunks of a stored waveform with the same interface as EnsembleSampler.
+    """
+    def __init__(self, analog_samples, digital_samples, offset_bin, chunk_length):
+        self._analog_samples = analog_samples
+        self._digital_samples = digital_samples
+        arrays = list(analog_samples.values()) + list(digital_samples.values())
+        self._total_samples = len(arrays[0]) if arrays else 0
+        self._chunk_length = chunk_length
+        self.offset_bin = offset_bin
+        self.processed_samples = 0
+        return
+
+    @property
+    def is_finished(self):
+        return self.processed_samples >= self._total_samples
+
+    @property
+    def total_samples(self):
+        return self._total_samples
+
+    def next_chunk(self):
+        """
+        Read the next chunk of the waveform from disk.
+
+        @return (dict, dict): analog samples (float32) and digital samples (bool) arrays with
+                              channel descriptors as keys.
+        """
+        start = self.processed_samples
+        stop = min(start + self._chunk_length, self._total_samples)
+        analog_samples = {chnl: np.array(samples[start:stop])
+                          for chnl, samples in self._analog_samples.items()}
+        digital_samples = {chnl: np.array(samples[start:stop])
+                           for chnl, samples in self._digital_samples.items()}
+        self.processed_samples = stop
+        return analog_samples, digital_samples
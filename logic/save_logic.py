@@ -21,23 +21,27 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 
 from cycler import cycler
 import datetime
-import inspect
+import itertools
 import logging
 import matplotlib.pyplot as plt
+import multiprocessing
 import numpy as np
 import os
+import pickle
+import queue
 import sys
+import threading
 import time
 
 from collections import OrderedDict
+from qtpy import QtCore
 from core.configoption import ConfigOption
 from core.util import units
+from core.util import data_storage
+from core.util import figure_export
 from core.util.mutex import Mutex
 from core.util.network import netobtain
 from logic.generic_logic import GenericLogic
-from matplotlib.backends.backend_pdf import PdfPages
-from PIL import Image
-from PIL import PngImagePlugin
 
 
 class DailyLogHandler(logging.FileHandler):
@@ -129,6 +133,8 @@ class SaveLogic(GenericLogic):
         log_into_daily_directory: True
         save_pdf: True
         save_png: True
+        save_queue_size: 8  # optional, maximum number of pending jobs of save_data_async
+        render_figures_in_process: True  # optional, export figures in a separate process
     """
 
     _win_data_dir = ConfigOption('win_data_directory', 'C:/Data/')
@@ -136,6 +142,12 @@ class SaveLogic(GenericLogic):
     log_into_daily_directory = ConfigOption('log_into_daily_directory', False, missing='warn')
     save_pdf = ConfigOption('save_pdf', False)
     save_png = ConfigOption('save_png', True)
+    _save_queue_size = ConfigOption('save_queue_size', 8, missing='nothing')
+    _render_figures_in_process = ConfigOption('render_figures_in_process', True, missing='nothing')
+
+    # Emitted by the background saving thread with the job ID and a success flag after a job
+    # queued by save_data_async has been processed.
+    sigSaveJobFinished = QtCore.Signal(int, bool)
 
     # Matplotlib style definition for saving plots
     mpl_qd_style = {
@@ -202,6 +214,20 @@ class SaveLogic(GenericLogic):
 
         self._daily_loghandler = None
 
+        # Background saving thread, bounded job queue and job ID counter for save_data_async
+        self._save_queue = None
+        self._save_thread = None
+        self._save_job_ids = itertools.count()
+        # Cache of calling module names with the code objects of the calling functions as keys
+        self._caller_module_names = dict()
+        # Process pool used to render and export figures
+        self._figure_pool = None
+        self._figure_pool_lock = threading.Lock()
+        # Results of figures being rendered in the process pool. Each thread additionally keeps
+        # track of the figures it started, so that a save job can wait for its own figures.
+        self._figure_results = list()
+        self._thread_figure_results = threading.local()
+
     def on_activate(self):
         """ Definition, configuration and initialisation of the SaveLogic.
         """
@@ -217,7 +243,23 @@ class SaveLogic(GenericLogic):
         else:
             self._daily_loghandler = None
 
+        self._save_queue = queue.Queue(maxsize=max(1, int(self._save_queue_size)))
+        self._save_thread = threading.Thread(target=self._save_worker, name='SaveLogic-saving')
+        self._save_thread.daemon = True
+        self._save_thread.start()
+
     def on_deactivate(self):
+        # Finish all pending save jobs and stop the saving thread
+        if self._save_thread is not None:
+            self._save_queue.put(None)
+            self._save_thread.join()
+            self._save_thread = None
+        with self._figure_pool_lock:
+            if self._figure_pool is not None:
+                self._figure_pool.close()
+                self._figure_pool.join()
+                self._figure_pool = None
+
         if self._daily_loghandler is not None:
             # removes the log handler logging into the daily directory
             logging.getLogger().removeHandler(self._daily_loghandler)
@@ -238,7 +280,8 @@ class SaveLogic(GenericLogic):
         self._daily_loghandler.setLevel(level)
 
     def save_data(self, data, filepath=None, parameters=None, filename=None, filelabel=None,
-                  timestamp=None, filetype='text', fmt='%.15e', delimiter='\t', plotfig=None):
+                  timestamp=None, filetype='text', fmt='%.15e', delimiter='\t', plotfig=None,
+                  compression=None, module_name=None):
         """
         General save routine for data.
 
@@ -284,7 +327,11 @@ class SaveLogic(GenericLogic):
                                    filename and a timestamp, because then the timestamp will be
                                    ignored.
         @param string filetype: optional, the file format the data should be saved in. Valid inputs
-                                are 'text', 'xml' and 'npz'. Default is 'text'.
+                                are 'text', 'npz' and 'hdf5'. Default is 'text'.
+                                For 'npz' the data arrays are stored in binary form and the
+                                header is saved in an additional textfile. For 'hdf5' the arrays
+                                become datasets and the parameters become file attributes.
+                                Binary files can be read back memory mapped with load_data.
         @param string or list of strings fmt: optional, format specifier for saved data. See python
                                               documentation for
                                               "Format Specification Mini-Language". If you want for
@@ -299,6 +346,12 @@ class SaveLogic(GenericLogic):
                                               behaviour or failure to save right away.
         @param string delimiter: optional, insert here the delimiter, like '\n' for new line, '\t'
                                  for tab, ',' for a comma ect.
+        @param bool compression: optional, compress the data arrays of binary file formats
+                                 ('npz' and 'hdf5'). Compressed arrays can not be read memory
+                                 mapped. Default is True for 'npz' and False for 'hdf5'.
+        @param string module_name: optional, name of the calling module used for the default file
+                                   path, file label and header. Determined from the call stack if
+                                   not given.
 
         1D data
         =======
@@ -385,34 +438,25 @@ class SaveLogic(GenericLogic):
             return -1
 
         # try to trace back the functioncall to the class which was calling it.
-        try:
-            frm = inspect.stack()[1]
-            # this will get the object, which called the save_data function.
-            mod = inspect.getmodule(frm[0])
-            # that will extract the name of the class.
-            module_name = mod.__name__.split('.')[-1]
-        except:
-            # Sometimes it is not possible to get the object which called the save_data function
-            # (such as when calling this from the console).
-            module_name = 'UNSPECIFIED'
-
-        # determine proper file path
-        if filepath is None:
-            filepath = self.get_path_for_module(module_name)
-        elif not os.path.exists(filepath):
-            os.makedirs(filepath)
-            self.log.info('Custom filepath does not exist. Created directory "{0}"'
-                          ''.format(filepath))
-
-        # create filelabel if none has been passed
-        if filelabel is None:
-            filelabel = module_name
-        if self.active_poi_name != '':
-            filelabel = self.active_poi_name.replace(' ', '_') + '_' + filelabel
-
-        # determine proper unique filename to save if none has been passed
-        if filename is None:
-            filename = timestamp.strftime('%Y%m%d-%H%M-%S' + '_' + filelabel + '.dat')
+        if module_name is None:
+            module_name = self._get_calling_module_name()
+
+        # determine proper file path and filename
+        filepath, filename = self._get_file_location(module_name=module_name,
+                                                     filepath=filepath,
+                                                     filename=filename,
+                                                     filelabel=filelabel,
+                                                     timestamp=timestamp)
+
+        if filetype == 'hdf5' and not data_storage.hdf5_available():
+            self.log.error('Saving data in HDF5 format requires the python package "h5py". '
+                           'Saving as textfile.')
+            filetype = 'text'
+        elif filetype not in ('text', 'npz', 'hdf5'):
+            self.log.error('Only saving of data as textfile, npz-file and hdf5-file is '
+                           'implemented. Filetype "{0}" is not supported yet. Saving as textfile.'
+                           ''.format(filetype))
+            filetype = 'text'
 
         # Check format specifier.
         if not isinstance(fmt, str) and len(fmt) != len(data):
@@ -447,7 +491,6 @@ class SaveLogic(GenericLogic):
         header += '\nData:\n=====\n'
 
         # write data to file
-        # FIXME: Implement other file formats
         # write to textfile
         if filetype == 'text':
             # Reshape data if multiple 1D arrays have been passed to this method.
@@ -494,78 +537,452 @@ class SaveLogic(GenericLogic):
         # write npz file and save parameters in textfile
         elif filetype == 'npz':
             header += str(list(data.keys()))[1:-1]
-            np.savez_compressed(filepath + '/' + filename[:-4], **data)
+            data_storage.save_npz(os.path.join(filepath, filename[:-4] + '.npz'),
+                                  data,
+                                  compression=compression is not False)
             self.save_array_as_text(data=[], filename=filename[:-4]+'_params.dat', filepath=filepath,
                                     fmt=fmt, header=header, delimiter=delimiter, comments='#',
                                     append=False)
+        # write hdf5 file with parameters as file attributes
         else:
-            self.log.error('Only saving of data as textfile and npz-file is implemented. Filetype "{0}" is not '
-                           'supported yet. Saving as textfile.'.format(filetype))
-            self.save_array_as_text(data=data[identifier_str], filename=filename, filepath=filepath,
-                                    fmt=fmt, header=header, delimiter=delimiter, comments='#',
-                                    append=False)
+            data_storage.save_hdf5(os.path.join(filepath, filename[:-4] + '.h5'),
+                                   data,
+                                   attributes=self._get_file_attributes(module_name,
+                                                                        timestamp,
+                                                                        parameters),
+                                   compression=bool(compression))
 
         #--------------------------------------------------------------------------------------------
         # Save thumbnail figure of plot
         if plotfig is not None:
-            # create Metadata
-            metadata = dict()
-            metadata['Title'] = 'Image produced by qudi: ' + module_name
-            metadata['Author'] = 'qudi - Software Suite'
-            metadata['Subject'] = 'Find more information on: https://github.com/Ulm-IQO/qudi'
-            metadata['Keywords'] = 'Python 3, Qt, experiment control, automation, measurement, software, framework, modular'
-            metadata['Producer'] = 'qudi - Software Suite'
-            if timestamp is not None:
-                metadata['CreationDate'] = timestamp
-                metadata['ModDate'] = timestamp
-            else:
-                metadata['CreationDate'] = time
-                metadata['ModDate'] = time
-            
-            if self.save_pdf:
-                # determine the PDF-Filename
-                fig_fname_vector = os.path.join(filepath, filename)[:-4] + '_fig.pdf'
-
-                # Create the PdfPages object to which we will save the pages:
-                # The with statement makes sure that the PdfPages object is closed properly at
-                # the end of the block, even if an Exception occurs.
-                with PdfPages(fig_fname_vector) as pdf:
-                    pdf.savefig(plotfig, bbox_inches='tight', pad_inches=0.05)
-
-                    # We can also set the file's metadata via the PdfPages object:
-                    pdf_metadata = pdf.infodict()
-                    for x in metadata:
-                        pdf_metadata[x] = metadata[x]
-
-            if self.save_png:
-                # determine the PNG-Filename and save the plain PNG
-                fig_fname_image = os.path.join(filepath, filename)[:-4] + '_fig.png'
-                plotfig.savefig(fig_fname_image, bbox_inches='tight', pad_inches=0.05)
-
-                # Use Pillow (an fork for PIL) to attach metadata to the PNG
-                png_image = Image.open(fig_fname_image)
-                png_metadata = PngImagePlugin.PngInfo()
-
-                # PIL can only handle Strings, so let's convert our times
-                metadata['CreationDate'] = metadata['CreationDate'].strftime('%Y%m%d-%H%M-%S')
-                metadata['ModDate'] = metadata['ModDate'].strftime('%Y%m%d-%H%M-%S')
-
-                for x in metadata:
-                    # make sure every value of the metadata is a string
-                    if not isinstance(metadata[x], str):
-                        metadata[x] = str(metadata[x])
-
-                    # add the metadata to the picture
-                    png_metadata.add_text(x, metadata[x])
-
-                # save the picture again, this time including the metadata
-                png_image.save(fig_fname_image, "png", pnginfo=png_metadata)
+            metadata = self._get_figure_metadata(module_name, timestamp)
+            self._save_figure(plotfig, os.path.join(filepath, filename)[:-4], metadata)
 
             # close matplotlib figure
             plt.close(plotfig)
             self.log.debug('Time needed to save data: {0:.2f}s'.format(time.time()-start_time))
             #----------------------------------------------------------------------------------
 
+    def save_data_async(self, data, **kwargs):
+        """
+        Queue data to be saved by a background thread and return immediately.
+        Takes the same arguments as save_data. The data arrays and parameters are copied, so the
+        caller is free to modify them afterwards. The passed figure must not be used any more.
+
+        If the queue is full (see ConfigOption save_queue_size) this call blocks until a queued
+        job has been finished. After each job sigSaveJobFinished is emitted with the job ID and a
+        success flag. Use wait_for_saves to block until all queued jobs are finished.
+
+        @param dictionary data: data to save, see save_data
+        @param kwargs: keyword arguments of save_data
+
+        @return int: ID of the queued save job
+        """
+        if kwargs.get('module_name') is None:
+            kwargs['module_name'] = self._get_calling_module_name()
+        if kwargs.get('timestamp') is None:
+            kwargs['timestamp'] = datetime.datetime.now()
+        if isinstance(kwargs.get('parameters'), dict):
+            kwargs['parameters'] = kwargs['parameters'].copy()
+        data = data.copy()
+        for key, value in data.items():
+            data[key] = np.array(netobtain(value))
+
+        job_id = next(self._save_job_ids)
+        if self._save_thread is None:
+            success = self.save_data(data, **kwargs) != -1
+            self.sigSaveJobFinished.emit(job_id, success)
+        else:
+            self._save_queue.put((job_id, data, kwargs))
+        return job_id
+
+    def wait_for_saves(self):
+        """
+        Block until all jobs queued by save_data_async are finished and all figures are written.
+        """
+        if self._save_queue is not None:
+            self._save_queue.join()
+        with self._figure_pool_lock:
+            figure_results = list(self._figure_results)
+        for result in figure_results:
+            result.wait()
+        return
+
+    @property
+    def pending_saves(self):
+        """
+        Number of jobs queued by save_data_async and figures being rendered in the background,
+        which are not finished yet.
+        """
+        with self._figure_pool_lock:
+            self._figure_results = [res for res in self._figure_results if not res.ready()]
+            pending_figures = len(self._figure_results)
+        if self._save_queue is None:
+            return pending_figures
+        return self._save_queue.unfinished_tasks + pending_figures
+
+    def _save_worker(self):
+        """
+        Target of the background saving thread. Processes jobs queued by save_data_async until
+        a None job is received.
+        """
+        while True:
+            job = self._save_queue.get()
+            try:
+                if job is None:
+                    break
+                job_id, data, kwargs = job
+                self._thread_figure_results.results = list()
+                try:
+                    success = self.save_data(data, **kwargs) != -1
+                except:
+                    self.log.exception('Saving of data in background failed:')
+                    success = False
+                # The job is finished once the figures of this job are written as well
+                for result in self._thread_figure_results.results:
+                    result.wait()
+                    success = success and result.successful()
+                self.sigSaveJobFinished.emit(job_id, success)
+            finally:
+                self._save_queue.task_done()
+        return
+
+    @staticmethod
+    def _get_figure_metadata(module_name, timestamp):
+        """
+        Create the metadata to add to saved figures.
+
+        @return dict: metadata of the figure files
+        """
+        metadata = dict()
+        metadata['Title'] = 'Image produced by qudi: ' + module_name
+        metadata['Author'] = 'qudi - Software Suite'
+        metadata['Subject'] = 'Find more information on: https://github.com/Ulm-IQO/qudi'
+        metadata['Keywords'] = 'Python 3, Qt, experiment control, automation, measurement, software, framework, modular'
+        metadata['Producer'] = 'qudi - Software Suite'
+        metadata['CreationDate'] = timestamp
+        metadata['ModDate'] = timestamp
+        return metadata
+
+    def _save_figure(self, plotfig, file_base, metadata):
+        """
+        Save a matplotlib figure as PDF/PNG file. If enabled the figure is pickled and rendered in
+        a separate process without waiting for the files to be written (see wait_for_saves).
+        Falls back to rendering in the calling thread if the figure can not be pickled.
+
+        @param matplotlib.figure.Figure plotfig: the figure to save
+        @param str file_base: full path of the files to create without ending
+        @param dict metadata: metadata to add to the files
+        """
+        if self._render_figures_in_process:
+            try:
+                pickled_figure = pickle.dumps(plotfig)
+            except Exception:
+                self.log.debug('Unable to pickle figure. Rendering figure in current process.')
+            else:
+                try:
+                    with self._figure_pool_lock:
+                        if self._figure_pool is None:
+                            context = multiprocessing.get_context('spawn')
+                            self._figure_pool = context.Pool(
+                                processes=1,
+                                initializer=figure_export.init_figure_process,
+                                initargs=(self.mpl_qd_style,))
+                        result = self._figure_pool.apply_async(
+                            figure_export.save_pickled_figure,
+                            (pickled_figure, file_base, metadata, self.save_pdf, self.save_png),
+                            error_callback=lambda err: self.log.error(
+                                'Rendering figure "{0}" in separate process failed: '
+                                '{1}'.format(file_base, err)))
+                        self._figure_results = [res for res in self._figure_results
+                                                if not res.ready()]
+                        self._figure_results.append(result)
+                    if hasattr(self._thread_figure_results, 'results'):
+                        self._thread_figure_results.results.append(result)
+                    return
+                except Exception:
+                    self.log.exception('Rendering figure in separate process failed. Rendering '
+                                       'figure in current process.')
+        figure_export.save_figure(plotfig, file_base, metadata, save_pdf=self.save_pdf,
+                                  save_png=self.save_png)
+        return
+
+    def open_data_stream(self, filepath=None, parameters=None, filename=None, filelabel=None,
+                         timestamp=None, filetype='hdf5', compression=None, module_name=None):
+        """
+        Open a binary data file to append data arrays to while they are acquired.
+        File location and naming follow the same rules as in save_data.
+
+        The returned stream object has an "append" method taking a dictionary of data arrays like
+        save_data. Arrays with the same key are concatenated along their first axis.
+        The stream must be closed after the acquisition (supports the "with" statement).
+
+        @param string filepath: optional, the path to the directory, where the data will be saved.
+        @param dictionary parameters: optional, a dictionary with all parameters you want to save
+                                      alongside the data.
+        @param string filename: optional, fixed filename (without ending)
+        @param string filelabel: optional, label to create the filename with
+        @param datetime timestamp: optional, timestamp to create the filename with
+        @param string filetype: optional, the file format. Valid inputs are 'hdf5' and 'npz'.
+        @param bool compression: optional, compress the data arrays. Default is True for 'npz'
+                                 and False for 'hdf5'.
+        @param string module_name: optional, name of the calling module. Determined from the call
+                                   stack if not given.
+
+        @return DataStream: stream object to append data to
+        """
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+        if filename is not None:
+            filename += '.dat'
+        if module_name is None:
+            module_name = self._get_calling_module_name()
+        filepath, filename = self._get_file_location(module_name=module_name,
+                                                     filepath=filepath,
+                                                     filename=filename,
+                                                     filelabel=filelabel,
+                                                     timestamp=timestamp)
+        if isinstance(parameters, dict) and isinstance(self._additional_parameters, dict):
+            parameters = {**self._additional_parameters, **parameters}
+        attributes = self._get_file_attributes(module_name, timestamp, parameters)
+
+        if filetype == 'hdf5':
+            return data_storage.Hdf5DataStream(os.path.join(filepath, filename[:-4] + '.h5'),
+                                               attributes=attributes,
+                                               compression=bool(compression))
+        if filetype != 'npz':
+            raise ValueError('Data streams can only be opened for filetype "hdf5" or "npz", not '
+                             '"{0}".'.format(filetype))
+        header = ''.join('{0}: {1}\n'.format(key, value) for key, value in attributes.items())
+        self.save_array_as_text(data=[], filename=filename[:-4] + '_params.dat',
+                                filepath=filepath, header=header)
+        return data_storage.NpzDataStream(os.path.join(filepath, filename[:-4] + '.npz'),
+                                          compression=compression is not False)
+
+    def open_array_stream(self, columns, filepath=None, parameters=None, filename=None,
+                          filelabel=None, timestamp=None, header='', chunk_rows=65536,
+                          module_name=None):
+        """
+        Open a npy file to append the rows of a 2D array to while they are acquired, e.g. for long
+        time trace recordings. File location and naming follow the same rules as in save_data.
+
+        Only a fixed size chunk of rows is kept in memory. Each full chunk is written to disk and
+        the file is kept readable at all times, so a recording is not lost if qudi crashes.
+        The parameters are saved in a separate text file ending with "_params.dat" right away and
+        are updated when the stream is closed with close_array_stream.
+
+        @param int columns: number of values per row
+        @param string filepath: optional, the path to the directory, where the data will be saved.
+        @param dictionary parameters: optional, a dictionary with all parameters you want to save
+                                      alongside the data.
+        @param string filename: optional, fixed filename (without ending)
+        @param string filelabel: optional, label to create the filename with
+        @param datetime timestamp: optional, timestamp to create the filename with
+        @param string header: optional, description of the columns
+        @param int chunk_rows: optional, number of rows to collect before writing them to disk
+        @param string module_name: optional, name of the calling module. Determined from the call
+                                   stack if not given.
+
+        @return NpyArrayStream: stream object to append rows to
+        """
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+        if filename is not None:
+            filename += '.dat'
+        if module_name is None:
+            module_name = self._get_calling_module_name()
+        filepath, filename = self._get_file_location(module_name=module_name,
+                                                     filepath=filepath,
+                                                     filename=filename,
+                                                     filelabel=filelabel,
+                                                     timestamp=timestamp)
+        if isinstance(parameters, dict) and isinstance(self._additional_parameters, dict):
+            parameters = {**self._additional_parameters, **parameters}
+
+        stream = data_storage.NpyArrayStream(
+            self._get_unique_file_base(os.path.join(filepath, filename[:-4])) + '.npy',
+            columns=columns,
+            chunk_rows=chunk_rows)
+        stream.module_name = module_name
+        stream.timestamp = timestamp
+        stream.filelabel = filelabel
+        stream.header = header
+        self._save_array_stream_parameters(stream, parameters)
+        return stream
+
+    def close_array_stream(self, stream, parameters=None, plotfig=None, filelabel=None,
+                           timestamp=None):
+        """
+        Close a stream opened with open_array_stream. Takes constant time independent of the
+        amount of recorded data.
+
+        The files are renamed if a new file label or timestamp is given, e.g. to add a postfix
+        that is only known at the end of the recording or to name the files after the stop time.
+
+        @param NpyArrayStream stream: the stream to close
+        @param dictionary parameters: optional, parameters to save alongside the data. Replaces the
+                                      parameters given upon opening the stream.
+        @param matplotlib.figure.Figure plotfig: optional, figure to save alongside the data
+        @param string filelabel: optional, new label to create the filename with
+        @param datetime timestamp: optional, new timestamp to create the filename with
+        """
+        stream.close()
+        if filelabel is not None or timestamp is not None:
+            self._rename_array_stream(stream, filelabel, timestamp)
+            if parameters is None:
+                parameters = stream.parameters
+        if parameters is not None:
+            if isinstance(parameters, dict) and isinstance(self._additional_parameters, dict):
+                parameters = {**self._additional_parameters, **parameters}
+            self._save_array_stream_parameters(stream, parameters)
+        if plotfig is not None:
+            metadata = self._get_figure_metadata(stream.module_name, stream.timestamp)
+            self._save_figure(plotfig, stream.file_path[:-4], metadata)
+            plt.close(plotfig)
+        return
+
+    def _rename_array_stream(self, stream, filelabel=None, timestamp=None):
+        """
+        Rename the files of a closed NpyArrayStream after a new file label and/or timestamp.
+        The parameter file has to be written again afterwards.
+        """
+        if filelabel is None:
+            filelabel = stream.filelabel
+        if timestamp is None:
+            timestamp = stream.timestamp
+        filepath, filename = self._get_file_location(module_name=stream.module_name,
+                                                     filepath=os.path.dirname(stream.file_path),
+                                                     filelabel=filelabel,
+                                                     timestamp=timestamp)
+        file_base = os.path.join(filepath, filename[:-4])
+        if file_base != stream.file_path[:-4]:
+            file_base = self._get_unique_file_base(file_base)
+            os.rename(stream.file_path, file_base + '.npy')
+            params_path = stream.file_path[:-4] + '_params.dat'
+            if os.path.exists(params_path):
+                os.remove(params_path)
+            stream.file_path = file_base + '.npy'
+        stream.filelabel = filelabel
+        stream.timestamp = timestamp
+        return
+
+    @staticmethod
+    def _get_unique_file_base(file_base):
+        """
+        Append an index to a file path without ending if a npy file with this name exists already.
+        Running or finished recordings are never overwritten, e.g. if two are started within a
+        second.
+
+        @param str file_base: full path of the file without ending
+
+        @return str: file path without ending which is not used by a npy file
+        """
+        unique_base = file_base
+        index = 0
+        while os.path.exists(unique_base + '.npy'):
+            index += 1
+            unique_base = '{0}_{1:d}'.format(file_base, index)
+        return unique_base
+
+    def _save_array_stream_parameters(self, stream, parameters):
+        """
+        Write the parameters of a NpyArrayStream into a text file next to the npy file.
+        """
+        stream.parameters = parameters
+        attributes = self._get_file_attributes(stream.module_name, stream.timestamp, parameters)
+        header = ''.join('{0}: {1}\n'.format(key, value) for key, value in attributes.items())
+        header += '\nData file: {0}\n'.format(os.path.basename(stream.file_path))
+        if stream.header:
+            header += 'Columns: {0}\n'.format(stream.header)
+        filepath, filename = os.path.split(stream.file_path)
+        self.save_array_as_text(data=[], filename=filename[:-4] + '_params.dat',
+                                filepath=filepath, header=header)
+        return
+
+    def load_data(self, filename, filepath='', mmap=True):
+        """
+        Load data arrays and parameters from a binary file created by save_data or
+        open_data_stream (filetype 'npz' or 'hdf5').
+        Uncompressed arrays are memory mapped read-only if mmap is True.
+
+        @param string filename: name of the file including the ending (.npz or .h5)
+        @param string filepath: optional, the directory containing the file
+        @param bool mmap: optional, memory map the arrays if possible. Default is True.
+
+        @return (dict, dict): data arrays and parameters (parameters only available for hdf5)
+        """
+        return data_storage.load_data_file(os.path.join(filepath, filename), mmap=mmap)
+
+    def _get_calling_module_name(self):
+        """
+        Try to trace back the function call to the module which called the SaveLogic method.
+        Only the single frame of the caller is accessed and the resulting name is cached per
+        calling code object, so this is cheap enough to be called for every save.
+
+        @return string: name of the calling module or 'UNSPECIFIED' if it can not be determined
+        """
+        try:
+            # frame of the function which called the public SaveLogic method
+            frame = sys._getframe(2)
+        except (AttributeError, ValueError):
+            return 'UNSPECIFIED'
+        code = frame.f_code
+        module_name = self._caller_module_names.get(code)
+        if module_name is None:
+            # Sometimes it is not possible to get the module which called the save_data function
+            # (such as when calling this from the console, a notebook or a script).
+            module_name = frame.f_globals.get('__name__')
+            if not module_name or module_name == '__main__' or module_name.startswith('<'):
+                module_name = 'UNSPECIFIED'
+            # that will extract the name of the module without package.
+            module_name = module_name.split('.')[-1]
+            self._caller_module_names[code] = module_name
+        return module_name
+
+    def _get_file_location(self, module_name, filepath=None, filename=None, filelabel=None,
+                           timestamp=None):
+        """
+        Determine the directory and the filename to save data to and create the directory if
+        needed.
+
+        @return (str, str): file path and file name (with ".dat" ending)
+        """
+        # determine proper file path
+        if filepath is None:
+            filepath = self.get_path_for_module(module_name)
+        elif not os.path.exists(filepath):
+            os.makedirs(filepath)
+            self.log.info('Custom filepath does not exist. Created directory "{0}"'
+                          ''.format(filepath))
+
+        # create filelabel if none has been passed
+        if filelabel is None:
+            filelabel = module_name
+        if self.active_poi_name != '':
+            filelabel = self.active_poi_name.replace(' ', '_') + '_' + filelabel
+
+        # determine proper unique filename to save if none has been passed
+        if filename is None:
+            filename = timestamp.strftime('%Y%m%d-%H%M-%S' + '_' + filelabel + '.dat')
+        return filepath, filename
+
+    def _get_file_attributes(self, module_name, timestamp, parameters):
+        """
+        Collect the information usually written into the text file header as dictionary.
+
+        @return OrderedDict: attribute names and values
+        """
+        attributes = OrderedDict()
+        attributes['Saved Data from the class'] = module_name
+        attributes['Timestamp'] = timestamp.strftime('%d.%m.%Y at %Hh%Mm%Ss')
+        if self.active_poi_name != '':
+            attributes['Measured at POI'] = self.active_poi_name
+        if isinstance(parameters, dict):
+            attributes.update(parameters)
+        elif parameters is not None:
+            attributes['not specified parameters'] = str(parameters)
+        return attributes
+
     def save_array_as_text(self, data, filename, filepath='', fmt='%.15e', header='',
                            delimiter='\t', comments='#', append=False):
         """
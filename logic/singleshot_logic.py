@@ -33,6 +33,110 @@ from logic.generic_logic import GenericLogic
 from qtpy import QtCore
 
 
+class SingleShotBinning:
+    """
+    All binnings of a single shot trace from 1 up to max_binning shots per bin.
+
+    The bins are calculated from the cumulative sum of the trace, so each binning costs only
+    O(shots / binning). New shots can be added at any time with add_data and only the bins
+    completed by the new shots are calculated.
+    """
+    def __init__(self, max_binning, channels=2):
+        """
+        @param int max_binning: largest number of shots added up in one bin
+        @param int channels: number of values per shot (e.g. one per laser pulse)
+        """
+        self._max_binning = max(int(max_binning), 0)
+        self._channels = int(channels)
+        self.clear()
+        return
+
+    @property
+    def max_binning(self):
+        return self._max_binning
+
+    @property
+    def shots(self):
+        """ Number of shots added so far """
+        return self._shots
+
+    def clear(self):
+        """ Discard all shots """
+        self._shots = 0
+        self._cumsum = None
+        # Cumulative sum at the end of the last complete bin of each binning
+        self._bin_edges = None
+        self._bins = [list() for _ in range(self._max_binning)]
+        return
+
+    def add_data(self, data):
+        """
+        Add new shots and update all binnings.
+
+        @param numpy.ndarray data: new shots with shape (shots, channels)
+        """
+        data = np.asarray(data).reshape(-1, self._channels)
+        if len(data) == 0:
+            return
+        if self._cumsum is None:
+            # Sum integer counts exactly
+            dtype = np.int64 if np.issubdtype(data.dtype, np.integer) else np.float64
+            self._cumsum = np.zeros(self._channels, dtype=dtype)
+            self._bin_edges = np.zeros((self._max_binning, self._channels), dtype=dtype)
+        old_shots = self._shots
+        # cumsum[i] is the sum of all shots before shot old_shots + i
+        cumsum = np.empty((len(data) + 1, self._channels), dtype=self._cumsum.dtype)
+        cumsum[0] = self._cumsum
+        np.cumsum(data, axis=0, out=cumsum[1:])
+        cumsum[1:] += self._cumsum
+        self._shots += len(data)
+        self._cumsum = cumsum[-1].copy()
+
+        for index in range(self._max_binning):
+            binning = index + 1
+            first = old_shots // binning + 1
+            last = self._shots // binning
+            if last < first:
+                continue
+            edges = cumsum[first * binning - old_shots:last * binning - old_shots + 1:binning]
+            new_bins = np.empty_like(edges)
+            new_bins[0] = edges[0] - self._bin_edges[index]
+            np.subtract(edges[1:], edges[:-1], out=new_bins[1:])
+            self._bin_edges[index] = edges[-1]
+            self._bins[index].append(new_bins)
+        return
+
+    def get_binning(self, binning):
+        """
+        Trace with the given number of shots added up in each bin. Incomplete bins at the end
+        are omitted.
+
+        @param int binning: number of shots per bin (1 to max_binning)
+
+        @return numpy.ndarray: binned trace with shape (bins, channels)
+        """
+        if not 0 < binning <= self._max_binning:
+            raise ValueError('Binning must be in the range 1 to {0:d}.'.format(self._max_binning))
+        chunks = self._bins[binning - 1]
+        if len(chunks) == 0:
+            dtype = np.float64 if self._cumsum is None else self._cumsum.dtype
+            return np.zeros((0, self._channels), dtype=dtype)
+        if len(chunks) > 1:
+            chunks[:] = [np.concatenate(chunks)]
+        return chunks[0]
+
+    def get_all_binnings(self):
+        """
+        All binnings in an object array, starting with one shot per bin.
+
+        @return numpy.ndarray: object array of the binned traces (see get_binning)
+        """
+        bin_list = np.empty(self._max_binning, dtype=object)
+        for index in range(self._max_binning):
+            bin_list[index] = self.get_binning(index + 1)
+        return bin_list
+
+
 class SingleShotLogic(GenericLogic):
     """ This class brings raw data coming from fastcounter measurements (gated or ungated)
         into trace form processable by the trace_analysis_logic.
@@ -75,6 +179,7 @@ class SingleShotLogic(GenericLogic):
         self._hist_num_bins = None
 
         self.data_dict = None
+        self.streaming_binning = None
 
     def on_activate(self):
         """ Initialisation performed during activation of the module.
@@ -241,29 +346,35 @@ class SingleShotLogic(GenericLogic):
         # this is just a guess value, at some point it doesn't make
         # sense anymore to further decrease the number of bins
         max_bin = NN // num_bins
-        count_var = 1
-        bin_list = []
-        temp_list = []
         signal = self.sum_laserpulse()
-        while count_var <= max_bin:
-            # check if the the first run through loop was done
-            if temp_list:
-                app_arr = np.array(temp_list)
-                bin_list.append(app_arr)
-                temp_list = []
-            jj = 0
-            while jj < NN:
-                sum_ind = np.linspace(jj, jj + count_var - 1, count_var, dtype=np.int)
-                # make sure we don't try to adress not reserved memory
-                jj += count_var
-                if sum_ind[-1] < NN:
-                    # normalize
-                    temp_list.append(np.array([np.sum(signal[sum_ind, 0]), np.sum(signal[sum_ind, 1])]))
-                else:
-                    jj = NN
-            count_var += 1
-
-        return np.array(bin_list)
+        binning = SingleShotBinning(max_bin - 1, channels=2)
+        binning.add_data(signal[:NN, :2])
+        return binning.get_all_binnings()
+
+    def start_streaming_binnings(self, max_binning):
+        """
+        Start a new set of binnings to be updated with add_streaming_data while the single shot
+        data is acquired.
+
+        @param int max_binning: largest number of shots added up in one bin
+        """
+        self.streaming_binning = SingleShotBinning(max_binning, channels=2)
+        return
+
+    def add_streaming_data(self, signal):
+        """
+        Add newly acquired shots to the streaming binnings. Only the bins completed by the new
+        shots are calculated.
+
+        @param numpy.ndarray signal: new shots with shape (shots, 2), e.g. from sum_laserpulse
+
+        @return numpy.ndarray: object array with all binnings (see calc_all_binnings)
+        """
+        if self.streaming_binning is None:
+            self.log.error('Call start_streaming_binnings before adding streaming data.')
+            return np.empty(0, dtype=object)
+        self.streaming_binning.add_data(np.asarray(signal)[:, :2])
+        return self.streaming_binning.get_all_binnings()
 
     def calc_all_binnings_normalized(self, num_bins=100):
         """
@@ -275,12 +386,11 @@ class SingleShotLogic(GenericLogic):
         """
 
         bin_list = self.calc_all_binnings(num_bins=num_bins)
-        normalized_bin_list = []
-        for binning in bin_list:
-            normalized_binning = (binning[:, 0] - binning[:, 1])/(binning[:, 0] + binning[:, 1])
-            normalized_bin_list.append(normalized_binning)
+        normalized_bin_list = np.empty(len(bin_list), dtype=object)
+        for index, binning in enumerate(bin_list):
+            normalized_bin_list[index] = (binning[:, 0] - binning[:, 1])/(binning[:, 0] + binning[:, 1])
 
-        return np.array(normalized_bin_list)
+        return normalized_bin_list
 
 
     def get_timetrace(self):
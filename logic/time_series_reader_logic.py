@@ -22,6 +22,7 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 from qtpy import QtCore
 import numpy as np
 import datetime as dt
+import os
 import time
 import matplotlib.pyplot as plt
 
@@ -31,6 +32,7 @@ from core.configoption import ConfigOption
 from logic.generic_logic import GenericLogic
 from core.util.mutex import Mutex
 from core.util.units import ScaledFloat
+from core.util.ring_buffer import RingBuffer, RunningMean
 from interface.data_instream_interface import StreamChannelType, StreamingMode
 
 
@@ -61,6 +63,13 @@ class TimeSeriesReaderLogic(GenericLogic):
     # config options
     _max_frame_rate = ConfigOption('max_frame_rate', default=10, missing='warn')
     _calc_digital_freq = ConfigOption('calc_digital_freq', default=True, missing='warn')
+    # Number of samples kept in memory before they are written to the recording file
+    _recording_chunk_size = ConfigOption('recording_chunk_size', default=65536, missing='nothing')
+
+    # Maximum number of points per channel drawn in the figure of a recording
+    _max_figure_points = 100000
+    # Capacity of the preallocated read buffers in units of data frames
+    _read_buffer_frames = 4
 
     # status vars
     _trace_window_size = StatusVar('trace_window_size', default=6)
@@ -87,10 +96,14 @@ class TimeSeriesReaderLogic(GenericLogic):
         self._trace_data = None
         self._trace_times = None
         self._trace_data_averaged = None
-        self.__moving_filter = None
+        self._running_mean = None
+        # Preallocated buffers to read the raw data into and to hold the processed data frames
+        self._raw_buffer = None
+        self._frame_buffers = None
+        self._frame_buffer_index = 0
 
         # for data recording
-        self._recorded_data = None
+        self._recorded_stream = None
         self._data_recording_active = False
         self._record_start_time = None
         return
@@ -162,12 +175,28 @@ class TimeSeriesReaderLogic(GenericLogic):
 
     def _init_data_arrays(self):
         window_size = self.trace_window_size_samples
-        self._trace_data = np.zeros(
-            [self.number_of_active_channels, window_size + self._moving_average_width // 2])
-        self._trace_data_averaged = np.zeros(
-            [len(self._averaged_channels), window_size - self._moving_average_width // 2])
+        # Ring buffers holding the continuously running time traces
+        self._trace_data = RingBuffer(window_size + self._moving_average_width // 2,
+                                      self.number_of_active_channels)
+        self._trace_data_averaged = RingBuffer(
+            max(window_size - self._moving_average_width // 2, 1), len(self._averaged_channels))
+        self._running_mean = RunningMean(self._moving_average_width, len(self._averaged_channels))
+
+        # Read buffers holding up to several data frames. The streamer writes directly into them.
+        # The buffers are flat, so a contiguous (channels, samples) view can be handed to the
+        # streamer for any number of samples.
+        frame_capacity = max(self._samples_per_frame, 1) * self._read_buffer_frames
+        self._frame_buffers = [
+            np.zeros(self.number_of_active_channels * frame_capacity, dtype=np.float64)
+            for _ in range(2)]
+        self._frame_buffer_index = 0
+        if self.oversampling_factor > 1 or self._streamer.data_type != np.float64:
+            self._raw_buffer = np.zeros(
+                self.number_of_active_channels * frame_capacity * self.oversampling_factor,
+                dtype=self._streamer.data_type)
+        else:
+            self._raw_buffer = None
         self._trace_times = np.arange(window_size) / self.data_rate
-        self._recorded_data = list()
         return
 
     @property
@@ -279,8 +308,9 @@ class TimeSeriesReaderLogic(GenericLogic):
 
     @property
     def trace_data(self):
-        data_offset = self._trace_data.shape[1] - self._moving_average_width // 2
-        data = {ch: self._trace_data[i, :data_offset] for i, ch in
+        data_offset = len(self._trace_data) - self._moving_average_width // 2
+        trace_data = self._trace_data.data
+        data = {ch: trace_data[i, :data_offset] for i, ch in
                 enumerate(self.active_channel_names)}
         return self._trace_times, data
 
@@ -288,9 +318,24 @@ class TimeSeriesReaderLogic(GenericLogic):
     def averaged_trace_data(self):
         if not self.averaged_channel_names or self.moving_average_width <= 1:
             return None, None
-        data = {ch: self._trace_data_averaged[i] for i, ch in
-                enumerate(self.averaged_channel_names)}
-        return self._trace_times[-self._trace_data_averaged.shape[1]:], data
+        averaged_data = self._trace_data_averaged.data
+        data = {ch: averaged_data[i] for i, ch in enumerate(self.averaged_channel_names)}
+        return self._trace_times[-len(self._trace_data_averaged):], data
+
+    def _get_trace_data_snapshot(self):
+        """ Copies of trace_data and averaged_trace_data, which can be sent to other threads.
+        trace_data and averaged_trace_data are views into the ring buffers, which are overwritten
+        by the next data frame. Call with threadlock held.
+
+        @return tuple: trace times, trace data, averaged trace times, averaged trace data
+        """
+        times, data = self.trace_data
+        data = {ch: arr.copy() for ch, arr in data.items()}
+        averaged_times, averaged_data = self.averaged_trace_data
+        if averaged_data is not None:
+            averaged_times = averaged_times.copy()
+            averaged_data = {ch: arr.copy() for ch, arr in averaged_data.items()}
+        return times.copy(), data, averaged_times, averaged_data
 
     @property
     def all_settings(self):
@@ -373,8 +418,6 @@ class TimeSeriesReaderLogic(GenericLogic):
                 if new_val / data_rate > self.trace_window_size:
                     if 'data_rate' in settings_dict or 'trace_window_size' in settings_dict:
                         self._moving_average_width = new_val
-                        self.__moving_filter = np.full(shape=self.moving_average_width,
-                                                       fill_value=1.0 / self.moving_average_width)
                     else:
                         self.log.warning('Moving average width to set ({0:d}) is smaller than the '
                                          'trace window size. Will adjust trace window size to '
@@ -382,8 +425,6 @@ class TimeSeriesReaderLogic(GenericLogic):
                         self._trace_window_size = float(new_val / data_rate)
                 else:
                     self._moving_average_width = new_val
-                    self.__moving_filter = np.full(shape=self.moving_average_width,
-                                                   fill_value=1.0 / self.moving_average_width)
 
             if 'data_rate' in settings_dict:
                 new_val = float(settings_dict['data_rate'])
@@ -463,7 +504,7 @@ class TimeSeriesReaderLogic(GenericLogic):
             settings = self.all_settings
             self.sigSettingsChanged.emit(settings)
             if not restart:
-                self.sigDataChanged.emit(*self.trace_data, *self.averaged_trace_data)
+                self.sigDataChanged.emit(*self._get_trace_data_snapshot())
         if restart:
             self.start_reading()
         return settings
@@ -505,8 +546,7 @@ class TimeSeriesReaderLogic(GenericLogic):
             # self.sigSettingsChanged.emit(settings)
 
             if self._data_recording_active:
-                self._record_start_time = dt.datetime.now()
-                self._recorded_data = list()
+                self._open_recording_stream()
 
             if self._streamer.start_stream() < 0:
                 self.log.error('Error while starting streaming device data acquisition.')
@@ -546,22 +586,34 @@ class TimeSeriesReaderLogic(GenericLogic):
                             'Error while trying to stop streaming device data acquisition.')
                     if self._data_recording_active:
                         self._save_recorded_data(to_file=True, save_figure=True)
-                        self._recorded_data = list()
                     self._data_recording_active = False
                     self.module_state.unlock()
                     self.sigStatusChanged.emit(False, False)
                     return
 
+                # Alternate between the two frame buffers, so the last frame stays valid while
+                # the next one is read.
+                self._frame_buffer_index = 1 - self._frame_buffer_index
+                frame_buffer = self._frame_buffers[self._frame_buffer_index]
+                read_buffer = frame_buffer if self._raw_buffer is None else self._raw_buffer
+
                 samples_to_read = max(
                     (self._streamer.available_samples // self._oversampling_factor) * self._oversampling_factor,
                     self._samples_per_frame * self._oversampling_factor)
+                # Read the rest with the next frame if more samples are available than fit
+                channels = self.number_of_active_channels
+                samples_to_read = min(samples_to_read, read_buffer.size // channels)
                 if samples_to_read < 1:
                     self._sigNextDataFrame.emit()
                     return
 
-                # read the current counter values
-                data = self._streamer.read_data(number_of_samples=samples_to_read)
-                if data.shape[1] != samples_to_read:
+                # read the current counter values directly into a contiguous view of the
+                # preallocated buffer
+                read_buffer = read_buffer[:channels * samples_to_read].reshape(
+                    (channels, samples_to_read))
+                read_samples = self._streamer.read_data_into_buffer(
+                    read_buffer, number_of_samples=samples_to_read)
+                if read_samples != samples_to_read:
                     self.log.error('Reading data from streamer went wrong; '
                                    'killing the stream with next data frame.')
                     self._stop_requested = True
@@ -569,16 +621,27 @@ class TimeSeriesReaderLogic(GenericLogic):
                     return
 
                 # Process data
-                self._process_trace_data(data)
+                if self._raw_buffer is None:
+                    self._process_trace_data(read_buffer)
+                else:
+                    frame_samples = samples_to_read // self._oversampling_factor
+                    self._process_trace_data(
+                        read_buffer,
+                        out=frame_buffer[:channels * frame_samples].reshape(
+                            (channels, frame_samples)))
 
                 # Emit update signal
-                self.sigDataChanged.emit(*self.trace_data, *self.averaged_trace_data)
+                self.sigDataChanged.emit(*self._get_trace_data_snapshot())
                 self._sigNextDataFrame.emit()
         return
 
-    def _process_trace_data(self, data):
+    def _process_trace_data(self, data, out=None):
         """
         Processes raw data from the streaming device
+
+        @param numpy.ndarray data: raw data with shape (channels, samples)
+        @param numpy.ndarray out: optional, preallocated array to store the processed data in.
+                                  If omitted, data is processed in place unless oversampled.
         """
         # Down-sample and average according to oversampling factor
         if self.oversampling_factor > 1:
@@ -589,7 +652,13 @@ class TimeSeriesReaderLogic(GenericLogic):
             tmp = data.reshape((data.shape[0],
                                 data.shape[1] // self.oversampling_factor,
                                 self.oversampling_factor))
-            data = np.mean(tmp, axis=2)
+            if out is None:
+                data = np.mean(tmp, axis=2)
+            else:
+                data = np.mean(tmp, axis=2, out=out[:, :tmp.shape[1]])
+        elif out is not None:
+            out[:, :data.shape[1]] = data
+            data = out[:, :data.shape[1]]
 
         digital_channels = [c for c, typ in self.active_channel_types.items() if
                             typ == StreamChannelType.DIGITAL]
@@ -597,27 +666,18 @@ class TimeSeriesReaderLogic(GenericLogic):
         if self._calc_digital_freq and digital_channels:
             data[:len(digital_channels)] *= self.sampling_rate
 
-        # Append data to save if necessary
-        if self._data_recording_active:
-            self._recorded_data.append(data.copy())
+        # Append data to the recording file if necessary
+        if self._data_recording_active and self._recorded_stream is not None:
+            self._recorded_stream.append(data.transpose())
 
-        data = data[:, -self._trace_data.shape[1]:]
-        new_samples = data.shape[1]
+        # Append new data to the ring buffer of the continuously running time trace
+        self._trace_data.append(data)
 
-        # Roll data array to have a continuously running time trace
-        self._trace_data = np.roll(self._trace_data, -new_samples, axis=1)
-        # Insert new data
-        self._trace_data[:, -new_samples:] = data
-
-        # Calculate moving average by using numpy.convolve with a normalized uniform filter
+        # Calculate the moving average of the new data only
         if self.moving_average_width > 1 and self.averaged_channel_names:
-            # Only convolve the new data and roll the previously calculated moving average
-            self._trace_data_averaged = np.roll(self._trace_data_averaged, -new_samples, axis=1)
-            offset = new_samples + len(self.__moving_filter) - 1
-            for i, ch in enumerate(self.averaged_channel_names):
-                data_index = self.active_channel_names.index(ch)
-                self._trace_data_averaged[i, -new_samples:] = np.convolve(
-                    self._trace_data[data_index, -offset:], self.__moving_filter, mode='valid')
+            data_indices = [self.active_channel_names.index(ch)
+                            for ch in self.averaged_channel_names]
+            self._trace_data_averaged.append(self._running_mean.update(data[data_indices]))
         return
 
     @QtCore.Slot()
@@ -635,8 +695,7 @@ class TimeSeriesReaderLogic(GenericLogic):
 
             self._data_recording_active = True
             if self.module_state() == 'locked':
-                self._recorded_data = list()
-                self._record_start_time = dt.datetime.now()
+                self._open_recording_stream()
                 self.sigStatusChanged.emit(True, True)
             else:
                 self.start_reading()
@@ -658,50 +717,82 @@ class TimeSeriesReaderLogic(GenericLogic):
             self._data_recording_active = False
             if self.module_state() == 'locked':
                 self._save_recorded_data(to_file=True, save_figure=True)
-                self._recorded_data = list()
                 self.sigStatusChanged.emit(True, False)
         return 0
 
-    def _save_recorded_data(self, to_file=True, name_tag='', save_figure=True):
-        """ Save the counter trace data and writes it to a file.
-
-        @param bool to_file: indicate, whether data have to be saved to file
-        @param str name_tag: an additional tag, which will be added to the filename upon save
-        @param bool save_figure: select whether png and pdf should be saved
-
-        @return dict parameters: Dictionary which contains the saving parameters
+    def _open_recording_stream(self):
+        """ Open the file the recorded data is streamed into during the acquisition.
         """
-        if not self._recorded_data:
-            self.log.error('No data has been recorded. Save to file failed.')
-            return np.empty(0), dict()
+        self._record_start_time = dt.datetime.now()
+        header = ', '.join(
+            '{0} ({1})'.format(ch, unit) for ch, unit in self.active_channel_units.items())
+        self._recorded_stream = self._savelogic.open_array_stream(
+            columns=self.number_of_active_channels,
+            filepath=self._savelogic.get_path_for_module(module_name='TimeSeriesReader'),
+            parameters=self._get_recording_parameters(),
+            filelabel='data_trace',
+            timestamp=self._record_start_time,
+            header=header,
+            chunk_rows=self._recording_chunk_size)
+        return
 
-        data_arr = np.concatenate(self._recorded_data, axis=1)
-        if data_arr.size == 0:
-            self.log.error('No data has been recorded. Save to file failed.')
-            return np.empty(0), dict()
+    def _get_recording_parameters(self, stop_time=None):
+        """ Collect the parameters of the current recording.
 
-        saving_stop_time = self._record_start_time + dt.timedelta(
-            seconds=data_arr.shape[1] / self.data_rate)
+        @param datetime.datetime stop_time: optional, end time of the recording
 
-        # write the parameters:
+        @return dict: parameters
+        """
         parameters = dict()
         parameters['Start recoding time'] = self._record_start_time.strftime(
             '%d.%m.%Y, %H:%M:%S.%f')
-        parameters['Stop recoding time'] = saving_stop_time.strftime('%d.%m.%Y, %H:%M:%S.%f')
+        if stop_time is not None:
+            parameters['Stop recoding time'] = stop_time.strftime('%d.%m.%Y, %H:%M:%S.%f')
         parameters['Data rate (Hz)'] = self.data_rate
         parameters['Oversampling factor (samples)'] = self.oversampling_factor
         parameters['Sampling rate (Hz)'] = self.sampling_rate
+        return parameters
 
-        if to_file:
-            # If there is a postfix then add separating underscore
-            filelabel = 'data_trace_{0}'.format(name_tag) if name_tag else 'data_trace'
+    def _save_recorded_data(self, to_file=True, name_tag='', save_figure=True):
+        """ Finish the recording and close the file the data has been streamed into.
 
-            # prepare the data in a dict:
-            header = ', '.join(
-                '{0} ({1})'.format(ch, unit) for ch, unit in self.active_channel_units.items())
+        The recording is saved as a npy file with one column per channel (load with numpy.load).
+        Former versions saved a tab separated ".dat" text file. The parameters are saved in a text
+        file ending with "_params.dat". The files are named after the stop time like before.
 
-            data = {header: data_arr.transpose()}
-            filepath = self._savelogic.get_path_for_module(module_name='TimeSeriesReader')
+        @param bool to_file: indicate, whether data have to be kept in a file. If False the file is
+                             deleted after the data has been read back into memory.
+        @param str name_tag: an additional tag, which will be added to the filename upon save
+        @param bool save_figure: select whether png and pdf should be saved
+
+        @return numpy.ndarray, dict: recorded data (memory mapped if kept in a file), parameters
+        """
+        stream = self._recorded_stream
+        self._recorded_stream = None
+        if stream is None:
+            self.log.error('No data has been recorded. Save to file failed.')
+            return np.empty(0), dict()
+
+        saving_stop_time = self._record_start_time + dt.timedelta(
+            seconds=stream.rows / self.data_rate)
+        parameters = self._get_recording_parameters(stop_time=saving_stop_time)
+
+        if stream.rows == 0 or not to_file:
+            self._savelogic.close_array_stream(stream)
+            data_arr = np.load(stream.file_path).transpose() if stream.rows else np.empty(0)
+            os.remove(stream.file_path)
+            os.remove(stream.file_path[:-4] + '_params.dat')
+            if data_arr.size == 0:
+                self.log.error('No data has been recorded. Save to file failed.')
+                return np.empty(0), dict()
+            return data_arr, parameters
+
+        # The file has been written during the acquisition already, so only the parameters and the
+        # figure are left to save.
+        stream.close()
+        fig = None
+        if save_figure:
+            data_arr = np.load(stream.file_path, mmap_mode='r').transpose()
             set_of_units = set(self.active_channel_units.values())
             unit_list = tuple(self.active_channel_units)
             y_unit = 'arb.u.'
@@ -711,17 +802,21 @@ class TimeSeriesReaderLogic(GenericLogic):
                 if count > occurrences:
                     occurrences = count
                     y_unit = unit
-
-            fig = self._draw_figure(data_arr, self.data_rate, y_unit) if save_figure else None
-
-            self._savelogic.save_data(data=data,
-                                      filepath=filepath,
-                                      parameters=parameters,
-                                      filelabel=filelabel,
-                                      plotfig=fig,
-                                      delimiter='\t',
-                                      timestamp=saving_stop_time)
-            self.log.info('Time series saved to: {0}'.format(filepath))
+            # Only draw a limited number of points for long recordings
+            step = max(data_arr.shape[1] // self._max_figure_points, 1)
+            fig = self._draw_figure(np.array(data_arr[:, ::step]), self.data_rate / step, y_unit)
+            # The memory map has to be released before the files are renamed
+            del data_arr
+
+        # If there is a postfix then add separating underscore
+        filelabel = 'data_trace_{0}'.format(name_tag) if name_tag else 'data_trace'
+        self._savelogic.close_array_stream(stream,
+                                           parameters=parameters,
+                                           plotfig=fig,
+                                           filelabel=filelabel,
+                                           timestamp=saving_stop_time)
+        data_arr = np.load(stream.file_path, mmap_mode='r').transpose()
+        self.log.info('Time series saved to: {0}'.format(stream.file_path))
         return data_arr, parameters
 
     def _draw_figure(self, data, timebase, y_unit):
@@ -774,8 +869,8 @@ class TimeSeriesReaderLogic(GenericLogic):
 
             header = ', '.join(
                 '{0} ({1})'.format(ch, unit) for ch, unit in self.active_channel_units.items())
-            data_offset = self._trace_data.shape[1] - self.moving_average_width // 2
-            data = {header: self._trace_data[:, :data_offset].transpose()}
+            data_offset = len(self._trace_data) - self.moving_average_width // 2
+            data = {header: self._trace_data.data[:, :data_offset].transpose()}
 
             if to_file:
                 filepath = self._savelogic.get_path_for_module(module_name='TimeSeriesReader')
@@ -807,7 +902,6 @@ class TimeSeriesReaderLogic(GenericLogic):
                     'Error while trying to stop streaming device data acquisition.')
             if self._data_recording_active:
                 self._save_recorded_data(to_file=True, save_figure=True)
-                self._recorded_data = list()
             self._data_recording_active = False
             self.module_state.unlock()
             self.sigStatusChanged.emit(False, False)
@@ -33,6 +33,7 @@ from core.connector import Connector
 from core.configoption import ConfigOption
 from logic.generic_logic import GenericLogic
 from core.util.mutex import Mutex
+from core.util.ring_buffer import GrowingArray
 
 
 class HardwarePull(QtCore.QObject):
@@ -73,7 +74,7 @@ class HardwarePull(QtCore.QObject):
         # only wavelength >200 nm make sense, ignore the rest
         if self._parentclass.current_wavelength > 200:
             self._parentclass._wavelength_data.append(
-                np.array([time_stamp, self._parentclass.current_wavelength])
+                (time_stamp, self._parentclass.current_wavelength)
             )
 
         # check if we have a new min or max and save it if so
@@ -127,7 +128,10 @@ class WavemeterLoggerLogic(GenericLogic):
         self._data_index = 0
 
         self._recent_wavelength_window = [0, 0]
-        self.counts_with_wavelength = []
+        # count data with interpolated wavelength (see counts_with_wavelength)
+        self._stitched_data = None
+        # count data of the last scan after the counter logic stopped saving
+        self._count_data = np.empty((0, 2))
 
         self._xmin = 650
         self._xmax = 750
@@ -139,7 +143,7 @@ class WavemeterLoggerLogic(GenericLogic):
     def on_activate(self):
         """ Initialisation performed during activation of the module.
         """
-        self._wavelength_data = []
+        self._wavelength_data = GrowingArray(2)
 
         self.stopRequested = False
 
@@ -216,6 +220,18 @@ class WavemeterLoggerLogic(GenericLogic):
         if len(self.fc.fit_list) > 0:
             self._statusVariables['fits'] = self.fc.save_to_dict()
 
+    @property
+    def counts_with_wavelength(self):
+        """ Count data of the scan with the interpolated wavelength of each count value.
+        The columns are the time (s), the counts (c/s), the wavelength (nm) and the counts of
+        further counter channels.
+
+        @return numpy.ndarray: stitched data with one row per count value
+        """
+        if self._stitched_data is None:
+            return np.empty((0, 3))
+        return self._stitched_data.data
+
     def get_max_wavelength(self):
         """ Current maximum wavelength of the scan.
 
@@ -296,12 +312,13 @@ class WavemeterLoggerLogic(GenericLogic):
 
         if not resume:
             self._acqusition_start_time = self._counter_logic._saving_start_time
-            self._wavelength_data = []
+            self._wavelength_data.clear()
 
             self.data_index = 0
 
             self._recent_wavelength_window = [0, 0]
-            self.counts_with_wavelength = []
+            self._stitched_data = None
+            self._count_data = np.empty((0, 2))
 
             self.rawhisto = np.zeros(self._bins)
             self.sumhisto = np.ones(self._bins) * 1.0e-10
@@ -309,6 +326,7 @@ class WavemeterLoggerLogic(GenericLogic):
             self.intern_xmin = 1.0e10
             self.recent_avg = [0, 0, 0]
             self.recent_count = 0
+            self._recent_sum = np.zeros(3)
 
         # start the measuring thread
         self.sig_handle_timer.emit(True)
@@ -329,10 +347,24 @@ class WavemeterLoggerLogic(GenericLogic):
             self.module_state.stop()
 
         if self._counter_logic.get_saving_state():
-            self._counter_logic.save_data(to_file=False)
+            self._count_data, _ = self._counter_logic.save_data(to_file=False)
 
         return 0
 
+    def _get_count_data(self, rows=None):
+        """ Count data of the current scan. While scanning the data is read from the saving
+        counter logic.
+
+        @param int rows: optional, number of most recent rows to return. All rows if None.
+
+        @return numpy.ndarray: count data with the time in the first column
+        """
+        if self._counter_logic.get_saving_state():
+            return self._counter_logic.get_saved_data(rows)
+        if rows is None:
+            return self._count_data
+        return self._count_data[max(len(self._count_data) - rows, 0):]
+
     def _attach_counts_to_wavelength(self, complete_histogram):
         """ Interpolate a wavelength value for each photon count value.  This process assumes that
         the wavelength is varying smoothly and fairly continuously, which is sensible for most
@@ -350,7 +382,7 @@ class WavemeterLoggerLogic(GenericLogic):
             return
 
         # The end of the recent_wavelength_window is the time of the latest wavelength data
-        self._recent_wavelength_window[1] = self._wavelength_data[-1][0]
+        self._recent_wavelength_window[1] = self._wavelength_data.data[-1, 0]
 
         # (speed-up) We only need to worry about "recent" counts, because as the count data gets
         # very long all the earlier points will already be attached to wavelength values.
@@ -359,8 +391,8 @@ class WavemeterLoggerLogic(GenericLogic):
         # TODO: Does this depend on things, or do we loop fast enough to get every wavelength value?
         wavelength_recentness = np.min([5, len(self._wavelength_data)])
 
-        recent_counts = np.array(self._counter_logic._data_to_save[-count_recentness:])
-        recent_wavelengths = np.array(self._wavelength_data[-wavelength_recentness:])
+        recent_counts = self._get_count_data(count_recentness)
+        recent_wavelengths = self._wavelength_data.data[-wavelength_recentness:]
 
         # The latest counts are those recorded during the recent_wavelength_window
         count_idx = [0, 0]
@@ -378,8 +410,10 @@ class WavemeterLoggerLogic(GenericLogic):
         # Stitch interpolated wavelength into latest counts array
         latest_stitched_data = np.insert(latest_counts, 2, values=interpolated_wavelengths, axis=1)
 
-        # Add this latest data to the list of counts vs wavelength
-        self.counts_with_wavelength += latest_stitched_data.tolist()
+        # Add this latest data to the array of counts vs wavelength
+        if self._stitched_data is None:
+            self._stitched_data = GrowingArray(latest_stitched_data.shape[1])
+        self._stitched_data.append(latest_stitched_data)
 
         # The start of the recent data window for the next round will be the end of this one.
         self._recent_wavelength_window[0] = self._recent_wavelength_window[1]
@@ -408,58 +442,51 @@ class WavemeterLoggerLogic(GenericLogic):
         # Note: The histogram may be recalculated (bins changed, etc) from the stitched data.
         # There is no need to recompute the interpolation for the stitched data.
         if complete_histogram:
-            count_window = len(self._counter_logic._data_to_save)
+            count_data = self._get_count_data()
             self._data_index = 0
             self.log.info('Recalcutating Laser Scanning Histogram for: '
                           '{0:d} counts and {1:d} wavelength.'.format(
-                              count_window,
+                              len(count_data),
                               len(self._wavelength_data)
                           )
                           )
         else:
-            count_window = min(100, len(self._counter_logic._data_to_save))
+            count_data = self._get_count_data(100)
 
-        if count_window < 2:
-            time.sleep(self._logic_update_timing * 1e-3)
-            self.sig_update_histogram_next.emit(False)
+        # The calling loop continues with the next update, so just wait for more data
+        if len(count_data) < 2:
             return
 
-        temp = np.array(self._counter_logic._data_to_save[-count_window:])
-
         # only do something if there is wavelength data to work with
         if len(self._wavelength_data) > 0:
-
-            for i in self._wavelength_data[self._data_index:]:
-                self._data_index += 1
-
-                if i[1] < self._xmin or i[1] > self._xmax:
-                    continue
-
-                # calculate the bin the new wavelength needs to go in
-                newbin = np.digitize([i[1]], self.histogram_axis)[0]
-                # if the bin make no sense, start from the beginning
-                if newbin > len(self.rawhisto) - 1:
-                    continue
-
-                # sum the counts in rawhisto and count the occurence of the bin in sumhisto
-                interpolation = np.interp(i[0], xp=temp[:, 0], fp=temp[:, 1])
-                self.rawhisto[newbin] += interpolation
-                self.sumhisto[newbin] += 1.0
-
-                self.envelope_histogram[newbin] = np.max([interpolation,
-                                                          self.envelope_histogram[newbin]
-                                                          ])
-
-                datapoint = [i[1], i[0], interpolation]
-                if time.time() - self.last_point_time > 1:
-                    self.sig_new_data_point.emit(self.recent_avg)
-                    self.last_point_time = time.time()
-                    self.recent_count = 0
-                else:
-                    self.recent_count += 1
-                    for j in range(3):
-                        self.recent_avg[j] -= self.recent_avg[j] / self.recent_count
-                        self.recent_avg[j] += datapoint[j] / self.recent_count
+            wavelength_data = self._wavelength_data.data[self._data_index:]
+            self._data_index += len(wavelength_data)
+
+            # calculate the bins the new wavelengths need to go in and skip the ones outside
+            wavelengths = wavelength_data[:, 1]
+            new_bins = np.digitize(wavelengths, self.histogram_axis)
+            valid = ((wavelengths >= self._xmin) & (wavelengths <= self._xmax)
+                     & (new_bins < len(self.rawhisto)))
+            new_bins = new_bins[valid]
+            wavelengths = wavelengths[valid]
+            times = wavelength_data[valid, 0]
+
+            # sum the counts in rawhisto and count the occurence of the bins in sumhisto
+            interpolation = np.interp(times, xp=count_data[:, 0], fp=count_data[:, 1])
+            self.rawhisto += np.bincount(new_bins, weights=interpolation,
+                                         minlength=len(self.rawhisto))
+            self.sumhisto += np.bincount(new_bins, minlength=len(self.rawhisto))
+            np.maximum.at(self.envelope_histogram, new_bins, interpolation)
+
+            # average of the data points (wavelength, time, counts) since the last emitted one
+            self._recent_sum += (wavelengths.sum(), times.sum(), interpolation.sum())
+            self.recent_count += len(new_bins)
+            if time.time() - self.last_point_time > 1 and self.recent_count > 0:
+                self.recent_avg = list(self._recent_sum / self.recent_count)
+                self.sig_new_data_point.emit(self.recent_avg)
+                self.last_point_time = time.time()
+                self.recent_count = 0
+                self._recent_sum = np.zeros(3)
 
             # the plot data is the summed counts divided by the occurence of the respective bins
             self.histogram = self.rawhisto / self.sumhisto
@@ -512,7 +539,7 @@ class WavemeterLoggerLogic(GenericLogic):
 
         # prepare the data in a dict or in an OrderedDict:
         data = OrderedDict()
-        data['Time (s), Wavelength (nm)'] = self._wavelength_data
+        data['Time (s), Wavelength (nm)'] = self._wavelength_data.data
         # write the parameters:
         parameters = OrderedDict()
         parameters['Acquisition Timing (ms)'] = self._logic_acquisition_timing
@@ -534,7 +561,7 @@ class WavemeterLoggerLogic(GenericLogic):
 
         # prepare the data in a dict or in an OrderedDict:
         data = OrderedDict()
-        data['Time (s),Signal (counts/s)'] = self._counter_logic._data_to_save
+        data['Time (s),Signal (counts/s)'] = self._get_count_data()
 
         # write the parameters:
         parameters = OrderedDict()
@@ -558,7 +585,8 @@ class WavemeterLoggerLogic(GenericLogic):
 
         # prepare the data in a dict or in an OrderedDict:
         data = OrderedDict()
-        data['Measurement Time (s), Signal (counts/s), Interpolated Wavelength (nm)'] = np.array(self.counts_with_wavelength)
+        data['Measurement Time (s), Signal (counts/s), Interpolated Wavelength (nm)'] = np.array(
+            self.counts_with_wavelength)
 
         fig = self.draw_figure()
         # write the parameters:
@@ -587,8 +615,8 @@ class WavemeterLoggerLogic(GenericLogic):
         """
         # TODO: Draw plot for second APD if it is connected
 
-        wavelength_data = [entry[2] for entry in self.counts_with_wavelength]
-        count_data = np.array([entry[1] for entry in self.counts_with_wavelength])
+        wavelength_data = self.counts_with_wavelength[:, 2]
+        count_data = self.counts_with_wavelength[:, 1]
 
         # Index of max counts, to use to position "0" of frequency-shift axis
         count_max_index = count_data.argmax()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the analytic jacobians and the cached models of the common fit methods.
+
+Each fit is run on the same synthetic noisy data twice: once as the fit methods do it now and once
+as before, i.e. with a newly created model for every fit and numerical derivatives in the
+Levenberg-Marquardt algorithm. The script prints the mean time per fit (including the estimator,
+best of several repetitions), the mean number of model evaluations and the largest difference of
+the fitted parameters in units of their standard error. It also compares the analytic jacobians to
+finite differences of the model functions. The exit code is 1 if the results differ.
+
+Run from the qudi main directory:
+
+    python tools/fit_jacobian_benchmark.py [number of fits per method] [repetitions]
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from tools.fit_logic_standalone import FitLogic
+
+# Largest accepted difference of the fitted values in units of their standard error
+VALUE_TOLERANCE = 1e-2
+# Largest accepted deviation of the analytic jacobian from finite differences (relative)
+JACOBIAN_TOLERANCE = 1e-5
+
+
+def lorentzian(x, center, fwhm, amplitude):
+    return amplitude * (fwhm / 2) ** 2 / ((x - center) ** 2 + (fwhm / 2) ** 2)
+
+
+def estimate_lorentziantriple(x_axis, data, params):
+    """
+    Start values for the triple lorentzian test data. estimate_lorentziantriple_N14 passes a float
+    number of samples to numpy.linspace, which recent numpy versions do not accept.
+    """
+    for index, shift in enumerate((-2.15e6, 0, 2.15e6)):
+        prefix = 'l{0:d}_'.format(index)
+        params[prefix + 'center'].set(value=2.87e9 + shift + 0.1e6)
+        params[prefix + 'amplitude'].set(value=-1.5e4)
+        params[prefix + 'sigma'].set(value=0.3e6)
+    params['offset'].set(value=np.median(data))
+    return 0, params
+
+
+def make_test_cases():
+    """
+    Synthetic data for each benchmarked fit method.
+
+    @return list: tuples (fit name, estimator name or function, x axis, data without noise,
+                  noise level)
+    """
+    cases = list()
+
+    x = np.linspace(2.85e9, 2.89e9, 300)
+    clean = 1e5 + lorentzian(x, 2.87e9, 4e6, -3e4)
+    cases.append(('lorentzian', 'lorentzian_dip', x, clean, 1e3))
+
+    clean = 1e5 + lorentzian(x, 2.862e9, 4e6, -3e4) + lorentzian(x, 2.878e9, 4e6, -2.5e4)
+    cases.append(('lorentziandouble', 'lorentziandouble_dip', x, clean, 1e3))
+
+    x = np.linspace(2.865e9, 2.875e9, 300)
+    clean = 1e5 + sum(lorentzian(x, 2.87e9 + shift, 0.5e6, -2e4) for shift in (-2.15e6, 0, 2.15e6))
+    cases.append(('lorentziantriple', estimate_lorentziantriple, x, clean, 1e3))
+
+    x = np.linspace(0, 10, 300)
+    clean = 100 + 500 * np.exp(-(x - 5) ** 2 / (2 * 0.8 ** 2))
+    cases.append(('gaussian', 'gaussian_peak', x, clean, 10))
+
+    x = np.linspace(0, 5e-6, 300)
+    clean = 1 + 0.3 * np.sin(2 * np.pi * 1e6 * x + 0.5)
+    cases.append(('sine', 'sine', x, clean, 0.02))
+
+    x = np.linspace(0, 1e-3, 300)
+    clean = 0.5 + 2 * np.exp(-x / 2e-4)
+    cases.append(('decayexponential', 'decayexponential', x, clean, 0.02))
+    return cases
+
+
+def fit_all(fitting, fit_name, estimator, x_axis, traces, previous):
+    """
+    Fit all traces and measure the mean time per fit.
+
+    @param bool previous: fit like before, with a new model and numerical derivatives for each fit
+
+    @return (float, list): mean time per fit in seconds, fit results
+    """
+    make_fit = getattr(fitting, 'make_{0}_fit'.format(fit_name))
+    if callable(estimator):
+        estimate = estimator
+    else:
+        estimate = getattr(fitting, 'estimate_{0}'.format(estimator))
+    model_cache = sys.modules['generalmethods']._model_cache
+    results = list()
+    duration = 0
+    for trace in traces:
+        start = time.perf_counter()
+        if previous:
+            model_cache.clear()
+            result = make_fit(x_axis=x_axis, data=trace, estimator=estimate,
+                              fit_kws={'Dfun': None})
+        else:
+            result = make_fit(x_axis=x_axis, data=trace, estimator=estimate)
+        duration += time.perf_counter() - start
+        results.append(result)
+    return duration / len(traces), results
+
+
+def compare_results(results, reference):
+    """
+    Largest difference of the fitted values in units of their standard error.
+    """
+    deviation = 0
+    for result, ref in zip(results, reference):
+        for name, param in ref.params.items():
+            if not param.vary or param.expr is not None:
+                continue
+            diff = abs(result.params[name].value - param.value)
+            if param.stderr:
+                deviation = max(deviation, diff / param.stderr)
+            elif diff > 0:
+                deviation = np.inf
+    return deviation
+
+
+def check_jacobian(model, params, x_axis):
+    """
+    Relative deviation of the analytic jacobian of a model from central finite differences.
+    """
+    values = params.valuesdict()
+    analytic = model.analytic_jacobian(x_axis, values)
+    deviation = 0
+    for name in model.param_names:
+        step = 1e-7 * max(abs(values[name]), 1e-12)
+        upper = dict(values)
+        lower = dict(values)
+        upper[name] += step
+        lower[name] -= step
+        numeric = (model.eval(x=x_axis, **upper) - model.eval(x=x_axis, **lower)) / (2 * step)
+        scale = np.max(np.abs(numeric))
+        if scale > 0:
+            deviation = max(deviation,
+                            np.max(np.abs(analytic[name] - numeric)) / scale)
+    return deviation
+
+
+def main(number_of_fits=30, repetitions=3):
+    fitting = FitLogic(os.getcwd())
+    rng = np.random.RandomState(42)
+    success = True
+    print('{0:<18s} {1:>12s} {2:>10s} {3:>8s} {4:>12s} {5:>10s} {6:>14s} {7:>10s}'.format(
+        'fit', 'before (ms)', 'now (ms)', 'speedup', 'nfev before', 'nfev now', 'max dev (std)',
+        'jacobian'))
+    for fit_name, estimator, x_axis, clean, noise in make_test_cases():
+        traces = clean + rng.normal(0, noise, (number_of_fits, clean.size))
+        # warm up: import and cache the model
+        fit_all(fitting, fit_name, estimator, x_axis, traces[:1], previous=False)
+        time_before = np.inf
+        time_now = np.inf
+        for _ in range(repetitions):
+            duration, reference = fit_all(fitting, fit_name, estimator, x_axis, traces,
+                                          previous=True)
+            time_before = min(time_before, duration)
+            duration, results = fit_all(fitting, fit_name, estimator, x_axis, traces,
+                                        previous=False)
+            time_now = min(time_now, duration)
+        deviation = compare_results(results, reference)
+        jacobian_deviation = check_jacobian(results[0].model, results[0].params, x_axis)
+        print('{0:<18s} {1:12.2f} {2:10.2f} {3:8.2f} {4:12.1f} {5:10.1f} {6:14.2e} {7:10.2e}'
+              ''.format(fit_name, time_before * 1e3, time_now * 1e3, time_before / time_now,
+                        np.mean([result.nfev for result in reference]),
+                        np.mean([result.nfev for result in results]), deviation,
+                        jacobian_deviation))
+        success &= deviation < VALUE_TOLERANCE and jacobian_deviation < JACOBIAN_TOLERANCE
+    print('Results unchanged' if success else 'Results differ')
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:3]]))
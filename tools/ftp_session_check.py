@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Check of the FTP transfer to the Tektronix AWGs without a device.
+
+A minimal FTP server is started on localhost as a stand-in for the AWG. The script checks that
+FTPSession uploads from memory and from files (also in the background), reconnects after the
+server has dropped the connection and that the waveform files written by the AWG70K (wfmx) and
+AWG7k (wfm) modules arrive byte-identical to a reference, both in a single chunk and in several
+chunks.
+
+Run from the qudi main directory:
+
+    python tools/ftp_session_check.py
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import io
+import logging
+import os
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from hardware.awg.ftp_session import FTPSession
+
+
+class StandInFTPHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one FTP control connection. Only the commands used by FTPSession are implemented and
+    only passive mode is supported.
+    """
+    def send(self, line):
+        self.wfile.write((line + '\r\n').encode())
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections.append(self.connection)
+        cwd = ''
+        pasv = None
+        self.send('220 qudi FTP stand-in')
+        while True:
+            try:
+                line = self.rfile.readline().decode().strip()
+            except OSError:
+                return
+            if not line:
+                return
+            cmd, _, arg = line.partition(' ')
+            cmd = cmd.upper()
+            path = os.path.join(server.root, cwd, arg)
+            if cmd == 'USER':
+                self.send('331 Password required')
+            elif cmd == 'PASS':
+                server.logins += 1
+                self.send('230 Logged in')
+            elif cmd == 'CWD':
+                if os.path.isdir(os.path.join(server.root, arg)):
+                    cwd = arg
+                    self.send('250 Directory changed')
+                else:
+                    self.send('550 Directory not found')
+            elif cmd == 'MKD':
+                os.makedirs(os.path.join(server.root, arg))
+                self.send('257 Directory created')
+            elif cmd == 'PWD':
+                self.send('257 "/{0}"'.format(cwd))
+            elif cmd == 'TYPE':
+                self.send('200 Type set')
+            elif cmd == 'PASV':
+                pasv = socket.socket()
+                pasv.bind(('127.0.0.1', 0))
+                pasv.listen(1)
+                port = pasv.getsockname()[1]
+                self.send('227 Entering Passive Mode (127,0,0,1,{0},{1})'.format(port >> 8,
+                                                                               port & 255))
+            elif cmd in ('STOR', 'LIST'):
+                self.send('150 Opening data connection')
+                conn, _ = pasv.accept()
+                if cmd == 'STOR':
+                    with open(path, 'wb') as file:
+                        while True:
+                            data = conn.recv(1 << 20)
+                            if not data:
+                                break
+                            file.write(data)
+                else:
+                    for name in sorted(os.listdir(os.path.join(server.root, cwd))):
+                        size = os.path.getsize(os.path.join(server.root, cwd, name))
+                        conn.sendall('05-10-16  05:22PM {0:>20d} {1}\r\n'.format(size,
+                                                                                 name).encode())
+                conn.close()
+                pasv.close()
+                self.send('226 Transfer complete')
+            elif cmd == 'DELE':
+                if os.path.exists(path):
+                    os.remove(path)
+                    self.send('250 File deleted')
+                else:
+                    self.send('550 File not found')
+            elif cmd == 'QUIT':
+                self.send('221 Bye')
+                return
+            else:
+                self.send('502 Command not implemented')
+
+
+class StandInFTPServer(socketserver.ThreadingTCPServer):
+    """ FTP server on localhost serving the directory root """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root):
+        super().__init__(('127.0.0.1', 0), StandInFTPHandler)
+        self.root = root
+        self.logins = 0
+        self.connections = list()
+        self.lock = threading.Lock()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def drop_connections(self):
+        """ Close all control connections, like a device does after an idle timeout """
+        with self.lock:
+            for conn in self.connections:
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self.connections = list()
+
+
+def check(name, condition):
+    print('{0:<55s} {1}'.format(name, 'OK' if condition else 'FAILED'))
+    return bool(condition)
+
+
+def check_session(server, root):
+    """ Upload from memory, from a file, in the background and after a dropped connection """
+    results = list()
+    session = FTPSession('127.0.0.1', port=server.port, working_dir='waves')
+    data = np.random.rand(100000)
+
+    session.upload('memory.bin', [b'head', data, bytearray(b'tail')])
+    with open(os.path.join(root, 'waves', 'memory.bin'), 'rb') as file:
+        results.append(check('upload from memory',
+                             file.read() == b'head' + data.tobytes() + b'tail'))
+
+    session.upload('file.bin', io.BytesIO(data.tobytes()))
+    with open(os.path.join(root, 'waves', 'file.bin'), 'rb') as file:
+        results.append(check('upload from file', file.read() == data.tobytes()))
+
+    futures = [session.upload_async('async{0:d}.bin'.format(i), data[i:]) for i in range(3)]
+    sizes = [future.result() for future in futures]
+    results.append(check('upload_async', sizes == [data[i:].nbytes for i in range(3)]))
+
+    logins = server.logins
+    server.drop_connections()
+    session.upload('reconnect.bin', b'reconnected')
+    with open(os.path.join(root, 'waves', 'reconnect.bin'), 'rb') as file:
+        results.append(check('reconnect after dropped connection',
+                             file.read() == b'reconnected' and server.logins == logins + 1))
+    results.append(check('session kept open between uploads', server.logins == 2))
+
+    session.close()
+    return all(results)
+
+
+def check_waveform_files(server, root, tmp_dir):
+    """ Write waveforms in one and several chunks and compare the uploaded files """
+    # The file writing methods only need a few attributes, so the modules are not activated.
+    from hardware.awg.tektronix_awg70k import AWG70K
+    from hardware.awg.tektronix_awg7k import AWG7k
+
+    samples = 10000
+    analog = np.random.rand(samples).astype('float32') * 2 - 1
+    markers = (np.random.rand(samples) > 0.5).astype('uint8')
+    markers += (np.random.rand(samples) > 0.5).astype('uint8') * 2
+
+    results = list()
+    session = FTPSession('127.0.0.1', port=server.port, working_dir='waves')
+    for cls, write_method in ((AWG70K, '_write_wfmx'), (AWG7k, '_write_wfm')):
+        awg = cls.__new__(cls)
+        awg.__dict__['log'] = logging.getLogger(cls.__name__)
+        awg._tmp_work_dir = tmp_dir
+        awg._wfmx_chunks = dict()
+        awg._wfm_chunks = dict()
+        awg.get_sample_rate = lambda: 25e9
+        if cls is AWG70K:
+            extension = '.wfmx'
+            expected = (awg._create_xml_header(samples, True).encode('utf8') + analog.tobytes()
+                        + markers.tobytes())
+        else:
+            extension = '.wfm'
+            records = np.zeros(samples, dtype='float32, uint8')
+            records['f0'] = analog
+            records['f1'] = markers
+            header = 'MAGIC 1000\r\n#{0:d}{1:d}'.format(len(str(5 * samples)), 5 * samples)
+            expected = header.encode() + records.tobytes()
+            expected += 'CLOCK {0:16.10E}\r\n'.format(25e9).encode()
+
+        for chunks in (1, 3):
+            bounds = np.linspace(0, samples, chunks + 1).astype(int)
+            for i in range(chunks):
+                # The arrays passed in are only valid during the call
+                data = getattr(awg, write_method)(
+                    filename='check',
+                    analog_samples=analog[bounds[i]:bounds[i + 1]].copy(),
+                    marker_bytes=markers[bounds[i]:bounds[i + 1]].copy(),
+                    is_first_chunk=i == 0,
+                    is_last_chunk=i == chunks - 1,
+                    total_number_of_samples=samples)
+            session.upload_async('check' + extension, data).result()
+            if hasattr(data, 'close'):
+                data.close()
+            with open(os.path.join(root, 'waves', 'check' + extension), 'rb') as file:
+                results.append(check('{0} file in {1:d} chunk(s)'.format(extension, chunks),
+                                     file.read() == expected))
+    results.append(check('temporary files removed', len(os.listdir(tmp_dir)) == 0))
+    session.close()
+    return all(results)
+
+
+def main():
+    root = tempfile.mkdtemp()
+    tmp_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, 'waves'))
+    server = StandInFTPServer(root)
+    try:
+        success = check_session(server, root)
+        success &= check_waveform_files(server, root, tmp_dir)
+    finally:
+        server.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
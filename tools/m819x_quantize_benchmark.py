@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the sample conversion of the Keysight M819x AWG modules without a device.
+
+The float samples of a waveform are converted to DAC integers (and combined with the marker bits
+for the M8190A) by float_to_sample of the hardware modules and by the previous implementation,
+which mapped the samples with scipy.interpolate.interp1d and added the markers afterwards. The
+script checks that both give identical samples and prints the throughput in samples per second.
+The exit code is 1 if the samples differ.
+
+Run from the qudi main directory:
+
+    python tools/m819x_quantize_benchmark.py [number of samples] [repetitions]
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import logging
+import os
+import sys
+import time
+import numpy as np
+import scipy.interpolate
+
+sys.path.append(os.getcwd())
+
+from hardware.awg.keysight_m819x import AWGM8190A, AWGM8195A
+
+
+def previous_float_to_int(val, n_bits):
+    """ Previous conversion of the float samples with interp1d """
+    bitsize = int(2 ** n_bits)
+    min_intval = -bitsize / 2
+    max_intval = bitsize / 2 - 1
+
+    max_u_samples = 1
+    if max(abs(val)) > 1:
+        max_u_samples = max([abs(np.min(val)), np.max(val)])
+    mapper = scipy.interpolate.interp1d([-max_u_samples, max_u_samples], [min_intval, max_intval])
+    return mapper(val)
+
+
+def previous_bool_to_sample(val_dch_1, val_dch_2, int_type_str='int16'):
+    """ Previous conversion of the marker samples """
+    bit_dch_1 = 0x1 & np.asarray(val_dch_1).astype(int_type_str)
+    bit_dch_2 = 0x2 & (np.asarray(val_dch_2).astype(int_type_str) << 1)
+    return bit_dch_1 + bit_dch_2
+
+
+def previous_m8190a(val, marker_1, marker_2, n_bits):
+    """ Previous M8190A float_to_sample and marker combination of _compile_bin_samples """
+    shiftbits = 16 - n_bits
+    samples = previous_float_to_int(val, n_bits).astype('int16') << shiftbits
+    return samples + previous_bool_to_sample(marker_1, marker_2, int_type_str='int16')
+
+
+def previous_m8195a(val):
+    """ Previous M8195A float_to_sample """
+    return previous_float_to_int(val, 8).astype('int8')
+
+
+def make_awg(cls, dac_resolution):
+    """ The conversion only needs a few attributes, so the module is not activated """
+    awg = cls.__new__(cls)
+    awg.__dict__['_dac_resolution'] = dac_resolution
+    return awg
+
+
+def best_time(function, repetitions):
+    duration = np.inf
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        result = function()
+        duration = min(duration, time.perf_counter() - start)
+    return duration, result
+
+
+def main(number_of_samples=10000000, repetitions=3):
+    # Silence the warnings about the samples out of range
+    logging.getLogger(AWGM8190A.__module__).setLevel(logging.ERROR)
+    rng = np.random.RandomState(42)
+    analog = np.sin(np.linspace(0, 2000 * np.pi, number_of_samples)) * 0.9
+    analog += rng.uniform(-0.1, 0.1, number_of_samples)
+    marker_1 = rng.rand(number_of_samples) > 0.5
+    marker_2 = rng.rand(number_of_samples) > 0.5
+    # Samples exceeding -1..1 are normalized to their maximum absolute value
+    analog_out_of_range = analog * 1.3
+
+    cases = list()
+    for n_bits in (12, 14):
+        awg = make_awg(AWGM8190A, n_bits)
+        for name, samples in (('', analog), (' (out of range)', analog_out_of_range)):
+            cases.append(('M8190A {0:d} bit{1}'.format(n_bits, name),
+                          lambda s=samples, a=awg: a.float_to_sample(s, marker_1, marker_2),
+                          lambda s=samples, n=n_bits: previous_m8190a(s, marker_1, marker_2, n)))
+    awg = make_awg(AWGM8195A, 8)
+    for name, samples in (('', analog), (' (out of range)', analog_out_of_range)):
+        cases.append(('M8195A 8 bit{0}'.format(name),
+                      lambda s=samples: awg.float_to_sample(s),
+                      lambda s=samples: previous_m8195a(s)))
+
+    success = True
+    print('{0:<32s} {1:>16s} {2:>16s} {3:>8s} {4:>10s}'.format(
+        'conversion', 'before (MSa/s)', 'now (MSa/s)', 'speedup', 'identical'))
+    for name, current, previous in cases:
+        time_before, reference = best_time(previous, repetitions)
+        time_now, result = best_time(current, repetitions)
+        identical = result.dtype == reference.dtype and np.array_equal(result, reference)
+        print('{0:<32s} {1:16.1f} {2:16.1f} {3:8.2f} {4:>10s}'.format(
+            name, number_of_samples / time_before / 1e6, number_of_samples / time_now / 1e6,
+            time_before / time_now, 'yes' if identical else 'NO'))
+        success &= identical
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:3]]))
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Regression check of the automatic POI detection of the POI manager logic.
+
+Random scan images with gaussian spots on a poissonian background are searched for spots with
+PoiManagerLogic._local_max and with the previous detector, which moved a window pixel by pixel over
+the image and checked the spot shape of each window in python loops. The script checks that both
+find exactly the same spots for random image sizes, spot sizes, POI diameters and thresholds and
+prints the time needed by both detectors. The exit code is 1 if the results differ.
+
+Run from the qudi main directory:
+
+    python tools/poi_detector_regression.py [number of trials]
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from logic.poi_manager_logic import PoiManagerLogic
+
+
+def previous_is_spot_shape(local_arr):
+    """ Previous spot shape check of a single window """
+    unspot_e = 0
+    ensem_e = 0
+    len_arr = len(local_arr)
+    mid_f = int(0.5 * len_arr)
+    hm_local_arr = local_arr[mid_f].mean()
+    vm_local_arr = local_arr[:, mid_f].mean()
+    for i in range(0, len_arr):
+        if local_arr[i].mean() > hm_local_arr:
+            ensem_e += 1
+        if local_arr[:, i].mean() > vm_local_arr:
+            ensem_e += 1
+        if hm_local_arr > vm_local_arr * 1.2:
+            unspot_e += 1
+        if vm_local_arr > hm_local_arr * 1.2:
+            unspot_e += 1
+    if ensem_e > 4:
+        return False
+    elif unspot_e > 1:
+        return False
+    else:
+        return True
+
+
+def previous_local_max(scan, filter_size, poi_threshold):
+    """ Previous spot detection moving the window pixel by pixel """
+    scan = np.asarray(scan, order="C")
+    scan_m = scan.mean()
+    mid_f = int(filter_size / 2)
+    xc = []
+    yc = []
+    for i in range(0, len(scan) - filter_size):
+        for j in range(0, len(scan[i]) - filter_size):
+            local_arr = scan[i:i + filter_size, j:j + filter_size]
+            arr_threshold = scan_m * poi_threshold * 0.5
+            if scan[i + mid_f][j + mid_f] == local_arr.max() and previous_is_spot_shape(
+                    local_arr) and local_arr.mean() > arr_threshold:
+                xc.append(i + mid_f)
+                yc.append(j + mid_f)
+    return xc, yc
+
+
+class DetectorOnly(PoiManagerLogic):
+    """ Provides the few attributes used by the spot detection without activating the module """
+    roi_scan_image_extent = None
+
+
+def make_detector(extent, poi_threshold, poi_diameter):
+    detector = DetectorOnly.__new__(DetectorOnly)
+    detector.__dict__.update(roi_scan_image_extent=extent,
+                             _poi_threshold=poi_threshold,
+                             _poi_diameter=poi_diameter)
+    return detector
+
+
+def make_scan_image(rng, width, height, spots, spot_width, background=200, amplitude=3000):
+    """ Truncated counts of gaussian spots on a poissonian background, as used by auto_catch_poi """
+    yy, xx = np.mgrid[0:height, 0:width]
+    image = rng.poisson(background, (height, width)).astype(float)
+    for _ in range(spots):
+        cx = rng.uniform(3, width - 3)
+        cy = rng.uniform(3, height - 3)
+        image += amplitude * rng.uniform(0.5, 1.5) * np.exp(
+            -((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * spot_width ** 2))
+    return np.trunc(image.T)
+
+
+def main(trials=50):
+    rng = np.random.RandomState(42)
+    success = True
+    time_before = 0
+    time_now = 0
+    spots_found = 0
+    print('{0:>5s} {1:>9s} {2:>7s} {3:>10s} {4:>8s} {5:>8s}'.format(
+        'trial', 'image', 'window', 'threshold', 'spots', 'same'))
+    for trial in range(trials):
+        width = rng.randint(30, 120)
+        height = rng.randint(30, 120)
+        scan = make_scan_image(rng, width, height, rng.randint(0, 30), rng.uniform(0.7, 3))
+        extent = ((0, width * 1e-7), (0, height * 1e-7))
+        poi_threshold = rng.uniform(1, 6)
+        detector = make_detector(extent, poi_threshold, rng.uniform(1e-7, 1.2e-6))
+        filter_size = detector._spot_filter(scan)
+
+        start = time.perf_counter()
+        xc_before, yc_before = previous_local_max(scan, filter_size, poi_threshold)
+        time_before += time.perf_counter() - start
+        start = time.perf_counter()
+        xc_now, yc_now = detector._local_max(scan)
+        time_now += time.perf_counter() - start
+
+        # The previous detector returned the spots in the same (row major) order
+        same = (np.array_equal(xc_now, np.asarray(xc_before, dtype=int))
+                and np.array_equal(yc_now, np.asarray(yc_before, dtype=int)))
+        spots_found += len(xc_before)
+        print('{0:5d} {1:>9s} {2:7d} {3:10.2f} {4:8d} {5:>8s}'.format(
+            trial, '{0:d}x{1:d}'.format(width, height), filter_size, poi_threshold,
+            len(xc_before), 'yes' if same else 'NO'))
+        success &= same
+    print('{0:d} spots in {1:d} images, total time before {2:.3f} s, now {3:.3f} s'.format(
+        spots_found, trials, time_before, time_now))
+    print('Results unchanged' if success else 'Results differ')
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:2]]))
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Round trip check of the TTTR record processing of the PicoQuant modules without a device.
+
+For the PicoHarp 300 and HydraHarp 400 record formats in T2 and T3 mode, synthetic records of a
+pulsed measurement are created with generate_records (spanning many overflows of the time tag or
+sync counter) and decoded again with TTTRDecoder. The decoded events and markers must be identical
+to the encoded ones, also if the records are decoded in chunks which are split right before and
+after overflow records. The events are histogrammed chunk by chunk with TTTRHistogram (ungated,
+gated and with a channel selection) and compared to a histogram computed directly from the
+generated events. The exit code is 1 if any check fails.
+
+Run from the qudi main directory:
+
+    python tools/tttr_roundtrip_check.py
+
+Qudi is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Qudi is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Qudi. If not, see <http://www.gnu.org/licenses/>.
+
+Copyright (c) the Qudi Developers. See the COPYRIGHT.txt file at the
+top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi/>
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from hardware.picoquant.tttr import TTTRDecoder, TTTRHistogram, WRAPAROUND, generate_records
+
+# Parameters of the synthetic measurement for each record format:
+# (number of syncs, sync period in s, resolution in s, photons per sync, marker period)
+# The low count rates in T3 mode leave gaps of several overflow periods without any record.
+MEASUREMENTS = {('picoharp', 2): (20000, 1e-6, 4e-12, 0.5, 1000),
+                ('picoharp', 3): (1000000, 1e-7, 16e-12, 0.005, 10000),
+                ('hydraharp', 2): (20000, 1e-6, 1e-12, 0.5, 1000),
+                ('hydraharp', 3): (1000000, 1e-7, 1e-12, 0.0005, 10000)}
+
+NUMBER_OF_BINS = 100
+NUMBER_OF_GATES = 4
+
+
+def check(name, condition):
+    print('{0:<60s} {1}'.format(name, 'OK' if condition else 'FAILED'))
+    return bool(condition)
+
+
+def overflow_positions(records, device):
+    """ Indices of the overflow records """
+    if device == 'picoharp':
+        return np.flatnonzero(records == np.uint32(15 << 28))
+    return np.flatnonzero((records >> 25) == np.uint32(0x7F))
+
+
+def chunk_bounds(records, device, rng):
+    """ Split points right before and after every overflow record and at random positions """
+    overflows = overflow_positions(records, device)
+    bounds = np.concatenate((overflows, overflows + 1,
+                             rng.randint(0, len(records), len(records) // 1000 + 1)))
+    return np.unique(np.concatenate(([0], bounds, [len(records)])))
+
+
+def decode_chunks(decoder, records, bounds):
+    events = list()
+    markers = list()
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        chunk_events, chunk_markers = decoder.decode(records[start:stop])
+        events.append(chunk_events)
+        markers.append(chunk_markers)
+    return np.concatenate(events), np.concatenate(markers)
+
+
+def reference_histogram(events, mode, period_ticks, ticks_per_bin, gates, channels):
+    """ Histogram computed from the generated events with the known sync times """
+    photons = events[np.isin(events['channel'], channels)]
+    if mode == 2:
+        sync_index = photons['time'] // np.uint64(period_ticks)
+        ticks = photons['time'] - sync_index * np.uint64(period_ticks)
+    else:
+        sync_index = photons['time']
+        ticks = photons['dtime']
+    bins = ticks.astype(np.int64) // ticks_per_bin
+    valid = bins < NUMBER_OF_BINS
+    if gates == 0:
+        return np.bincount(bins[valid], minlength=NUMBER_OF_BINS)
+    gate = sync_index[valid].astype(np.int64) % gates
+    return np.bincount(gate * NUMBER_OF_BINS + bins[valid],
+                       minlength=gates * NUMBER_OF_BINS).reshape(gates, NUMBER_OF_BINS)
+
+
+def check_format(device, mode, rng):
+    syncs, sync_period, resolution, count_rate, marker_period = MEASUREMENTS[(device, mode)]
+    records, events, markers = generate_records(syncs, sync_period, resolution, count_rate,
+                                                device=device, mode=mode,
+                                                marker_period=marker_period,
+                                                seed=rng.randint(1000))
+    name = '{0} T{1:d}'.format(device, mode)
+    results = list()
+    print('{0}: {1:d} records, {2:d} overflow records, {3:d} events, {4:d} markers'.format(
+        name, len(records), len(overflow_positions(records, device)), len(events), len(markers)))
+    results.append(check(name + ': records span several overflow periods',
+                         int(events['time'][-1]) > 10 * WRAPAROUND[(device, mode)]))
+
+    decoder = TTTRDecoder(device, mode)
+    decoded_events, decoded_markers = decoder.decode(records)
+    results.append(check(name + ': events decoded at once',
+                         np.array_equal(decoded_events, events)))
+    results.append(check(name + ': markers decoded at once',
+                         np.array_equal(decoded_markers, markers)))
+
+    bounds = chunk_bounds(records, device, rng)
+    decoder.reset()
+    chunk_events, chunk_markers = decode_chunks(decoder, records, bounds)
+    results.append(check(name + ': decoded in {0:d} chunks split at overflows'.format(
+        len(bounds) - 1), np.array_equal(chunk_events, events)
+                         and np.array_equal(chunk_markers, markers)))
+
+    # Histogram with a bin width of two ticks covering the start of each sync period
+    period_ticks = int(round(sync_period / resolution))
+    ticks_per_bin = 2
+    for gates, channels in ((0, None), (NUMBER_OF_GATES, None), (0, [1]), (0, [2])):
+        histogram = TTTRHistogram(mode, resolution, ticks_per_bin * resolution, NUMBER_OF_BINS,
+                                  number_of_gates=gates,
+                                  channels=channels)
+        decoder.reset()
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            histogram.add_events(decoder.decode(records[start:stop])[0])
+        # The generated photons are all on detector channel 1
+        expected = reference_histogram(events, mode, period_ticks, ticks_per_bin, gates,
+                                       [1] if channels is None else channels)
+        same = np.array_equal(histogram.histogram, expected)
+        if mode == 2:
+            same &= histogram.syncs == syncs
+        results.append(check('{0}: histogram{1}, {2}'.format(
+            name, ' with {0:d} gates'.format(gates) if gates else '',
+            'all channels' if channels is None else 'channels {0}'.format(channels)), same))
+    return all(results)
+
+
+def main():
+    rng = np.random.RandomState(42)
+    success = True
+    for device, mode in sorted(WRAPAROUND):
+        success &= check_format(device, mode, rng)
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())